@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Actualización del catálogo de tasas del Simulador Multi-SOFIPO
+
+Valida un catálogo nuevo (JSON con la estructura de datos/catalogo_sofipos.json),
+lo compila con el mismo motor de la app, muestra las diferencias contra el
+vigente y, si todo está bien, lo instala:
+
+- Productos y SOFIPOs agregados o eliminados
+- Cada campo que cambió (tasas, límites, mínimos, requisitos...)
+- Productos cuya huella cambia: solo los resultados en caché que los usan se
+  recalculan en la app
+
+La app revisa la fecha de modificación del JSON en cada ejecución, así que toma
+el catálogo nuevo sin reiniciar el servidor.
+
+Uso:
+    python actualizar_catalogo.py nuevo.json
+    python actualizar_catalogo.py nuevo.json --revisar
+    python actualizar_catalogo.py nuevo.json --actualizado "1 de Diciembre, 2025"
+
+Termina con código 1 si el catálogo nuevo no es válido.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+logging.disable(logging.WARNING)
+
+import simulador_sofipos as s
+
+def diferencias_catalogo(anterior, nuevo):
+    """
+    Compara dos catálogos (el dict "sofipos" de cada uno)
+
+    Returns:
+        Dict con "agregados" y "eliminados" (listas de "SOFIPO - producto" o
+        "SOFIPO") y "cambios" (lista de (elemento, campo, antes, después))
+    """
+    agregados = [sofipo for sofipo in nuevo if sofipo not in anterior]
+    eliminados = [sofipo for sofipo in anterior if sofipo not in nuevo]
+    cambios = []
+
+    for sofipo in [sofipo for sofipo in nuevo if sofipo in anterior]:
+        datos_antes, datos_ahora = anterior[sofipo], nuevo[sofipo]
+        for campo in sorted((set(datos_antes) | set(datos_ahora)) - {"productos"}):
+            if datos_antes.get(campo) != datos_ahora.get(campo):
+                cambios.append((sofipo, campo, datos_antes.get(campo), datos_ahora.get(campo)))
+
+        productos_antes, productos_ahora = datos_antes["productos"], datos_ahora["productos"]
+        agregados += [f"{sofipo} - {producto}" for producto in productos_ahora if producto not in productos_antes]
+        eliminados += [f"{sofipo} - {producto}" for producto in productos_antes if producto not in productos_ahora]
+        for producto in [producto for producto in productos_ahora if producto in productos_antes]:
+            info_antes, info_ahora = productos_antes[producto], productos_ahora[producto]
+            for campo in sorted(set(info_antes) | set(info_ahora)):
+                if info_antes.get(campo) != info_ahora.get(campo):
+                    cambios.append((f"{sofipo} - {producto}", campo, info_antes.get(campo), info_ahora.get(campo)))
+
+    return {"agregados": agregados, "eliminados": eliminados, "cambios": cambios}
+
+def productos_modificados(anterior, compilado):
+    """
+    Productos del catálogo compilado cuya huella no existe en el anterior (nuevos
+    o con algún cambio); son los únicos cuyos resultados en caché se recalculan
+    """
+    huellas_antes = set(s.compilar_catalogo(anterior)["huellas"])
+    return [
+        f"{sofipo} - {producto}"
+        for (sofipo, producto), huella in zip(compilado["claves"], compilado["huellas"])
+        if huella not in huellas_antes
+    ]
+
+def _escribir_reemplazando(ruta, escribir):
+    """
+    Escribe un archivo nuevo junto al destino y lo reemplaza de una vez, para que
+    la app nunca lea un archivo a medias
+    """
+    descriptor, temporal = tempfile.mkstemp(dir=os.path.dirname(ruta), suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "w", encoding="utf-8") as archivo:
+            escribir(archivo)
+        os.replace(temporal, ruta)
+    except BaseException:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
+
+def instalar_catalogo(contenido):
+    """
+    Reemplaza el JSON del catálogo vigente
+
+    Args:
+        contenido: Dict {"actualizado", "sofipos"} ya validado
+
+    Returns:
+        Versión del catálogo instalado
+    """
+    def escribir_json(archivo):
+        json.dump(contenido, archivo, ensure_ascii=False, indent=2)
+        archivo.write("\n")
+
+    _escribir_reemplazando(s.ARCHIVO_CATALOGO, escribir_json)
+    return s.version_catalogo(contenido["sofipos"])
+
+def _valor(valor):
+    return "—" if valor is None else json.dumps(valor, ensure_ascii=False)
+
+def imprimir_diferencias(diferencias, modificados, compilado, duracion):
+    print("=" * 60)
+    print("DIFERENCIAS CONTRA EL CATÁLOGO VIGENTE")
+    print("=" * 60)
+    for elemento in diferencias["agregados"]:
+        print(f"+ {elemento}")
+    for elemento in diferencias["eliminados"]:
+        print(f"- {elemento}")
+    for elemento, campo, antes, ahora in diferencias["cambios"]:
+        print(f"~ {elemento}: {campo} {_valor(antes)} -> {_valor(ahora)}")
+    if not any(diferencias.values()):
+        print("Sin cambios")
+    print(f"{'Productos compilados:':<34}{len(compilado['claves'])} en {duracion * 1000:.2f} ms")
+    print(f"{'Productos que se recalculan:':<34}{len(modificados)} de {len(compilado['claves'])}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Actualiza el catálogo de tasas del simulador")
+    parser.add_argument("archivo", help="Catálogo nuevo (JSON)")
+    parser.add_argument("--revisar", action="store_true", help="Solo validar y mostrar diferencias, sin instalar")
+    parser.add_argument("--actualizado", help="Texto de la fecha de actualización que muestra la app")
+    args = parser.parse_args()
+
+    vigente = s.leer_catalogo()
+    try:
+        with open(args.archivo, encoding="utf-8") as archivo:
+            contenido = json.load(archivo)
+    except (OSError, ValueError) as e:
+        print(f"❌ No se pudo leer {args.archivo}: {e}")
+        return 1
+
+    errores = s.validar_catalogo(contenido)
+    for error in errores:
+        print(f"❌ {error}")
+    if errores:
+        return 1
+
+    contenido = {
+        "actualizado": args.actualizado or contenido.get("actualizado") or vigente["actualizado"],
+        "sofipos": contenido["sofipos"]
+    }
+    inicio = time.perf_counter()
+    compilado = s.compilar_catalogo(contenido["sofipos"])
+    duracion = time.perf_counter() - inicio
+    diferencias = diferencias_catalogo(vigente["sofipos"], contenido["sofipos"])
+    modificados = productos_modificados(vigente["sofipos"], compilado)
+    imprimir_diferencias(diferencias, modificados, compilado, duracion)
+
+    if args.revisar:
+        print("✅ Catálogo válido (no se instaló)")
+        return 0
+
+    version = instalar_catalogo(contenido)
+    print(f"✅ Catálogo instalado: versión {vigente['version']} -> {version}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark de arranque del Simulador Multi-SOFIPO
+
+Mide lo que paga cada proceso nuevo (y cada sesión nueva) antes de que el
+usuario vea la primera pantalla:
+
+- Tiempo de importación del simulador, sin contar Streamlit
+- Módulos pesados que quedaron cargados después de importar
+- Bytes que cada ejecución envía al navegador (tema claro y oscuro), con la
+  hoja de estilos servida como archivo estático y en línea
+- Costo por llamada del factor de crecimiento: tabla precalculada contra
+  la potencia directa
+- Memoria del score: una reejecución con el mismo portafolio no vuelve a
+  evaluarlo
+
+Uso:
+    python benchmark_simulador.py
+    python benchmark_simulador.py --repeticiones 10 --presupuesto 0.6
+
+Termina con código 1 si se excede el presupuesto de importación, si un
+módulo diferido (pandas, plotly) se cargó durante el arranque o si el score
+memoizado se pierde al reejecutar.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+
+# Módulos que el simulador debe cargar solo cuando se usan
+MODULOS_DIFERIDOS = ["pandas", "plotly.express", "plotly.graph_objs._figure"]
+
+PRESUPUESTO_IMPORTACION_SEG = 0.6
+
+# Se ejecuta en un proceso nuevo para medir un arranque en frío
+_CODIGO_ARRANQUE = """
+import json, sys, time, logging
+logging.disable(logging.WARNING)
+import streamlit
+inicio = time.perf_counter()
+import simulador_sofipos
+duracion = time.perf_counter() - inicio
+print(json.dumps({
+    "importacion": duracion,
+    "cargados": [m for m in %r if m in sys.modules]
+}))
+""" % (MODULOS_DIFERIDOS,)
+
+def medir_arranque(repeticiones):
+    """
+    Importa el simulador en procesos nuevos y regresa las mediciones de cada uno
+    """
+    mediciones = []
+    for _ in range(repeticiones):
+        salida = subprocess.run(
+            [sys.executable, "-c", _CODIGO_ARRANQUE],
+            cwd=DIRECTORIO,
+            capture_output=True,
+            text=True,
+            check=True
+        )
+        mediciones.append(json.loads(salida.stdout.strip().splitlines()[-1]))
+    return mediciones
+
+# Ejecuta la app con AppTest y suma el tamaño de los elementos que se envían
+_CODIGO_CARGA = """
+import json, logging
+logging.disable(logging.WARNING)
+from streamlit.testing.v1 import AppTest
+
+def elementos(nodo):
+    hijos = getattr(nodo, "children", None)
+    if hijos is None:
+        yield nodo
+        return
+    for hijo in hijos.values():
+        yield from elementos(hijo)
+
+def medir(app):
+    total = estilos = 0
+    for elemento in elementos(app._tree):
+        proto = getattr(elemento, "proto", None)
+        if proto is None:
+            continue
+        tamano = proto.ByteSize()
+        total += tamano
+        if "<style" in getattr(proto, "body", ""):
+            estilos += tamano
+    return {"total": total, "estilos": estilos}
+
+app = AppTest.from_file(%r, default_timeout=60)
+app.run()
+claro = medir(app)
+app.toggle(key="dark_mode").set_value(True).run()
+print(json.dumps({"claro": claro, "oscuro": medir(app)}))
+"""
+
+def medir_carga(estatico=True):
+    """
+    Bytes de los elementos que una ejecución envía al navegador, en tema claro y oscuro
+
+    Args:
+        estatico: Si es False se ejecuta fuera del directorio del simulador, sin
+                  .streamlit/config.toml, y los estilos viajan en línea
+    """
+    salida = subprocess.run(
+        [sys.executable, "-c", _CODIGO_CARGA % (os.path.join(DIRECTORIO, "simulador_sofipos.py"),)],
+        cwd=DIRECTORIO if estatico else os.path.dirname(DIRECTORIO),
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    return json.loads(salida.stdout.strip().splitlines()[-1])
+
+_CODIGO_FACTORES = """
+import json, logging, timeit
+logging.disable(logging.WARNING)
+import simulador_sofipos as s
+pares = list(s.FACTORES["indice"])
+llamadas = len(pares) * %d
+
+calcular_interes_compuesto = s.calcular_interes_compuesto
+
+def con_tabla():
+    for tasa, dias in pares:
+        calcular_interes_compuesto(1000.0, tasa, dias)
+
+def interes_con_potencia(capital, tasa_anual, dias, compounding="diario"):
+    # calcular_interes_compuesto antes de la tabla de factores
+    tasa_decimal = tasa_anual / 100
+    if compounding == "diario":
+        n = 365
+        t = dias / 365
+        monto_final = capital * (1 + tasa_decimal / n) ** (n * t)
+    return monto_final - capital
+
+def con_potencia():
+    for tasa, dias in pares:
+        interes_con_potencia(1000.0, tasa, dias)
+
+def fuera_de_tabla():
+    for tasa, dias in pares:
+        calcular_interes_compuesto(1000.0, tasa + 0.01, dias)
+
+print(json.dumps({
+    "pares": len(pares),
+    "tabla": min(timeit.repeat(con_tabla, number=%d, repeat=5)) / llamadas,
+    "potencia": min(timeit.repeat(con_potencia, number=%d, repeat=5)) / llamadas,
+    "fallback": min(timeit.repeat(fuera_de_tabla, number=%d, repeat=5)) / llamadas
+}))
+"""
+
+def medir_factores(vueltas=200):
+    """
+    Compara el factor de crecimiento desde la tabla contra la potencia directa
+    (tiempo por llamada, en segundos)
+    """
+    salida = subprocess.run(
+        [sys.executable, "-c", _CODIGO_FACTORES % ((vueltas,) * 4)],
+        cwd=DIRECTORIO,
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    return json.loads(salida.stdout.strip().splitlines()[-1])
+
+# Streamlit reejecuta el módulo completo en cada interacción; recargarlo reproduce
+# esa reejecución. Después de recargar, el motor del score falla a propósito: solo
+# un acierto de la memoria puede regresar el resultado.
+_CODIGO_MEMO_SCORE = """
+import importlib, json, logging
+logging.disable(logging.WARNING)
+import numpy as np
+import simulador_sofipos as s
+
+montos = np.zeros(len(s.CATALOGO["claves"]))
+montos[:3] = [15000.0, 10000.0, 5000.0]
+primero = s.score_portafolio(montos, 12)
+
+s = importlib.reload(s)
+def motor_bloqueado(*args, **kwargs):
+    raise LookupError
+s.evaluar_portafolios_lote = motor_bloqueado
+
+def consultar(vector):
+    try:
+        return s.score_portafolio(vector, 12)
+    except LookupError:
+        return None
+
+repetido = consultar(montos)
+montos[3] = 1000.0
+print(json.dumps({
+    "acierto": repetido == primero,
+    "nuevo_recalcula": consultar(montos) is None
+}))
+"""
+
+def medir_memo_score():
+    """
+    Confirma que el score de un portafolio sobrevive a la reejecución del módulo
+    y que un vector distinto sí se recalcula
+    """
+    salida = subprocess.run(
+        [sys.executable, "-c", _CODIGO_MEMO_SCORE],
+        cwd=DIRECTORIO,
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    return json.loads(salida.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de arranque del simulador")
+    parser.add_argument("--repeticiones", type=int, default=5, help="Procesos nuevos a medir")
+    parser.add_argument("--presupuesto", type=float, default=PRESUPUESTO_IMPORTACION_SEG,
+                        help="Tiempo máximo de importación (segundos, mediana)")
+    args = parser.parse_args()
+
+    mediciones = medir_arranque(args.repeticiones)
+    tiempos = [m["importacion"] for m in mediciones]
+    mediana = statistics.median(tiempos)
+    cargados = sorted({modulo for m in mediciones for modulo in m["cargados"]})
+
+    print("=" * 60)
+    print("ARRANQUE DEL SIMULADOR")
+    print("=" * 60)
+    filas = [
+        (f"Importación (mediana de {args.repeticiones})", f"{mediana * 1000:.1f} ms"),
+        ("Importación (mín / máx)", f"{min(tiempos) * 1000:.1f} / {max(tiempos) * 1000:.1f} ms"),
+        ("Presupuesto", f"{args.presupuesto * 1000:.1f} ms"),
+        ("Módulos diferidos cargados", ", ".join(cargados) if cargados else "ninguno")
+    ]
+    for etiqueta, valor in filas:
+        print(f"{etiqueta + ':':<34}{valor}")
+
+    estatico = medir_carga()
+    en_linea = medir_carga(estatico=False)
+    print("=" * 60)
+    print("BYTES POR EJECUCIÓN (elementos enviados / de ellos, estilos)")
+    print("=" * 60)
+    filas = [
+        (f"{etiqueta} ({tema})", f"{carga[tema]['total']:,} / {carga[tema]['estilos']:,} bytes")
+        for etiqueta, carga in [("Hoja estática", estatico), ("Estilos en línea", en_linea)]
+        for tema in ("claro", "oscuro")
+    ]
+    for etiqueta, valor in filas:
+        print(f"{etiqueta + ':':<34}{valor}")
+
+    factores = medir_factores()
+    print("=" * 60)
+    print("FACTOR DE CRECIMIENTO (1 + r/365)^d")
+    print("=" * 60)
+    filas = [
+        ("Pares (tasa, días) en la tabla", f"{factores['pares']:,}"),
+        ("Interés compuesto con tabla", f"{factores['tabla'] * 1e9:.0f} ns/llamada"),
+        ("Potencia directa (anterior)", f"{factores['potencia'] * 1e9:.0f} ns/llamada"),
+        ("Fuera de la tabla (fallback)", f"{factores['fallback'] * 1e9:.0f} ns/llamada")
+    ]
+    for etiqueta, valor in filas:
+        print(f"{etiqueta + ':':<34}{valor}")
+
+    memo = medir_memo_score()
+    print("=" * 60)
+    print("MEMORIA DEL SCORE")
+    print("=" * 60)
+    filas = [
+        ("Reejecución, mismo portafolio", "acierto" if memo["acierto"] else "se recalculó"),
+        ("Portafolio distinto", "se recalcula" if memo["nuevo_recalcula"] else "no se recalculó")
+    ]
+    for etiqueta, valor in filas:
+        print(f"{etiqueta + ':':<34}{valor}")
+
+    errores = []
+    if mediana > args.presupuesto:
+        errores.append(f"La importación tarda {mediana:.3f}s (presupuesto {args.presupuesto:.3f}s)")
+    if cargados:
+        errores.append(f"Se cargaron módulos que deberían ser diferidos: {', '.join(cargados)}")
+    if not (memo["acierto"] and memo["nuevo_recalcula"]):
+        errores.append("El score memoizado no sobrevive a la reejecución")
+
+    for error in errores:
+        print(f"❌ {error}")
+    if not errores:
+        print("✅ Dentro del presupuesto")
+
+    return 1 if errores else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
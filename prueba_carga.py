@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+"""
+Prueba de carga del Simulador Multi-SOFIPO
+
+Simula varias sesiones simultáneas con el AppTest de Streamlit. Cada sesión
+corre en su propio proceso: AppTest reemplaza el Runtime global y parchea la
+configuración mientras ejecuta el script, así que dos ejecuciones en hilos del
+mismo proceso se pisan (widgets que "desaparecen"). Por eso los cachés
+(st.cache_resource, st.cache_data, pool de tareas) son de cada proceso, como en
+un despliegue con varios procesos; con calentamiento cada proceso recorre su
+flujo una vez antes de medir. Todas las sesiones arrancan juntas (barrera) y
+compiten por el CPU de la máquina. Cada sesión recorre uno de los flujos
+reales de la app:
+
+- objetivo: calcular el capital para una ganancia objetivo y aplicarlo
+- estrategia: proponer y confirmar la estrategia agresiva
+- montos: activar SOFIPOs y editar un monto
+- aportaciones: activar aportaciones recurrentes a 5 años
+
+Por cada nivel de concurrencia reporta la latencia de cada ejecución
+(percentiles), las ejecuciones por segundo, el CPU y la memoria por sesión,
+y al final el punto de saturación: el primer nivel en el que más usuarios ya
+no dan más ejecuciones por segundo o en el que el p95 pasa del presupuesto.
+
+El reporte se guarda en JSON con la versión (commit) y el entorno, para
+compararlo entre versiones.
+
+Uso:
+    python prueba_carga.py
+    python prueba_carga.py --usuarios 1 2 4 8 16 --vueltas 2 --salida carga.json
+    python prueba_carga.py --comparar carga_anterior.json
+
+Termina con código 1 si alguna ejecución lanzó una excepción.
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+ARCHIVO_APP = os.path.join(DIRECTORIO, "simulador_sofipos.py")
+
+NIVELES_USUARIOS = [1, 2, 4, 8]
+PRESUPUESTO_P95_SEG = 2.0
+# Ganancia mínima de ejecuciones/s al subir de nivel para no considerarlo saturado
+GANANCIA_MINIMA_RENDIMIENTO = 0.10
+INTERVALO_MEMORIA_SEG = 0.05
+PERCENTILES = (50, 90, 95, 99)
+
+# Cada flujo es una lista de pasos (nombre, acción); la acción recibe el
+# AppTest y regresa el elemento ya modificado, listo para .run()
+FLUJOS = {
+    "objetivo": [
+        ("abrir objetivo", lambda app: app.button(key="btn_objetivo").click()),
+        ("calcular capital", lambda app: app.button(key="btn_calcular_obj").click()),
+        ("proponer", lambda app: app.button(key="btn_aplicar_obj").click()),
+        ("confirmar", lambda app: app.button(key="propuesta_objetivo_confirmar").click())
+    ],
+    "estrategia": [
+        ("proponer agresiva", lambda app: app.button(key="btn_aplicar_agresiva").click()),
+        ("confirmar", lambda app: app.button(key="propuesta_agresiva_confirmar").click())
+    ],
+    "montos": [
+        ("activar Nu", lambda app: app.checkbox(key="check_Nu México").check()),
+        ("activar DiDi", lambda app: app.checkbox(key="check_DiDi").check()),
+        ("editar monto", lambda app: app.number_input(key="monto_DiDi_DiDi Ahorro").set_value(7000))
+    ],
+    "aportaciones": [
+        ("activar Nu", lambda app: app.checkbox(key="check_Nu México").check()),
+        ("activar aportaciones", lambda app: app.checkbox(key="aportaciones_activas").check()),
+        ("plazo 5 años", lambda app: app.selectbox(key="periodo_simulacion").set_value(60))
+    ]
+}
+
+def memoria_rss_mb():
+    """
+    Memoria residente del proceso en MB (Linux: /proc; en otros sistemas, el pico)
+    """
+    try:
+        with open("/proc/self/statm") as archivo:
+            paginas = int(archivo.read().split()[1])
+        return paginas * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        import resource
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return pico / 2**20 if sys.platform == "darwin" else pico / 1024
+
+class MonitorMemoria:
+    """
+    Muestrea la memoria del proceso en un hilo mientras dura una sesión
+    """
+    def __init__(self, intervalo=INTERVALO_MEMORIA_SEG):
+        self.intervalo = intervalo
+        self.inicial = self.pico = memoria_rss_mb()
+        self._alto = threading.Event()
+        self._hilo = threading.Thread(target=self._muestrear, daemon=True)
+
+    def _muestrear(self):
+        while not self._alto.wait(self.intervalo):
+            self.pico = max(self.pico, memoria_rss_mb())
+
+    def __enter__(self):
+        self._hilo.start()
+        return self
+
+    def __exit__(self, *_):
+        self._alto.set()
+        self._hilo.join()
+        self.pico = max(self.pico, memoria_rss_mb())
+
+def ejecutar_sesion(nombre_flujo, vueltas, tiempo_limite):
+    """
+    Una sesión simulada: abre la app y recorre su flujo vueltas veces
+
+    Cada vuelta empieza con una sesión nueva (como un usuario que recarga la página).
+
+    Returns:
+        Dict con la latencia de cada ejecución (segundos), por paso, y los errores
+    """
+    from streamlit.testing.v1 import AppTest
+
+    latencias = []
+    por_paso = {}
+    errores = []
+    for _ in range(vueltas):
+        app = AppTest.from_file(ARCHIVO_APP, default_timeout=tiempo_limite)
+        pasos = [("carga inicial", None)] + FLUJOS[nombre_flujo]
+        for paso, accion in pasos:
+            inicio = time.perf_counter()
+            try:
+                (app if accion is None else accion(app)).run()
+            except Exception as e:
+                errores.append(f"{nombre_flujo} / {paso}: {e}")
+                break
+            duracion = time.perf_counter() - inicio
+            latencias.append(duracion)
+            por_paso.setdefault(f"{nombre_flujo} / {paso}", []).append(duracion)
+            if app.exception:
+                errores.append(f"{nombre_flujo} / {paso}: {app.exception[0].message}")
+                break
+    return {"latencias": latencias, "por_paso": por_paso, "errores": errores}
+
+def _proceso_sesion(nombre_flujo, vueltas, tiempo_limite, calentar, barrera, resultados):
+    """
+    Cuerpo de cada proceso: calienta sus cachés, espera a las demás sesiones y
+    mide su flujo (latencias, CPU y memoria del proceso)
+    """
+    logging.disable(logging.WARNING)
+    os.chdir(DIRECTORIO)
+    if calentar:
+        ejecutar_sesion(nombre_flujo, 1, tiempo_limite)
+    barrera.wait()
+    cpu_inicial = time.process_time()
+    with MonitorMemoria() as memoria:
+        sesion = ejecutar_sesion(nombre_flujo, vueltas, tiempo_limite)
+    sesion["cpu_seg"] = time.process_time() - cpu_inicial
+    sesion["memoria_inicial_mb"] = memoria.inicial
+    sesion["memoria_pico_mb"] = memoria.pico
+    resultados.put(sesion)
+
+def percentil(valores, p):
+    """Percentil p (0-100) con interpolación lineal"""
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    posicion = (len(ordenados) - 1) * p / 100
+    abajo = int(posicion)
+    arriba = min(abajo + 1, len(ordenados) - 1)
+    return ordenados[abajo] + (ordenados[arriba] - ordenados[abajo]) * (posicion - abajo)
+
+def medir_nivel(usuarios, vueltas, tiempo_limite, calentar=True):
+    """
+    Corre usuarios sesiones simultáneas, una por proceso; la sesión i recorre
+    el flujo i (en ciclo)
+
+    Returns:
+        Dict con las métricas del nivel
+    """
+    nombres_flujos = list(FLUJOS)
+    contexto = multiprocessing.get_context("spawn")
+    # El proceso principal también espera en la barrera para tomar el tiempo de arranque
+    barrera = contexto.Barrier(usuarios + 1)
+    resultados = contexto.Queue()
+    procesos = [
+        contexto.Process(
+            target=_proceso_sesion,
+            args=(nombres_flujos[i % len(nombres_flujos)], vueltas, tiempo_limite, calentar, barrera, resultados)
+        )
+        for i in range(usuarios)
+    ]
+    for proceso in procesos:
+        proceso.start()
+    barrera.wait()
+    inicio = time.perf_counter()
+    sesiones = [resultados.get() for _ in procesos]
+    duracion = time.perf_counter() - inicio
+    for proceso in procesos:
+        proceso.join()
+    cpu = sum(sesion["cpu_seg"] for sesion in sesiones)
+
+    latencias = [latencia for sesion in sesiones for latencia in sesion["latencias"]]
+    por_paso = {}
+    for sesion in sesiones:
+        for paso, valores in sesion["por_paso"].items():
+            por_paso.setdefault(paso, []).extend(valores)
+
+    return {
+        "usuarios": usuarios,
+        "ejecuciones": len(latencias),
+        "duracion_seg": duracion,
+        "ejecuciones_por_seg": len(latencias) / duracion if duracion > 0 else 0.0,
+        "latencia_seg": {f"p{p}": percentil(latencias, p) for p in PERCENTILES},
+        "latencia_media_seg": statistics.fmean(latencias) if latencias else 0.0,
+        "cpu_seg_por_sesion": cpu / usuarios,
+        "uso_cpu": cpu / duracion if duracion > 0 else 0.0,
+        "memoria_pico_mb": sum(sesion["memoria_pico_mb"] for sesion in sesiones),
+        "memoria_mb_por_sesion": statistics.fmean(
+            max(0.0, sesion["memoria_pico_mb"] - sesion["memoria_inicial_mb"]) for sesion in sesiones
+        ),
+        "p95_por_paso_seg": {paso: percentil(valores, 95) for paso, valores in sorted(por_paso.items())},
+        "errores": [error for sesion in sesiones for error in sesion["errores"]]
+    }
+
+def punto_saturacion(niveles, presupuesto_p95):
+    """
+    Primer nivel en el que subir de usuarios ya no aumenta las ejecuciones por
+    segundo (menos de GANANCIA_MINIMA_RENDIMIENTO) o el p95 pasa del presupuesto
+
+    Returns:
+        Dict con usuarios (None si no se alcanzó) y motivo
+    """
+    anterior = None
+    for nivel in niveles:
+        if nivel["latencia_seg"]["p95"] > presupuesto_p95:
+            return {"usuarios": nivel["usuarios"], "motivo": f"p95 de {nivel['latencia_seg']['p95']:.2f}s (presupuesto {presupuesto_p95:.2f}s)"}
+        if anterior is not None and nivel["ejecuciones_por_seg"] < anterior["ejecuciones_por_seg"] * (1 + GANANCIA_MINIMA_RENDIMIENTO):
+            return {
+                "usuarios": nivel["usuarios"],
+                "motivo": f"{nivel['ejecuciones_por_seg']:.2f} ejecuciones/s contra {anterior['ejecuciones_por_seg']:.2f} con {anterior['usuarios']} usuarios"
+            }
+        anterior = nivel
+    return {"usuarios": None, "motivo": "no se alcanzó en los niveles probados"}
+
+def version_codigo():
+    """Commit actual (y si hay cambios sin guardar) para identificar el reporte"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=DIRECTORIO,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        cambios = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=DIRECTORIO,
+                                 capture_output=True, text=True, check=True).stdout.strip()
+        return commit + ("-modificado" if cambios else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "desconocida"
+
+def entorno():
+    """Versiones y máquina donde se corrió la prueba"""
+    import numpy
+    import streamlit
+    return {
+        "python": platform.python_version(),
+        "streamlit": streamlit.__version__,
+        "numpy": numpy.__version__,
+        "sistema": platform.platform(),
+        "cpus": os.cpu_count()
+    }
+
+def imprimir_niveles(niveles):
+    print("=" * 78)
+    print(f"{'Usuarios':>8} {'Ejec/s':>8} {'p50':>7} {'p90':>7} {'p95':>7} {'p99':>7} {'CPU/ses':>8} {'MB/ses':>7} {'Errores':>8}")
+    print("=" * 78)
+    for nivel in niveles:
+        latencia = nivel["latencia_seg"]
+        print(
+            f"{nivel['usuarios']:>8} {nivel['ejecuciones_por_seg']:>8.2f} "
+            f"{latencia['p50']:>6.2f}s {latencia['p90']:>6.2f}s {latencia['p95']:>6.2f}s {latencia['p99']:>6.2f}s "
+            f"{nivel['cpu_seg_por_sesion']:>7.2f}s {nivel['memoria_mb_por_sesion']:>7.1f} {len(nivel['errores']):>8}"
+        )
+
+def imprimir_comparacion(reporte, anterior):
+    """
+    Diferencias por nivel contra un reporte anterior (p50, p95 y ejecuciones/s)
+    """
+    niveles_anteriores = {nivel["usuarios"]: nivel for nivel in anterior["niveles"]}
+    print("=" * 78)
+    print(f"COMPARACIÓN CONTRA {anterior['version']} (negativo = mejor en latencia)")
+    print("=" * 78)
+    for nivel in reporte["niveles"]:
+        previo = niveles_anteriores.get(nivel["usuarios"])
+        if previo is None:
+            continue
+        cambios = []
+        for p in ("p50", "p95"):
+            antes, ahora = previo["latencia_seg"][p], nivel["latencia_seg"][p]
+            cambios.append(f"{p} {ahora - antes:+.2f}s ({(ahora / antes - 1) * 100 if antes else 0:+.0f}%)")
+        antes, ahora = previo["ejecuciones_por_seg"], nivel["ejecuciones_por_seg"]
+        cambios.append(f"ejec/s {ahora - antes:+.2f} ({(ahora / antes - 1) * 100 if antes else 0:+.0f}%)")
+        print(f"{nivel['usuarios']:>3} usuarios: " + ", ".join(cambios))
+    print(f"Saturación: {anterior['saturacion']['usuarios']} -> {reporte['saturacion']['usuarios']} usuarios")
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga del simulador")
+    parser.add_argument("--usuarios", type=int, nargs="+", default=NIVELES_USUARIOS,
+                        help="Niveles de sesiones simultáneas")
+    parser.add_argument("--vueltas", type=int, default=1, help="Veces que cada sesión recorre su flujo")
+    parser.add_argument("--presupuesto-p95", type=float, default=PRESUPUESTO_P95_SEG,
+                        help="Latencia p95 máxima por ejecución (segundos)")
+    parser.add_argument("--tiempo-limite", type=float, default=120, help="Tiempo máximo de una ejecución (segundos)")
+    parser.add_argument("--sin-calentamiento", action="store_true",
+                        help="No recorrer los flujos una vez antes de medir (cachés en frío)")
+    parser.add_argument("--salida", default="prueba_carga.json", help="Archivo JSON del reporte")
+    parser.add_argument("--comparar", help="Reporte JSON anterior para comparar")
+    args = parser.parse_args()
+
+    niveles = []
+    for usuarios in sorted(set(args.usuarios)):
+        print(f"Midiendo {usuarios} usuario(s)...", flush=True)
+        niveles.append(medir_nivel(usuarios, args.vueltas, args.tiempo_limite, not args.sin_calentamiento))
+
+    reporte = {
+        "version": version_codigo(),
+        "fecha": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "entorno": entorno(),
+        "parametros": {
+            "usuarios": sorted(set(args.usuarios)),
+            "vueltas": args.vueltas,
+            "presupuesto_p95_seg": args.presupuesto_p95,
+            "calentamiento": not args.sin_calentamiento,
+            "flujos": {nombre: [paso for paso, _ in pasos] for nombre, pasos in FLUJOS.items()}
+        },
+        "niveles": niveles,
+        "saturacion": punto_saturacion(niveles, args.presupuesto_p95)
+    }
+
+    with open(args.salida, "w", encoding="utf-8") as archivo:
+        json.dump(reporte, archivo, ensure_ascii=False, indent=2)
+
+    imprimir_niveles(niveles)
+    saturacion = reporte["saturacion"]
+    print(f"Punto de saturación: {saturacion['usuarios'] or '-'} usuarios ({saturacion['motivo']})")
+    print(f"Reporte: {args.salida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as archivo:
+            imprimir_comparacion(reporte, json.load(archivo))
+
+    errores = [error for nivel in niveles for error in nivel["errores"]]
+    for error in sorted(set(errores)):
+        print(f"❌ {error}")
+    return 1 if errores else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
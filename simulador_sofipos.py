@@ -7,13 +7,47 @@ Fecha: Noviembre 2025
 """
 
 import streamlit as st
-import pandas as pd
 import numpy as np
-import plotly.graph_objects as go
-import plotly.express as px
 from datetime import datetime, timedelta
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+import hashlib
+import importlib
+import importlib.util
+import io
 import json
 import base64
+import os
+import re
+import sys
+import threading
+
+class ModuloDiferido:
+    """
+    Referencia a un módulo que se importa la primera vez que se usa uno de sus atributos
+
+    Pandas y Plotly son las importaciones más pesadas del simulador y la
+    pantalla inicial no las necesita, así que no se pagan al arrancar. La
+    referencia no se registra en sys.modules: así las herramientas que
+    recorren los módulos cargados (inspect, el propio Streamlit) no fuerzan
+    la importación.
+    """
+
+    def __init__(self, nombre):
+        self._nombre = nombre
+        self._modulo = None
+
+    def __getattr__(self, atributo):
+        if self._modulo is None:
+            self._modulo = importlib.import_module(self._nombre)
+        return getattr(self._modulo, atributo)
+
+    def cargado(self):
+        """Indica si el módulo ya fue importado"""
+        return self._modulo is not None or self._nombre in sys.modules
+
+pd = ModuloDiferido("pandas")
+go = ModuloDiferido("plotly.graph_objects")
 
 # Configuración de la página
 st.set_page_config(
@@ -46,24 +80,10 @@ def guardar_simulacion():
             "usa_finsus": st.session_state.get("usa_finsus", True),
             "solo_vista": st.session_state.get("solo_vista", False)
         },
-        "inversiones": {}
+        # Inversiones del estado compacto del portafolio (montos o porcentajes ya convertidos)
+        "inversiones": inversiones_en_sesion(st.session_state.get("monto_total_input", 50000))
     }
     
-    # Capturar inversiones manuales (checkboxes y montos)
-    sofipos = ["Nu México", "DiDi", "Stori", "Klar", "Ualá", "Mercado Pago", "Finsus"]
-    for sofipo in sofipos:
-        check_key = f"check_{sofipo}"
-        if st.session_state.get(check_key, False):
-            prod_key = f"prod_{sofipo}"
-            producto = st.session_state.get(prod_key, "")
-            if producto:
-                monto_key = f"monto_{sofipo}_{producto}"
-                monto = st.session_state.get(monto_key, 0)
-                simulacion["inversiones"][sofipo] = {
-                    "producto": producto,
-                    "monto": monto
-                }
-    
     return simulacion
 
 def cargar_simulacion(simulacion_data):
@@ -78,12 +98,12 @@ def cargar_simulacion(simulacion_data):
         for key, value in preferencias.items():
             st.session_state[key] = value
         
-        # Cargar inversiones
-        inversiones = simulacion_data.get("inversiones", {})
-        for sofipo, datos in inversiones.items():
-            st.session_state[f"check_{sofipo}"] = True
-            st.session_state[f"prod_{sofipo}"] = datos["producto"]
-            st.session_state[f"monto_{sofipo}_{datos['producto']}"] = datos["monto"]
+        # Cargar inversiones: reemplazan la selección actual del portafolio
+        estado = estado_portafolio()
+        desconocidos = aplicar_inversiones_estado(estado, simulacion_data.get("inversiones", {}))
+        escribir_widgets_portafolio(estado)
+        if desconocidos:
+            st.warning(f"⚠️ Productos que ya no existen en el catálogo: {', '.join(desconocidos)}")
         
         return True
     except Exception as e:
@@ -97,548 +117,219 @@ def exportar_json(simulacion):
     fecha = datetime.now().strftime("%Y%m%d_%H%M%S")
     return json_str, b64, fecha
 
-# Estilos CSS personalizados - Diseño Premium
-st.markdown("""
-<style>
-    /* Importar fuentes modernas */
-    @import url('https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700;800&family=Poppins:wght@600;700;800&display=swap');
-    
-    /* Estilos globales */
-    .main {
-        background: #f8fafc;
-        font-family: 'Inter', sans-serif;
-    }
-    
-    /* Header principal - Fresh & Clean */
-    .main-header {
-        font-size: 3rem;
-        font-family: 'Poppins', sans-serif;
-        color: #1a1a2e;
-        font-weight: 700;
-        text-align: center;
-        margin-bottom: 0.5rem;
-        letter-spacing: -0.5px;
-    }
-    
-    .subtitle {
-        text-align: center;
-        font-size: 1.2rem;
-        color: #64748b;
-        margin-bottom: 3rem;
-        font-weight: 400;
-    }
-    
-    /* Tarjetas de SOFIPO - Diseño Fresh y Minimalista */
-    .sofipo-section {
-        background: white;
-        padding: 2rem;
-        border-radius: 16px;
-        margin-bottom: 1.5rem;
-        border: 1px solid #e8eaed;
-        box-shadow: 0 2px 8px rgba(0, 0, 0, 0.04);
-        transition: all 0.3s ease;
-        position: relative;
-        overflow: visible;
-    }
-    
-    .sofipo-section::before {
-        content: '';
-        position: absolute;
-        top: -1px;
-        left: -1px;
-        right: -1px;
-        bottom: -1px;
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        border-radius: 16px;
-        opacity: 0;
-        z-index: -1;
-        transition: opacity 0.3s ease;
-    }
-    
-    .sofipo-section:hover {
-        transform: translateY(-2px);
-        box-shadow: 0 8px 24px rgba(102, 126, 234, 0.12);
-        border-color: transparent;
-    }
-    
-    .sofipo-section:hover::before {
-        opacity: 1;
-    }
-    
-    /* Cajas de advertencia y éxito - Minimalista */
-    .warning-box {
-        background: #fef3c7;
-        padding: 1.2rem 1.5rem;
-        border-radius: 12px;
-        border-left: 3px solid #f59e0b;
-        margin: 1rem 0;
-        color: #92400e;
-        font-size: 0.95rem;
-    }
-    
-    .success-box {
-        background: #d1fae5;
-        padding: 1.2rem 1.5rem;
-        border-radius: 12px;
-        border-left: 3px solid #10b981;
-        margin: 1rem 0;
-        color: #065f46;
-        font-size: 0.95rem;
-    }
-    
-    .info-box {
-        background: #dbeafe;
-        padding: 1.2rem 1.5rem;
-        border-radius: 12px;
-        border-left: 3px solid #3b82f6;
-        margin: 1rem 0;
-        color: #1e40af;
-        font-size: 0.95rem;
-    }
-    
-    /* Tarjetas de métricas - Fresh Design */
-    .metric-card {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        padding: 1.5rem;
-        border-radius: 12px;
-        color: white;
-        text-align: center;
-        box-shadow: 0 4px 12px rgba(102, 126, 234, 0.2);
-        transition: all 0.2s ease;
-    }
-    
-    .metric-card:hover {
-        transform: translateY(-3px);
-        box-shadow: 0 8px 20px rgba(102, 126, 234, 0.3);
-    }
-    
-    /* Botones personalizados - Clean */
-    .stButton>button {
-        background: #667eea;
-        color: white;
-        border: none;
-        border-radius: 10px;
-        padding: 0.7rem 1.8rem;
-        font-weight: 600;
-        font-size: 0.95rem;
-        transition: all 0.2s ease;
-        box-shadow: 0 2px 8px rgba(102, 126, 234, 0.2);
-    }
-    
-    .stButton>button:hover {
-        background: #5568d3;
-        transform: translateY(-1px);
-        box-shadow: 0 4px 12px rgba(102, 126, 234, 0.3);
-    }
-    
-    /* Checkboxes mejorados */
-    .stCheckbox {
-        font-size: 1.1rem;
-        font-weight: 500;
-    }
-    
-    /* Inputs numéricos */
-    .stNumberInput>div>div>input {
-        border-radius: 10px;
-        border: 2px solid #e0e7ff;
-        padding: 0.75rem;
-        font-size: 1rem;
-        transition: all 0.3s ease;
-    }
-    
-    .stNumberInput>div>div>input:focus {
-        border-color: #667eea;
-        box-shadow: 0 0 0 3px rgba(102, 126, 234, 0.1);
-    }
-    
-    /* Selectbox mejorado */
-    .stSelectbox>div>div {
-        border-radius: 10px;
-        border: 2px solid #e0e7ff;
-    }
-    
-    /* Dataframe personalizado */
-    .dataframe {
-        border-radius: 15px;
-        overflow: hidden;
-        box-shadow: 0 4px 20px rgba(0,0,0,0.08);
-    }
-    
-    /* Sidebar mejorado */
-    .css-1d391kg {
-        background: linear-gradient(180deg, #667eea 0%, #764ba2 100%);
-        color: white;
-    }
-    
-    /* Animaciones sutiles */
-    @keyframes fadeIn {
-        from {
-            opacity: 0;
-            transform: translateY(10px);
-        }
-        to {
-            opacity: 1;
-            transform: translateY(0);
-        }
-    }
-    
-    /* Badge moderno */
-    .badge {
-        display: inline-block;
-        padding: 0.35rem 0.8rem;
-        font-size: 0.875rem;
-        font-weight: 600;
-        border-radius: 20px;
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        color: white;
-        margin: 0.25rem;
-        box-shadow: 0 2px 10px rgba(102, 126, 234, 0.3);
-    }
-    
-    /* Separador estilizado */
-    hr {
-        border: none;
-        height: 2px;
-        background: linear-gradient(90deg, transparent, #667eea, transparent);
-        margin: 2rem 0;
-    }
-    
-    /* Tabs personalizados */
-    .stTabs [data-baseweb="tab-list"] {
-        gap: 8px;
-        background-color: #f8f9ff;
-        padding: 0.5rem;
-        border-radius: 15px;
-    }
-    
-    .stTabs [data-baseweb="tab"] {
-        border-radius: 10px;
-        padding: 0.75rem 1.5rem;
-        font-weight: 600;
-        transition: all 0.3s ease;
-    }
-    
-    .stTabs [aria-selected="true"] {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        color: white;
-    }
-    
-    /* Expander mejorado */
-    .streamlit-expanderHeader {
-        background: linear-gradient(135deg, #f8f9ff 0%, #e8eeff 100%);
-        border-radius: 10px;
-        font-weight: 600;
-        padding: 1rem;
-    }
-    
-    /* Tooltip personalizado */
-    .tooltip {
-        position: relative;
-        display: inline-block;
-        border-bottom: 1px dotted #667eea;
+# ============================================================================
+# TEMA (HOJA DE ESTILOS ESTÁTICA)
+# ============================================================================
+#
+# Los estilos claro y oscuro viven en static/simulador.css. Con
+# server.enableStaticServing (ver .streamlit/config.toml) Streamlit sirve el
+# archivo y el navegador lo guarda en caché, así que cada ejecución solo envía
+# una línea @import. El modo oscuro se activa con un marcador de clase
+# (CLASE_TEMA_OSCURO) en lugar de reenviar otro bloque de estilos.
+
+ARCHIVO_ESTILOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "simulador.css")
+URL_ESTILOS = "app/static/simulador.css"
+CLASE_TEMA_OSCURO = "tema-oscuro"
+
+# Comentario de la hoja que separa las reglas del modo oscuro (solo se usa sin archivos estáticos)
+INICIO_ESTILOS_OSCUROS = "/* MODO OSCURO COMPLETO */"
+
+def _minificar_css(css):
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    css = re.sub(r"\s*([{};,>])\s*", r"\1", css)
+    css = re.sub(r":\s+", ":", css)
+    return f"<style>{css.strip()}</style>"
+
+@st.cache_resource(show_spinner=False)
+def hoja_estilos():
+    """
+    Lee la hoja de estilos una sola vez por proceso
+
+    Returns:
+        Dict con version (hash corto del archivo, para invalidar el caché del
+        navegador) y los bloques <style> minificados claro y oscuro, que se usan
+        cuando el servidor no sirve archivos estáticos
+    """
+    with open(ARCHIVO_ESTILOS, encoding="utf-8") as archivo:
+        css = archivo.read()
+    claro, _, oscuro = css.partition(INICIO_ESTILOS_OSCUROS)
+    return {
+        "version": hashlib.sha256(css.encode("utf-8")).hexdigest()[:12],
+        "claro": _minificar_css(claro),
+        "oscuro": _minificar_css(oscuro)
     }
-</style>
-""", unsafe_allow_html=True)
+
+def servidor_estatico():
+    """Indica si Streamlit sirve la carpeta static/ (server.enableStaticServing)"""
+    return st.get_option("server.enableStaticServing")
+
+def bloque_estilos():
+    """
+    Lo que se envía en cada ejecución para cargar los estilos
+
+    Returns:
+        Un @import de la hoja estática o, si el servidor no sirve archivos
+        estáticos (por ejemplo, al ejecutar desde otro directorio sin la
+        configuración), los estilos claros en línea
+    """
+    hoja = hoja_estilos()
+    if servidor_estatico():
+        return f"<style>@import url('{URL_ESTILOS}?v={hoja['version']}');</style>"
+    return hoja["claro"]
+
+def marcador_tema(oscuro):
+    """
+    Marcador que activa las reglas .stApp:has(.tema-oscuro) de la hoja de estilos
+
+    Sin archivos estáticos el marcador lleva además las reglas oscuras en línea.
+    """
+    if not oscuro:
+        return ""
+    marcador = f'<div class="{CLASE_TEMA_OSCURO}"></div>'
+    return marcador if servidor_estatico() else marcador + hoja_estilos()["oscuro"]
+
+st.markdown(bloque_estilos(), unsafe_allow_html=True)
 
 # ============================================================================
-# DATOS DE LAS SOFIPOS (Tasas actualizadas a Noviembre 2025)
+# DATOS DE LAS SOFIPOS (datos/catalogo_sofipos.json)
+# ============================================================================
+#
+# Las tasas viven en un catálogo JSON que se actualiza con actualizar_catalogo.py:
+# valida el archivo nuevo, muestra qué cambió contra el vigente y lo instala.
+# En cada ejecución se revisa la fecha de modificación del JSON; si cambió se
+# vuelve a leer sin reiniciar el servidor, se compila una vez por versión
+# (recursos_compartidos) y solo se recalcula lo que usa alguno de los productos
+# que cambiaron (ver huella_productos).
+#
+# Estructura: {"actualizado": texto, "sofipos": {sofipo: {"logo", "color",
+# "descripcion", "productos": {producto: {"tasa_base", "liquidez", "minimo",
+# "tipo", ...}}}}}
+#
 # ============================================================================
 
-SOFIPOS_DATA = {
-    "Nu México": {
-        "logo": "💜",
-        "productos": {
-            "Cajita Turbo": {
-                "tasa_base": 15.00,
-                "liquidez": "Inmediata",
-                "minimo": 0,
-                "tipo": "vista",
-                "limite_max": 25000,
-                "descripcion_extra": "Hasta $25,000 MXN"
-            },
-            "Dinero en Cajita (disponible)": {
-                "tasa_base": 7.50,
-                "liquidez": "Inmediata",
-                "minimo": 0,
-                "tipo": "vista"
-            },
-            "Plazo Fijo 7 días": {
-                "tasa_base": 7.55,
-                "liquidez": "7 días",
-                "minimo": 100,
-                "tipo": "plazo",
-                "plazo_dias": 7
-            },
-            "Plazo Fijo 28 días": {
-                "tasa_base": 7.60,
-                "liquidez": "28 días",
-                "minimo": 100,
-                "tipo": "plazo",
-                "plazo_dias": 28
-            },
-            "Plazo Fijo 90 días": {
-                "tasa_base": 7.70,
-                "liquidez": "90 días",
-                "minimo": 100,
-                "tipo": "plazo",
-                "plazo_dias": 90
-            },
-            "Plazo Fijo 180 días": {
-                "tasa_base": 7.80,
-                "liquidez": "180 días",
-                "minimo": 100,
-                "tipo": "plazo",
-                "plazo_dias": 180
-            }
-        },
-        "color": "#8A05BE",
-        "descripcion": "SOFIPO líder en México con 13+ millones de clientes"
-    },
-    "DiDi": {
-        "logo": "🚗",
-        "productos": {
-            "DiDi Ahorro": {
-                "tasa_base": 8.50,
-                "tasa_premium": 16.00,
-                "limite_premium": 10000,
-                "liquidez": "Inmediata",
-                "minimo": 0,
-                "tipo": "vista_hibrida"
-            }
-        },
-        "color": "#FF6600",
-        "descripcion": "Hasta 16% en primeros $10,000, después 8.5%"
-    },
-    "Stori": {
-        "logo": "🟦",
-        "productos": {
-            "Sin plazo": {
-                "tasa_base": 8.00,
-                "liquidez": "Inmediata",
-                "minimo": 0,
-                "tipo": "vista",
-                "plazo_dias": 0
-            },
-            "30 días": {
-                "tasa_base": 8.05,
-                "liquidez": "30 días",
-                "minimo": 0,
-                "tipo": "plazo",
-                "plazo_dias": 30
-            },
-            "90 días": {
-                "tasa_base": 10.00,
-                "liquidez": "90 días",
-                "minimo": 0,
-                "tipo": "plazo",
-                "plazo_dias": 90
-            },
-            "180 días": {
-                "tasa_base": 7.50,
-                "liquidez": "180 días",
-                "minimo": 0,
-                "tipo": "plazo",
-                "plazo_dias": 180
-            },
-            "360 días": {
-                "tasa_base": 7.00,
-                "liquidez": "360 días",
-                "minimo": 0,
-                "tipo": "plazo",
-                "plazo_dias": 360
-            }
-        },
-        "color": "#0066FF",
-        "descripcion": "Inversiones con y sin plazo (requiere cuenta Stori)"
-    },
-    "Klar": {
-        "logo": "⚡",
-        "productos": {
-            "Cuenta Klar": {
-                "tasa_base": 8.50,
-                "liquidez": "Inmediata",
-                "minimo": 100,
-                "tipo": "vista"
-            },
-            "Inversión Flexible Max": {
-                "tasa_base": 15.00,
-                "liquidez": "Inmediata",
-                "minimo": 100,
-                "tipo": "vista",
-                "requisito": "Plus o Platino",
-                "descripcion_extra": "Requiere membresía Plus o Platino"
-            }
-        },
-        "color": "#00D98C",
-        "descripcion": "SOFIPO regulada por CNBV con más de 2M usuarios"
-    },
-    "Ualá": {
-        "logo": "🔴",
-        "productos": {
-            "Cuenta con Rendimiento (Base)": {
-                "tasa_base": 7.75,
-                "liquidez": "Inmediata",
-                "minimo": 0,
-                "tipo": "vista",
-                "limite_max": 30000,
-                "descripcion_extra": "7.75% hasta $30,000"
-            },
-            "Cuenta con Rendimiento Plus": {
-                "tasa_base": 16.00,
-                "liquidez": "Inmediata",
-                "minimo": 0,
-                "tipo": "vista",
-                "limite_max": 50000,
-                "requisito": "Plus",
-                "requisito_deposito": 3000,
-                "descripcion_extra": "16% hasta $50k (requiere $3k/mes en consumos o nómina)"
-            },
-            "Reserva 7 días": {
-                "tasa_base": 7.80,
-                "liquidez": "7 días",
-                "minimo": 0,
-                "tipo": "plazo",
-                "plazo_dias": 7
-            },
-            "Reserva 14 días": {
-                "tasa_base": 7.85,
-                "liquidez": "14 días",
-                "minimo": 0,
-                "tipo": "plazo",
-                "plazo_dias": 14
-            },
-            "Reserva 28 días": {
-                "tasa_base": 7.90,
-                "liquidez": "28 días",
-                "minimo": 0,
-                "tipo": "plazo",
-                "plazo_dias": 28
-            },
-            "Reserva 90 días": {
-                "tasa_base": 8.00,
-                "liquidez": "90 días",
-                "minimo": 0,
-                "tipo": "plazo",
-                "plazo_dias": 90
-            },
-            "Reserva 180 días": {
-                "tasa_base": 8.10,
-                "liquidez": "180 días",
-                "minimo": 0,
-                "tipo": "plazo",
-                "plazo_dias": 180
-            },
-            "Reserva 1 año": {
-                "tasa_base": 8.15,
-                "liquidez": "365 días",
-                "minimo": 0,
-                "tipo": "plazo",
-                "plazo_dias": 365
-            }
-        },
-        "color": "#00D4FF",
-        "descripcion": "Hasta 16% con Tasa Plus (requiere $3k/mes en consumos/nómina)"
-    },
-    "Mercado Pago": {
-        "logo": "💙",
-        "productos": {
-            "Rendimientos MP": {
-                "tasa_base": 13.00,
-                "liquidez": "Inmediata",
-                "minimo": 3000,
-                "tipo": "vista",
-                "limite_max": 25000,
-                "requisito_deposito": 3000,
-                "descripcion_extra": "Requiere depositar $3,000/mes, máximo $25,000"
-            }
-        },
-        "color": "#00AAFF",
-        "descripcion": "13% anual (requiere $3k/mes, máx $25k)"
-    },
-    "Finsus": {
-        "logo": "🟢",
-        "productos": {
-            "Finsus+ (a la vista)": {
-                "tasa_base": 8.09,
-                "liquidez": "Inmediata",
-                "minimo": 0,
-                "tipo": "vista"
-            },
-            "Apartados": {
-                "tasa_base": 4.00,
-                "liquidez": "Inmediata",
-                "minimo": 0,
-                "tipo": "vista",
-                "descripcion_extra": "Ideal para metas de ahorro"
-            },
-            "Plazo Fijo 7 días": {
-                "tasa_base": 8.00,
-                "liquidez": "7 días",
-                "minimo": 0,
-                "tipo": "plazo",
-                "plazo_dias": 7
-            },
-            "Plazo Fijo 30 días": {
-                "tasa_base": 8.09,
-                "liquidez": "30 días",
-                "minimo": 0,
-                "tipo": "plazo",
-                "plazo_dias": 30
-            },
-            "Plazo Fijo 90 días": {
-                "tasa_base": 8.39,
-                "liquidez": "90 días",
-                "minimo": 0,
-                "tipo": "plazo",
-                "plazo_dias": 90
-            },
-            "Plazo Fijo 180 días": {
-                "tasa_base": 8.59,
-                "liquidez": "180 días",
-                "minimo": 0,
-                "tipo": "plazo",
-                "plazo_dias": 180
-            },
-            "Plazo Fijo 360 días": {
-                "tasa_base": 10.09,
-                "liquidez": "360 días",
-                "minimo": 0,
-                "tipo": "plazo",
-                "plazo_dias": 360
-            },
-            "Plazo Fijo 720 días": {
-                "tasa_base": 8.19,
-                "liquidez": "720 días",
-                "minimo": 0,
-                "tipo": "plazo",
-                "plazo_dias": 720
-            },
-            "Plazo Fijo 1080 días": {
-                "tasa_base": 7.59,
-                "liquidez": "1080 días",
-                "minimo": 0,
-                "tipo": "plazo",
-                "plazo_dias": 1080
-            },
-            "Plazo Fijo 1440 días": {
-                "tasa_base": 7.29,
-                "liquidez": "1440 días",
-                "minimo": 0,
-                "tipo": "plazo",
-                "plazo_dias": 1440
-            },
-            "Plazo Fijo 1800 días": {
-                "tasa_base": 6.89,
-                "liquidez": "1800 días",
-                "minimo": 0,
-                "tipo": "plazo",
-                "plazo_dias": 1800
-            }
-        },
-        "color": "#4CAF50",
-        "descripcion": "Ahorro sustentable a la vista y plazos fijos hasta 1800 días"
+ARCHIVO_CATALOGO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "datos", "catalogo_sofipos.json")
+
+TIPOS_PRODUCTO = ("vista", "vista_hibrida", "plazo")
+# Tasas anuales aceptadas (%); fuera de este rango casi seguro es un error de captura
+RANGO_TASAS = (0.0, 30.0)
+
+def _es_numero(valor):
+    return isinstance(valor, (int, float)) and not isinstance(valor, bool)
+
+def validar_catalogo(contenido):
+    """
+    Revisa la estructura y los valores de un catálogo de tasas
+
+    Args:
+        contenido: Dict leído del JSON ({"actualizado", "sofipos"})
+
+    Returns:
+        Lista de errores (vacía si el catálogo es válido)
+    """
+    sofipos = contenido.get("sofipos") if isinstance(contenido, dict) else None
+    if not isinstance(sofipos, dict) or not sofipos:
+        return ["Falta el diccionario 'sofipos' o está vacío"]
+
+    errores = []
+    for sofipo, datos in sofipos.items():
+        for campo in ("logo", "color", "descripcion"):
+            if not isinstance(datos.get(campo), str):
+                errores.append(f"{sofipo}: falta '{campo}'")
+        productos = datos.get("productos")
+        if not isinstance(productos, dict) or not productos:
+            errores.append(f"{sofipo}: no tiene productos")
+            continue
+
+        for producto, info in productos.items():
+            nombre = f"{sofipo} - {producto}"
+            tipo = info.get("tipo")
+            if tipo not in TIPOS_PRODUCTO:
+                errores.append(f"{nombre}: tipo {tipo!r} desconocido (usa {', '.join(TIPOS_PRODUCTO)})")
+            if not isinstance(info.get("liquidez"), str):
+                errores.append(f"{nombre}: falta 'liquidez'")
+
+            campos_tasa = ["tasa_base", "tasa_premium"] if tipo == "vista_hibrida" else ["tasa_base"]
+            for campo in campos_tasa:
+                valor = info.get(campo)
+                if not _es_numero(valor) or not RANGO_TASAS[0] <= valor <= RANGO_TASAS[1]:
+                    errores.append(f"{nombre}: {campo} = {valor!r} fuera de {RANGO_TASAS[0]:g}-{RANGO_TASAS[1]:g}%")
+            if tipo == "vista_hibrida" and _es_numero(info.get("tasa_premium")) and _es_numero(info.get("tasa_base")) \
+                    and info["tasa_premium"] < info["tasa_base"]:
+                errores.append(f"{nombre}: la tasa premium es menor que la base")
+
+            if not _es_numero(info.get("minimo")) or info["minimo"] < 0:
+                errores.append(f"{nombre}: minimo = {info.get('minimo')!r} debe ser un monto >= 0")
+            for campo, requerido in (("limite_max", False), ("limite_premium", tipo == "vista_hibrida"), ("requisito_deposito", False)):
+                if campo not in info and not requerido:
+                    continue
+                if not _es_numero(info.get(campo)) or info[campo] <= 0:
+                    errores.append(f"{nombre}: {campo} = {info.get(campo)!r} debe ser un monto > 0")
+            if _es_numero(info.get("limite_max")) and _es_numero(info.get("minimo")) and info["minimo"] > info["limite_max"]:
+                errores.append(f"{nombre}: el mínimo es mayor que el límite")
+            if tipo == "plazo" and (not isinstance(info.get("plazo_dias"), int) or info["plazo_dias"] <= 0):
+                errores.append(f"{nombre}: plazo_dias = {info.get('plazo_dias')!r} debe ser un entero > 0")
+    return errores
+
+def version_catalogo(sofipos):
+    """Hash corto del contenido del catálogo (identifica las tasas en uso)"""
+    contenido = json.dumps(sofipos, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")
+    return hashlib.sha256(contenido).hexdigest()[:12]
+
+def leer_catalogo(ruta=ARCHIVO_CATALOGO):
+    """
+    Lee y valida un catálogo JSON
+
+    Returns:
+        Dict con actualizado, sofipos y version
+
+    Raises:
+        OSError si no se puede leer; ValueError si no es JSON o no es válido
+    """
+    with open(ruta, encoding="utf-8") as archivo:
+        contenido = json.load(archivo)
+    errores = validar_catalogo(contenido)
+    if errores:
+        raise ValueError("; ".join(errores))
+    return {
+        "actualizado": contenido.get("actualizado", ""),
+        "sofipos": contenido["sofipos"],
+        "version": version_catalogo(contenido["sofipos"])
     }
-}
+
+@st.cache_resource(show_spinner=False)
+def _ultimo_catalogo_valido():
+    """Último catálogo que se leyó bien (se sigue usando si el archivo nuevo falla)"""
+    return {}
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def cargar_catalogo(firma):
+    """
+    Catálogo del archivo, compartido por todas las sesiones
+
+    Si el archivo nuevo no es válido se sigue usando el último catálogo bueno,
+    con el motivo en "error".
+
+    Args:
+        firma: (fecha de modificación, tamaño) del JSON; al cambiar se vuelve a leer
+    """
+    ultimo = _ultimo_catalogo_valido()
+    try:
+        catalogo = leer_catalogo()
+    except (OSError, ValueError) as e:
+        if "catalogo" not in ultimo:
+            raise
+        return dict(ultimo["catalogo"], error=str(e))
+    ultimo["catalogo"] = catalogo
+    return catalogo
+
+def catalogo_vigente():
+    """Catálogo de tasas vigente; se vuelve a leer si el archivo cambió"""
+    estado = os.stat(ARCHIVO_CATALOGO)
+    return cargar_catalogo((estado.st_mtime_ns, estado.st_size))
+
+CATALOGO_TASAS = catalogo_vigente()
+SOFIPOS_DATA = CATALOGO_TASAS["sofipos"]
 
 # ============================================================================
 # FUNCIONES DE CÁLCULO FINANCIERO
@@ -672,27 +363,24 @@ SOFIPOS_DATA = {
 def calcular_rendimiento_hibrido_didi(monto, tasa_premium, limite_premium, tasa_base, dias):
     """
     Calcula el rendimiento con estructura híbrida de DiDi con capitalización diaria
-    16% sobre primeros $10,000 y tasa base sobre el resto
+    tasa premium sobre los primeros limite_premium pesos y tasa base sobre el resto
     
     CORRECCIÓN FINANCIERA: DiDi capitaliza diariamente, no usa interés simple
     """
     if monto <= limite_premium:
         # Todo el monto está en tasa premium con capitalización diaria
-        tasa_decimal = tasa_premium / 100
-        monto_final = monto * (1 + tasa_decimal / 365) ** dias
+        monto_final = monto * factor_crecimiento(tasa_premium, dias)
         return monto_final - monto
     else:
         # Capitalización diaria separada para cada tramo
-        tasa_premium_decimal = tasa_premium / 100
-        tasa_base_decimal = tasa_base / 100
         
         # Interés compuesto sobre el límite premium
-        monto_final_premium = limite_premium * (1 + tasa_premium_decimal / 365) ** dias
+        monto_final_premium = limite_premium * factor_crecimiento(tasa_premium, dias)
         interes_premium = monto_final_premium - limite_premium
         
         # Interés compuesto sobre el excedente
         excedente = monto - limite_premium
-        monto_final_excedente = excedente * (1 + tasa_base_decimal / 365) ** dias
+        monto_final_excedente = excedente * factor_crecimiento(tasa_base, dias)
         interes_excedente = monto_final_excedente - excedente
         
         return interes_premium + interes_excedente
@@ -714,10 +402,8 @@ def calcular_interes_compuesto(capital, tasa_anual, dias, compounding="diario"):
     tasa_decimal = tasa_anual / 100
     
     if compounding == "diario":
-        # Capitalización diaria: n=365, periodos en días
-        n = 365
-        t = dias / 365  # Tiempo en años
-        monto_final = capital * (1 + tasa_decimal / n) ** (n * t)
+        # Capitalización diaria: n=365, periodos en días (factor de la tabla precalculada)
+        monto_final = capital * factor_crecimiento(tasa_anual, dias)
     elif compounding == "mensual":
         # Capitalización mensual: n=12, periodos en meses
         n = 12
@@ -748,66 +434,142 @@ def calcular_interes_simple(capital, tasa_anual, dias):
     interes = capital * tasa_decimal * (dias / 360)  # Año comercial
     return interes
 
-def generar_proyeccion_mensual(capital, tasa_anual, tipo_calculo, meses=12, escenario="Optimista"):
+# Reducción TRIMESTRAL de tasas según escenario (puntos porcentuales cada 3 meses)
+REDUCCION_TRIMESTRAL_ESCENARIO = {
+    "Optimista": 0,
+    "Realista": 0.25,    # Baja 0.25% cada trimestre (1% al año)
+    "Conservador": 0.5   # Baja 0.5% cada trimestre (2% al año)
+}
+TASA_MINIMA_ESCENARIO = 1.0
+
+# Tasa anual de retención de ISR sobre el capital (%), publicada cada año en la
+# Ley de Ingresos de la Federación. La retención se devenga diario sobre el saldo.
+TASAS_RETENCION_ISR = {
+    2024: 0.50,
+    2025: 0.50,
+    2026: 0.90
+}
+
+def tasa_retencion_isr(anio=None):
+    """
+    Tasa anual de retención de ISR vigente en un año
+
+    Args:
+        anio: Año fiscal (por omisión, el actual). Después del último año
+              publicado se usa la última tasa conocida.
+
+    Returns:
+        Tupla (año de la tasa aplicada, tasa anual en %)
+    """
+    anio = anio or datetime.now().year
+    publicados = [a for a in TASAS_RETENCION_ISR if a <= anio]
+    vigente = max(publicados) if publicados else min(TASAS_RETENCION_ISR)
+    return vigente, TASAS_RETENCION_ISR[vigente]
+
+# Número de aportaciones por mes según frecuencia
+APORTACIONES_POR_MES = {
+    "Semanal": 4.33,      # ~4.33 semanas por mes
+    "Quincenal": 2,
+    "Mensual": 1
+}
+
+def periodos_aportacion(frecuencia, meses):
+    """
+    Aportaciones que caen en cada mes del plazo
+
+    Las semanales siguen el patrón 4/4/5: 13 semanas por trimestre, 52 al año.
+
+    Args:
+        frecuencia: "Semanal", "Quincenal" o "Mensual"
+        meses: Meses a simular
+
+    Returns:
+        Arreglo de enteros (longitud meses); su suma es el total de aportaciones
+    """
+    numeros_mes = np.arange(1, meses + 1)
+    if frecuencia == "Semanal":
+        return np.where(numeros_mes % 3 == 0, 5, 4)
+    return np.full(meses, int(APORTACIONES_POR_MES.get(frecuencia, 1)))
+
+def tasas_por_mes(tasa_anual, meses, escenario="Optimista"):
+    """
+    Tasa vigente en cada mes (0..meses) según el escenario de tasas
+
+    La reducción es escalonada: se aplica completa al cumplirse cada trimestre
+    y la tasa nunca baja de TASA_MINIMA_ESCENARIO.
+
+    Args:
+        tasa_anual: Tasa anual inicial (%); un arreglo P da la trayectoria de P productos
+
+    Returns:
+        Arreglo de longitud meses + 1 ((meses + 1) x P si tasa_anual es un arreglo)
+    """
+    reduccion_trimestral = REDUCCION_TRIMESTRAL_ESCENARIO.get(escenario, 0)
+    trimestres_completos = (np.arange(meses + 1) // 3).reshape((-1,) + (1,) * np.ndim(tasa_anual))
+    return np.maximum(TASA_MINIMA_ESCENARIO, np.asarray(tasa_anual, dtype=float) - reduccion_trimestral * trimestres_completos)
+
+def factores_crecimiento_mensual(tasas, tipo_calculo, retencion=0.0):
+    """
+    Factor de crecimiento de cada mes (meses de 30 días) para un arreglo de tasas
+
+    El mes 0 no genera intereses, así que su factor es 1. La retención de ISR
+    se devenga diario sobre el saldo, así que en el compuesto equivale a restarla
+    de la tasa y en el simple se descuenta sobre el capital (año de 365 días).
+
+    Args:
+        tasas: Arreglo de tasas anuales (%) por mes, como el de tasas_por_mes()
+        tipo_calculo: "compuesto" (diario, 365) o "simple" (año comercial, 360)
+        retencion: Tasa anual de retención de ISR (%); un arreglo R x 1 calcula
+                   R series a la vez (por ejemplo, bruta y neta)
+
+    Returns:
+        Arreglo de la misma longitud que tasas (R x len(tasas) con varias retenciones)
+    """
+    tasas_decimales = np.asarray(tasas, dtype=float) / 100
+    retencion_decimal = np.asarray(retencion, dtype=float) / 100
+    if tipo_calculo == "compuesto":
+        factores = (1 + (tasas_decimales - retencion_decimal) / 365) ** 30
+    else:
+        factores = 1 + tasas_decimales * 30 / 360 - retencion_decimal * 30 / 365
+    factores[..., 0] = 1.0
+    return factores
+
+def retenciones_bruta_neta(retencion_isr):
+    """
+    Retenciones para calcular en una sola pasada la serie bruta (renglón 0) y la neta (renglón 1)
+    """
+    return np.array([[0.0], [retencion_isr]])
+
+def generar_proyeccion_mensual(capital, tasa_anual, tipo_calculo, meses=12, escenario="Optimista", retencion_isr=0.0):
     """
     Genera proyección mes a mes del crecimiento de la inversión
     
+    La serie bruta y la neta de ISR se calculan juntas (un renglón cada una).
+    
     Args:
         capital: Capital inicial
         tasa_anual: Tasa anual inicial
         tipo_calculo: "compuesto" o "simple"
         meses: Número de meses a proyectar
-        escenario: "Optimista" (tasas constantes), "Realista" (-2%/año), "Conservador" (-3%/año)
+        escenario: "Optimista" (tasas constantes), "Realista" (-1%/año), "Conservador" (-2%/año)
+        retencion_isr: Tasa anual de retención de ISR (%) para las columnas netas
     """
-    proyeccion = []
-    capital_acumulado = capital
-    interes_total_acumulado = 0
-    
-    # Definir reducción TRIMESTRAL de tasas según escenario
-    # La reducción se aplica cada 3 meses (cada trimestre)
-    reduccion_trimestral = {
-        "Optimista": 0,
-        "Realista": 0.25,    # Baja 0.25% cada trimestre (1% al año)
-        "Conservador": 0.5   # Baja 0.5% cada trimestre (2% al año)
-    }.get(escenario, 0)
-    
-    # DEBUG: Imprimir info al inicio
-    print(f"DEBUG generar_proyeccion_mensual: escenario={escenario}, reduccion_trimestral={reduccion_trimestral}, tasa_inicial={tasa_anual}")
-    
-    for mes in range(meses + 1):
-        # Calcular cuántos trimestres han pasado (reducción escalonada cada 3 meses)
-        trimestres_completos = mes // 3
-        reduccion_acumulada = reduccion_trimestral * trimestres_completos
-        tasa_ajustada = max(1.0, tasa_anual - reduccion_acumulada)
-        
-        # DEBUG: Imprimir tasas ajustadas
-        if mes in [0, 3, 6, 9, 12]:
-            print(f"  Mes {mes}: trimestres={trimestres_completos}, reduccion={reduccion_acumulada}, tasa={tasa_ajustada}")
-        
-        # Calcular interés del mes actual
-        if mes == 0:
-            interes_mes = 0
-        else:
-            dias_mes = 30
-            if tipo_calculo == "compuesto":
-                interes_mes = calcular_interes_compuesto(capital_acumulado, tasa_ajustada, dias_mes)
-            else:
-                interes_mes = calcular_interes_simple(capital_acumulado, tasa_ajustada, dias_mes)
-            
-            capital_acumulado += interes_mes
-            interes_total_acumulado += interes_mes
-        
-        proyeccion.append({
-            "Mes": mes,
-            "Capital Inicial": capital,
-            "Intereses Generados": interes_total_acumulado,
-            "Total Acumulado": capital_acumulado,
-            "Tasa Actual": tasa_ajustada
-        })
-    
-    return pd.DataFrame(proyeccion)
+    tasas = tasas_por_mes(tasa_anual, meses, escenario)
+    factores = factores_crecimiento_mensual(tasas, tipo_calculo, retenciones_bruta_neta(retencion_isr))
+    total_acumulado, total_neto = capital * np.cumprod(factores, axis=1)
+    
+    return pd.DataFrame({
+        "Mes": np.arange(meses + 1),
+        "Capital Inicial": np.full(meses + 1, capital),
+        "Intereses Generados": total_acumulado - capital,
+        "Total Acumulado": total_acumulado,
+        "Intereses Netos": total_neto - capital,
+        "Total Neto": total_neto,
+        "Tasa Actual": tasas
+    })
 
-def calcular_distribucion_aportaciones(inversiones_seleccionadas, aportacion_monto, estrategia, total_invertido):
+def calcular_distribucion_aportaciones(inversiones_seleccionadas, aportacion_monto, estrategia, total_invertido,
+                                       liquidez_objetivo=None):
     """
     Calcula cómo distribuir cada aportación entre los productos, respetando límites máximos
     
@@ -816,6 +578,7 @@ def calcular_distribucion_aportaciones(inversiones_seleccionadas, aportacion_mon
         aportacion_monto: Monto de cada aportación
         estrategia: Estrategia de distribución seleccionada
         total_invertido: Capital inicial total
+        liquidez_objetivo: Liquidez mínima (%) para la distribución inteligente
     
     Returns:
         Dict con la distribución de la aportación y lista de mensajes explicativos
@@ -897,36 +660,36 @@ def calcular_distribucion_aportaciones(inversiones_seleccionadas, aportacion_mon
                 monto_restante = 0
     
     else:  # Distribución inteligente automática
-        mensajes.append("🤖 Aplicando distribución inteligente (simulada):")
-        mensajes.append("   • Maximizando rendimiento")
-        mensajes.append("   • Respetando límites por producto")
-        mensajes.append("   • Manteniendo diversificación")
+        mensajes.append("🤖 Distribución inteligente:")
+        mensajes.append("   • Mejores tasas primero, hasta el límite de cada producto")
+        mensajes.append(f"   • Sin pasar de la cobertura IPAB (${LIMITE_IPAB_MXN:,}) por institución")
+        if liquidez_objetivo:
+            mensajes.append(f"   • Primero a productos a la vista si la liquidez baja de {liquidez_objetivo:.0f}%")
         
-        # Por ahora, usar la misma lógica que "mayor rendimiento"
-        inversiones_ordenadas = sorted(
-            inversiones_seleccionadas.items(),
-            key=lambda x: x[1]['producto_info']['tasa_base'],
-            reverse=True
+        llaves = list(inversiones_seleccionadas)
+        datos = [inversiones_seleccionadas[llave] for llave in llaves]
+        asignacion = repartir_aportacion(
+            aportacion_monto,
+            saldos=[inv_data['monto'] for inv_data in datos],
+            tasas=[inv_data['producto_info']['tasa_base'] for inv_data in datos],
+            limites=[
+                inv_data['producto_info'].get('limite_maximo') or inv_data['producto_info'].get('limite_max')
+                or inv_data['producto_info'].get('limite_premium') or np.inf
+                for inv_data in datos
+            ],
+            grupos=matriz_instituciones([inv_data['sofipo'] for inv_data in datos]),
+            topes_grupo=LIMITE_IPAB_MXN,
+            liquidos=[inv_data['producto_info']['tipo'] in ("vista", "vista_hibrida") for inv_data in datos],
+            liquidez_objetivo=liquidez_objetivo
         )
         
-        for sofipo_key, inv_data in inversiones_ordenadas:
-            if monto_restante <= 0:
-                break
-            
-            producto_info = inv_data['producto_info']
-            limite_maximo = producto_info.get('limite_maximo', producto_info.get('limite_max', producto_info.get('limite_premium', None)))
-            monto_actual = inv_data['monto']
-            
-            if limite_maximo and monto_actual >= limite_maximo:
-                distribucion[sofipo_key] = 0
-            elif limite_maximo:
-                espacio_disponible = limite_maximo - monto_actual
-                monto_asignar = min(monto_restante, espacio_disponible)
-                distribucion[sofipo_key] = monto_asignar
-                monto_restante -= monto_asignar
-            else:
-                distribucion[sofipo_key] = monto_restante
-                monto_restante = 0
+        for llave, inv_data, monto_asignar in zip(llaves, datos, asignacion):
+            distribucion[llave] = float(monto_asignar)
+            if monto_asignar > 0:
+                mensajes.append(f"✅ {inv_data['sofipo']} ({inv_data['producto_info']['tasa_base']}%): ${monto_asignar:,.0f}")
+        sin_asignar = aportacion_monto - asignacion.sum()
+        if sin_asignar > 0.5:
+            mensajes.append(f"⚠️ ${sin_asignar:,.0f} no caben en ningún producto (límites e IPAB)")
     
     return distribucion, mensajes
 
@@ -937,11 +700,18 @@ def generar_proyeccion_con_aportaciones(
     meses=12, 
     aportacion=0, 
     frecuencia="Mensual",
-    escenario="Optimista"
+    escenario="Optimista",
+    retencion_isr=0.0
 ):
     """
     Genera proyección considerando aportaciones recurrentes
     
+    Cada mes se capitalizan los intereses y al final del mes se suman las
+    aportaciones que cayeron en él (periodos_aportacion(), las mismas que el
+    libro de aportaciones). La recurrencia C[m] = C[m-1] * f[m] + A[m] se
+    resuelve en forma cerrada con productos acumulados:
+    C[m] = G[m] * (C[0] + suma(A[k] / G[k], k = 1..m)).
+    
     Args:
         capital_inicial: Capital inicial a invertir
         tasa_anual: Tasa de interés anual promedio ponderada
@@ -949,87 +719,285 @@ def generar_proyeccion_con_aportaciones(
         meses: Número de meses a simular
         aportacion: Monto de cada aportación
         frecuencia: "Semanal", "Quincenal", o "Mensual"
-        escenario: "Optimista" (tasas constantes), "Realista" (-2%/año), "Conservador" (-3%/año)
+        escenario: "Optimista" (tasas constantes), "Realista" (-1%/año), "Conservador" (-2%/año)
+        retencion_isr: Tasa anual de retención de ISR (%) para las columnas netas
     
     Returns:
         DataFrame con proyección detallada mes a mes
     """
-    proyeccion = []
-    
-    # Definir reducción TRIMESTRAL de tasas según escenario
-    reduccion_trimestral = {
-        "Optimista": 0,
-        "Realista": 0.25,    # Baja 0.25% cada trimestre (1% al año)
-        "Conservador": 0.5   # Baja 0.5% cada trimestre (2% al año)
-    }.get(escenario, 0)
-    
-    # Calcular número de aportaciones por mes según frecuencia
-    aportaciones_por_mes = {
-        "Semanal": 4.33,      # ~4.33 semanas por mes
-        "Quincenal": 2,
-        "Mensual": 1
-    }
-    
-    aportacion_mensual_equivalente = aportacion * aportaciones_por_mes.get(frecuencia, 1)
-    
-    capital_acumulado = capital_inicial
-    total_aportaciones = 0
-    
-    for mes in range(meses + 1):
-        # Calcular cuántos trimestres han pasado
-        trimestres_completos = mes // 3
-        reduccion_acumulada = reduccion_trimestral * trimestres_completos
-        tasa_ajustada = max(1.0, tasa_anual - reduccion_acumulada)
-        
-        # Calcular intereses del mes sobre el capital acumulado
-        if mes > 0:
-            dias_mes = 30
-            if tipo_calculo == "compuesto":
-                intereses_mes = calcular_interes_compuesto(capital_acumulado, tasa_ajustada, dias_mes)
-            else:
-                intereses_mes = calcular_interes_simple(capital_acumulado, tasa_ajustada, dias_mes)
-            
-            capital_acumulado += intereses_mes
-            
-            # Agregar aportación al final del mes
-            capital_acumulado += aportacion_mensual_equivalente
-            total_aportaciones += aportacion_mensual_equivalente
-        
-        # Calcular intereses totales acumulados
-        intereses_totales = capital_acumulado - capital_inicial - total_aportaciones
-        
-        proyeccion.append({
-            "Mes": mes,
-            "Capital Inicial": capital_inicial,
-            "Aportaciones Acumuladas": total_aportaciones,
-            "Intereses Generados": intereses_totales,
-            "Total Acumulado": capital_acumulado,
-            "Tasa Actual": tasa_ajustada
-        })
-    
-    return pd.DataFrame(proyeccion)
+    aportes_mes = aportacion * periodos_aportacion(frecuencia, meses)
+    
+    # Renglón 0: bruto; renglón 1: neto de ISR
+    tasas = tasas_por_mes(tasa_anual, meses, escenario)
+    crecimiento = np.cumprod(factores_crecimiento_mensual(tasas, tipo_calculo, retenciones_bruta_neta(retencion_isr)), axis=1)
+    
+    aportes_descontados = np.concatenate((np.zeros((2, 1)), np.cumsum(aportes_mes / crecimiento[:, 1:], axis=1)), axis=1)
+    total_acumulado, total_neto = crecimiento * (capital_inicial + aportes_descontados)
+    total_aportaciones = np.concatenate(([0], np.cumsum(aportes_mes))).astype(float)
+    
+    return pd.DataFrame({
+        "Mes": np.arange(meses + 1),
+        "Capital Inicial": np.full(meses + 1, capital_inicial),
+        "Aportaciones Acumuladas": total_aportaciones,
+        "Intereses Generados": total_acumulado - capital_inicial - total_aportaciones,
+        "Total Acumulado": total_acumulado,
+        "Intereses Netos": total_neto - capital_inicial - total_aportaciones,
+        "Total Neto": total_neto,
+        "Tasa Actual": tasas
+    })
 
-def analizar_diversificacion(inversiones_dict):
+def matriz_instituciones(sofipos):
     """
-    Analiza el nivel de diversificación y genera recomendaciones
+    Matriz indicadora P x S (producto x institución) para sumar saldos por SOFIPO
     """
-    total_invertido = sum([inv["monto"] for inv in inversiones_dict.values()])
-    
-    if total_invertido == 0:
-        return None
-    
-    # Calcular concentración
-    concentraciones = {
-        sofipo: (inv["monto"] / total_invertido * 100) 
-        for sofipo, inv in inversiones_dict.items()
-    }
-    
-    max_concentracion = max(concentraciones.values())
-    num_sofipos = len([c for c in concentraciones.values() if c > 0])
-    
-    # Calcular liquidez total
-    liquidez_inmediata = sum([
-        inv["monto"] for inv in inversiones_dict.values() 
+    nombres = list(dict.fromkeys(sofipos))
+    grupos = np.zeros((len(sofipos), len(nombres)))
+    grupos[np.arange(len(sofipos)), [nombres.index(sofipo) for sofipo in sofipos]] = 1
+    return grupos
+
+def _acumulado_previo(valores, axis=-1):
+    """Suma acumulada exclusiva (sin el elemento propio); admite np.inf"""
+    acumulado = np.cumsum(valores, axis=axis)
+    return np.concatenate((np.zeros_like(np.take(acumulado, [0], axis=axis)), np.delete(acumulado, -1, axis=axis)), axis=axis)
+
+def _llenar_en_orden(monto, espacio, orden):
+    """
+    Llena los productos en el orden dado, cada uno hasta su espacio disponible
+
+    Args:
+        monto: Monto a repartir; escalar o uno por renglón de espacio
+        espacio: Arreglo (..., P) con lo que cabe en cada producto (puede ser np.inf)
+        orden: Índices de los productos, del primero al último en llenarse
+    """
+    espacio_orden = espacio[..., orden]
+    llenado_previo = _acumulado_previo(espacio_orden)
+    asignacion = np.empty_like(espacio)
+    asignacion[..., orden] = np.clip(np.asarray(monto)[..., None] - llenado_previo, 0, espacio_orden)
+    return asignacion
+
+def repartir_aportacion(aportacion, saldos, tasas, limites, grupos=None, topes_grupo=np.inf, liquidos=None,
+                        liquidez_objetivo=None, pesos=None):
+    """
+    Reparte una aportación entre productos con saldos vivos
+
+    Ningún producto pasa de su límite y ninguna institución pasa de su tope
+    (cobertura IPAB); lo que no cabe en un producto se va al siguiente mejor.
+    Todo son operaciones de arreglos: los saldos pueden traer renglones extra
+    (por ejemplo bruto y neto de ISR) y se reparte cada renglón a la vez.
+
+    Args:
+        aportacion: Monto a repartir
+        saldos: Arreglo (..., P) de saldos actuales
+        tasas: Arreglo P de tasas anuales (%); define el orden de llenado
+        limites: Arreglo P con el saldo máximo de cada producto (np.inf si no tiene)
+        grupos: Matriz P x S de matriz_instituciones() (None: sin tope por institución)
+        topes_grupo: Saldo máximo por institución
+        liquidos: Arreglo P de booleanos, productos a la vista
+        liquidez_objetivo: Liquidez mínima (%); si el saldo líquido queda abajo,
+            la aportación va primero a productos a la vista hasta alcanzarla
+        pesos: Arreglo P de proporciones; si se da, la aportación se reparte en
+            esas proporciones y solo el sobrante va por tasa
+
+    Returns:
+        Arreglo (..., P) con lo asignado a cada producto
+    """
+    saldos = np.asarray(saldos, dtype=float)
+    tasas = np.asarray(tasas, dtype=float)
+    orden = np.argsort(-tasas, kind="stable")
+    espacio = np.maximum(np.asarray(limites, dtype=float) - saldos, 0)
+
+    if grupos is not None:
+        # Dentro de cada institución, lo que cabe en cada producto (en orden de
+        # llenado) es lo que queda del tope después de los productos anteriores
+        grupos_orden = grupos[orden].astype(bool)
+        espacio_orden = espacio[..., orden]
+        espacio_grupo = np.maximum(topes_grupo - saldos @ grupos, 0)
+        tope = espacio_grupo @ grupos_orden.T
+        en_grupo = np.where(grupos_orden, espacio_orden[..., None], 0)
+        previo = np.where(grupos_orden, _acumulado_previo(en_grupo, axis=-2), 0).sum(axis=-1)
+        espacio[..., orden] = np.minimum(tope, previo + espacio_orden) - np.minimum(tope, previo)
+
+    asignacion = np.zeros_like(espacio)
+    restante = np.full(saldos.shape[:-1], float(aportacion))
+
+    if liquidez_objetivo and liquidos is not None:
+        liquidos = np.asarray(liquidos, dtype=bool)
+        faltante = liquidez_objetivo / 100 * (saldos.sum(axis=-1) + aportacion) - (saldos * liquidos).sum(axis=-1)
+        asignacion += _llenar_en_orden(np.clip(faltante, 0, restante), np.where(liquidos, espacio, 0), orden)
+        restante = restante - asignacion.sum(axis=-1)
+
+    if pesos is not None:
+        pesos = np.asarray(pesos, dtype=float)
+        proporcional = np.minimum(restante[..., None] * pesos / max(pesos.sum(), 1e-12), espacio - asignacion)
+        asignacion += proporcional
+        restante = restante - proporcional.sum(axis=-1)
+
+    return asignacion + _llenar_en_orden(restante, espacio - asignacion, orden)
+
+def calcular_libro_aportaciones(saldos_iniciales, tasas, limites, aportacion, frecuencia, meses, progreso=None,
+                                retencion_isr=0.0, sofipos=None, liquidos=None, liquidez_objetivo=None, pesos=None,
+                                escenario="Optimista"):
+    """
+    Simula periodo a periodo el reparto de cada aportación entre productos
+    
+    En cada periodo primero se capitalizan los saldos (interés compuesto
+    diario durante 30 / aportaciones_por_mes días) y luego repartir_aportacion()
+    asigna la aportación sobre los saldos vivos: por tasa (o en proporción a
+    pesos), sin pasar del límite de cada producto ni, si se dan las
+    instituciones, de la cobertura IPAB de cada una en ese mes. Cada periodo
+    depende del saldo anterior, así que se recorren en orden, pero cada paso
+    opera sobre arreglos de productos y el resultado queda en arreglos
+    numéricos (T x P) en lugar de filas de texto: 40 años de aportaciones
+    semanales son ~2,100 periodos. Lo que no cabe en ningún producto queda
+    sin asignar (sin rendimiento) y se cuenta en el total.
+    
+    Args:
+        saldos_iniciales: Arreglo P con el saldo inicial de cada producto
+        tasas: Arreglo P de tasas anuales iniciales (%)
+        limites: Arreglo P con el saldo máximo de cada producto (np.inf si no tiene)
+        aportacion: Monto de cada aportación
+        frecuencia: "Semanal", "Quincenal" o "Mensual"
+        meses: Meses a simular
+        progreso: Función opcional que recibe el avance (0 a 1) cada año simulado
+        retencion_isr: Tasa anual de retención de ISR (%); el libro neto se simula
+            a la par del bruto (un renglón más en cada operación)
+        sofipos: SOFIPO de cada producto; si se da, ninguna institución pasa
+            de la cobertura IPAB (25,000 UDIs al valor de cada mes)
+        liquidos: Arreglo P de booleanos, productos a la vista
+        liquidez_objetivo: Liquidez mínima (%) que se mantiene con las aportaciones
+        pesos: Proporciones de reparto (None: de mayor a menor tasa)
+        escenario: Escenario de tasas; cada periodo capitaliza y reparte con la
+            tasa de su mes según tasas_por_mes(), igual que las proyecciones
+    
+    Returns:
+        Dict con arreglos "mes" (T, mes al que pertenece cada periodo),
+        "asignado" (T x P), "saldos" (T x P, después de aportar),
+        "sin_asignar" (T, acumulado), "intereses_acumulados" (T), "total" (T)
+        y sus equivalentes netos de ISR "intereses_netos" (T) y "total_neto" (T)
+    """
+    periodos_por_mes = APORTACIONES_POR_MES.get(frecuencia, 1)
+    mes_periodo = np.repeat(np.arange(1, meses + 1), periodos_aportacion(frecuencia, meses))
+    
+    # Renglón 0: saldos brutos; renglón 1: saldos netos de ISR
+    saldos = np.tile(np.asarray(saldos_iniciales, dtype=float), (2, 1))
+    limites = np.asarray(limites, dtype=float)
+    # Tasas de cada mes ((meses + 1) x P) y factores por periodo de cada mes, bruto y neto
+    tasas_mes = tasas_por_mes(np.asarray(tasas, dtype=float), meses, escenario)
+    factores_mes = (1 + (tasas_mes[:, None, :] - retenciones_bruta_neta(retencion_isr)) / 100 / 365) ** (30 / periodos_por_mes)
+    
+    # Tope IPAB por institución en el mes de cada periodo (sube con la UDI)
+    if sofipos is not None:
+        grupos = matriz_instituciones(sofipos)
+        topes_periodo = limites_ipab_mensuales(meses)[mes_periodo]
+    else:
+        grupos = None
+        topes_periodo = np.full(len(mes_periodo), np.inf)
+    
+    num_periodos = len(mes_periodo)
+    num_productos = saldos.shape[1]
+    asignado = np.zeros((num_periodos, num_productos))
+    saldos_periodo = np.zeros((num_periodos, num_productos))
+    sin_asignar = np.zeros(num_periodos)
+    intereses_acumulados = np.zeros(num_periodos)
+    intereses_netos = np.zeros(num_periodos)
+    total_neto = np.zeros(num_periodos)
+    intereses_total = np.zeros(2)
+    sin_asignar_total = np.zeros(2)
+    
+    for t in range(num_periodos):
+        capitalizados = saldos * factores_mes[mes_periodo[t]]
+        intereses_total += (capitalizados - saldos).sum(axis=1)
+        saldos = capitalizados
+        
+        asignacion = repartir_aportacion(
+            aportacion, saldos, tasas_mes[mes_periodo[t]], limites,
+            grupos=grupos,
+            topes_grupo=topes_periodo[t],
+            liquidos=liquidos,
+            liquidez_objetivo=liquidez_objetivo,
+            pesos=pesos
+        )
+        asignado[t] = asignacion[0]
+        sin_asignar_total += aportacion - asignacion.sum(axis=1)
+        
+        saldos += asignacion
+        saldos_periodo[t] = saldos[0]
+        sin_asignar[t] = sin_asignar_total[0]
+        total_neto[t] = saldos[1].sum() + sin_asignar_total[1]
+        intereses_acumulados[t], intereses_netos[t] = intereses_total
+        
+        if progreso is not None and t % 52 == 51:
+            progreso((t + 1) / num_periodos)
+    
+    return {
+        "mes": mes_periodo,
+        "asignado": asignado,
+        "saldos": saldos_periodo,
+        "sin_asignar": sin_asignar,
+        "intereses_acumulados": intereses_acumulados,
+        "total": saldos_periodo.sum(axis=1) + sin_asignar,
+        "intereses_netos": intereses_netos,
+        "total_neto": total_neto
+    }
+
+def cortes_resolucion_adaptativa(meses, meses_mensual=24, meses_trimestral=60):
+    """
+    Meses en los que termina cada renglón de una vista de resolución adaptativa
+    
+    Mensual durante los primeros meses_mensual meses, trimestral hasta
+    meses_trimestral y anual después; el último mes siempre se incluye.
+    
+    Returns:
+        Arreglo ascendente de meses (1..meses)
+    """
+    cortes = np.concatenate((
+        np.arange(1, min(meses, meses_mensual) + 1),
+        np.arange(meses_mensual + 3, min(meses, meses_trimestral) + 1, 3),
+        np.arange(meses_trimestral + 12, meses + 1, 12),
+        [meses]
+    ))
+    return np.unique(cortes[cortes <= meses]).astype(np.int64)
+
+def etiqueta_rango_meses(mes_inicio, mes_fin):
+    """
+    Texto para un renglón que cubre los meses mes_inicio..mes_fin
+    """
+    if mes_inicio == mes_fin:
+        return f"Mes {mes_fin}"
+    if mes_fin - mes_inicio == 11 and mes_fin % 12 == 0:
+        return f"Año {mes_fin // 12}"
+    return f"Meses {mes_inicio}-{mes_fin}"
+
+def formato_plazo(meses):
+    """
+    Texto legible para un plazo en meses (ej. "6 meses", "1 año", "30 años")
+    """
+    if meses < 12 or meses % 12:
+        return f"{meses} meses"
+    anios = meses // 12
+    return f"{anios} año" if anios == 1 else f"{anios} años"
+
+def analizar_diversificacion(inversiones_dict):
+    """
+    Analiza el nivel de diversificación y genera recomendaciones
+    """
+    total_invertido = sum([inv["monto"] for inv in inversiones_dict.values()])
+    
+    if total_invertido == 0:
+        return None
+    
+    # Calcular concentración
+    concentraciones = {
+        sofipo: (inv["monto"] / total_invertido * 100) 
+        for sofipo, inv in inversiones_dict.items()
+    }
+    
+    max_concentracion = max(concentraciones.values())
+    num_sofipos = len([c for c in concentraciones.values() if c > 0])
+    
+    # Calcular liquidez total
+    liquidez_inmediata = sum([
+        inv["monto"] for inv in inversiones_dict.values() 
         if inv.get("liquidez") == "Inmediata"
     ])
     
@@ -1044,582 +1012,3349 @@ def analizar_diversificacion(inversiones_dict):
         "porcentaje_liquido": porcentaje_liquido
     }
 
-def generar_recomendaciones(analisis, rendimiento_ponderado, cumple_klar=False, cumple_mp=False, cumple_uala=False):
+def generar_recomendaciones(analisis, rendimiento_ponderado, cumple_klar=False, cumple_mp=False, cumple_uala=False):
+    """
+    Genera recomendaciones personalizadas estructuradas: alertas críticas y oportunidades
+    """
+    if analisis is None:
+        return {"alertas": [], "oportunidades": []}
+    
+    alertas = []
+    oportunidades = []
+    
+    # ========================================================================
+    # ALERTAS CRÍTICAS (solo problemas importantes)
+    # ========================================================================
+    
+    # Alerta de concentración extrema
+    if analisis["max_concentracion"] > 85:
+        alertas.append({
+            "tipo": "critico",
+            "emoji": "⚠️",
+            "titulo": "**Concentración Elevada**",
+            "mensaje": f"{analisis['max_concentracion']:.1f}% en una sola institución. Lo ideal es no superar el 40-50% por SOFIPO."
+        })
+    
+    # Alerta de liquidez muy baja
+    if analisis["porcentaje_liquido"] < 20:
+        alertas.append({
+            "tipo": "warning",
+            "emoji": "⚠️",
+            "titulo": "**Baja Liquidez**",
+            "mensaje": f"Solo {analisis['porcentaje_liquido']:.1f}% está disponible inmediatamente. Considera mantener al menos 20-30% en inversiones líquidas para emergencias."
+        })
+    
+    # Alerta de muy poca diversificación
+    if analisis["num_sofipos"] == 1 and analisis["total_invertido"] > 50000:
+        alertas.append({
+            "tipo": "warning",
+            "emoji": "⚠️",
+            "titulo": "**Alta Concentración**",
+            "mensaje": f"Inviertes en una sola SOFIPO. Considera diversificar en al menos 3-4 instituciones para reducir riesgo."
+        })
+    
+    # ========================================================================
+    # OPORTUNIDADES (productos que NO tiene y podrían mejorar rendimiento)
+    # ========================================================================
+    
+    sofipos_actuales = [k for k, v in analisis["concentraciones"].items() if v > 0]
+    
+    def oportunidad(orden, sofipo, producto, con_requisito=False):
+        # Tasa, detalle y requisito salen del catálogo; si el producto ya no existe no se recomienda
+        info = SOFIPOS_DATA.get(sofipo, {}).get('productos', {}).get(producto)
+        if info is None:
+            return
+        requisito = None
+        if con_requisito:
+            requisito = f"✅ Cumples requisito de {texto_requisito(info)}" if info.get('requisito_deposito') else f"✅ Tienes membresía {info.get('requisito')}"
+        detalle = resumen_tasa(info)
+        if info['tipo'] == "vista_hibrida":
+            detalle += f", luego {info['tasa_base']:g}%"
+        detalle += " con liquidez inmediata" if info['tipo'] != "plazo" else f" a plazo fijo de {info['liquidez']}"
+        oportunidades.append({
+            "orden": orden,
+            "tasa": tasa_maxima_producto(info),
+            "sofipo": sofipo,
+            "producto": producto,
+            "detalle": detalle,
+            "requisito": requisito
+        })
+    
+    # 1. Nu México Cajita Turbo - liquidez inmediata (SIEMPRE disponible)
+    if not any("Nu México" in s and "Turbo" in s for s in sofipos_actuales):
+        oportunidad(1, "Nu México", "Cajita Turbo")
+    
+    # 2. DiDi Ahorro - tasa premium en los primeros pesos (SIEMPRE disponible)
+    if not any("DiDi" in s for s in sofipos_actuales):
+        oportunidad(2, "DiDi", "DiDi Ahorro")
+    
+    # 3. Ualá Plus vs Base (depende de si cumple requisitos)
+    if not any("Ualá" in s for s in sofipos_actuales):
+        if cumple_uala:
+            oportunidad(3, "Ualá", "Cuenta con Rendimiento Plus", con_requisito=True)
+        else:
+            oportunidad(7, "Ualá", "Cuenta con Rendimiento (Base)")
+    
+    # 4. Klar Max vs Cuenta (depende de si tiene tarjeta Plus/Platino)
+    if not any("Klar" in s for s in sofipos_actuales):
+        if cumple_klar:
+            oportunidad(4, "Klar", "Inversión Flexible Max", con_requisito=True)
+        else:
+            oportunidad(8, "Klar", "Cuenta Klar")
+    
+    # 5. Mercado Pago (solo si cumple requisitos)
+    if cumple_mp and not any("Mercado Pago" in s for s in sofipos_actuales):
+        oportunidad(5, "Mercado Pago", "Rendimientos MP", con_requisito=True)
+    
+    # 6. Stori 90 días - plazo fijo (SIEMPRE disponible)
+    if not any("Stori" in s and "90" in s for s in sofipos_actuales):
+        oportunidad(6, "Stori", "90 días")
+    
+    # Ordenar por tasa descendente y tomar top 3
+    oportunidades.sort(key=lambda x: (-x["tasa"], x["orden"]))
+    oportunidades = oportunidades[:3]
+    
+    return {"alertas": alertas, "oportunidades": oportunidades}
+
+# ============================================================================
+# MODELO INCREMENTAL DEL PORTAFOLIO
+# ============================================================================
+#
+# Cada producto se calcula por separado y se guarda junto con su firma
+# (producto, tasas, monto, plazo y escenario). Al editar un monto solo se
+# recalcula ese producto; las columnas del portafolio (capital, intereses y
+# total por mes) se ajustan restando la proyección anterior del producto y
+# sumando la nueva. Cambiar el plazo invalida todo; cambiar el escenario
+# cambia la firma de todos los productos.
+
+COLUMNAS_AGREGADAS = ["Capital Inicial", "Intereses Generados", "Total Acumulado", "Intereses Netos", "Total Neto"]
+
+def ganancia_producto(producto_info, monto, dias, retencion=0.0):
+    """
+    Ganancia de un producto en un plazo, opcionalmente neta de la retención de ISR
+
+    La retención se devenga diario sobre el saldo: en los productos compuestos
+    equivale a restarla de la tasa y en los de interés simple se descuenta
+    sobre el capital con año de 365 días.
+
+    Args:
+        producto_info: Dict del producto en SOFIPOS_DATA
+        monto: Monto invertido
+        dias: Días de inversión
+        retencion: Tasa anual de retención de ISR (%)
+    """
+    tipo = producto_info['tipo']
+    if tipo == "vista_hibrida":
+        return calcular_rendimiento_hibrido_didi(
+            monto,
+            producto_info['tasa_premium'] - retencion,
+            producto_info['limite_premium'],
+            producto_info['tasa_base'] - retencion,
+            dias
+        )
+    if tipo == "vista":
+        return calcular_interes_compuesto(monto, producto_info['tasa_base'] - retencion, dias)
+    return calcular_interes_simple(monto, producto_info['tasa_base'] - retencion * 360 / 365, dias)
+
+def calcular_resultado_producto(producto_info, monto, periodo_meses, escenario, retencion_isr=0.0):
+    """
+    Rendimiento y proyección mensual de una sola inversión
+
+    Args:
+        producto_info: Dict del producto en SOFIPOS_DATA
+        monto: Monto invertido
+        periodo_meses: Plazo de la simulación en meses
+        escenario: Escenario de tasas
+        retencion_isr: Tasa anual de retención de ISR (%) para las cifras netas
+
+    Returns:
+        Dict con tasa_efectiva, tipo_interes, ganancia_periodo, ganancia_neta,
+        isr_retenido, ganancia_dia, ganancia_mes, ganancia_anio y proyeccion
+        (DataFrame de generar_proyeccion_mensual, con columnas brutas y netas)
+    """
+    tipo = producto_info['tipo']
+
+    # Determinar tasa efectiva
+    if tipo == "vista_hibrida":
+        # DiDi con estructura híbrida
+        interes_anual = calcular_rendimiento_hibrido_didi(
+            monto,
+            producto_info['tasa_premium'],
+            producto_info['limite_premium'],
+            producto_info['tasa_base'],
+            365
+        )
+        tasa_efectiva = (interes_anual / monto) * 100
+        tipo_interes = "Compuesto (Diario)"
+    elif tipo == "vista":
+        # A la vista con interés compuesto
+        tasa_efectiva = producto_info['tasa_base']
+        tipo_interes = "Compuesto (Diario)"
+    else:
+        # Plazo fijo con interés simple
+        tasa_efectiva = producto_info['tasa_base']
+        tipo_interes = "Simple"
+
+    # Calcular rendimientos
+    dias_simulacion = periodo_meses * 30
+    ganancia_periodo = ganancia_producto(producto_info, monto, dias_simulacion)
+    ganancia_neta = ganancia_producto(producto_info, monto, dias_simulacion, retencion_isr)
+
+    ganancia_dia = ganancia_periodo / dias_simulacion
+
+    # Proyección mensual con escenario de tasas
+    proyeccion = generar_proyeccion_mensual(
+        monto,
+        tasa_efectiva,
+        "compuesto" if tipo_interes == "Compuesto (Diario)" else "simple",
+        periodo_meses,
+        escenario,
+        retencion_isr
+    )
+
+    return {
+        "tasa_efectiva": tasa_efectiva,
+        "tipo_interes": tipo_interes,
+        "ganancia_periodo": ganancia_periodo,
+        "ganancia_neta": ganancia_neta,
+        "isr_retenido": ganancia_periodo - ganancia_neta,
+        "ganancia_dia": ganancia_dia,
+        "ganancia_mes": ganancia_dia * 30,
+        "ganancia_anio": ganancia_dia * 365,
+        "proyeccion": proyeccion
+    }
+
+def nuevo_modelo_portafolio():
+    """
+    Modelo vacío (se guarda en st.session_state entre ejecuciones)
+    """
+    return {"periodo": None, "productos": {}, "agregado": None}
+
+def actualizar_modelo_portafolio(modelo, inversiones, periodo_meses, escenario, retencion_isr=0.0):
+    """
+    Pone el modelo al día con las inversiones actuales recalculando solo lo que cambió
+
+    Args:
+        modelo: Dict de nuevo_modelo_portafolio() (se modifica en su lugar)
+        inversiones: Dict {clave: {"sofipo", "producto", "monto", "producto_info"}}
+        periodo_meses: Plazo de la simulación en meses
+        escenario: Escenario de tasas
+        retencion_isr: Tasa anual de retención de ISR (%)
+
+    Returns:
+        Lista de claves de los productos que se recalcularon
+    """
+    if modelo["periodo"] != periodo_meses:
+        modelo["periodo"] = periodo_meses
+        modelo["productos"] = {}
+        modelo["agregado"] = np.zeros((periodo_meses + 1, len(COLUMNAS_AGREGADAS)))
+
+    productos = modelo["productos"]
+    agregado = modelo["agregado"]
+
+    for clave in [clave for clave in productos if clave not in inversiones]:
+        agregado -= productos.pop(clave)["columnas"]
+
+    recalculados = []
+    for clave, inversion in inversiones.items():
+        info = inversion['producto_info']
+        firma = (
+            inversion['sofipo'],
+            inversion['producto'],
+            info['tasa_base'],
+            info.get('tasa_premium'),
+            inversion['monto'],
+            periodo_meses,
+            escenario,
+            retencion_isr
+        )
+        anterior = productos.get(clave)
+        if anterior is not None and anterior["firma"] == firma:
+            continue
+
+        resultado = calcular_resultado_producto(info, inversion['monto'], periodo_meses, escenario, retencion_isr)
+        resultado["proyeccion"]["SOFIPO"] = clave
+        resultado["columnas"] = resultado["proyeccion"][COLUMNAS_AGREGADAS].to_numpy()
+        resultado["firma"] = firma
+
+        if anterior is not None:
+            agregado -= anterior["columnas"]
+        agregado += resultado["columnas"]
+        productos[clave] = resultado
+        recalculados.append(clave)
+
+    # Sin productos el agregado vuelve a cero exacto (sin residuos de las restas)
+    if not productos:
+        agregado[:] = 0
+
+    return recalculados
+
+def proyeccion_agregada(modelo):
+    """
+    DataFrame mensual del portafolio (suma de todos los productos) a partir del modelo
+    """
+    datos = {"Mes": np.arange(modelo["periodo"] + 1)}
+    for j, columna in enumerate(COLUMNAS_AGREGADAS):
+        datos[columna] = modelo["agregado"][:, j].copy()
+    return pd.DataFrame(datos)
+
+# ============================================================================
+# INFLACIÓN Y UDIS (GAT REAL)
+# ============================================================================
+#
+# datos/udis.csv trae la serie mensual de la UDI (sigue al INPC). Por ahora son
+# valores de referencia interpolados entre los de inicio de año: hay que
+# reemplazarlos con la serie SP68257 de Banxico.
+# Después del último dato la serie se extiende con CURVA_INFLACION_SUPUESTA.
+# La serie completa se carga una sola vez por proceso y de ella salen:
+# - El tope del IPAB en pesos (25,000 UDIs) en cualquier fecha
+# - Los deflactores para expresar saldos futuros en pesos de hoy
+#
+# ============================================================================
+
+ARCHIVO_UDIS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "datos", "udis.csv")
+LIMITE_IPAB_UDIS = 25000
+
+# Inflación anual supuesta (%) por tramo, en meses desde el último dato observado
+# (None = el resto del horizonte)
+CURVA_INFLACION_SUPUESTA = (
+    (12, 3.8),
+    (24, 3.5),
+    (None, 3.0)  # Meta de Banxico
+)
+MESES_PROYECCION_UDI = 600
+
+@st.cache_resource(show_spinner=False)
+def serie_udis():
+    """
+    Serie mensual de la UDI: los datos observados más la proyección con la curva supuesta
+
+    Returns:
+        Dict con inicio (primer mes, datetime64[M]), udi (arreglo compartido,
+        uno por mes; no se debe modificar) y observados (cuántos son datos reales)
+    """
+    with open(ARCHIVO_UDIS, encoding="utf-8") as archivo:
+        renglones = [linea.strip().split(",") for linea in archivo if linea.strip() and not linea.startswith("#")][1:]
+    meses = np.array([fecha for fecha, _ in renglones], dtype="datetime64[M]")
+    observada = np.array([float(valor) for _, valor in renglones])
+
+    inflacion = np.empty(MESES_PROYECCION_UDI)
+    desde = 0
+    for hasta, tasa in CURVA_INFLACION_SUPUESTA:
+        inflacion[desde:hasta] = tasa
+        desde = hasta if hasta is not None else MESES_PROYECCION_UDI
+    proyectada = observada[-1] * np.cumprod((1 + inflacion / 100) ** (1 / 12))
+
+    udi = np.concatenate((observada, proyectada))
+    udi.setflags(write=False)
+    return {"inicio": meses[0], "udi": udi, "observados": len(observada)}
+
+def indice_mes_udi(fecha=None):
+    """Posición de un mes (por omisión, el actual) dentro de serie_udis()"""
+    serie = serie_udis()
+    mes = np.datetime64(fecha or datetime.now(), "M")
+    return int(np.clip((mes - serie["inicio"]).astype(int), 0, len(serie["udi"]) - 1))
+
+def valor_udi(fecha=None):
+    """Valor de la UDI en un mes (por omisión, el actual)"""
+    return float(serie_udis()["udi"][indice_mes_udi(fecha)])
+
+def limite_ipab_mxn(fecha=None):
+    """Cobertura del IPAB en pesos (25,000 UDIs) en un mes (por omisión, el actual)"""
+    return LIMITE_IPAB_UDIS * valor_udi(fecha)
+
+def udis_mensuales(meses, fecha_inicio=None):
+    """
+    Valor de la UDI en cada mes (0..meses) de una proyección
+
+    Args:
+        meses: Horizonte en meses
+        fecha_inicio: Mes de inicio de la proyección (por omisión, el actual)
+
+    Returns:
+        Arreglo de longitud meses + 1
+    """
+    inicio = indice_mes_udi(fecha_inicio)
+    return serie_udis()["udi"].take(np.arange(inicio, inicio + meses + 1), mode="clip")
+
+def limites_ipab_mensuales(meses, fecha_inicio=None):
+    """Cobertura del IPAB en pesos en cada mes (0..meses) de una proyección"""
+    return LIMITE_IPAB_UDIS * udis_mensuales(meses, fecha_inicio)
+
+def deflactores_mensuales(meses, fecha_inicio=None):
+    """
+    Factor para pasar a pesos de hoy el saldo de cada mes (0..meses)
+
+    Args:
+        meses: Horizonte en meses
+        fecha_inicio: Mes de inicio de la proyección (por omisión, el actual)
+
+    Returns:
+        Arreglo de longitud meses + 1 (el primero es 1)
+    """
+    udis = udis_mensuales(meses, fecha_inicio)
+    return udis[0] / udis
+
+def a_pesos_de_hoy(matriz, fecha_inicio=None):
+    """
+    Deflacta una proyección completa con una sola multiplicación
+
+    Args:
+        matriz: Arreglo con un renglón por mes (0..meses); puede tener varias columnas
+        fecha_inicio: Mes de inicio de la proyección (por omisión, el actual)
+    """
+    matriz = np.asarray(matriz, dtype=float)
+    deflactores = deflactores_mensuales(len(matriz) - 1, fecha_inicio)
+    return matriz * (deflactores[:, None] if matriz.ndim == 2 else deflactores)
+
+def inflacion_anual_esperada(meses, fecha_inicio=None):
+    """Inflación anual promedio (%) implícita en la serie para el horizonte dado"""
+    if meses <= 0:
+        return 0.0
+    return ((1 / deflactores_mensuales(meses, fecha_inicio)[-1]) ** (12 / meses) - 1) * 100
+
+def gat_real(gat_nominal, inflacion):
+    """GAT real (%) a partir de la nominal y la inflación anual, ambas en %"""
+    return ((1 + gat_nominal / 100) / (1 + inflacion / 100) - 1) * 100
+
+# ============================================================================
+# MOTOR VECTORIZADO DE PORTAFOLIOS
+# ============================================================================
+#
+# Evalúa muchos portafolios a la vez. Cada portafolio es un vector de montos
+# con una posición por producto del catálogo (mismo orden que SOFIPOS_DATA),
+# de modo que N portafolios forman una matriz N x P y todos los cálculos se
+# hacen con operaciones de arreglos en lugar de ciclos por producto.
+#
+# Usa exactamente las mismas convenciones que la sección de resultados:
+# - vista: compuesto diario, (1 + r/365)^días
+# - plazo: interés simple, r * días/360
+# - vista_hibrida (DiDi): compuesto diario por tramo (premium / excedente)
+#
+# ============================================================================
+
+LIMITE_IPAB_MXN = int(limite_ipab_mxn())  # 25,000 UDIs por persona por institución, al valor de hoy
+
+TIPO_COMPUESTO = 0
+TIPO_SIMPLE = 1
+TIPO_HIBRIDO = 2
+
+def compilar_catalogo(sofipos_data):
+    """
+    Compila el catálogo de productos en arreglos NumPy para el motor vectorizado
+
+    Args:
+        sofipos_data: Diccionario con la estructura de SOFIPOS_DATA
+
+    Returns:
+        Dict con la lista de claves (sofipo, producto), su índice, la huella de
+        cada producto y un arreglo por atributo (tasas, límites, tipo de
+        cálculo, liquidez, institución)
+    """
+    claves = [
+        (sofipo_name, producto_name)
+        for sofipo_name, sofipo_data in sofipos_data.items()
+        for producto_name in sofipo_data['productos']
+    ]
+    sofipos = list(sofipos_data.keys())
+    n = len(claves)
+
+    tasa_base = np.zeros(n)
+    tasa_premium = np.zeros(n)
+    limite_premium = np.zeros(n)
+    limite_max = np.full(n, np.inf)
+    minimo = np.zeros(n)
+    requiere_condicion = np.zeros(n, dtype=bool)
+    tipo_calculo = np.zeros(n, dtype=np.int8)
+    liquido = np.zeros(n, dtype=bool)
+    plazo_dias = np.zeros(n)
+    sofipo_idx = np.zeros(n, dtype=np.int64)
+
+    for i, (sofipo_name, producto_name) in enumerate(claves):
+        info = sofipos_data[sofipo_name]['productos'][producto_name]
+        tasa_base[i] = info['tasa_base']
+        sofipo_idx[i] = sofipos.index(sofipo_name)
+        liquido[i] = info['tipo'] in ("vista", "vista_hibrida")
+        limite_max[i] = info.get('limite_max', np.inf)
+        minimo[i] = info.get('minimo', 0)
+        plazo_dias[i] = info.get('plazo_dias', 0)
+        requiere_condicion[i] = 'requisito' in info or 'requisito_deposito' in info
+
+        if info['tipo'] == "vista_hibrida":
+            tipo_calculo[i] = TIPO_HIBRIDO
+            tasa_premium[i] = info['tasa_premium']
+            limite_premium[i] = info['limite_premium']
+        elif info['tipo'] == "vista":
+            tipo_calculo[i] = TIPO_COMPUESTO
+        else:
+            tipo_calculo[i] = TIPO_SIMPLE
+
+    huellas = [
+        version_catalogo([sofipo_name, producto_name, sofipos_data[sofipo_name]['productos'][producto_name]])
+        for sofipo_name, producto_name in claves
+    ]
+
+    # Matriz P x S para agregar montos por institución con un solo producto matricial
+    matriz_sofipo = np.zeros((n, len(sofipos)))
+    matriz_sofipo[np.arange(n), sofipo_idx] = 1
+
+    return {
+        "claves": claves,
+        "indice": {clave: i for i, clave in enumerate(claves)},
+        "sofipos": sofipos,
+        "huellas": huellas,
+        "tasa_base": tasa_base,
+        "tasa_premium": tasa_premium,
+        "limite_premium": limite_premium,
+        "limite_max": limite_max,
+        "minimo": minimo,
+        "requiere_condicion": requiere_condicion,
+        "tipo_calculo": tipo_calculo,
+        "liquido": liquido,
+        "plazo_dias": plazo_dias,
+        "sofipo_idx": sofipo_idx,
+        "matriz_sofipo": matriz_sofipo
+    }
+
+# Plazos que ofrece la interfaz (meses)
+PLAZOS_ESTANDAR_MESES = (3, 6, 12, 24, 36, 60, 120, 180, 240, 360, 480)
+
+def dias_estandar():
+    """
+    Días que usan casi todos los cálculos: un mes, un año (360 y 365), cada plazo
+    de la interfaz y el periodo de cada frecuencia de aportación
+    """
+    dias = {30.0, 360.0, 365.0}
+    dias.update(meses * 30.0 for meses in PLAZOS_ESTANDAR_MESES)
+    dias.update(30 / periodos for periodos in APORTACIONES_POR_MES.values())
+    return np.array(sorted(dias))
+
+def tabla_factores(tasas, dias):
+    """
+    Factores de crecimiento compuesto diario (1 + r/365)^d para cada tasa y plazo
+
+    Args:
+        tasas: Arreglo R de tasas anuales (%)
+        dias: Arreglo D de plazos en días
+
+    Returns:
+        Dict con "tasas" (R), "dias" (D), "factores" (R x D) e "indice"
+        ({(tasa, días): factor} para consultas escalares)
+    """
+    tasas = np.asarray(tasas, dtype=float)
+    dias = np.asarray(dias, dtype=float)
+    factores = (1 + tasas[:, None] / 100 / 365) ** dias[None, :]
+    return {
+        "tasas": tasas,
+        "dias": dias,
+        "factores": factores,
+        "indice": {
+            (tasa, dia): factores[i, j].item()
+            for i, tasa in enumerate(tasas.tolist())
+            for j, dia in enumerate(dias.tolist())
+        }
+    }
+
+def factor_crecimiento(tasa_anual, dias, factores=None):
+    """
+    Factor de crecimiento compuesto diario (1 + r/365)^d
+
+    Se toma de la tabla precalculada cuando la tasa es del catálogo y el plazo
+    es estándar; cualquier otra combinación se calcula directamente.
+
+    Args:
+        tasa_anual: Tasa anual (%)
+        dias: Plazo en días
+        factores: Tabla de tabla_factores() (por omisión la compartida)
+
+    Returns:
+        float con el factor
+    """
+    factor = (factores or FACTORES)["indice"].get((tasa_anual, dias))
+    if factor is None:
+        factor = (1 + tasa_anual / 100 / 365) ** dias
+    return factor
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def recursos_compartidos(version):
+    """
+    Catálogo compilado y tabla de factores, creados una vez por proceso y por
+    versión del catálogo, y compartidos por todas las sesiones. Los arreglos
+    quedan de solo lectura.
+
+    Args:
+        version: version_catalogo() de SOFIPOS_DATA (al cambiar las tasas se compila de nuevo)
+
+    Returns:
+        Dict con "version", "catalogo" y "factores"
+    """
+    catalogo = compilar_catalogo(SOFIPOS_DATA)
+    tasas = np.unique(np.concatenate([catalogo["tasa_base"], catalogo["tasa_premium"]]))
+    factores = tabla_factores(tasas[tasas > 0], dias_estandar())
+
+    for tabla in (catalogo, factores):
+        for valor in tabla.values():
+            if isinstance(valor, np.ndarray):
+                valor.flags.writeable = False
+
+    return {
+        "version": version,
+        "catalogo": catalogo,
+        "factores": factores
+    }
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def tabla_comparativa_compartida(version):
+    """
+    DataFrame de la tabla comparativa de tasas de una versión del catálogo (se
+    crea la primera vez que se muestra, así pandas no se importa al arrancar)
+    """
+    tabla_comparativa = []
+    for sofipo_name, sofipo_data in SOFIPOS_DATA.items():
+        for producto_name, producto_info in sofipo_data['productos'].items():
+            tabla_comparativa.append({
+                "SOFIPO": f"{sofipo_data['logo']} {sofipo_name}",
+                "Producto": producto_name,
+                "GAT Nominal": f"{producto_info['tasa_base']}%",
+                "Liquidez": producto_info['liquidez'],
+                "Mínimo": f"${producto_info['minimo']:,}"
+            })
+    return pd.DataFrame(tabla_comparativa)
+
+def recargar_recursos_compartidos():
+    """
+    Vuelve a leer el catálogo y descarta los recursos compartidos y todo lo
+    calculado con las tasas anteriores; se vuelven a crear en la siguiente ejecución
+
+    Al cambiar el archivo del catálogo no hace falta: se recarga solo y nada
+    más se recalcula lo que usa los productos que cambiaron.
+    """
+    cargar_catalogo.clear()
+    recursos_compartidos.clear()
+    tabla_comparativa_compartida.clear()
+    calcular_malla_sensibilidad.clear()
+    calcular_estrategias.clear()
+    limpiar_resultados_tareas()
+
+CATALOGO = recursos_compartidos(CATALOGO_TASAS["version"])["catalogo"]
+FACTORES = recursos_compartidos(CATALOGO_TASAS["version"])["factores"]
+
+def huella_productos(mascara=None, catalogo=CATALOGO):
+    """
+    Huella de las tasas y condiciones de un grupo de productos del catálogo
+
+    Los resultados en caché que dependen del catálogo la reciben como argumento:
+    al recargar el catálogo solo cambia (y se recalcula) lo que usa alguno de
+    los productos que cambiaron.
+
+    Args:
+        mascara: Arreglo booleano de longitud P (por omisión, todos los productos)
+    """
+    huellas = catalogo["huellas"] if mascara is None else [
+        huella for huella, usar in zip(catalogo["huellas"], np.asarray(mascara).tolist()) if usar
+    ]
+    return hashlib.sha256("".join(huellas).encode("utf-8")).hexdigest()[:12]
+
+def vector_portafolio(inversiones, catalogo=CATALOGO):
+    """
+    Convierte las inversiones de una simulación guardada en un vector de montos
+
+    Args:
+        inversiones: Dict {sofipo: {"producto": ..., "monto": ...}} (formato de guardar_simulacion)
+        catalogo: Catálogo compilado
+
+    Returns:
+        Tupla (vector de montos de longitud P, lista de productos no encontrados)
+    """
+    montos = np.zeros(len(catalogo["claves"]))
+    desconocidos = []
+
+    for sofipo, datos in inversiones.items():
+        i = catalogo["indice"].get((sofipo, datos.get("producto")))
+        if i is None:
+            desconocidos.append(f"{sofipo} - {datos.get('producto')}")
+            continue
+        montos[i] += float(datos.get("monto", 0) or 0)
+
+    return montos, desconocidos
+
+def calcular_ganancias_lote(montos, dias, catalogo=CATALOGO, con_gradientes=False):
+    """
+    Calcula la ganancia de cada producto para una matriz de portafolios
+
+    Args:
+        montos: Arreglo N x P (o vector P) de montos invertidos
+        dias: Días de inversión; escalar o un valor por portafolio (N)
+        catalogo: Catálogo compilado
+        con_gradientes: Si es True, también regresa las derivadas parciales
+            del saldo final (ver _ganancias_broadcast)
+
+    Returns:
+        Arreglo N x P con la ganancia de cada posición, o la tupla
+        (ganancias, gradientes) si con_gradientes=True
+    """
+    montos = np.atleast_2d(np.asarray(montos, dtype=float))
+    dias = np.asarray(dias, dtype=float).reshape(-1, 1)
+    return _ganancias_broadcast(montos, dias, catalogo["tasa_base"], catalogo["tasa_premium"], catalogo, con_gradientes)
+
+def _ganancias_broadcast(montos, dias, tasa_base, tasa_premium, catalogo, con_gradientes=False):
+    """
+    Núcleo del cálculo de ganancias con broadcasting libre de NumPy
+
+    El último eje siempre es el producto (P); montos, días y tasas pueden
+    tener cualquier forma compatible, lo que permite evaluar mallas completas
+    (capital x plazo x escenario) en una sola operación.
+
+    Derivadas del saldo final B = monto + ganancia (tasas en %):
+    - Compuesto, B = m * f con f = (1 + r/36500)^d:
+        dB/dm = f,  dB/dr = m * d * f / (36500 + r)
+    - Simple, B = m * (1 + r*d/36000):
+        dB/dm = 1 + r*d/36000,  dB/dr = m * d / 36000
+    - Híbrido: cada tramo usa la fórmula compuesta; el siguiente peso cae en
+      el tramo premium mientras m < límite y en la tasa base después.
+    Se reutilizan los factores ya calculados, así que su costo es marginal.
+    """
+    tasa_base_pct = np.asarray(tasa_base, dtype=float)
+    tasa_premium_pct = np.asarray(tasa_premium, dtype=float)
+    tasa_base = tasa_base_pct / 100
+    factor_base = (1 + tasa_base / 365) ** dias
+    factor_premium = (1 + tasa_premium_pct / 100 / 365) ** dias
+
+    compuesto = montos * (factor_base - 1)
+    simple = montos * tasa_base * (dias / 360)
+
+    tramo_premium = np.minimum(montos, catalogo["limite_premium"])
+    excedente = montos - tramo_premium
+    hibrido = tramo_premium * (factor_premium - 1) + excedente * (factor_base - 1)
+
+    tipo = catalogo["tipo_calculo"]
+    es_compuesto = tipo == TIPO_COMPUESTO
+    es_simple = tipo == TIPO_SIMPLE
+    ganancias = np.where(es_compuesto, compuesto, np.where(es_simple, simple, hibrido))
+
+    if not con_gradientes:
+        return ganancias
+
+    factor_simple = 1 + tasa_base * (dias / 360)
+    en_premium = montos < catalogo["limite_premium"]
+    d_monto = np.where(
+        es_compuesto, factor_base,
+        np.where(es_simple, factor_simple, np.where(en_premium, factor_premium, factor_base))
+    )
+
+    d_tasa_compuesta = dias * factor_base / (36500 + tasa_base_pct)
+    d_tasa = np.where(
+        es_compuesto, montos * d_tasa_compuesta,
+        np.where(es_simple, montos * dias / 36000, excedente * d_tasa_compuesta)
+    )
+    es_hibrido = tipo == TIPO_HIBRIDO
+    d_tasa_premium = np.where(es_hibrido, tramo_premium * dias * factor_premium / (36500 + tasa_premium_pct), 0)
+
+    gradientes = {
+        "d_monto": np.broadcast_to(d_monto, ganancias.shape),
+        "d_tasa": np.broadcast_to(d_tasa, ganancias.shape),
+        "d_tasa_premium": np.broadcast_to(d_tasa_premium, ganancias.shape)
+    }
+    return ganancias, gradientes
+
+PUNTOS_MAXIMOS_SCORE = {
+    "Rendimiento": 40,
+    "Protección IPAB": 25,
+    "Liquidez": 20,
+    "Diversificación": 15
+}
+
+def calcular_componentes_score_lote(gat_ponderado, proteccion_completa, cobertura_ipab, porcentaje_liquidez, num_sofipos):
+    """
+    Calcula los puntos de cada componente del score para muchos portafolios a la vez
+
+    Componentes (ver PUNTOS_MAXIMOS_SCORE): Rendimiento (40), Protección
+    IPAB (25), Liquidez (20) y Diversificación (15).
+
+    Returns:
+        Dict {componente: arreglo de puntos por portafolio}
+    """
+    gat = np.asarray(gat_ponderado, dtype=float)
+    liquidez = np.asarray(porcentaje_liquidez, dtype=float)
+    num_sofipos = np.asarray(num_sofipos)
+
+    return {
+        "Rendimiento": np.select(
+            [gat >= 15, gat >= 14, gat >= 13, gat >= 12],
+            [40, 35, 30, 25],
+            default=np.floor(np.maximum(gat, 0) / 12 * 25)
+        ).astype(int),
+        "Protección IPAB": np.where(
+            proteccion_completa, 25, np.floor(np.asarray(cobertura_ipab) / 100 * 25)
+        ).astype(int),
+        "Liquidez": np.select(
+            [liquidez >= 80, liquidez >= 50, liquidez >= 30],
+            [20, 15, 10],
+            default=np.floor(liquidez / 30 * 10)
+        ).astype(int),
+        "Diversificación": np.select(
+            [num_sofipos >= 5, num_sofipos >= 3, num_sofipos >= 2],
+            [15, 12, 9],
+            default=6
+        ).astype(int)
+    }
+
+def evaluar_portafolios_lote(montos, periodos_meses, catalogo=CATALOGO):
+    """
+    Evalúa una matriz de portafolios en una sola pasada vectorizada
+
+    Args:
+        montos: Arreglo N x P de montos por producto
+        periodos_meses: Plazo en meses; escalar o uno por portafolio
+        catalogo: Catálogo compilado
+
+    Returns:
+        Dict de arreglos (longitud N): total_invertido, ganancia_total,
+        gat_ponderado, proteccion_completa, cobertura_ipab, porcentaje_liquidez,
+        num_sofipos, concentracion_maxima, score y componentes_score
+    """
+    montos = np.atleast_2d(np.asarray(montos, dtype=float))
+    periodos = np.broadcast_to(np.asarray(periodos_meses, dtype=float), (montos.shape[0],))
+
+    ganancias = calcular_ganancias_lote(montos, periodos * 30, catalogo)
+    total_invertido = montos.sum(axis=1)
+    ganancia_total = ganancias.sum(axis=1)
+    hay_capital = total_invertido > 0
+    divisor = np.where(hay_capital, total_invertido, 1)
+
+    # Tasa equivalente anual: r_anual = (1 + r_periodo)^(12/periodo) - 1
+    rendimiento_periodo = ganancia_total / divisor
+    gat_ponderado = np.where(hay_capital, ((1 + rendimiento_periodo) ** (12 / periodos) - 1) * 100, 0)
+
+    montos_por_sofipo = montos @ catalogo["matriz_sofipo"]
+    proteccion_completa = (montos_por_sofipo <= LIMITE_IPAB_MXN).all(axis=1)
+    monto_protegido = np.minimum(montos_por_sofipo, LIMITE_IPAB_MXN).sum(axis=1)
+    cobertura_ipab = np.where(proteccion_completa, 100, monto_protegido / divisor * 100)
+
+    monto_liquido = (montos * catalogo["liquido"]).sum(axis=1)
+    porcentaje_liquidez = np.where(hay_capital, monto_liquido / divisor * 100, 0)
+    num_sofipos = (montos_por_sofipo > 0).sum(axis=1)
+    concentracion_maxima = np.where(hay_capital, montos_por_sofipo.max(axis=1, initial=0) / divisor * 100, 0)
+
+    componentes_score = calcular_componentes_score_lote(
+        gat_ponderado, proteccion_completa, cobertura_ipab, porcentaje_liquidez, num_sofipos
+    )
+
+    return {
+        "total_invertido": total_invertido,
+        "ganancia_total": ganancia_total,
+        "gat_ponderado": gat_ponderado,
+        "proteccion_completa": proteccion_completa,
+        "cobertura_ipab": cobertura_ipab,
+        "porcentaje_liquidez": porcentaje_liquidez,
+        "num_sofipos": num_sofipos,
+        "concentracion_maxima": concentracion_maxima,
+        "score": sum(componentes_score.values()),
+        "componentes_score": componentes_score
+    }
+
+# ============================================================================
+# COBERTURA IPAB EN EL TIEMPO
+# ============================================================================
+#
+# El IPAB cubre 25,000 UDIs por persona e institución, sumando todos los
+# productos de la misma SOFIPO. Los saldos crecen con los intereses y las
+# aportaciones, y el tope crece con la UDI, así que un portafolio cubierto al
+# inicio puede dejar de estarlo a mitad del plazo. Todo se calcula sobre la
+# matriz de saldos por institución (meses x SOFIPOs), con un acumulado lógico
+# sobre el eje de los meses para encontrar el primer rebase.
+#
+# ============================================================================
+
+ELEMENTOS_BLOQUE_IPAB = 2_000_000
+
+def cobertura_ipab_en_el_tiempo(saldos_por_sofipo, fecha_inicio=None):
+    """
+    Cobertura del IPAB mes a mes a partir de los saldos por institución
+
+    Args:
+        saldos_por_sofipo: Arreglo (..., meses + 1, S) con el saldo de cada
+            institución al cierre de cada mes; los ejes iniciales (opcionales)
+            son portafolios
+        fecha_inicio: Mes de inicio de la proyección (por omisión, el actual)
+
+    Returns:
+        Dict con limite (tope en pesos por mes), excedente (..., meses + 1, S),
+        sin_cobertura (..., meses + 1), cobertura (% cubierto por mes),
+        mes_rebase (..., S) y primer_rebase (...), con -1 si nunca se rebasa
+    """
+    saldos = np.asarray(saldos_por_sofipo, dtype=float)
+    num_meses = saldos.shape[-2]
+    limite = limites_ipab_mensuales(num_meses - 1, fecha_inicio)
+
+    excedente = np.maximum(saldos - limite[:, None], 0)
+    ya_rebaso = np.logical_or.accumulate(excedente > 0, axis=-2)
+    meses_rebasados = ya_rebaso.sum(axis=-2)
+    mes_rebase = np.where(meses_rebasados > 0, num_meses - meses_rebasados, -1)
+    primer_rebase = np.where(mes_rebase >= 0, mes_rebase, num_meses).min(axis=-1, initial=num_meses)
+
+    sin_cobertura = excedente.sum(axis=-1)
+    saldo_total = saldos.sum(axis=-1)
+    cobertura = np.where(saldo_total > 0, (saldo_total - sin_cobertura) / np.where(saldo_total > 0, saldo_total, 1) * 100, 100)
+
+    return {
+        "limite": limite,
+        "excedente": excedente,
+        "sin_cobertura": sin_cobertura,
+        "cobertura": cobertura,
+        "mes_rebase": mes_rebase,
+        "primer_rebase": np.where(primer_rebase < num_meses, primer_rebase, -1)
+    }
+
+def saldos_por_institucion(saldos, sofipos):
+    """
+    Suma por institución los saldos de varios productos
+
+    Args:
+        saldos: Arreglo (meses + 1) x K con el saldo de cada producto
+        sofipos: SOFIPO de cada una de las K columnas
+
+    Returns:
+        Tupla (arreglo (meses + 1) x S, nombres de las S instituciones)
+    """
+    return np.asarray(saldos, dtype=float) @ matriz_instituciones(sofipos), list(dict.fromkeys(sofipos))
+
+def primer_rebase_ipab_lote(montos, periodos_meses, catalogo=CATALOGO, fecha_inicio=None):
+    """
+    Primer mes en que cada portafolio rebasa la cobertura del IPAB en alguna institución
+
+    Proyecta el saldo de cada producto mes a mes (mismas fórmulas que
+    calcular_ganancias_lote) por bloques de portafolios, para que la matriz
+    portafolios x meses x productos no crezca sin límite.
+
+    Args:
+        montos: Arreglo N x P de montos por producto
+        periodos_meses: Plazo en meses; escalar o uno por portafolio
+        catalogo: Catálogo compilado
+        fecha_inicio: Mes de inicio de las proyecciones (por omisión, el actual)
+
+    Returns:
+        Arreglo de enteros (longitud N): mes del primer rebase, o -1 si el
+        portafolio queda cubierto durante todo su plazo
+    """
+    montos = np.atleast_2d(np.asarray(montos, dtype=float))
+    n, p = montos.shape
+    periodos = np.broadcast_to(np.asarray(periodos_meses, dtype=int), (n,))
+    meses = int(periodos.max(initial=0))
+    dias = (np.arange(meses + 1) * 30.0)[:, None]
+    bloque = max(1, ELEMENTOS_BLOQUE_IPAB // ((meses + 1) * max(p, 1)))
+
+    primer_rebase = np.full(n, -1)
+    for inicio in range(0, n, bloque):
+        montos_bloque = montos[inicio:inicio + bloque, None, :]
+        saldos = montos_bloque + _ganancias_broadcast(
+            montos_bloque, dias, catalogo["tasa_base"], catalogo["tasa_premium"], catalogo
+        )
+        por_sofipo = saldos @ catalogo["matriz_sofipo"]
+        # Los meses posteriores al plazo de cada portafolio no cuentan
+        por_sofipo[np.arange(meses + 1)[None, :] > periodos[inicio:inicio + bloque, None]] = 0
+        primer_rebase[inicio:inicio + bloque] = cobertura_ipab_en_el_tiempo(por_sofipo, fecha_inicio)["primer_rebase"]
+    return primer_rebase
+
+# ============================================================================
+# MOTOR DE SCORE DEL PORTAFOLIO
+# ============================================================================
+#
+# Única implementación del score 0-100: calcular_componentes_score_lote().
+# evaluar_portafolios_lote() lo incluye en sus métricas, así que los procesos
+# por lotes (comparación, búsqueda de estrategias) lo leen de ahí junto con la
+# ganancia y la cobertura; la interfaz usa score_portafolio(), memoizado por
+# vector de montos, para el portafolio que se está viendo.
+#
+# ============================================================================
+
+def clasificar_score(score_total):
+    """
+    Regresa el semáforo de riesgo para un score total
+    """
+    if score_total >= 85:
+        return {"semaforo": "🟢", "texto": "EXCELENTE", "color": "#22c55e", "mensaje": "Tu portafolio está muy bien optimizado"}
+    elif score_total >= 70:
+        return {"semaforo": "🟢", "texto": "BUENO", "color": "#84cc16", "mensaje": "Portafolio sólido con buen balance"}
+    elif score_total >= 55:
+        return {"semaforo": "🟡", "texto": "ACEPTABLE", "color": "#eab308", "mensaje": "Considera mejorar algunos aspectos"}
+    else:
+        return {"semaforo": "🔴", "texto": "MEJORABLE", "color": "#ef4444", "mensaje": "Hay áreas importantes que optimizar"}
+
+def _niveles_score(metricas):
+    """
+    Etiquetas descriptivas de cada componente para un solo portafolio
+    """
+    gat = metricas["gat_ponderado"]
+    if gat >= 15:
+        nivel_rendimiento = "Excelente"
+    elif gat >= 14:
+        nivel_rendimiento = "Muy Bueno"
+    elif gat >= 13:
+        nivel_rendimiento = "Bueno"
+    elif gat >= 12:
+        nivel_rendimiento = "Aceptable"
+    else:
+        nivel_rendimiento = "Mejorable"
+
+    if metricas["proteccion_completa"]:
+        nivel_ipab = "100% Protegido"
+    else:
+        nivel_ipab = f"{metricas['cobertura_ipab']:.0f}% Protegido"
+
+    liquidez = metricas["porcentaje_liquidez"]
+    if liquidez >= 80:
+        nivel_liquidez = "Muy Alta"
+    elif liquidez >= 50:
+        nivel_liquidez = "Balanceada"
+    elif liquidez >= 30:
+        nivel_liquidez = "Moderada"
+    else:
+        nivel_liquidez = "Baja"
+
+    num_sofipos = metricas["num_sofipos"]
+    if num_sofipos >= 5:
+        nivel_diversificacion = "Excelente"
+    elif num_sofipos >= 3:
+        nivel_diversificacion = "Buena"
+    elif num_sofipos >= 2:
+        nivel_diversificacion = "Aceptable"
+    else:
+        nivel_diversificacion = "Básica"
+
+    return {
+        "Rendimiento": nivel_rendimiento,
+        "Protección IPAB": nivel_ipab,
+        "Liquidez": nivel_liquidez,
+        "Diversificación": nivel_diversificacion
+    }
+
+@st.cache_data(show_spinner=False, max_entries=512)
+def _score_portafolio_memo(montos, periodo_meses, huella):
+    metricas_lote = evaluar_portafolios_lote(np.array(montos), periodo_meses)
+    metricas = {
+        clave: valor[0].item()
+        for clave, valor in metricas_lote.items()
+        if clave != "componentes_score"
+    }
+    niveles = _niveles_score(metricas)
+    metricas["componentes"] = [
+        (nombre, int(puntos[0]), PUNTOS_MAXIMOS_SCORE[nombre], niveles[nombre])
+        for nombre, puntos in metricas_lote["componentes_score"].items()
+    ]
+    metricas["niveles"] = niveles
+    metricas["clasificacion"] = clasificar_score(metricas["score"])
+    return metricas
+
+def score_portafolio(montos, periodo_meses):
+    """
+    Score completo de un portafolio, memoizado por su vector de montos
+
+    La memoria sobrevive a las reejecuciones y se comparte entre sesiones; la
+    huella de los productos con monto hace que un cambio de tasas la invalide.
+
+    Args:
+        montos: Vector P de montos por producto
+        periodo_meses: Plazo de la simulación en meses
+
+    Returns:
+        Dict con las métricas escalares del portafolio, los componentes
+        (nombre, puntos, máximo, nivel) y la clasificación del semáforo
+    """
+    montos = np.asarray(montos, dtype=float)
+    return _score_portafolio_memo(tuple(montos.tolist()), float(periodo_meses), huella_productos(montos > 0))
+
+def vector_desde_seleccion(inversiones_seleccionadas, catalogo=CATALOGO):
+    """
+    Convierte inversiones_seleccionadas (formato de la interfaz) en un vector de montos
+    """
+    inversiones = {
+        inv['sofipo']: {"producto": inv['producto'], "monto": inv['monto']}
+        for inv in inversiones_seleccionadas.values()
+    }
+    montos, _ = vector_portafolio(inversiones, catalogo)
+    return montos
+
+def tabla_retorno_marginal(montos, dias, catalogo=CATALOGO):
+    """
+    Tabla de retorno marginal por producto a partir de los gradientes analíticos
+
+    Args:
+        montos: Vector P de montos del portafolio
+        dias: Días del periodo simulado
+        catalogo: Catálogo compilado
+
+    Returns:
+        Lista de dicts (uno por producto con monto > 0) con la ganancia extra
+        por cada $1,000 adicionales y por cada punto adicional de tasa
+    """
+    montos = np.asarray(montos, dtype=float)
+    _, gradientes = calcular_ganancias_lote(montos, dias, catalogo, con_gradientes=True)
+
+    filas = []
+    for i in np.flatnonzero(montos > 0):
+        sofipo, producto = catalogo["claves"][i]
+        espacio = catalogo["limite_max"][i] - montos[i]
+        filas.append({
+            "SOFIPO": sofipo,
+            "Producto": producto,
+            "Monto": montos[i],
+            "Por cada $1,000 extra": (gradientes["d_monto"][0, i] - 1) * 1000,
+            "Por +1 punto de tasa": gradientes["d_tasa"][0, i] + gradientes["d_tasa_premium"][0, i],
+            "Espacio antes del límite": espacio if np.isfinite(espacio) else None
+        })
+
+    filas.sort(key=lambda x: -x["Por cada $1,000 extra"])
+    return filas
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def calcular_malla_sensibilidad(montos, capitales, horizontes, desplazamientos, huella=None):
+    """
+    Evalúa el portafolio actual sobre una malla capital x plazo x desplazamiento de tasas
+
+    Se conserva la distribución del portafolio (porcentaje por producto) y se
+    escala a cada nivel de capital. Lo que rebasa el límite máximo de un
+    producto no se invierte: queda sin asignar y no genera intereses, en vez
+    de cambiar la distribución. Todo se resuelve en una sola operación con
+    broadcasting sobre un arreglo C x H x S x P; el resultado queda en caché,
+    así que mover un control dentro de la malla es solo una consulta.
+
+    Args:
+        montos: Vector P con los montos actuales por producto
+        capitales: Niveles de capital a evaluar (C)
+        horizontes: Plazos en meses (H)
+        desplazamientos: Cambios en puntos porcentuales sobre todas las tasas (S)
+        huella: huella_productos() de los productos con monto; no entra en el
+                cálculo, separa en la caché los resultados de tasas distintas
+
+    Returns:
+        Dict con arreglos C x H x S de ganancia total y GAT ponderado (sobre
+        lo invertido), y el arreglo C del capital que quedó sin asignar
+    """
+    catalogo = CATALOGO
+    montos = np.asarray(montos, dtype=float)
+    capitales = np.asarray(capitales, dtype=float)
+    horizontes = np.asarray(horizontes, dtype=float)
+    desplazamientos = np.asarray(desplazamientos, dtype=float)
+
+    pesos = montos / montos.sum()
+    montos_malla = np.minimum(capitales[:, None] * pesos, catalogo["limite_max"])
+    invertido = montos_malla.sum(axis=1)
+    montos_malla = montos_malla[:, None, None, :]
+    dias = horizontes[None, :, None, None] * 30
+    tasa_base = np.maximum(catalogo["tasa_base"] + desplazamientos[:, None], 0)[None, None, :, :]
+    tasa_premium = np.maximum(catalogo["tasa_premium"] + desplazamientos[:, None], 0)[None, None, :, :]
+
+    ganancia = _ganancias_broadcast(montos_malla, dias, tasa_base, tasa_premium, catalogo).sum(axis=-1)
+    rendimiento_periodo = ganancia / invertido[:, None, None]
+    gat = ((1 + rendimiento_periodo) ** (12 / horizontes[None, :, None]) - 1) * 100
+
+    return {"ganancia": ganancia, "gat": gat, "sin_asignar": capitales - invertido}
+
+def iterar_comparacion_simulaciones(archivos, tam_lote=64, catalogo=CATALOGO):
+    """
+    Evalúa simulaciones guardadas (JSON de guardar_simulacion) por lotes
+
+    Cada archivo se lee, se convierte a vector y se descarta; solo se mantiene
+    en memoria un búfer de tam_lote vectores. Al llenarse el búfer se evalúa
+    con evaluar_portafolios_lote y se emiten las filas de resultados.
+
+    Args:
+        archivos: Iterable de archivos (objetos con .read() y .name)
+        tam_lote: Número de simulaciones a evaluar por lote
+        catalogo: Catálogo compilado
+
+    Yields:
+        Tupla (filas, errores, procesados) por cada lote; procesados es el
+        número de archivos leídos hasta ese momento (un archivo puede dar una
+        fila y también un error, o solo un error)
+    """
+    buffer_montos = np.zeros((tam_lote, len(catalogo["claves"])))
+    buffer_periodos = np.zeros(tam_lote)
+    buffer_info = []
+    errores = []
+    procesados = 0
+
+    def evaluar_buffer():
+        n = len(buffer_info)
+        metricas = evaluar_portafolios_lote(buffer_montos[:n], buffer_periodos[:n], catalogo)
+        rebases = primer_rebase_ipab_lote(buffer_montos[:n], buffer_periodos[:n], catalogo)
+        filas = []
+        for j, (nombre, fecha, periodo) in enumerate(buffer_info):
+            filas.append({
+                "Simulación": nombre,
+                "Guardada": fecha,
+                "Plazo (meses)": int(periodo),
+                "Invertido": metricas["total_invertido"][j],
+                "Ganancia Total": metricas["ganancia_total"][j],
+                "GAT Ponderado": metricas["gat_ponderado"][j],
+                "Cobertura IPAB": metricas["cobertura_ipab"][j],
+                "Rebasa IPAB (mes)": int(rebases[j]) if rebases[j] >= 0 else None,
+                "Liquidez": metricas["porcentaje_liquidez"][j],
+                "SOFIPOs": int(metricas["num_sofipos"][j]),
+                "Score": int(metricas["score"][j])
+            })
+        return filas
+
+    for archivo in archivos:
+        nombre = getattr(archivo, "name", str(archivo))
+        procesados += 1
+        try:
+            simulacion_data = json.load(archivo)
+            montos, desconocidos = vector_portafolio(simulacion_data.get("inversiones", {}), catalogo)
+            periodo = float(simulacion_data.get("periodo_simulacion", 12))
+        except Exception as e:
+            errores.append(f"{nombre}: {str(e)}")
+            continue
+
+        if desconocidos:
+            errores.append(f"{nombre}: productos no encontrados ({', '.join(desconocidos)})")
+
+        j = len(buffer_info)
+        buffer_montos[j] = montos
+        buffer_periodos[j] = periodo
+        buffer_info.append((nombre, simulacion_data.get("fecha_guardado", "Sin fecha"), periodo))
+
+        if len(buffer_info) == tam_lote:
+            yield evaluar_buffer(), errores, procesados
+            buffer_info.clear()
+            errores = []
+
+    if buffer_info or errores:
+        yield (evaluar_buffer() if buffer_info else []), errores, procesados
+
+# ============================================================================
+# BÚSQUEDA DE PORTAFOLIOS ÓPTIMOS
+# ============================================================================
+#
+# Explora distribuciones del capital entre los productos habilitados y regresa
+# los candidatos que mejor combinan score y rendimiento. Los candidatos se
+# generan y evalúan por lotes con evaluar_portafolios_lote(); después de cada
+# lote la distribución de muestreo se concentra en los productos y pesos de
+# los mejores candidatos (entropía cruzada), lo que poda las combinaciones
+# que no compiten sin tener que enumerarlas.
+#
+# Restricciones que se respetan (las mismas que permite la interfaz):
+#   - Un solo producto por institución
+#   - Monto mínimo y límite máximo (limite_max) de cada producto
+#   - Máximo LIMITE_IPAB_MXN por institución
+#   - Instituciones excluidas, requisitos cumplidos y modo solo a la vista
+#
+# ============================================================================
+
+PREFERENCIA_SOFIPO = {
+    "Nu México": "usa_nu",
+    "DiDi": "usa_didi",
+    "Stori": "usa_stori",
+    "Klar": "usa_klar",
+    "Ualá": "usa_uala",
+    "Mercado Pago": "usa_mp",
+    "Finsus": "usa_finsus"
+}
+
+# Preferencia que indica si el usuario cumple el requisito de los productos condicionados
+REQUISITO_SOFIPO = {
+    "Klar": "cumple_klar_plus",
+    "Ualá": "cumple_uala_plus",
+    "Mercado Pago": "cumple_mercadopago"
+}
+
+def productos_elegibles(preferencias, catalogo=CATALOGO):
+    """
+    Máscara de productos que el usuario puede usar según sus preferencias
+
+    Args:
+        preferencias: Dict con las llaves usa_*, cumple_* y solo_vista
+            (mismo formato que guardar_simulacion)
+        catalogo: Catálogo compilado
+
+    Returns:
+        Arreglo booleano de longitud P
+    """
+    elegibles = np.ones(len(catalogo["claves"]), dtype=bool)
+
+    for i, (sofipo, _) in enumerate(catalogo["claves"]):
+        if not preferencias.get(PREFERENCIA_SOFIPO.get(sofipo), True):
+            elegibles[i] = False
+        elif catalogo["requiere_condicion"][i] and not preferencias.get(REQUISITO_SOFIPO.get(sofipo), False):
+            elegibles[i] = False
+
+    if preferencias.get("solo_vista", False):
+        elegibles &= catalogo["liquido"]
+
+    return elegibles
+
+def _ajustar_a_limites(montos, seleccion, topes, iteraciones=8):
+    """
+    Recorta cada posición a su tope y reparte el excedente entre las
+    posiciones seleccionadas que aún tienen espacio (proporcional a su monto)
+    """
+    for _ in range(iteraciones):
+        excedente = np.maximum(montos - topes, 0).sum(axis=1, keepdims=True)
+        if not excedente.any():
+            break
+        montos = np.minimum(montos, topes)
+        con_espacio = np.where(seleccion & (montos < topes), montos, 0)
+        total_con_espacio = con_espacio.sum(axis=1, keepdims=True)
+        reparto = np.divide(con_espacio, total_con_espacio, out=np.zeros_like(montos), where=total_con_espacio > 0)
+        montos = montos + excedente * reparto
+
+    return np.minimum(montos, topes)
+
+def buscar_portafolios_optimos(capital, periodo_meses, elegibles, peso_score=0.5, top_k=5,
+                               num_lotes=12, tam_lote=1024, fraccion_elite=0.1, semilla=0,
+                               catalogo=CATALOGO, progreso=None, huella=None):
+    """
+    Busca los portafolios que maximizan peso_score * score + (1 - peso_score) * rendimiento
+
+    El score se normaliza sobre 100 y el rendimiento (GAT sobre el capital
+    total, así el dinero sin asignar cuenta como 0%) sobre la tasa más alta
+    disponible, para que ambos términos queden en la misma escala.
+
+    Args:
+        capital: Capital total a distribuir
+        periodo_meses: Plazo de la simulación en meses
+        elegibles: Máscara booleana de productos permitidos (productos_elegibles)
+        peso_score: Peso del score en el objetivo (0 = solo rendimiento, 1 = solo score)
+        top_k: Número de portafolios a regresar
+        num_lotes: Número de lotes de candidatos
+        tam_lote: Candidatos por lote
+        fraccion_elite: Fracción del lote que guía el muestreo del siguiente
+        semilla: Semilla del generador aleatorio (resultados reproducibles)
+        catalogo: Catálogo compilado
+        progreso: Función opcional que recibe el avance (0 a 1) después de cada lote
+        huella: huella_productos() de los elegibles (solo distingue el resultado
+                de la tarea cuando cambia el catálogo)
+
+    Returns:
+        Dict con la lista "candidatos" (mejor primero; cada uno con su vector
+        de montos, objetivo y métricas), el número de candidatos "evaluados"
+        y de "descartados" por mínimos o límites
+    """
+    elegibles = np.asarray(elegibles, dtype=bool)
+    num_productos = len(catalogo["claves"])
+    topes = np.minimum(catalogo["limite_max"], LIMITE_IPAB_MXN)
+    minimos = np.maximum(catalogo["minimo"], 100)
+
+    grupos = [
+        np.flatnonzero(elegibles & (catalogo["sofipo_idx"] == s))
+        for s in range(len(catalogo["sofipos"]))
+    ]
+    grupos = [g for g in grupos if len(g)]
+    if capital <= 0 or not grupos:
+        return {"candidatos": [], "evaluados": 0, "descartados": 0}
+
+    # Cada institución elige uno de sus productos o ninguno (última opción)
+    prob_producto = [np.full(len(g) + 1, 1 / (len(g) + 1)) for g in grupos]
+    alfa = np.ones(num_productos)
+    tasa_referencia = np.maximum(catalogo["tasa_base"], catalogo["tasa_premium"])[elegibles].max()
+    tam_elite = max(top_k, int(tam_lote * fraccion_elite))
+
+    rng = np.random.default_rng(semilla)
+    reserva_montos = np.zeros((0, num_productos))
+    reserva_objetivo = np.zeros(0)
+    evaluados = 0
+    descartados = 0
+
+    for lote in range(num_lotes):
+        if progreso is not None:
+            progreso(lote / num_lotes)
+
+        seleccion = np.zeros((tam_lote, num_productos), dtype=bool)
+        for g, prob in zip(grupos, prob_producto):
+            eleccion = rng.choice(len(g) + 1, size=tam_lote, p=prob)
+            filas = np.flatnonzero(eleccion < len(g))
+            seleccion[filas, g[eleccion[filas]]] = True
+
+        pesos = np.where(seleccion, rng.gamma(alfa, size=(tam_lote, num_productos)), 0)
+        total_pesos = pesos.sum(axis=1, keepdims=True)
+        con_posiciones = total_pesos[:, 0] > 0
+        seleccion = seleccion[con_posiciones]
+        montos = capital * pesos[con_posiciones] / total_pesos[con_posiciones]
+
+        montos = _ajustar_a_limites(montos, seleccion, topes)
+
+        # Redondear a múltiplos de $100; lo que se pierde al redondear va a la
+        # posición seleccionada con más espacio
+        redondeados = np.floor(montos / 100) * 100
+        perdido = montos.sum(axis=1) - redondeados.sum(axis=1)
+        espacio = np.where(seleccion, topes - redondeados, -np.inf)
+        destino = espacio.argmax(axis=1)
+        filas = np.arange(len(montos))
+        redondeados[filas, destino] += np.minimum(np.round(perdido), np.maximum(espacio[filas, destino], 0))
+        montos = redondeados
+
+        # Poda: posiciones por debajo del mínimo del producto
+        factibles = ~(seleccion & (montos < minimos)).any(axis=1)
+        descartados += tam_lote - int(factibles.sum())
+        montos = montos[factibles]
+        if not len(montos):
+            continue
+
+        metricas = evaluar_portafolios_lote(montos, periodo_meses, catalogo)
+        gat_capital = ((1 + metricas["ganancia_total"] / capital) ** (12 / periodo_meses) - 1) * 100
+        objetivo = peso_score * metricas["score"] / 100 + (1 - peso_score) * gat_capital / tasa_referencia
+        evaluados += len(montos)
+
+        # Conservar los mejores candidatos únicos de todos los lotes
+        reserva_montos = np.vstack([reserva_montos, montos])
+        reserva_objetivo = np.concatenate([reserva_objetivo, objetivo])
+        reserva_montos, unicos = np.unique(reserva_montos, axis=0, return_index=True)
+        reserva_objetivo = reserva_objetivo[unicos]
+        orden = np.argsort(-reserva_objetivo, kind="stable")[:tam_elite]
+        reserva_montos = reserva_montos[orden]
+        reserva_objetivo = reserva_objetivo[orden]
+
+        # Actualizar la distribución de muestreo hacia la élite (con suavizado
+        # para no dejar de explorar por completo)
+        elite = reserva_montos
+        for j, g in enumerate(grupos):
+            en_uso = elite[:, g] > 0
+            frecuencia = np.append(en_uso.sum(axis=0), (~en_uso.any(axis=1)).sum()) / len(elite)
+            prob_producto[j] = 0.3 * prob_producto[j] + 0.7 * frecuencia
+            prob_producto[j] /= prob_producto[j].sum()
+
+        pesos_elite = elite / elite.sum(axis=1, keepdims=True)
+        veces_elegido = (elite > 0).sum(axis=0)
+        peso_medio = np.divide(pesos_elite.sum(axis=0), veces_elegido, out=np.zeros(num_productos), where=veces_elegido > 0)
+        alfa = 0.3 * alfa + 0.7 * np.maximum(peso_medio * 20, 0.05)
+
+    if not len(reserva_montos):
+        return {"candidatos": [], "evaluados": evaluados, "descartados": descartados}
+
+    # Preferir candidatos con combinaciones de productos distintas; si no
+    # alcanzan, completar con variantes de las mismas combinaciones
+    _, primera_aparicion = np.unique(reserva_montos > 0, axis=0, return_index=True)
+    distintos = np.sort(primera_aparicion)
+    resto = np.setdiff1d(np.arange(len(reserva_montos)), distintos)
+    orden = np.concatenate([distintos, resto])[:top_k]
+    mejores = reserva_montos[orden]
+    reserva_objetivo = reserva_objetivo[orden]
+    metricas = evaluar_portafolios_lote(mejores, periodo_meses, catalogo)
+    candidatos = []
+    for j, montos in enumerate(mejores):
+        candidato = {
+            clave: valor[j].item()
+            for clave, valor in metricas.items()
+            if clave != "componentes_score"
+        }
+        candidato["montos"] = montos
+        candidato["objetivo"] = reserva_objetivo[j].item()
+        candidato["gat_capital"] = ((1 + candidato["ganancia_total"] / capital) ** (12 / periodo_meses) - 1) * 100
+        candidatos.append(candidato)
+
+    return {"candidatos": candidatos, "evaluados": evaluados, "descartados": descartados}
+
+def estrategia_desde_vector(montos, catalogo=CATALOGO):
+    """
+    Convierte un vector de montos al formato de st.session_state['estrategia_aplicada']
+    """
+    estrategia = []
+    for i in np.flatnonzero(np.asarray(montos) > 0):
+        sofipo, producto = catalogo["claves"][i]
+        info = SOFIPOS_DATA[sofipo]['productos'][producto]
+        estrategia.append({
+            "sofipo": sofipo,
+            "producto": producto,
+            "monto": int(montos[i]),
+            "tasa": info.get('tasa_premium', info['tasa_base']),
+            "razon": describir_producto(sofipo, producto),
+            "emoji": SOFIPOS_DATA[sofipo]['logo']
+        })
+    return estrategia
+
+def tasa_maxima_producto(info):
+    """Tasa más alta de un producto del catálogo (la premium en los híbridos)"""
+    return info['tasa_premium'] if info['tipo'] == "vista_hibrida" else info['tasa_base']
+
+def resumen_tasa(info):
+    """
+    Tasa y límite de un producto del catálogo, p. ej. "15% hasta $25k"
+    """
+    if info['tipo'] == "vista_hibrida":
+        return f"{info['tasa_premium']:g}% primeros ${info['limite_premium'] / 1000:,.0f}k"
+    if info.get('limite_max'):
+        return f"{info['tasa_base']:g}% hasta ${info['limite_max'] / 1000:,.0f}k"
+    return f"{info['tasa_base']:g}% sin límite"
+
+def ayuda_tasas_sofipo(sofipo):
+    """
+    Mejores tasas de una SOFIPO para la ayuda de los filtros: la mejor sin
+    requisitos y la mejor con requisito
+    """
+    productos = SOFIPOS_DATA[sofipo]['productos'].values()
+    partes = []
+    for con_requisito in (False, True):
+        grupo = [info for info in productos if bool(info.get('requisito') or info.get('requisito_deposito')) == con_requisito]
+        if not grupo:
+            continue
+        mejor = max(grupo, key=tasa_maxima_producto)
+        texto = resumen_tasa(mejor)
+        if mejor['tipo'] == "plazo":
+            texto += f" a {mejor['liquidez']}"
+        partes.append(texto + (" con requisito" if con_requisito else ""))
+    return ", ".join(partes)
+
+# Cómo se cumple el requisito de depósito mensual de cada SOFIPO (el monto sale del catálogo)
+FORMA_REQUISITO_DEPOSITO = {
+    "Mercado Pago": "depositar",
+    "Ualá": "consumir con tarjetas Ualá (o domiciliar tu nómina)"
+}
+
+def producto_con_requisito(sofipo):
+    """
+    Producto de mayor tasa de una SOFIPO que pide requisito (membresía o depósito mensual)
+
+    Returns:
+        Tupla (nombre, info), o (None, None) si la SOFIPO no tiene
+    """
+    productos = SOFIPOS_DATA.get(sofipo, {}).get('productos', {})
+    candidatos = [(nombre, info) for nombre, info in productos.items() if info.get('requisito') or info.get('requisito_deposito')]
+    if not candidatos:
+        return None, None
+    return max(candidatos, key=lambda par: tasa_maxima_producto(par[1]))
+
+def texto_requisito(info, completo=False):
+    """
+    Requisito de un producto: "$3k/mes" (o "$3,000/mes" si completo) o el nombre de la membresía
+    """
+    if info is None:
+        return "el requisito"
+    if info.get('requisito_deposito'):
+        deposito = info['requisito_deposito']
+        return f"${deposito:,}/mes" if completo else f"${deposito / 1000:g}k/mes"
+    return info.get('requisito')
+
+def mejora_por_requisito(sofipo):
+    """
+    Lo que obtiene quien cumple el requisito de una SOFIPO frente a su mejor
+    producto a la vista sin requisito, p. ej. "16% hasta $50k (en vez de 7.75%)"
+    """
+    _, info = producto_con_requisito(sofipo)
+    if info is None:
+        return "una tasa más alta"
+    texto = resumen_tasa(info)
+    sin_requisito = [
+        tasa_maxima_producto(otro) for otro in SOFIPOS_DATA[sofipo]['productos'].values()
+        if otro['tipo'] != "plazo" and not (otro.get('requisito') or otro.get('requisito_deposito'))
+    ]
+    if sin_requisito:
+        texto += f" (en vez de {max(sin_requisito):g}%)"
+    return texto
+
+def _productos_ejemplo_aportaciones():
+    """
+    Productos a la vista sin requisito, de mayor a menor tasa: (sofipo, tasa, capacidad)
+    """
+    productos = []
+    for sofipo, datos in SOFIPOS_DATA.items():
+        for info in datos['productos'].values():
+            if info['tipo'] == "plazo" or info.get('requisito') or info.get('requisito_deposito'):
+                continue
+            capacidad = info['limite_premium'] if info['tipo'] == "vista_hibrida" else info.get('limite_max')
+            productos.append((sofipo, tasa_maxima_producto(info), capacidad or float('inf')))
+    return sorted(productos, key=lambda producto: -producto[1])
+
+def limites_ejemplo_aportaciones():
+    """Límites de los productos a la vista sin requisito, p. ej. "DiDi $10k, Nu México $25k" (con $ escapado)"""
+    return ", ".join(
+        f"{sofipo} \\${capacidad / 1000:,g}k"
+        for sofipo, _, capacidad in _productos_ejemplo_aportaciones()
+        if capacidad != float('inf')
+    )
+
+def ejemplo_aportaciones(aportacion_mensual=10000, meses=4):
+    """
+    Renglones de ejemplo (lista de markdown) de cómo se llenan los productos con
+    una aportación mensual, de mayor a menor tasa y respetando cada límite
+    """
+    productos = _productos_ejemplo_aportaciones()
+    saldos = [0.0] * len(productos)
+    renglones = []
+    for mes in range(1, meses + 1):
+        restante = aportacion_mensual
+        partes = []
+        for j, (sofipo, tasa, capacidad) in enumerate(productos):
+            if restante <= 0:
+                break
+            monto = min(restante, capacidad - saldos[j])
+            if monto <= 0:
+                continue
+            saldos[j] += monto
+            restante -= monto
+            parte = f"\\${monto / 1000:,g}k → {sofipo} {tasa:g}%"
+            if saldos[j] >= capacidad:
+                parte += f" (llega a su límite de \\${capacidad / 1000:,g}k)"
+            partes.append(parte)
+        renglones.append(f"- **Mes {mes}:** " + " + ".join(partes))
+    return renglones
+
+def tasa_promedio_mercado(elegibles=None, catalogo=CATALOGO):
+    """
+    Promedio de la mejor tasa de cada SOFIPO (la premium en los híbridos)
+
+    Args:
+        elegibles: Máscara de productos a considerar (productos_elegibles); por
+            omisión, los que no piden requisitos
+        catalogo: Catálogo compilado
+
+    Returns:
+        Tasa anual en %, 0 si no hay productos
+    """
+    if elegibles is None:
+        elegibles = ~catalogo["requiere_condicion"]
+    tasas = np.where(catalogo["tipo_calculo"] == TIPO_HIBRIDO, catalogo["tasa_premium"], catalogo["tasa_base"])
+    mejores = np.full(len(catalogo["sofipos"]), -np.inf)
+    np.maximum.at(mejores, catalogo["sofipo_idx"][elegibles], tasas[elegibles])
+    mejores = mejores[np.isfinite(mejores)]
+    return float(mejores.mean()) if len(mejores) else 0.0
+
+def describir_producto(sofipo, producto):
+    """
+    Resumen corto de tasa, límite, requisito y liquidez de un producto
+    """
+    info = SOFIPOS_DATA[sofipo]['productos'][producto]
+    texto = resumen_tasa(info)
+    if info.get('requisito') or info.get('requisito_deposito'):
+        texto += " ✅ Cumples el requisito"
+    if info['tipo'] == "plazo":
+        return f"{texto} 📅 PLAZO FIJO {info['liquidez']}"
+    return f"{texto} 💧 A LA VISTA"
+
+# ============================================================================
+# ESTADO COMPACTO DEL PORTAFOLIO
+# ============================================================================
+#
+# La selección de cada SOFIPO (si se invierte, qué producto, si se captura en
+# monto o porcentaje y el valor) vive en un solo registro de arreglos con una
+# casilla por SOFIPO del catálogo; el producto es su índice en el catálogo.
+# Es la fuente de verdad de la sesión:
+#
+# - Al inicio de cada ejecución recibe los valores que dejaron los widgets y se
+#   borran las llaves de los widgets que ya no se van a mostrar (productos que
+#   se dejaron de elegir, SOFIPOs desmarcadas, el modo que no está activo)
+# - Los widgets se crean con los valores del estado
+# - Cuando el código cambia la selección (estrategia aplicada, simulación
+#   cargada) se modifica el estado y se copia a las llaves de los widgets
+#
+# ============================================================================
+
+MODOS_CAPTURA = ["💵 Monto ($)", "📊 Porcentaje (%)"]
+MONTO_INICIAL_PRODUCTO = 10000
+PORCENTAJE_INICIAL_PRODUCTO = 10.0
+# Campos que se copian tal cual al reconstruir el estado con otro catálogo
+CAMPOS_ESTADO_PORTAFOLIO = ("activo", "porcentual", "monto", "porcentaje")
+
+def monto_inicial_producto(indice, catalogo=CATALOGO):
+    """Monto con el que se propone un producto: $10,000 o su mínimo si es mayor"""
+    return int(max(MONTO_INICIAL_PRODUCTO, catalogo["minimo"][indice]))
+
+def nuevo_estado_portafolio(catalogo=CATALOGO):
+    """
+    Estado sin SOFIPOs elegidas: el primer producto de cada una, capturado por monto
+
+    Returns:
+        Dict con las claves del catálogo con el que se creó y un arreglo de
+        longitud S (SOFIPOs) por campo: activo, producto (índice en el catálogo),
+        porcentual, monto y porcentaje
+    """
+    primeros = np.unique(catalogo["sofipo_idx"], return_index=True)[1]
+    return {
+        "claves": catalogo["claves"],
+        "activo": np.zeros(len(primeros), dtype=bool),
+        "producto": primeros.astype(np.int64),
+        "porcentual": np.zeros(len(primeros), dtype=bool),
+        "monto": np.maximum(MONTO_INICIAL_PRODUCTO, catalogo["minimo"][primeros]).astype(np.int64),
+        "porcentaje": np.full(len(primeros), PORCENTAJE_INICIAL_PRODUCTO)
+    }
+
+def estado_portafolio(catalogo=CATALOGO):
+    """
+    Estado compacto de la sesión (st.session_state["portafolio"])
+
+    Si el catálogo se recompiló (tasas recargadas) el estado se reconstruye por
+    nombre de SOFIPO y producto; los productos que ya no existen se descartan.
+    """
+    estado = st.session_state.get("portafolio")
+    if estado is None or estado["claves"] is not catalogo["claves"]:
+        nuevo = nuevo_estado_portafolio(catalogo)
+        if estado is not None:
+            for s in np.flatnonzero(estado["activo"]).tolist():
+                i = catalogo["indice"].get(estado["claves"][estado["producto"][s]])
+                if i is None:
+                    continue
+                t = catalogo["sofipo_idx"][i]
+                nuevo["producto"][t] = i
+                for campo in CAMPOS_ESTADO_PORTAFOLIO:
+                    nuevo[campo][t] = estado[campo][s]
+        st.session_state["portafolio"] = estado = nuevo
+    return estado
+
+def inversiones_desde_estado(estado, monto_total):
+    """
+    Portafolio del estado con las mismas reglas que la interfaz (los porcentajes
+    se convierten a montos con el mínimo de cada producto)
+
+    Returns:
+        Dict {sofipo: {"producto": ..., "monto": ...}} (formato de guardar_simulacion)
+    """
+    inversiones = {}
+    for s in np.flatnonzero(estado["activo"]).tolist():
+        sofipo, producto = estado["claves"][estado["producto"][s]]
+        if estado["porcentual"][s]:
+            minimo = SOFIPOS_DATA[sofipo]['productos'][producto]['minimo']
+            monto = max(int(monto_total * estado["porcentaje"][s].item() / 100), minimo)
+        else:
+            monto = estado["monto"][s].item()
+        inversiones[sofipo] = {"producto": producto, "monto": monto}
+    return inversiones
+
+def aplicar_inversiones_estado(estado, inversiones, catalogo=CATALOGO):
+    """
+    Reemplaza la selección del estado por un portafolio capturado por monto;
+    las SOFIPOs que no aparecen quedan desmarcadas
+
+    Args:
+        estado: Dict de estado_portafolio() (se modifica en su lugar)
+        inversiones: Dict {sofipo: {"producto": ..., "monto": ...}}
+
+    Returns:
+        Lista de productos que no están en el catálogo (se omiten)
+    """
+    estado["activo"][:] = False
+    desconocidos = []
+    for sofipo, datos in inversiones.items():
+        i = catalogo["indice"].get((sofipo, datos.get("producto")))
+        if i is None:
+            desconocidos.append(f"{sofipo} - {datos.get('producto')}")
+            continue
+        s = catalogo["sofipo_idx"][i]
+        estado["activo"][s] = True
+        estado["producto"][s] = i
+        estado["porcentual"][s] = False
+        estado["monto"][s] = int(datos.get("monto", 0) or 0)
+    return desconocidos
+
+def sincronizar_estado_portafolio(estado, catalogo=CATALOGO):
+    """
+    Pasa al estado los valores que dejaron los widgets de cada SOFIPO y borra de
+    st.session_state las llaves de los widgets que esta ejecución no va a mostrar
+
+    Se llama al inicio de cada ejecución, antes de leer el portafolio.
+
+    Returns:
+        Número de llaves borradas
+    """
+    sesion = st.session_state
+    vigentes = set()
+    for s, sofipo in enumerate(catalogo["sofipos"]):
+        estado["activo"][s] = sesion.get(f"check_{sofipo}", estado["activo"][s])
+        # Al cambiar de producto el monto vuelve al inicial del producto nuevo
+        i = catalogo["indice"].get((sofipo, sesion.get(f"prod_{sofipo}")))
+        if i is not None and i != estado["producto"][s]:
+            estado["producto"][s] = i
+            estado["monto"][s] = monto_inicial_producto(i, catalogo)
+        if sesion.get(f"modo_{sofipo}") in MODOS_CAPTURA:
+            estado["porcentual"][s] = sesion[f"modo_{sofipo}"] == MODOS_CAPTURA[1]
+
+        producto = catalogo["claves"][estado["producto"][s]][1]
+        llave_monto = f"monto_{sofipo}_{producto}"
+        llave_porcentaje = f"pct_{sofipo}_{producto}"
+        if llave_monto in sesion:
+            estado["monto"][s] = sesion[llave_monto]
+        if llave_porcentaje in sesion:
+            estado["porcentaje"][s] = sesion[llave_porcentaje]
+
+        if estado["activo"][s]:
+            vigentes.update((f"prod_{sofipo}", f"modo_{sofipo}"))
+            vigentes.add(llave_porcentaje if estado["porcentual"][s] else llave_monto)
+
+    llaves = {f"prod_{sofipo}" for sofipo in catalogo["sofipos"]}
+    llaves.update(f"modo_{sofipo}" for sofipo in catalogo["sofipos"])
+    llaves.update(f"{prefijo}_{sofipo}_{producto}" for sofipo, producto in catalogo["claves"] for prefijo in ("monto", "pct"))
+    obsoletas = [llave for llave in llaves - vigentes if llave in sesion]
+    for llave in obsoletas:
+        del sesion[llave]
+    return len(obsoletas)
+
+def escribir_widgets_portafolio(estado, catalogo=CATALOGO):
+    """
+    Copia el estado a las llaves de los widgets después de cambiarlo desde el
+    código; debe llamarse antes de que se creen los widgets de las pestañas
+    """
+    for s, sofipo in enumerate(catalogo["sofipos"]):
+        st.session_state[f"check_{sofipo}"] = bool(estado["activo"][s])
+        if not estado["activo"][s]:
+            continue
+        producto = catalogo["claves"][estado["producto"][s]][1]
+        st.session_state[f"prod_{sofipo}"] = producto
+        st.session_state[f"modo_{sofipo}"] = MODOS_CAPTURA[int(estado["porcentual"][s])]
+        if estado["porcentual"][s]:
+            st.session_state[f"pct_{sofipo}_{producto}"] = estado["porcentaje"][s].item()
+        else:
+            st.session_state[f"monto_{sofipo}_{producto}"] = estado["monto"][s].item()
+
+# ============================================================================
+# COMPARACIÓN ANTES DE APLICAR (WHAT-IF)
+# ============================================================================
+
+# Métricas que se comparan entre el portafolio actual y el propuesto: (clave, etiqueta, formato)
+METRICAS_COMPARACION = [
+    ("ganancia_total", "💵 Ganancia", "dinero"),
+    ("gat_ponderado", "📈 GAT ponderado", "porcentaje"),
+    ("porcentaje_liquidez", "💧 Liquidez", "porcentaje"),
+    ("cobertura_ipab", "🛡️ Cobertura IPAB", "porcentaje"),
+    ("score", "🏆 Score", "puntos")
+]
+
+def resolver_producto(sofipo, producto):
+    """
+    Nombre válido del producto en SOFIPOS_DATA: exacto, por coincidencia parcial
+    o el primero de la SOFIPO
+    """
+    productos_disponibles = list(SOFIPOS_DATA[sofipo]['productos'].keys())
+    if producto in productos_disponibles:
+        return producto
+    for prod in productos_disponibles:
+        if producto.lower() in prod.lower() or prod.lower() in producto.lower():
+            return prod
+    return productos_disponibles[0]
+
+def inversiones_desde_estrategia(estrategia):
+    """
+    Convierte una estrategia (lista de items sofipo/producto/monto) al formato de guardar_simulacion
+
+    La interfaz admite un producto por SOFIPO: gana el último item de cada SOFIPO,
+    y los items que caen en el mismo producto suman sus montos.
+    """
+    inversiones = {}
+    for item in estrategia:
+        sofipo = item["sofipo"]
+        if sofipo not in SOFIPOS_DATA:
+            continue
+        producto = resolver_producto(sofipo, item["producto"])
+        anterior = inversiones.get(sofipo)
+        monto = int(item["monto"])
+        if anterior and anterior["producto"] == producto:
+            monto += anterior["monto"]
+        inversiones[sofipo] = {"producto": producto, "monto": monto}
+    return inversiones
+
+def inversiones_en_sesion(monto_total):
+    """
+    Portafolio capturado en las pestañas de cada SOFIPO, leído del estado compacto
+    de la sesión (ver estado_portafolio)
+
+    Args:
+        monto_total: Capital total, para convertir porcentajes a montos
+
+    Returns:
+        Dict {sofipo: {"producto": ..., "monto": ...}} (formato de guardar_simulacion)
+    """
+    return inversiones_desde_estado(estado_portafolio(), monto_total)
+
+def comparar_portafolios(actual, propuesto, periodo_meses, catalogo=CATALOGO):
+    """
+    Evalúa el portafolio actual y el propuesto en una sola llamada al motor vectorizado
+
+    Args:
+        actual: Vector de montos del portafolio actual
+        propuesto: Vector de montos del portafolio propuesto
+        periodo_meses: Plazo de la simulación en meses
+        catalogo: Catálogo compilado
+
+    Returns:
+        Dict {clave: {"actual", "propuesto", "delta"}} para total_invertido y
+        cada métrica de METRICAS_COMPARACION
+    """
+    metricas = evaluar_portafolios_lote(np.vstack([actual, propuesto]), periodo_meses, catalogo)
+    comparacion = {}
+    for clave in ["total_invertido"] + [m[0] for m in METRICAS_COMPARACION]:
+        actual_valor, propuesto_valor = (float(v) for v in metricas[clave])
+        comparacion[clave] = {
+            "actual": actual_valor,
+            "propuesto": propuesto_valor,
+            "delta": propuesto_valor - actual_valor
+        }
+    return comparacion
+
+# ============================================================================
+# ESTRATEGIAS PREDEFINIDAS
+# ============================================================================
+#
+# Cada estrategia se declara con su perfil y sus reglas, y un solo motor las
+# resuelve contra el catálogo:
+#
+# - clases: tipos de producto permitidos (vista, vista_hibrida, plazo)
+# - plazo_maximo_dias: plazo fijo más largo permitido (None = sin límite)
+# - liquidez_minima: % de lo invertido que debe quedar en productos a la vista
+# - tope_institucion: % máximo del capital en una misma SOFIPO
+# - proteger_ipab: no pasar de LIMITE_IPAB_MXN en una misma SOFIPO
+#
+# El motor llena los productos permitidos de mayor a menor tasa, con un
+# producto por SOFIPO (como en la interfaz), respetando mínimos y límites.
+
+ESTRATEGIAS = {
+    "Conservadora": {
+        "emoji": "🛡️",
+        "riesgo": "Bajo",
+        "perfil": "Prioriza seguridad y liquidez sobre el rendimiento máximo.",
+        "consideraciones": [
+            "Todas las opciones tienen liquidez inmediata",
+            "Ideal para fondos de emergencia"
+        ],
+        "clases": ("vista", "vista_hibrida"),
+        "plazo_maximo_dias": 0,
+        "liquidez_minima": 100,
+        "tope_institucion": 30,
+        "proteger_ipab": True
+    },
+    "Balanceada": {
+        "emoji": "⚖️",
+        "riesgo": "Moderado",
+        "perfil": "Balance entre rendimiento, liquidez y diversificación.",
+        "consideraciones": [
+            "Hasta 20% puede quedar en plazos fijos de 90 días o menos",
+            "Ideal para la mayoría de inversores"
+        ],
+        "clases": ("vista", "vista_hibrida", "plazo"),
+        "plazo_maximo_dias": 90,
+        "liquidez_minima": 80,
+        "tope_institucion": 25,
+        "proteger_ipab": True
+    },
+    "Agresiva": {
+        "emoji": "🚀",
+        "riesgo": "Alto",
+        "perfil": "Obtener el máximo rendimiento posible sin importar la liquidez.",
+        "consideraciones": [],
+        "clases": ("vista", "vista_hibrida", "plazo"),
+        "plazo_maximo_dias": None,
+        "liquidez_minima": 0,
+        "tope_institucion": 100,
+        "proteger_ipab": False
+    }
+}
+
+# Clase de producto de cada tipo de cálculo del catálogo
+CLASE_TIPO_CALCULO = {TIPO_COMPUESTO: "vista", TIPO_HIBRIDO: "vista_hibrida", TIPO_SIMPLE: "plazo"}
+
+def _llenar_estrategia(permitidos, capital, tope, liquidez_minima, tasas, capacidad, catalogo):
+    """
+    Llena los productos permitidos de mayor a menor tasa (un producto por SOFIPO)
+
+    Returns:
+        Tupla (vector de montos, índices de los plazos recortados por la liquidez
+        mínima, de menor a mayor tasa)
+    """
+    presupuesto_plazo = capital * (100 - liquidez_minima) / 100
+
+    montos = np.zeros(len(catalogo["claves"]))
+    usadas = set()
+    saldo = capital
+    # Mayor tasa primero; en empate, el orden del catálogo
+    for i in np.lexsort((np.arange(len(tasas)), -tasas)):
+        if saldo <= 0:
+            break
+        if not permitidos[i] or catalogo["sofipo_idx"][i] in usadas:
+            continue
+        disponible = saldo if catalogo["liquido"][i] else min(saldo, presupuesto_plazo)
+        monto = int(min(disponible, capacidad[i], tope))
+        if monto <= 0 or monto < catalogo["minimo"][i]:
+            continue
+        montos[i] = monto
+        usadas.add(catalogo["sofipo_idx"][i])
+        saldo -= monto
+        if not catalogo["liquido"][i]:
+            presupuesto_plazo -= monto
+
+    # Si los topes por institución o del IPAB dejaron capital sin asignar, la
+    # liquidez mínima se vuelve a aplicar sobre lo invertido: los plazos se
+    # recortan (la menor tasa primero) hasta que quepan junto a lo que quedó a la vista
+    recortados = []
+    if liquidez_minima > 0:
+        liquido = catalogo["liquido"]
+        maximo_plazo = montos[liquido].sum() * (100 - liquidez_minima) / liquidez_minima
+        plazos = np.flatnonzero(~liquido & (montos > 0))
+        for i in plazos[np.lexsort((-plazos, tasas[plazos]))]:
+            exceso = montos[~liquido].sum() - maximo_plazo
+            if exceso <= 0:
+                break
+            restante = np.floor(montos[i] - exceso)
+            montos[i] = restante if restante > 0 and restante >= catalogo["minimo"][i] else 0
+            recortados.append(i)
+
+    return montos, recortados
+
+def distribuir_estrategia(regla, capital, elegibles, catalogo=CATALOGO):
+    """
+    Reparte el capital según las reglas de una estrategia
+
+    Lo invertido siempre cumple la liquidez mínima de la regla. Cuando un plazo
+    se tiene que recortar, también se prueba sin él (su SOFIPO queda libre para
+    un producto a la vista) y se conserva el reparto de mayor rendimiento anual.
+
+    Args:
+        regla: Dict de ESTRATEGIAS
+        capital: Capital total a distribuir
+        elegibles: Máscara de productos permitidos por el usuario (productos_elegibles)
+        catalogo: Catálogo compilado
+
+    Returns:
+        Vector de montos de longitud P (lo que no cabe queda sin asignar)
+    """
+    clases = np.array([CLASE_TIPO_CALCULO[tipo] for tipo in catalogo["tipo_calculo"]])
+    permitidos = elegibles & np.isin(clases, regla["clases"])
+    if regla["plazo_maximo_dias"] is not None:
+        permitidos &= catalogo["liquido"] | (catalogo["plazo_dias"] <= regla["plazo_maximo_dias"])
+
+    # El producto híbrido se llena solo hasta su tramo premium
+    hibrido = catalogo["tipo_calculo"] == TIPO_HIBRIDO
+    tasas = np.where(hibrido, catalogo["tasa_premium"], catalogo["tasa_base"])
+    capacidad = np.where(hibrido, catalogo["limite_premium"], catalogo["limite_max"])
+
+    tope = capital * regla["tope_institucion"] / 100
+    if regla["proteger_ipab"]:
+        tope = min(tope, LIMITE_IPAB_MXN)
+
+    mejor, recortados = _llenar_estrategia(
+        permitidos, capital, tope, regla["liquidez_minima"], tasas, capacidad, catalogo
+    )
+    while recortados:
+        permitidos = permitidos.copy()
+        permitidos[recortados[0]] = False
+        montos, recortados = _llenar_estrategia(
+            permitidos, capital, tope, regla["liquidez_minima"], tasas, capacidad, catalogo
+        )
+        if montos @ tasas > mejor @ tasas:
+            mejor = montos
+
+    return mejor
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def calcular_estrategias(capital, preferencias, periodo_meses=12, huella=None):
+    """
+    Resuelve todas las estrategias predefinidas y las evalúa en una sola llamada al motor
+
+    El resultado queda en caché por capital y preferencias, así que cambiar de
+    pestaña no recalcula nada.
+
+    Args:
+        capital: Capital total a distribuir
+        preferencias: Dict con las llaves usa_*, cumple_* y solo_vista
+        periodo_meses: Plazo de las métricas
+        huella: huella_productos() de los productos elegibles (solo para la caché)
+
+    Returns:
+        Dict {nombre: {montos, distribucion, sin_asignar, gat_capital y las
+        métricas de evaluar_portafolios_lote}} en el orden de ESTRATEGIAS
+    """
+    catalogo = CATALOGO
+    elegibles = productos_elegibles(preferencias, catalogo)
+    nombres = list(ESTRATEGIAS)
+    matriz = np.vstack([
+        distribuir_estrategia(ESTRATEGIAS[nombre], capital, elegibles, catalogo)
+        for nombre in nombres
+    ])
+    metricas = evaluar_portafolios_lote(matriz, periodo_meses, catalogo)
+
+    estrategias = {}
+    for j, nombre in enumerate(nombres):
+        estrategia = {
+            clave: valores[j].item()
+            for clave, valores in metricas.items()
+            if clave != "componentes_score"
+        }
+        estrategia["montos"] = matriz[j]
+        estrategia["distribucion"] = estrategia_desde_vector(matriz[j], catalogo)
+        estrategia["sin_asignar"] = capital - estrategia["total_invertido"]
+        # Rendimiento sobre el capital total: lo no asignado cuenta como 0%
+        estrategia["gat_capital"] = estrategia["ganancia_total"] / capital * 100 if capital > 0 else 0
+        estrategias[nombre] = estrategia
+    return estrategias
+
+# ============================================================================
+# CALCULADORA DE OBJETIVO
+# ============================================================================
+
+def distribucion_objetivo(monto_prueba, preferencias):
+    """
+    Distribución que llena los productos permitidos de mayor a menor tasa
+
+    Args:
+        monto_prueba: Capital a distribuir
+        preferencias: Dict con las llaves usa_*, cumple_* y solo_vista
+
+    Returns:
+        Tupla (tasa ponderada a 12 meses, lista de dicts sofipo/producto/monto/tasa/tipo/requisito)
+    """
+    # Un tramo por producto elegible; el híbrido aporta dos (premium y excedente)
+    productos_disponibles = []
+    for sofipo, producto in (CATALOGO["claves"][i] for i in np.flatnonzero(productos_elegibles(preferencias))):
+        info = SOFIPOS_DATA[sofipo]['productos'][producto]
+        tipo = "plazo" if info['tipo'] == "plazo" else "vista"
+        tramo = {"sofipo": sofipo, "tipo": tipo, "requisito": texto_requisito(info), "minimo": info['minimo']}
+        if info['tipo'] == "vista_hibrida":
+            limite = info['limite_premium']
+            productos_disponibles.append(dict(tramo, producto=f"{producto} (primeros ${limite / 1000:,.0f}k)", tasa=info['tasa_premium'], maximo=limite))
+            productos_disponibles.append(dict(tramo, producto=f"{producto} (después de ${limite / 1000:,.0f}k)", tasa=info['tasa_base'], maximo=None))
+        else:
+            productos_disponibles.append(dict(tramo, producto=producto, tasa=info['tasa_base'], maximo=info.get('limite_max')))
+
+    if not productos_disponibles:
+        return 0, []
+
+    # Mayor tasa primero; en empate, el orden del catálogo (sorted es estable)
+    productos_ordenados = sorted(productos_disponibles, key=lambda x: x["tasa"], reverse=True)
+
+    distribucion = []
+    saldo = monto_prueba
+
+    for producto in productos_ordenados:
+        if saldo <= 0:
+            break
+
+        if producto["maximo"] is not None:
+            monto_asignar = min(producto["maximo"], saldo)
+        else:
+            monto_asignar = saldo
+
+        if monto_asignar > 0 and monto_asignar >= producto["minimo"]:
+            distribucion.append({
+                "sofipo": producto["sofipo"],
+                "producto": producto["producto"],
+                "monto": monto_asignar,
+                "tasa": producto["tasa"],
+                "tipo": producto["tipo"],
+                "requisito": producto["requisito"]
+            })
+            saldo -= monto_asignar
+
+            if producto["maximo"] is None:
+                break
+
+    if distribucion:
+        rendimiento_total = 0
+        dias_simulacion = 12 * 30
+        for d in distribucion:
+            interes = calcular_interes_compuesto(d["monto"], d["tasa"], dias_simulacion)
+            rendimiento_total += interes
+        tasa_ponderada = (rendimiento_total / monto_prueba) * 100 if monto_prueba > 0 else 0
+        return tasa_ponderada, distribucion
+    else:
+        return 0, []
+
+def resolver_capital_objetivo(ganancia_anual_objetivo, preferencias, progreso=None, huella=None):
+    """
+    Capital necesario para ganar ganancia_anual_objetivo al año (bisección)
+
+    Args:
+        ganancia_anual_objetivo: Ganancia anual deseada
+        preferencias: Dict con las llaves usa_*, cumple_* y solo_vista
+        progreso: Función opcional que recibe el avance (0 a 1) en cada iteración
+        huella: huella_productos() de los productos elegibles (solo distingue
+                el resultado de la tarea cuando cambia el catálogo)
+
+    Returns:
+        Dict con capital, tasa, distribucion y tasa_referencia (0 si no hay productos disponibles)
+    """
+    tasa_referencia, _ = distribucion_objetivo(100000, preferencias)
+    if tasa_referencia == 0:
+        return {"capital": 0, "tasa": 0, "distribucion": [], "tasa_referencia": 0}
+
+    capital_estimado = (ganancia_anual_objetivo / tasa_referencia) * 100
+    capital_min = max(1000, capital_estimado * 0.5)
+    capital_max = capital_estimado * 2
+    capital_necesario = capital_estimado
+    iteraciones = 0
+    max_iteraciones = 30
+
+    while iteraciones < max_iteraciones and capital_max - capital_min > 10:
+        if progreso is not None:
+            progreso(iteraciones / max_iteraciones)
+
+        capital_prueba = (capital_min + capital_max) / 2
+        tasa_ponderada, _ = distribucion_objetivo(capital_prueba, preferencias)
+        ganancia_estimada = capital_prueba * tasa_ponderada / 100
+        diferencia = abs(ganancia_estimada - ganancia_anual_objetivo)
+
+        if diferencia < 10:
+            capital_necesario = capital_prueba
+            break
+        elif ganancia_estimada < ganancia_anual_objetivo:
+            capital_min = capital_prueba
+        else:
+            capital_max = capital_prueba
+
+        capital_necesario = capital_prueba
+        iteraciones += 1
+
+    tasa_real, distribucion_final = distribucion_objetivo(capital_necesario, preferencias)
+    return {
+        "capital": capital_necesario,
+        "tasa": tasa_real,
+        "distribucion": distribucion_final,
+        "tasa_referencia": tasa_referencia
+    }
+
+# ============================================================================
+# FIGURAS (PLOTLY)
+# ============================================================================
+#
+# Las gráficas se arman con fábricas: el estilo estático vive en una
+# plantilla (go.layout.Template) que se construye una vez por proceso, y cada
+# figura solo recibe sus arreglos de datos. Las figuras terminadas quedan en
+# caché por el contenido de sus datos, así que una re-ejecución que no cambia
+# el portafolio no las vuelve a construir.
+#
+# Los datos se pasan como arreglos NumPy (Plotly los serializa en binario) y
+# las series largas se reducen y se dibujan con scattergl.
+#
+# ============================================================================
+
+MAX_PUNTOS_FIGURA = 1500     # Puntos máximos por serie enviados al navegador
+UMBRAL_WEBGL = 500           # Series más largas se dibujan con scattergl
+MAX_PUNTOS_MARCADORES = 60   # Arriba de esto las líneas se dibujan sin marcadores
+
+COLORES_SOFIPO = {
+    "DiDi": "#FF6B6B",
+    "Nu México": "#8B5CF6",
+    "Klar": "#3B82F6",
+    "Mercado Pago": "#FCD34D",
+    "Ualá": "#10B981",
+    "Finsus": "#F59E0B",
+    "Stori": "#EC4899"
+}
+
+# Estilo de cada tipo de serie de la gráfica de crecimiento
+ESTILOS_SERIE = {
+    "total": {
+        "color": "#667eea", "area": "rgba(102, 126, 234, 0.3)", "ancho": 3.5, "marcador": 9, "borde": 2, "dash": None,
+        "hovertemplate": '<b style="color:#667eea;">Total Acumulado</b><br><b>Mes %{x}</b><br>Monto: <b>$%{y:,.0f}</b><br><extra></extra>'
+    },
+    "con_aportaciones": {
+        "color": "#43e97b", "area": "rgba(67, 233, 123, 0.3)", "ancho": 3.5, "marcador": 9, "borde": 2, "dash": None,
+        "hovertemplate": '<b style="color:#43e97b;">Con Aportaciones</b><br><b>Mes %{x}</b><br>Total: <b>$%{y:,.0f}</b><br><extra></extra>'
+    },
+    "sin_aportaciones": {
+        "color": "#667eea", "area": None, "ancho": 2.5, "marcador": 7, "borde": 1.5, "dash": "dash",
+        "hovertemplate": '<b style="color:#667eea;">Sin Aportaciones</b><br><b>Mes %{x}</b><br>Total: <b>$%{y:,.0f}</b><br><extra></extra>'
+    },
+    "neto": {
+        "color": "#f7b731", "area": None, "ancho": 2.5, "marcador": 0, "borde": 0, "dash": "dash",
+        "hovertemplate": '<b style="color:#f7b731;">Neto de ISR</b><br><b>Mes %{x}</b><br>Total: <b>$%{y:,.0f}</b><br><extra></extra>'
+    },
+    "real": {
+        "color": "#ff6348", "area": None, "ancho": 2.5, "marcador": 0, "borde": 0, "dash": "dot",
+        "hovertemplate": '<b style="color:#ff6348;">En pesos de hoy</b><br><b>Mes %{x}</b><br>Total: <b>$%{y:,.0f}</b><br><extra></extra>'
+    },
+    "sin_cobertura": {
+        "color": "#ef4444", "area": "rgba(239, 68, 68, 0.25)", "ancho": 2.5, "marcador": 0, "borde": 0, "dash": None,
+        "hovertemplate": '<b style="color:#ef4444;">Sin cobertura IPAB</b><br><b>Mes %{x}</b><br>Monto: <b>$%{y:,.0f}</b><br><extra></extra>'
+    },
+    "capital": {
+        "color": "rgba(150, 150, 150, 0.4)", "area": None, "ancho": 2, "marcador": 0, "borde": 0, "dash": "dot",
+        "hovertemplate": "Capital Inicial: $%{y:,.0f}<extra></extra>"
+    }
+}
+
+@st.cache_resource(show_spinner=False)
+def plantilla_figuras(oscuro=False):
+    """
+    Plantilla con todo el estilo estático de las gráficas del simulador
+
+    Solo incluye lo que el simulador personaliza (no parte de plotly_white ni
+    plotly_dark), así cada figura serializada lleva una plantilla mínima y el
+    resto lo completa el tema de Streamlit en el navegador.
+
+    Args:
+        oscuro: Si es True usa los colores del modo oscuro
+
+    Returns:
+        go.layout.Template compartida por todas las sesiones
+    """
+    plantilla = go.layout.Template()
+    ejes = dict(
+        showgrid=True,
+        gridwidth=1,
+        gridcolor='rgba(200,200,200,0.2)',
+        zeroline=False,
+        showline=True,
+        linewidth=2,
+        linecolor='rgba(200,200,200,0.3)'
+    )
+    plantilla.layout.update(
+        margin=dict(l=20, r=20, t=40, b=20),
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(0,0,0,0)',
+        font=dict(size=12, color='#c9d1d9' if oscuro else '#333333', family="Arial"),
+        xaxis=ejes,
+        yaxis=ejes,
+        legend=dict(
+            orientation="h",
+            xanchor="center",
+            x=0.5,
+            bgcolor='rgba(30,30,30,0.8)' if oscuro else 'rgba(255,255,255,0.8)',
+            bordercolor='rgba(200,200,200,0.3)',
+            borderwidth=1,
+            font=dict(size=11)
+        ),
+        annotationdefaults=dict(arrowhead=2, arrowsize=1, arrowwidth=2, borderpad=4)
+    )
+    plantilla.data.pie = [go.Pie(
+        hole=0.45,
+        textinfo='none',
+        marker=dict(line=dict(color='white', width=3)),
+        hovertemplate='<b>%{label}</b><br>Monto: $%{value:,.2f}<extra></extra>'
+    )]
+    return plantilla
+
+def reducir_serie(x, y, max_puntos=MAX_PUNTOS_FIGURA):
+    """
+    Submuestreo uniforme de una serie, conservando el primer y el último punto
+
+    Args:
+        x, y: Arreglos de la serie
+        max_puntos: Número máximo de puntos a conservar
+
+    Returns:
+        Tupla (x, y) con a lo más max_puntos elementos
+    """
+    if len(x) <= max_puntos:
+        return x, y
+    indices = np.unique(np.linspace(0, len(x) - 1, max_puntos).round().astype(np.int64))
+    return x[indices], y[indices]
+
+def _traza_serie(x, y, **propiedades):
+    """
+    Crea la traza de una serie eligiendo Scatter o Scattergl según su longitud
+    """
+    if len(x) > UMBRAL_WEBGL:
+        x, y = reducir_serie(x, y)
+        linea = propiedades.get("line", {})
+        linea.pop("shape", None)  # scattergl no soporta líneas suavizadas
+        return go.Scattergl(x=x, y=y, **propiedades)
+    return go.Scatter(x=x, y=y, **propiedades)
+
+@st.cache_resource(show_spinner=False, max_entries=32)
+def figura_crecimiento(series, anotaciones, oscuro=False):
+    """
+    Gráfica de evolución del portafolio
+
+    Args:
+        series: Lista de tuplas (nombre, estilo, x, y); estilo es una llave de ESTILOS_SERIE
+        anotaciones: Lista de dicts con x, y, texto, color, ax, ay y tamano (12 u 11)
+        oscuro: Usar la plantilla del modo oscuro
+
+    Returns:
+        go.Figure (compartida; no se debe modificar)
+    """
+    fig = go.Figure(layout=dict(template=plantilla_figuras(oscuro)))
+
+    for nombre, estilo, x, y in series:
+        e = ESTILOS_SERIE[estilo]
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+
+        if e["area"]:
+            fig.add_trace(_traza_serie(
+                x, y,
+                mode='lines',
+                name=f"{nombre} (área)",
+                line=dict(width=0),
+                fillcolor=e["area"],
+                fill='tozeroy',
+                showlegend=False,
+                hoverinfo='skip'
+            ))
+
+        con_marcadores = e["marcador"] and len(x) <= MAX_PUNTOS_MARCADORES
+        fig.add_trace(_traza_serie(
+            x, y,
+            mode='lines+markers' if con_marcadores else 'lines',
+            name=nombre,
+            line=dict(width=e["ancho"], color=e["color"], dash=e["dash"], shape='spline' if e["marcador"] else None),
+            marker=dict(
+                size=e["marcador"],
+                color=e["color"],
+                symbol='circle',
+                line=dict(color='white', width=e["borde"])
+            ) if con_marcadores else None,
+            hovertemplate=e["hovertemplate"]
+        ))
+
+    for anotacion in anotaciones:
+        grande = anotacion.get("tamano", 12) >= 12
+        fig.add_annotation(
+            x=anotacion["x"],
+            y=anotacion["y"],
+            text=anotacion["texto"],
+            showarrow=True,
+            arrowcolor=anotacion["color"],
+            ax=anotacion["ax"],
+            ay=anotacion["ay"],
+            font=dict(size=anotacion.get("tamano", 12), color=anotacion["color"], family="Arial"),
+            bgcolor="rgba(255,255,255,0.9)" if grande else "rgba(255,255,255,0.85)",
+            bordercolor=anotacion["color"],
+            borderwidth=2 if grande else 1.5,
+            borderpad=4 if grande else 3
+        )
+
+    fig.update_layout(
+        height=450,
+        hovermode='x unified',
+        xaxis_title="<b>Periodo (Meses)</b>",
+        yaxis=dict(title="<b>Monto Total (MXN)</b>", tickformat="$,.0f"),
+        showlegend=True,
+        legend=dict(yanchor="top", y=-0.15)
+    )
+    return fig
+
+@st.cache_resource(show_spinner=False, max_entries=32)
+def figura_distribucion(etiquetas, valores, colores, total, oscuro=False):
+    """
+    Gráfica de dona con la distribución final por SOFIPO
+
+    Args:
+        etiquetas: Etiquetas de cada rebanada
+        valores: Monto de cada rebanada
+        colores: Color de cada rebanada
+        total: Monto mostrado al centro
+        oscuro: Usar la plantilla del modo oscuro
+
+    Returns:
+        go.Figure (compartida; no se debe modificar)
+    """
+    fig = go.Figure(
+        data=[go.Pie(
+            labels=list(etiquetas),
+            values=np.asarray(valores, dtype=float),
+            marker=dict(colors=list(colores)),
+            pull=[0.02] * len(etiquetas)
+        )],
+        layout=dict(template=plantilla_figuras(oscuro))
+    )
+    fig.add_annotation(
+        text=f"<b>${total:,.0f}</b><br><span style='font-size:14px;'>Total Final</span>",
+        x=0.5, y=0.5,
+        font=dict(size=24, color='#667eea', family="Arial", weight="bold"),
+        showarrow=False
+    )
+    fig.update_layout(
+        showlegend=True,
+        height=450,
+        margin=dict(t=10, b=10, l=10, r=10),
+        legend=dict(yanchor="bottom", y=-0.2, bgcolor='rgba(0,0,0,0)', borderwidth=0)
+    )
+    return fig
+
+# ============================================================================
+# TABLAS NUMÉRICAS
+# ============================================================================
+
+# Formato de cada tipo de columna: (printf para exportar, formato de st.column_config)
+FORMATOS_TABLA = {
+    "dinero": ("%.2f", "dollar"),
+    "entero": ("%d", "%d"),
+    "porcentaje": ("%.4f", "%.2f%%")
+}
+
+FILAS_BLOQUE_CSV = 4096
+
+def crear_tabla(columnas):
+    """
+    Tabla respaldada por arreglos numéricos; el texto se genera solo para los renglones que se piden
+
+    Args:
+        columnas: Lista de tuplas (nombre, valores, formato). formato es una llave de
+                  FORMATOS_TABLA o "texto"; en ese caso valores es una función que recibe
+                  un arreglo de índices de renglón y regresa la lista de textos
+
+    Returns:
+        Dict con columnas (lista de dicts nombre/valores/formato) y num_filas
+    """
+    columnas_tabla = []
+    num_filas = 0
+    for nombre, valores, formato in columnas:
+        if formato != "texto":
+            valores = np.asarray(valores)
+            num_filas = len(valores)
+        columnas_tabla.append({"nombre": nombre, "valores": valores, "formato": formato})
+    return {"columnas": columnas_tabla, "num_filas": num_filas}
+
+def valores_columna(tabla, nombre):
+    """
+    Arreglo de valores de una columna numérica
+    """
+    for columna in tabla["columnas"]:
+        if columna["nombre"] == nombre:
+            return columna["valores"]
+    raise KeyError(nombre)
+
+def columnas_numericas(tabla):
+    """
+    Nombres de las columnas que se pueden ordenar y filtrar
+    """
+    return [c["nombre"] for c in tabla["columnas"] if c["formato"] != "texto"]
+
+def indices_tabla(tabla, orden=None, descendente=False, filtro=None):
+    """
+    Renglones visibles de la tabla después de filtrar y ordenar
+
+    No se reconstruye nada: el orden y el filtro solo producen un arreglo de índices
+    sobre los arreglos originales.
+
+    Args:
+        tabla: Tabla de crear_tabla()
+        orden: Nombre de la columna para ordenar (None = orden original)
+        descendente: Ordenar de mayor a menor
+        filtro: Tupla (columna, mínimo, máximo) o None
+
+    Returns:
+        np.ndarray con los índices de renglón en el orden a mostrar
+    """
+    columnas = {c["nombre"]: c["valores"] for c in tabla["columnas"] if c["formato"] != "texto"}
+    indices = np.arange(tabla["num_filas"])
+
+    if filtro is not None:
+        valores = columnas[filtro[0]]
+        indices = indices[(valores >= filtro[1]) & (valores <= filtro[2])]
+
+    if orden is not None:
+        valores = columnas[orden][indices]
+        indices = indices[np.argsort(-valores if descendente else valores, kind="stable")]
+    elif descendente:
+        indices = indices[::-1]
+
+    return indices
+
+def pagina_tabla(tabla, indices):
+    """
+    DataFrame con los renglones pedidos; los números se quedan como números
+
+    Args:
+        tabla: Tabla de crear_tabla()
+        indices: Renglones de la página, en orden
+
+    Returns:
+        pd.DataFrame listo para st.dataframe con configuracion_columnas_tabla()
+    """
+    datos = {}
+    for columna in tabla["columnas"]:
+        if columna["formato"] == "texto":
+            datos[columna["nombre"]] = columna["valores"](indices)
+        else:
+            datos[columna["nombre"]] = columna["valores"][indices]
+    return pd.DataFrame(datos)
+
+def configuracion_columnas_tabla(tabla):
+    """
+    column_config que formatea las columnas numéricas en el navegador
+    """
+    return {
+        c["nombre"]: st.column_config.NumberColumn(format=FORMATOS_TABLA[c["formato"]][1])
+        for c in tabla["columnas"]
+        if c["formato"] != "texto"
+    }
+
+def _texto_csv(valores):
+    """
+    Entrecomilla textos para CSV
+    """
+    return ['"' + str(v).replace('"', '""') + '"' for v in valores]
+
+def iterar_csv_tabla(tabla, indices=None, filas_bloque=FILAS_BLOQUE_CSV):
+    """
+    Genera el CSV de la tabla por bloques directamente de los arreglos numéricos
+
+    Args:
+        tabla: Tabla de crear_tabla()
+        indices: Renglones a exportar, en orden (None = todos)
+        filas_bloque: Renglones por bloque
+
+    Yields:
+        Fragmentos de texto CSV; el primero es el encabezado
+    """
+    if indices is None:
+        indices = np.arange(tabla["num_filas"])
+    yield ",".join(_texto_csv(c["nombre"] for c in tabla["columnas"])) + "\n"
+
+    for inicio in range(0, len(indices), filas_bloque):
+        bloque = indices[inicio:inicio + filas_bloque]
+        campos = []
+        for columna in tabla["columnas"]:
+            if columna["formato"] == "texto":
+                campos.append(_texto_csv(columna["valores"](bloque)))
+            else:
+                campos.append(np.char.mod(FORMATOS_TABLA[columna["formato"]][0], columna["valores"][bloque]))
+        yield "".join(",".join(fila) + "\n" for fila in zip(*campos))
+
+def csv_tabla(tabla, indices=None):
+    """
+    CSV completo de la tabla en bytes (UTF-8 con BOM para que Excel respete los acentos)
+    """
+    salida = io.BytesIO()
+    salida.write("\ufeff".encode("utf-8"))
+    for fragmento in iterar_csv_tabla(tabla, indices):
+        salida.write(fragmento.encode("utf-8"))
+    return salida.getvalue()
+
+# Formatos de exportación: (extensión, tipo MIME, módulo opcional que requiere)
+FORMATOS_EXPORTACION = {
+    "CSV": ("csv", "text/csv", None),
+    "Excel": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "openpyxl"),
+    "Parquet": ("parquet", "application/vnd.apache.parquet", "pyarrow")
+}
+
+def formatos_exportacion_disponibles():
+    """
+    Formatos de exportación cuyo módulo opcional está instalado (sin importarlo)
+    """
+    return [
+        formato
+        for formato, (_, _, modulo) in FORMATOS_EXPORTACION.items()
+        if modulo is None or importlib.util.find_spec(modulo) is not None
+    ]
+
+def _bloques_tabla(tabla, filas_bloque=FILAS_BLOQUE_CSV):
+    """
+    Recorre la tabla por bloques de renglones
+
+    Yields:
+        Lista con los valores de cada columna para el bloque (arreglos o listas de texto)
+    """
+    for inicio in range(0, tabla["num_filas"], filas_bloque):
+        bloque = np.arange(inicio, min(inicio + filas_bloque, tabla["num_filas"]))
+        yield [
+            c["valores"](bloque) if c["formato"] == "texto" else c["valores"][bloque]
+            for c in tabla["columnas"]
+        ]
+
+def _excel_tabla(tabla):
+    """
+    Libro de Excel en modo de solo escritura: los renglones se vuelcan por bloques
+    """
+    import openpyxl
+
+    libro = openpyxl.Workbook(write_only=True)
+    hoja = libro.create_sheet("Simulación")
+    hoja.append([c["nombre"] for c in tabla["columnas"]])
+    for valores in _bloques_tabla(tabla):
+        columnas = [v.tolist() if isinstance(v, np.ndarray) else v for v in valores]
+        for fila in zip(*columnas):
+            hoja.append(fila)
+
+    salida = io.BytesIO()
+    libro.save(salida)
+    return salida.getvalue()
+
+def _parquet_tabla(tabla):
+    """
+    Archivo Parquet escrito por lotes de renglones
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    tipos = {"dinero": pa.float64(), "entero": pa.int64(), "porcentaje": pa.float64(), "texto": pa.string()}
+    esquema = pa.schema([(c["nombre"], tipos[c["formato"]]) for c in tabla["columnas"]])
+
+    salida = io.BytesIO()
+    with pq.ParquetWriter(salida, esquema) as escritor:
+        for valores in _bloques_tabla(tabla):
+            escritor.write_batch(pa.record_batch(
+                [pa.array(v, type=campo.type) for v, campo in zip(valores, esquema)],
+                schema=esquema
+            ))
+    return salida.getvalue()
+
+def exportar_tabla(tabla, formato):
+    """
+    Archivo de exportación de la tabla
+
+    Args:
+        tabla: Tabla de crear_tabla()
+        formato: Llave de FORMATOS_EXPORTACION
+
+    Returns:
+        bytes con el contenido del archivo
+    """
+    if formato == "Excel":
+        return _excel_tabla(tabla)
+    if formato == "Parquet":
+        return _parquet_tabla(tabla)
+    return csv_tabla(tabla)
+
+def tabla_proyecciones(proyecciones, con_isr=False):
+    """
+    Proyección mensual de todos los productos en formato largo (un renglón por producto y mes)
+
+    Args:
+        proyecciones: Lista de DataFrames de generar_proyeccion_mensual() con la columna SOFIPO
+        con_isr: Agrega los intereses y el total netos de ISR
+
+    Returns:
+        Tabla de crear_tabla()
+    """
+    nombres = [proyeccion["SOFIPO"].iloc[0] for proyeccion in proyecciones]
+    codigos = np.repeat(np.arange(len(proyecciones)), [len(proyeccion) for proyeccion in proyecciones])
+
+    def columna(nombre):
+        return np.concatenate([proyeccion[nombre].to_numpy() for proyeccion in proyecciones])
+
+    return crear_tabla([
+        ("Producto", lambda indices: [nombres[c] for c in codigos[indices]], "texto"),
+        ("Mes", columna("Mes"), "entero"),
+        ("Capital Inicial", columna("Capital Inicial"), "dinero"),
+        ("Intereses Generados", columna("Intereses Generados"), "dinero"),
+        ("Total Acumulado", columna("Total Acumulado"), "dinero"),
+        *([
+            ("Intereses Netos", columna("Intereses Netos"), "dinero"),
+            ("Total Neto", columna("Total Neto"), "dinero")
+        ] if con_isr else []),
+        ("Tasa Actual", columna("Tasa Actual"), "porcentaje")
+    ])
+
+def tabla_libro_aportaciones(libro, nombres, aportacion, nombre_periodo, con_isr=False):
+    """
+    Libro de aportaciones completo: un renglón por aportación con lo asignado y el saldo de cada producto
+
+    Args:
+        libro: Resultado de calcular_libro_aportaciones()
+        nombres: Nombre de cada producto (mismo orden que las columnas del libro)
+        aportacion: Monto de cada aportación
+        nombre_periodo: Semana, Quincena o Mes
+        con_isr: Agrega el total y los intereses netos de ISR
+
+    Returns:
+        Tabla de crear_tabla()
+    """
+    num_periodos = len(libro["mes"])
+    columnas = [
+        (nombre_periodo, np.arange(1, num_periodos + 1), "entero"),
+        ("Mes", libro["mes"], "entero"),
+        ("Aportación", np.full(num_periodos, float(aportacion)), "dinero")
+    ]
+    for i, nombre in enumerate(nombres):
+        columnas.append((f"Aportado {nombre}", libro["asignado"][:, i], "dinero"))
+        columnas.append((f"Saldo {nombre}", libro["saldos"][:, i], "dinero"))
+    columnas += [
+        ("Total Acumulado", libro["total"], "dinero"),
+        ("Intereses Totales", libro["intereses_acumulados"], "dinero")
+    ]
+    if con_isr:
+        columnas += [
+            ("Total Neto", libro["total_neto"], "dinero"),
+            ("Intereses Netos", libro["intereses_netos"], "dinero")
+        ]
+    return crear_tabla(columnas)
+
+def tabla_resultados(inversiones, modelo, periodo_meses, con_isr=False):
+    """
+    Resultados por producto del portafolio: un renglón por inversión, valores numéricos
+
+    Args:
+        inversiones: inversiones_seleccionadas de la interfaz
+        modelo: Modelo de actualizar_modelo_portafolio() ya actualizado con esas inversiones
+        periodo_meses: Plazo simulado (aparece en el nombre de la columna del total)
+        con_isr: Agrega el ISR retenido y la ganancia neta de cada producto
+
+    Returns:
+        Tabla de crear_tabla()
+    """
+    llaves = list(inversiones)
+    productos = [modelo["productos"][llave] for llave in llaves]
+
+    def texto(valores):
+        return lambda indices: [valores[i] for i in indices]
+
+    def numeros(valores):
+        return np.fromiter(valores, dtype=float, count=len(llaves))
+
+    montos = numeros(inversiones[llave]["monto"] for llave in llaves)
+    ganancias = numeros(p["ganancia_periodo"] for p in productos)
+    columnas_isr = [
+        ("ISR Retenido", numeros(p["isr_retenido"] for p in productos), "dinero"),
+        ("Ganancia Neta", numeros(p["ganancia_neta"] for p in productos), "dinero")
+    ] if con_isr else []
+    return crear_tabla([
+        ("SOFIPO", texto([inversiones[llave]["sofipo"] for llave in llaves]), "texto"),
+        ("Producto", texto([inversiones[llave]["producto"] for llave in llaves]), "texto"),
+        ("Monto Invertido", montos, "dinero"),
+        ("GAT Efectivo", numeros(p["tasa_efectiva"] for p in productos), "porcentaje"),
+        ("Ganancia/Día", numeros(p["ganancia_dia"] for p in productos), "dinero"),
+        ("Ganancia/Mes", numeros(p["ganancia_mes"] for p in productos), "dinero"),
+        ("Ganancia/Año", numeros(p["ganancia_anio"] for p in productos), "dinero"),
+        (f"Total ({periodo_meses} meses)", montos + ganancias, "dinero"),
+        ("Ganancia Total", ganancias, "dinero"),
+        *columnas_isr,
+        ("Tipo Interés", texto([p["tipo_interes"] for p in productos]), "texto")
+    ])
+
+# ============================================================================
+# TAREAS EN SEGUNDO PLANO
+# ============================================================================
+#
+# Los cálculos pesados (libro de aportaciones a plazos largos, búsqueda de
+# portafolios, calculadora de objetivo) se ejecutan en un pool de hilos
+# compartido por todas las sesiones. Cada tarea se identifica por el hash de
+# su función y sus argumentos:
+#
+# - Si el resultado ya está en el caché (LRU acotado) se regresa de inmediato
+# - Si la misma tarea ya está corriendo, la nueva solicitud se une a ella
+# - Mientras corre, la interfaz muestra su avance y el resto de la página
+#   sigue respondiendo
+#
+# Las funciones que se envían reciben el argumento progreso (una función que
+# recibe el avance de 0 a 1) y no deben llamar a Streamlit.
+#
+# Si una tarea falla, su error se queda en caché (no se vuelve a enviar sola
+# en cada interacción) y mostrar_progreso_tarea() lo muestra con un botón para
+# reintentarla.
+
+MAX_HILOS_TAREAS = 2
+MAX_RESULTADOS_TAREAS = 64
+ESPERA_TAREA_SEG = 0.25       # Las tareas rápidas se muestran sin barra de progreso
+INTERVALO_PROGRESO_SEG = 0.5
+
+@st.cache_resource(show_spinner=False)
+def administrador_tareas():
+    """
+    Pool de hilos, tareas en curso y caché de resultados (uno por proceso)
+    """
+    return {
+        "ejecutor": ThreadPoolExecutor(max_workers=MAX_HILOS_TAREAS, thread_name_prefix="simulador"),
+        "candado": threading.Lock(),
+        "en_curso": {},
+        "resultados": OrderedDict(),
+        "errores": OrderedDict()
+    }
+
+def _huella(valor, digest):
+    """
+    Agrega un valor (arreglos, listas, dicts, escalares) al hash de la tarea
+    """
+    if isinstance(valor, np.ndarray):
+        digest.update(f"nd{valor.dtype.str}{valor.shape}".encode())
+        digest.update(np.ascontiguousarray(valor).tobytes())
+    elif isinstance(valor, (list, tuple)):
+        digest.update(f"{type(valor).__name__}{len(valor)}".encode())
+        for elemento in valor:
+            _huella(elemento, digest)
+    elif isinstance(valor, dict):
+        digest.update(f"dict{len(valor)}".encode())
+        for llave in sorted(valor, key=repr):
+            _huella(llave, digest)
+            _huella(valor[llave], digest)
+    else:
+        digest.update(repr(valor).encode())
+
+def llave_tarea(funcion, args, kwargs):
+    """
+    Hash que identifica una tarea por su función y sus argumentos
+    """
+    digest = hashlib.sha256(f"{funcion.__module__}.{funcion.__qualname__}".encode())
+    _huella(list(args), digest)
+    _huella(kwargs, digest)
+    return digest.hexdigest()
+
+def _terminar_tarea(admin, llave, futuro):
+    """
+    Pasa una tarea terminada al caché de resultados (o al de errores)
+    """
+    with admin["candado"]:
+        admin["en_curso"].pop(llave, None)
+        destino = admin["errores"] if futuro.exception() is not None else admin["resultados"]
+        destino[llave] = futuro.exception() or futuro.result()
+        while len(destino) > MAX_RESULTADOS_TAREAS:
+            destino.popitem(last=False)
+
+def enviar_tarea(funcion, *args, **kwargs):
+    """
+    Envía un cálculo al pool si su resultado no está en caché ni en curso
+
+    Args:
+        funcion: Función pura que acepta el argumento progreso
+        *args, **kwargs: Argumentos de la función
+
+    Returns:
+        Llave de la tarea (para resultado_tarea y avance_tarea)
+    """
+    admin = administrador_tareas()
+    llave = llave_tarea(funcion, args, kwargs)
+    with admin["candado"]:
+        if llave in admin["resultados"] or llave in admin["en_curso"] or llave in admin["errores"]:
+            return llave
+
+        tarea = {"avance": 0.0}
+
+        def progreso(avance):
+            tarea["avance"] = min(max(float(avance), 0.0), 1.0)
+
+        tarea["futuro"] = admin["ejecutor"].submit(funcion, *args, progreso=progreso, **kwargs)
+        admin["en_curso"][llave] = tarea
+    tarea["futuro"].add_done_callback(lambda futuro: _terminar_tarea(admin, llave, futuro))
+    return llave
+
+def resultado_tarea(llave, espera=ESPERA_TAREA_SEG):
+    """
+    Resultado de una tarea, esperando a lo más `espera` segundos
+
+    Returns:
+        El resultado, o None si la tarea sigue corriendo, falló (ver
+        error_tarea) o ya no está en caché
+    """
+    admin = administrador_tareas()
+    with admin["candado"]:
+        if llave in admin["resultados"]:
+            admin["resultados"].move_to_end(llave)
+            return admin["resultados"][llave]
+        tarea = admin["en_curso"].get(llave)
+
+    if tarea is None:
+        return None
+    wait([tarea["futuro"]], timeout=espera)
+    if tarea["futuro"].done() and tarea["futuro"].exception() is None:
+        return tarea["futuro"].result()
+    return None
+
+def error_tarea(llave):
+    """
+    Excepción de una tarea que falló, o None si no ha fallado
+    """
+    admin = administrador_tareas()
+    with admin["candado"]:
+        error = admin["errores"].get(llave)
+        tarea = admin["en_curso"].get(llave)
+    if error is None and tarea is not None and tarea["futuro"].done():
+        error = tarea["futuro"].exception()
+    return error
+
+def reintentar_tarea(llave):
+    """
+    Olvida el error de una tarea para que el siguiente enviar_tarea la vuelva a correr
+    """
+    admin = administrador_tareas()
+    with admin["candado"]:
+        admin["errores"].pop(llave, None)
+
+def limpiar_resultados_tareas():
+    """
+    Vacía el caché de resultados (las tareas en curso terminan normalmente)
+    """
+    admin = administrador_tareas()
+    with admin["candado"]:
+        admin["resultados"].clear()
+        admin["errores"].clear()
+
+def avance_tarea(llave):
+    """
+    Avance (0 a 1) de una tarea en curso, o None si ya terminó
+    """
+    admin = administrador_tareas()
+    with admin["candado"]:
+        tarea = admin["en_curso"].get(llave)
+    if tarea is None or tarea["futuro"].done():
+        return None
+    return tarea["avance"]
+
+# ============================================================================
+# INTERFAZ PRINCIPAL
+# ============================================================================
+
+def seleccionar_pagina(num_filas, key, filas_por_pagina=52):
+    """
+    Selector de página para tablas largas
+
+    Args:
+        num_filas: Número total de renglones
+        key: Key del widget de página
+        filas_por_pagina: Renglones por página
+
+    Returns:
+        Tupla (inicio, fin) con el rango de renglones a mostrar
+    """
+    num_paginas = max(1, -(-num_filas // filas_por_pagina))
+    if num_paginas == 1:
+        return 0, num_filas
+
+    # Si la tabla se hizo más corta, no dejar la página fuera de rango
+    if st.session_state.get(key, 1) > num_paginas:
+        st.session_state[key] = num_paginas
+
+    pagina = st.number_input(
+        f"Página (de {num_paginas})",
+        min_value=1,
+        max_value=num_paginas,
+        value=1,
+        step=1,
+        key=key
+    )
+    inicio = (pagina - 1) * filas_por_pagina
+    fin = min(inicio + filas_por_pagina, num_filas)
+    st.caption(f"Mostrando renglones {inicio + 1:,}-{fin:,} de {num_filas:,}")
+    return inicio, fin
+
+def mostrar_tabla_numerica(tabla, key, nombre_archivo, filas_por_pagina=52, altura=None):
+    """
+    Tabla paginada con orden, filtro y descarga CSV
+
+    Solo se arma la página visible; el formato de los números lo aplica el
+    navegador mediante column_config.
+
+    Args:
+        tabla: Tabla de crear_tabla()
+        key: Prefijo de las keys de los widgets
+        nombre_archivo: Nombre del CSV descargable
+        filas_por_pagina: Renglones por página
+        altura: Altura de la tabla en pixeles (None = automática)
+    """
+    if tabla["num_filas"] == 0:
+        st.info("Sin renglones para mostrar")
+        return
+
+    numericas = columnas_numericas(tabla)
+
+    with st.popover("↕️ Ordenar y filtrar"):
+        orden = st.selectbox("Ordenar por", ["Orden original"] + numericas, key=f"{key}_orden")
+        descendente = st.toggle("De mayor a menor", key=f"{key}_descendente")
+        columna_filtro = st.selectbox("Filtrar por", ["Sin filtro"] + numericas, key=f"{key}_filtro")
+        filtro = None
+        if columna_filtro != "Sin filtro":
+            valores = next(c["valores"] for c in tabla["columnas"] if c["nombre"] == columna_filtro)
+            col_min, col_max = st.columns(2)
+            with col_min:
+                minimo = st.number_input("Desde", value=float(valores.min()), key=f"{key}_min_{columna_filtro}")
+            with col_max:
+                maximo = st.number_input("Hasta", value=float(valores.max()), key=f"{key}_max_{columna_filtro}")
+            filtro = (columna_filtro, minimo, maximo)
+
+    indices = indices_tabla(
+        tabla,
+        orden=None if orden == "Orden original" else orden,
+        descendente=descendente,
+        filtro=filtro
+    )
+    if len(indices) == 0:
+        st.info("Ningún renglón cumple el filtro")
+        return
+
+    inicio, fin = seleccionar_pagina(len(indices), f"{key}_pagina", filas_por_pagina)
+    argumentos_altura = {"height": altura} if altura else {}
+    st.dataframe(
+        pagina_tabla(tabla, indices[inicio:fin]),
+        column_config=configuracion_columnas_tabla(tabla),
+        width="stretch",
+        hide_index=True,
+        **argumentos_altura
+    )
+    st.download_button(
+        "📥 Descargar CSV",
+        data=lambda: csv_tabla(tabla, indices),
+        file_name=nombre_archivo,
+        mime="text/csv",
+        key=f"{key}_csv",
+        on_click="ignore"
+    )
+
+def mostrar_exportaciones(tablas, periodo_meses):
+    """
+    Botones de descarga de los resultados; cada archivo se genera hasta que se pide
+
+    Args:
+        tablas: Lista de tuplas (etiqueta, nombre base del archivo, tabla)
+        periodo_meses: Plazo simulado, se agrega al nombre del archivo
+    """
+    with st.expander("📥 Exportar resultados"):
+        disponibles = formatos_exportacion_disponibles()
+        formato = st.radio("Formato", disponibles, horizontal=True, key="formato_exportacion")
+        faltantes = [f for f in FORMATOS_EXPORTACION if f not in disponibles]
+        if faltantes:
+            st.caption("Para " + " y ".join(faltantes) + " instala " + " y ".join(
+                f"`{FORMATOS_EXPORTACION[f][2]}`" for f in faltantes
+            ))
+
+        extension, mime, _ = FORMATOS_EXPORTACION[formato]
+        for etiqueta, nombre_base, tabla in tablas:
+            st.download_button(
+                f"{etiqueta} ({tabla['num_filas']:,} renglones)",
+                data=lambda tabla=tabla: exportar_tabla(tabla, formato),
+                file_name=f"{nombre_base}_{periodo_meses}m.{extension}",
+                mime=mime,
+                key=f"exportar_{nombre_base}",
+                on_click="ignore"
+            )
+
+def mostrar_progreso_tarea(llave, mensaje):
+    """
+    Barra de progreso de una tarea en segundo plano; vuelve a ejecutar la app cuando termina
+
+    Si la tarea falló muestra el error y un botón para reintentarla.
+    """
+    error = error_tarea(llave)
+    if error is not None:
+        st.error(f"❌ No se pudo completar el cálculo ({mensaje.rstrip('.')}): {error}")
+        if st.button("🔄 Reintentar", key=f"reintentar_{llave}"):
+            reintentar_tarea(llave)
+            st.rerun()
+        return
+
+    @st.fragment(run_every=INTERVALO_PROGRESO_SEG)
+    def progreso_tarea():
+        avance = avance_tarea(llave)
+        if avance is None:
+            st.rerun()
+        st.progress(avance, text=mensaje)
+
+    progreso_tarea()
+
+def _formato_comparacion(valor, formato, delta=False):
+    if formato == "dinero":
+        texto = f"${abs(valor):,.0f}"
+        return ("-" if valor < 0 else "+") + texto if delta else texto
+    if formato == "porcentaje":
+        return f"{valor:+.2f} pts" if delta else f"{valor:.2f}%"
+    return f"{valor:+.0f}" if delta else f"{valor:.0f}"
+
+def revisar_propuesta(origen, estrategia, monto_total, periodo_meses):
+    """
+    Comparación antes/después de una estrategia pendiente de aplicar
+
+    Solo lee st.session_state: el portafolio actual no cambia hasta que el
+    usuario confirma.
+
+    Args:
+        origen: Identificador de la propuesta (el botón que la pidió)
+        estrategia: Lista de items sofipo/producto/monto propuestos
+        monto_total: Capital total (para los montos capturados en porcentaje)
+        periodo_meses: Plazo de la comparación
+
+    Returns:
+        True si el usuario confirmó la propuesta
+    """
+    if st.session_state.get("propuesta_pendiente") != origen:
+        return False
+
+    actual, _ = vector_portafolio(inversiones_en_sesion(monto_total))
+    propuesto, _ = vector_portafolio(inversiones_desde_estrategia(estrategia))
+    comparacion = comparar_portafolios(actual, propuesto, periodo_meses)
+
+    with st.container(border=True):
+        st.markdown("#### 🔍 Antes de aplicar: tu portafolio actual contra la propuesta")
+        st.caption(
+            f"Invertido: ${comparacion['total_invertido']['actual']:,.0f} actual → "
+            f"${comparacion['total_invertido']['propuesto']:,.0f} propuesto ({periodo_meses} meses)"
+        )
+        for col, (clave, etiqueta, formato) in zip(st.columns(len(METRICAS_COMPARACION)), METRICAS_COMPARACION):
+            valores = comparacion[clave]
+            with col:
+                st.metric(
+                    etiqueta,
+                    _formato_comparacion(valores["propuesto"], formato),
+                    delta=_formato_comparacion(valores["delta"], formato, delta=True),
+                    help=f"Actual: {_formato_comparacion(valores['actual'], formato)}"
+                )
+
+        col_confirmar, col_cancelar = st.columns(2)
+        with col_confirmar:
+            confirmar = st.button("✅ Confirmar y aplicar", key=f"{origen}_confirmar", type="primary", width="stretch")
+        with col_cancelar:
+            cancelar = st.button("✖️ Mantener mi portafolio", key=f"{origen}_cancelar", width="stretch")
+
+    if confirmar or cancelar:
+        del st.session_state["propuesta_pendiente"]
+    if cancelar:
+        st.rerun()
+    return confirmar
+
+def mostrar_cobertura_ipab(saldos, sofipos, oscuro=False):
+    """
+    Línea de tiempo de la cobertura del IPAB por institución
+
+    Args:
+        saldos: Arreglo (meses + 1) x K con el saldo de cada producto al cierre de cada mes
+        sofipos: SOFIPO de cada una de las K columnas
+        oscuro: Usar la plantilla del modo oscuro en la gráfica
+    """
+    por_sofipo, instituciones = saldos_por_institucion(saldos, sofipos)
+    cobertura = cobertura_ipab_en_el_tiempo(por_sofipo)
+    meses = np.arange(len(por_sofipo))
+
+    if cobertura["primer_rebase"] < 0:
+        st.success(f"🛡️ Todo tu dinero queda cubierto durante el plazo. El tope sube con la UDI: ${cobertura['limite'][0]:,.0f} hoy y ${cobertura['limite'][-1]:,.0f} al final.")
+    else:
+        primera = instituciones[int(np.argmin(np.where(cobertura["mes_rebase"] >= 0, cobertura["mes_rebase"], len(meses))))]
+        st.warning(
+            f"⚠️ En el mes {cobertura['primer_rebase']} tu saldo en **{primera}** pasa de 25,000 UDIs. "
+            f"Al final quedarían **${cobertura['sin_cobertura'][-1]:,.0f}** sin cobertura ({cobertura['cobertura'][-1]:.0f}% cubierto)."
+        )
+        st.plotly_chart(
+            figura_crecimiento((("Sin cobertura IPAB", "sin_cobertura", meses, cobertura["sin_cobertura"]),), (), oscuro=oscuro),
+            width="stretch",
+            config={'displayModeBar': False}
+        )
+
+    rebases = [f"Mes {mes}" if mes >= 0 else "Nunca" for mes in cobertura["mes_rebase"]]
+    tabla = crear_tabla([
+        ("Institución", lambda indices: [instituciones[i] for i in indices], "texto"),
+        ("Saldo Final", por_sofipo[-1], "dinero"),
+        ("Tope IPAB Final", np.full(len(instituciones), cobertura["limite"][-1]), "dinero"),
+        ("Sin Cobertura Final", cobertura["excedente"][-1], "dinero"),
+        ("Rebasa el Tope", lambda indices: [rebases[i] for i in indices], "texto")
+    ])
+    st.dataframe(
+        pagina_tabla(tabla, np.arange(tabla["num_filas"])),
+        width="stretch",
+        hide_index=True,
+        column_config=configuracion_columnas_tabla(tabla)
+    )
+
+def mostrar_estrategia(nombre, estrategia, monto_total, periodo_meses, solo_vista):
+    """
+    Distribución de una estrategia predefinida, sus métricas y el botón para aplicarla
+
+    Args:
+        nombre: Llave de ESTRATEGIAS
+        estrategia: Resultado de calcular_estrategias() para esa estrategia
+        monto_total: Capital total
+        periodo_meses: Plazo de la simulación (para la comparación antes de aplicar)
+        solo_vista: Si el usuario activó el modo A LA VISTA
+    """
+    regla = ESTRATEGIAS[nombre]
+    clave = nombre.lower()
+    distribucion = estrategia["distribucion"]
+
+    st.markdown(f"### {regla['emoji']} Estrategia {nombre} (riesgo {regla['riesgo'].lower()})")
+    st.markdown(f"**Perfil**: {regla['perfil']}")
+    reglas = [f"liquidez mínima {regla['liquidez_minima']}%", f"máximo {regla['tope_institucion']}% por institución"]
+    if regla["plazo_maximo_dias"] == 0:
+        reglas.append("sin plazos fijos")
+    elif regla["plazo_maximo_dias"] is not None:
+        reglas.append(f"plazos de hasta {regla['plazo_maximo_dias']} días")
+    if regla["proteger_ipab"]:
+        reglas.append(f"dentro de la cobertura IPAB (${LIMITE_IPAB_MXN:,})")
+    st.caption("Reglas: " + ", ".join(reglas))
+
+    # Advertencia si quedan fondos sin asignar
+    if estrategia["sin_asignar"] > 0:
+        if solo_vista:
+            st.warning(f"⚠️ Quedan **${estrategia['sin_asignar']:,.0f}** sin asignar. En modo A LA VISTA, los productos a plazo fijo están excluidos. Desactiva el modo A LA VISTA o activa más SOFIPOs para distribuir todo tu capital.")
+        else:
+            st.warning(f"⚠️ Quedan **${estrategia['sin_asignar']:,.0f}** sin asignar por las reglas de esta estrategia o porque excluiste SOFIPOs. Activa más SOFIPOs para distribuir todo tu capital.")
+
+    if not distribucion:
+        st.error("⚠️ No hay recomendaciones disponibles. Has excluido todas las SOFIPOs. Activa al menos una para ver recomendaciones.")
+        return
+
+    st.markdown("**💰 Montos específicos sugeridos:**")
+    for i, dist in enumerate(distribucion, 1):
+        porcentaje = (dist['monto'] / monto_total * 100) if monto_total > 0 else 0
+        col1, col2, col3 = st.columns([2, 2, 1])
+
+        with col1:
+            st.markdown(f"**{i}. {dist['sofipo']}** - {dist['producto']}")
+            st.caption(f"{dist['emoji']} {dist['razon']}")
+
+        with col2:
+            st.metric(
+                "Monto",
+                f"${dist['monto']:,.0f}",
+                delta=f"{porcentaje:.1f}% del total"
+            )
+
+        with col3:
+            st.metric("GAT", f"{dist['tasa']}%")
+
+    st.success(f"🎯 **Con esta estrategia {nombre.lower()} obtendrás:**")
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Tasa ponderada", f"{estrategia['gat_capital']:.2f}%")
+    with col2:
+        st.metric("Ganancia estimada (12 meses)", f"${estrategia['ganancia_total']:,.0f}")
+    with col3:
+        st.metric("Liquidez", f"{estrategia['porcentaje_liquidez']:.0f}%")
+    with col4:
+        st.metric("Score", f"{estrategia['score']:.0f}/100")
+
+    if regla["consideraciones"]:
+        st.info("**Consideraciones:**\n" + "\n".join(f"- {texto}" for texto in regla["consideraciones"]))
+
+    # Botón para aplicar estrategia; se aplica solo cuando el usuario confirma la comparación
+    st.markdown("---")
+    if st.button("🚀 Aplicar esta estrategia a mi simulación", key=f"btn_aplicar_{clave}", type="primary"):
+        st.session_state['propuesta_pendiente'] = f"propuesta_{clave}"
+
+    if revisar_propuesta(f"propuesta_{clave}", distribucion, monto_total, periodo_meses):
+        st.session_state['estrategia_aplicada'] = distribucion
+        st.session_state['aplicar_estrategia'] = True
+        st.rerun()
+
+def mostrar_dashboard_score(resultado):
     """
-    Genera recomendaciones personalizadas estructuradas: alertas críticas y oportunidades
+    Muestra el Dashboard Ejecutivo a partir del resultado de score_portafolio()
     """
-    if analisis is None:
-        return {"alertas": [], "oportunidades": []}
-    
-    alertas = []
-    oportunidades = []
-    
-    # ========================================================================
-    # ALERTAS CRÍTICAS (solo problemas importantes)
-    # ========================================================================
-    
-    # Alerta de concentración extrema
-    if analisis["max_concentracion"] > 85:
-        alertas.append({
-            "tipo": "critico",
-            "emoji": "⚠️",
-            "titulo": "**Concentración Elevada**",
-            "mensaje": f"{analisis['max_concentracion']:.1f}% en una sola institución. Lo ideal es no superar el 40-50% por SOFIPO."
-        })
-    
-    # Alerta de liquidez muy baja
-    if analisis["porcentaje_liquido"] < 20:
-        alertas.append({
-            "tipo": "warning",
-            "emoji": "⚠️",
-            "titulo": "**Baja Liquidez**",
-            "mensaje": f"Solo {analisis['porcentaje_liquido']:.1f}% está disponible inmediatamente. Considera mantener al menos 20-30% en inversiones líquidas para emergencias."
-        })
-    
-    # Alerta de muy poca diversificación
-    if analisis["num_sofipos"] == 1 and analisis["total_invertido"] > 50000:
-        alertas.append({
-            "tipo": "warning",
-            "emoji": "⚠️",
-            "titulo": "**Alta Concentración**",
-            "mensaje": f"Inviertes en una sola SOFIPO. Considera diversificar en al menos 3-4 instituciones para reducir riesgo."
-        })
-    
-    # ========================================================================
-    # OPORTUNIDADES (productos que NO tiene y podrían mejorar rendimiento)
-    # ========================================================================
-    
-    sofipos_actuales = [k for k, v in analisis["concentraciones"].items() if v > 0]
-    
-    # 1. Nu México Cajita Turbo - 15% liquidez inmediata (SIEMPRE disponible)
-    if not any("Nu México" in s and "Turbo" in s for s in sofipos_actuales):
-        oportunidades.append({
-            "orden": 1,
-            "tasa": 15.0,
-            "sofipo": "Nu México",
-            "producto": "Cajita Turbo",
-            "detalle": "15% hasta $25k con liquidez inmediata",
-            "requisito": None
-        })
-    
-    # 2. DiDi Ahorro - 16% primeros $10k (SIEMPRE disponible)
-    if not any("DiDi" in s for s in sofipos_actuales):
-        oportunidades.append({
-            "orden": 2,
-            "tasa": 16.0,
-            "sofipo": "DiDi",
-            "producto": "Ahorro",
-            "detalle": "16% primeros $10k, luego 8.5%",
-            "requisito": None
-        })
-    
-    # 3. Ualá Plus vs Base (depende de si cumple requisitos)
-    if not any("Ualá" in s for s in sofipos_actuales):
-        if cumple_uala:
-            oportunidades.append({
-                "orden": 3,
-                "tasa": 16.0,
-                "sofipo": "Ualá",
-                "producto": "Plus",
-                "detalle": "16% hasta $50k",
-                "requisito": "✅ Cumples requisito de $3k/mes"
-            })
-        else:
-            oportunidades.append({
-                "orden": 7,
-                "tasa": 7.75,
-                "sofipo": "Ualá",
-                "producto": "Base",
-                "detalle": "7.75% hasta $30k",
-                "requisito": None
-            })
-    
-    # 4. Klar Max vs Cuenta (depende de si tiene tarjeta Plus/Platino)
-    if not any("Klar" in s for s in sofipos_actuales):
-        if cumple_klar:
-            oportunidades.append({
-                "orden": 4,
-                "tasa": 15.0,
-                "sofipo": "Klar",
-                "producto": "Inversión Max",
-                "detalle": "15% con liquidez inmediata",
-                "requisito": "✅ Tienes tarjeta Plus/Platino"
-            })
-        else:
-            oportunidades.append({
-                "orden": 8,
-                "tasa": 8.5,
-                "sofipo": "Klar",
-                "producto": "Cuenta",
-                "detalle": "8.5% sin requisitos",
-                "requisito": None
-            })
-    
-    # 5. Mercado Pago - 13% (solo si cumple requisitos)
-    if cumple_mp and not any("Mercado Pago" in s for s in sofipos_actuales):
-        oportunidades.append({
-            "orden": 5,
-            "tasa": 13.0,
-            "sofipo": "Mercado Pago",
-            "producto": "Rendimientos",
-            "detalle": "13% hasta $25k",
-            "requisito": "✅ Cumples requisito de $3k/mes"
-        })
-    
-    # 6. Stori 90 días - 10% plazo (SIEMPRE disponible)
-    if not any("Stori" in s and "90" in s for s in sofipos_actuales):
-        oportunidades.append({
-            "orden": 6,
-            "tasa": 10.0,
-            "sofipo": "Stori",
-            "producto": "90 días",
-            "detalle": "10% a plazo fijo (sin requisitos)",
-            "requisito": None
-        })
-    
-    # Ordenar por tasa descendente y tomar top 3
-    oportunidades.sort(key=lambda x: (-x["tasa"], x["orden"]))
-    oportunidades = oportunidades[:3]
-    
-    return {"alertas": alertas, "oportunidades": oportunidades}
+    clasificacion = resultado["clasificacion"]
+    niveles = resultado["niveles"]
 
-# ============================================================================
-# INTERFAZ PRINCIPAL
-# ============================================================================
+    st.markdown("---")
+    st.markdown("### 📊 Dashboard Ejecutivo")
+    st.caption("🚀 Tu portafolio en 30 segundos")
+
+    col_score, col_msg = st.columns([1, 2])
+
+    with col_score:
+        st.markdown(f"""
+        <div style="text-align: center; padding: 20px; background: {clasificacion['color']}15; border-radius: 10px; border: 2px solid {clasificacion['color']};">
+            <div style="font-size: 48px; font-weight: bold; color: {clasificacion['color']};">
+                {resultado['score']}/100
+            </div>
+            <div style="font-size: 18px; font-weight: bold; color: {clasificacion['color']}; margin-top: 10px;">
+                {clasificacion['semaforo']} {clasificacion['texto']}
+            </div>
+        </div>
+        """, unsafe_allow_html=True)
+
+    with col_msg:
+        st.info(f"**Score de Calidad del Portafolio**\n\n{clasificacion['mensaje']}")
+
+    st.markdown("#### 📋 Desglose del Score")
+
+    for nombre, puntos, maximo, nivel in resultado["componentes"]:
+        col_nombre, col_progreso = st.columns([1, 3])
+        with col_nombre:
+            st.markdown(f"**{nombre}**")
+        with col_progreso:
+            st.progress(puntos / maximo, text=f"{puntos}/{maximo} pts - {nivel}")
+
+    col_kpi1, col_kpi2, col_kpi3, col_kpi4 = st.columns(4)
+
+    with col_kpi1:
+        st.metric(label="📈 GAT Ponderado", value=f"{resultado['gat_ponderado']:.2f}%", delta="Anual")
+
+    with col_kpi2:
+        st.metric(label="🏦 SOFIPOs", value=f"{resultado['num_sofipos']}", delta=niveles["Diversificación"])
+
+    with col_kpi3:
+        st.metric(label="🛡️ IPAB", value=niveles["Protección IPAB"], delta="Protección")
+
+    with col_kpi4:
+        st.metric(label="💧 Liquidez", value=f"{resultado['porcentaje_liquidez']:.0f}%", delta=niveles["Liquidez"])
+
+    st.caption(f"📊 Concentración máxima en una institución: {resultado['concentracion_maxima']:.0f}%")
 
 def main():
+    # El portafolio de la sesión recibe lo que dejaron los widgets en la ejecución anterior
+    estado = estado_portafolio()
+    sincronizar_estado_portafolio(estado)
+    
     # Crear espacio para el toggle en la esquina superior derecha
     col_spacer, col_toggle = st.columns([6, 1])
     
     with col_toggle:
         modo_oscuro = st.toggle("🌙", value=False, key="dark_mode", help="Modo Oscuro")
     
-    # Aplicar estilos según el modo
+    # El modo oscuro solo agrega el marcador; sus estilos ya vienen en la hoja estática
     if modo_oscuro:
-        st.markdown("""
-        <style>
-            /* ============================================ */
-            /* MODO OSCURO COMPLETO */
-            /* ============================================ */
-            
-            /* Fondo principal y contenedor */
-            .stApp, .main, .block-container {
-                background-color: #0d1117 !important;
-                color: #c9d1d9 !important;
-            }
-            
-            /* Headers y títulos */
-            .main-header {
-                color: #f0f6fc !important;
-                text-shadow: 0 0 20px rgba(139, 92, 246, 0.3);
-                text-align: center !important;
-            }
-            
-            .subtitle {
-                color: #8b949e !important;
-                text-align: center !important;
-            }
-            
-            h1, h2, h3, h4, h5, h6 {
-                color: #f0f6fc !important;
-            }
-            
-            /* Texto general */
-            p, span, label, div, li {
-                color: #c9d1d9 !important;
-            }
-            
-            /* Tarjetas de SOFIPO */
-            .sofipo-section {
-                background: #161b22 !important;
-                border: 1px solid #30363d !important;
-                box-shadow: 0 4px 12px rgba(0, 0, 0, 0.3) !important;
-            }
-            
-            .sofipo-section:hover {
-                background: #1c2128 !important;
-                border-color: #667eea !important;
-                box-shadow: 0 8px 24px rgba(102, 126, 234, 0.2) !important;
-            }
-            
-            /* Métricas */
-            [data-testid="stMetric"] {
-                background-color: #161b22 !important;
-                border: 1px solid #30363d !important;
-                border-radius: 12px !important;
-                padding: 1rem !important;
-            }
-            
-            [data-testid="stMetricValue"] {
-                color: #58a6ff !important;
-            }
-            
-            [data-testid="stMetricLabel"] {
-                color: #8b949e !important;
-            }
-            
-            [data-testid="stMetricDelta"] {
-                color: #3fb950 !important;
-            }
-            
-            .metric-card {
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%) !important;
-            }
-            
-            /* Inputs - Mejorados con brillo en focus */
-            input, textarea, select {
-                background-color: #0d1117 !important;
-                color: #c9d1d9 !important;
-                border: 2px solid #30363d !important;
-                transition: all 0.3s ease !important;
-            }
-            
-            input:focus, textarea:focus, select:focus {
-                border-color: #58a6ff !important;
-                box-shadow: 0 0 0 4px rgba(88, 166, 255, 0.15), 0 0 12px rgba(88, 166, 255, 0.3) !important;
-                outline: none !important;
-                transform: translateY(-1px) !important;
-            }
-            
-            .stNumberInput input {
-                background-color: #0d1117 !important;
-                color: #c9d1d9 !important;
-                border: 2px solid #30363d !important;
-                transition: all 0.3s ease !important;
-            }
-            
-            .stNumberInput input:focus {
-                border-color: #58a6ff !important;
-                box-shadow: 0 0 0 4px rgba(88, 166, 255, 0.15), 0 0 12px rgba(88, 166, 255, 0.3) !important;
-            }
-            
-            /* Selectbox */
-            [data-baseweb="select"] {
-                background-color: #0d1117 !important;
-            }
-            
-            [data-baseweb="select"] > div {
-                background-color: #0d1117 !important;
-                border-color: #30363d !important;
-            }
-            
-            /* Checkbox y Toggle */
-            [data-testid="stCheckbox"] label {
-                color: #c9d1d9 !important;
-            }
-            
-            /* Radio buttons */
-            [data-testid="stRadio"] label {
-                color: #c9d1d9 !important;
-            }
-            
-            /* Tabs - Mejorados con mejor contraste */
-            .stTabs [data-baseweb="tab-list"] {
-                background-color: #161b22 !important;
-                border-radius: 12px !important;
-                padding: 0.5rem !important;
-                border: 1px solid #30363d !important;
-            }
-            
-            .stTabs [data-baseweb="tab"] {
-                background-color: transparent !important;
-                color: #8b949e !important;
-                border-radius: 10px !important;
-                padding: 0.75rem 1.5rem !important;
-                font-weight: 600 !important;
-                transition: all 0.3s ease !important;
-            }
-            
-            .stTabs [data-baseweb="tab"]:hover {
-                background-color: #21262d !important;
-                color: #c9d1d9 !important;
-                transform: translateY(-2px) !important;
-            }
-            
-            .stTabs [aria-selected="true"] {
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%) !important;
-                color: #ffffff !important;
-                box-shadow: 0 4px 12px rgba(102, 126, 234, 0.4), 0 0 20px rgba(102, 126, 234, 0.2) !important;
-                transform: scale(1.02) !important;
-            }
-            
-            /* Expander - Diseño profesional */
-            [data-testid="stExpander"] {
-                background-color: #0d1117 !important;
-                border: 1px solid #30363d !important;
-                border-radius: 12px !important;
-                margin-bottom: 1rem !important;
-                transition: all 0.3s ease !important;
-            }
-            
-            [data-testid="stExpander"] summary {
-                background-color: #161b22 !important;
-                color: #c9d1d9 !important;
-                padding: 1rem !important;
-                border-radius: 12px !important;
-                font-weight: 600 !important;
-                cursor: pointer !important;
-            }
-            
-            [data-testid="stExpander"] summary:hover {
-                background-color: #1c2128 !important;
-                color: #58a6ff !important;
-            }
-            
-            [data-testid="stExpander"]:hover {
-                border-color: #58a6ff !important;
-                box-shadow: 0 4px 12px rgba(88, 166, 255, 0.15) !important;
-            }
-            
-            [data-testid="stExpander"] > div:last-child {
-                background-color: #0d1117 !important;
-                padding: 1rem !important;
-            }
-            
-            /* DataFrames y Tablas - Diseño profesional sin fondos blancos */
-            [data-testid="stDataFrame"] {
-                background-color: transparent !important;
-                border-radius: 12px !important;
-                overflow: hidden !important;
-            }
-            
-            /* Iframe de la tabla (contiene Glide Data Grid) */
-            [data-testid="stDataFrame"] iframe {
-                background-color: #0d1117 !important;
-                border: 1px solid #30363d !important;
-                border-radius: 8px !important;
-            }
-            
-            /* Estilo para tablas HTML estándar si las hay */
-            .dataframe {
-                background-color: #0d1117 !important;
-                border: 1px solid #30363d !important;
-                border-radius: 8px !important;
-                overflow: hidden !important;
-            }
-            
-            .dataframe thead tr th {
-                background-color: #161b22 !important;
-                color: #58a6ff !important;
-                border-bottom: 2px solid #30363d !important;
-                font-weight: 600 !important;
-                padding: 12px 16px !important;
-                text-align: left !important;
-            }
-            
-            .dataframe tbody tr {
-                background-color: #0d1117 !important;
-                border-bottom: 1px solid #21262d !important;
-                transition: background-color 0.2s ease !important;
-            }
-            
-            .dataframe tbody tr:hover {
-                background-color: #161b22 !important;
-            }
-            
-            .dataframe tbody tr td {
-                color: #c9d1d9 !important;
-                background-color: transparent !important;
-                padding: 10px 16px !important;
-                border-right: 1px solid #21262d !important;
-            }
-            
-            .dataframe tbody tr td:last-child {
-                border-right: none !important;
-            }
-            
-            /* Alertas y cajas de mensaje */
-            .stAlert, [data-testid="stNotification"] {
-                background-color: #161b22 !important;
-                border: 1px solid #30363d !important;
-                color: #c9d1d9 !important;
-            }
-            
-            .warning-box {
-                background-color: #3d2a00 !important;
-                border-left: 4px solid #f59e0b !important;
-                color: #fbbf24 !important;
-            }
-            
-            .success-box {
-                background-color: #002d1a !important;
-                border-left: 4px solid #10b981 !important;
-                color: #34d399 !important;
-            }
-            
-            .info-box {
-                background-color: #001d3d !important;
-                border-left: 4px solid #3b82f6 !important;
-                color: #60a5fa !important;
-            }
-            
-            /* Divisores */
-            hr {
-                border-color: #30363d !important;
-                background: linear-gradient(90deg, transparent, #30363d, transparent) !important;
-            }
-            
-            /* Botones */
-            .stButton > button {
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%) !important;
-                color: white !important;
-                border: none !important;
-            }
-            
-            .stButton > button:hover {
-                background: linear-gradient(135deg, #5568d3 0%, #643a8d 100%) !important;
-                box-shadow: 0 4px 12px rgba(102, 126, 234, 0.4) !important;
-            }
-            
-            /* Sidebar (si se usa) */
-            [data-testid="stSidebar"] {
-                background-color: #0d1117 !important;
-            }
-            
-            [data-testid="stSidebarNav"] {
-                background-color: #161b22 !important;
-            }
-            
-            /* Gráficas Plotly - Profesional y limpio */
-            [data-testid="stPlotlyChart"] {
-                background-color: transparent !important;
-                border-radius: 12px !important;
-                padding: 1rem !important;
-            }
-            
-            /* Contenedor de gráfica con borde sutil */
-            .js-plotly-plot {
-                border: 1px solid #30363d !important;
-                border-radius: 12px !important;
-                overflow: hidden !important;
-            }
-            
-            /* Modebar (botones de interacción) */
-            .modebar-container, .modebar {
-                background-color: rgba(22, 27, 34, 0.9) !important;
-            }
-            
-            .modebar-btn {
-                color: #8b949e !important;
-            }
-            
-            .modebar-btn:hover {
-                background-color: #30363d !important;
-                color: #58a6ff !important;
-            }
-            
-            /* Caption y textos pequeños */
-            .stCaption, small {
-                color: #8b949e !important;
-            }
-            
-            /* Footer */
-            footer {
-                background-color: #0d1117 !important;
-                color: #8b949e !important;
-            }
-            
-            /* Markdown y código */
-            code {
-                background-color: #161b22 !important;
-                color: #ff7b72 !important;
-                border: 1px solid #30363d !important;
-            }
-            
-            /* Progress bars */
-            [data-testid="stProgressBar"] > div > div {
-                background-color: #667eea !important;
-            }
-            
-            /* Spinner */
-            [data-testid="stSpinner"] > div {
-                border-color: #667eea transparent transparent transparent !important;
-            }
-            
-            /* Markdown containers */
-            .element-container {
-                color: #c9d1d9 !important;
-            }
-            
-            /* Info, warning, error, success messages de Streamlit */
-            .stInfo {
-                background-color: #001d3d !important;
-                color: #60a5fa !important;
-            }
-            
-            .stWarning {
-                background-color: #3d2a00 !important;
-                color: #fbbf24 !important;
-            }
-            
-            .stError {
-                background-color: #3d0000 !important;
-                color: #ff7b72 !important;
-            }
-            
-            .stSuccess {
-                background-color: #002d1a !important;
-                color: #34d399 !important;
-            }
-            
-            /* Links */
-            a {
-                color: #58a6ff !important;
-            }
-            
-            a:hover {
-                color: #79c0ff !important;
-            }
-            
-            /* Badge */
-            .badge {
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%) !important;
-                color: white !important;
-                box-shadow: 0 2px 10px rgba(102, 126, 234, 0.4) !important;
-            }
-            
-            /* Efectos adicionales de hover para mejor UX */
-            .stButton > button:active {
-                transform: scale(0.98) !important;
-            }
-            
-            /* Scrollbar personalizado para modo oscuro */
-            ::-webkit-scrollbar {
-                width: 12px;
-                height: 12px;
-            }
-            
-            ::-webkit-scrollbar-track {
-                background: #0d1117 !important;
-            }
-            
-            ::-webkit-scrollbar-thumb {
-                background: #30363d !important;
-                border-radius: 6px !important;
-                border: 2px solid #0d1117 !important;
-            }
-            
-            ::-webkit-scrollbar-thumb:hover {
-                background: #484f58 !important;
-            }
-            
-            /* Animaciones suaves */
-            * {
-                transition: background-color 0.2s ease, border-color 0.2s ease !important;
-            }
-            
-            /* Selectbox mejorado */
-            [data-baseweb="select"] > div:hover {
-                border-color: #58a6ff !important;
-                box-shadow: 0 0 0 2px rgba(88, 166, 255, 0.1) !important;
-            }
-            
-            /* Mejora visual del toggle de modo oscuro */
-            [data-testid="stCheckbox"] input:checked ~ div {
-                background-color: #667eea !important;
-            }
-        </style>
-        """, unsafe_allow_html=True)
+        st.markdown(marcador_tema(True), unsafe_allow_html=True)
     
     # Encabezado centrado (v2.0 - Simplificado)
     st.markdown('<h1 class="main-header">💰 Simulador de Inversiones</h1>', unsafe_allow_html=True)
@@ -1716,7 +4451,54 @@ def main():
         if "ultima_simulacion" in st.session_state:
             sim = st.session_state["ultima_simulacion"]
             st.info(f"ℹ️ **Última simulación guardada:** {sim['fecha_guardado']} | Monto: ${sim['monto_total']:,.0f} | Inversiones: {len(sim['inversiones'])}")
-    
+
+    # ========================================================================
+    # COMPARAR VARIAS SIMULACIONES GUARDADAS
+    # ========================================================================
+
+    with st.expander("📚 Comparar simulaciones guardadas", expanded=False):
+        st.markdown("**Sube varios archivos JSON guardados para compararlos lado a lado** (no modifica tu simulación actual)")
+
+        archivos_comparar = st.file_uploader(
+            "📂 Simulaciones a comparar",
+            type=['json'],
+            accept_multiple_files=True,
+            key="archivos_comparar",
+            label_visibility="collapsed"
+        )
+
+        if archivos_comparar:
+            barra_progreso = st.progress(0.0, text="Evaluando simulaciones...")
+            filas_comparacion = []
+            errores_comparacion = []
+
+            for filas, errores, procesadas in iterar_comparacion_simulaciones(archivos_comparar):
+                filas_comparacion.extend(filas)
+                errores_comparacion.extend(errores)
+                barra_progreso.progress(procesadas / len(archivos_comparar), text=f"Evaluadas {procesadas} de {len(archivos_comparar)}")
+
+            barra_progreso.empty()
+
+            if filas_comparacion:
+                df_comparacion = pd.DataFrame(filas_comparacion).sort_values("Score", ascending=False)
+                st.dataframe(
+                    df_comparacion,
+                    width="stretch",
+                    hide_index=True,
+                    column_config={
+                        "Invertido": st.column_config.NumberColumn(format="dollar"),
+                        "Ganancia Total": st.column_config.NumberColumn(format="dollar"),
+                        "GAT Ponderado": st.column_config.NumberColumn(format="%.2f%%"),
+                        "Cobertura IPAB": st.column_config.NumberColumn(format="%.0f%%"),
+                        "Rebasa IPAB (mes)": st.column_config.NumberColumn(help="Primer mes en que alguna institución pasa de 25,000 UDIs (vacío: nunca)"),
+                        "Liquidez": st.column_config.NumberColumn(format="%.0f%%"),
+                        "Score": st.column_config.ProgressColumn(min_value=0, max_value=100, format="%d")
+                    }
+                )
+
+            for error in errores_comparacion:
+                st.warning(f"⚠️ {error}")
+
     st.divider()
     # ========================================================================
     # APLICAR ESTRATEGIA OBJETIVO SI ESTÁ PENDIENTE
@@ -1728,40 +4510,9 @@ def main():
         # SIEMPRE actualizar el capital cuando se aplica una estrategia
         st.session_state["monto_total_input"] = estrategia["capital"]
         
-        # Limpiar selecciones previas
-        for sofipo in ["Nu México", "DiDi", "Stori", "Klar", "Ualá", "Mercado Pago", "Finsus"]:
-            st.session_state[f"check_{sofipo}"] = False
-        
-        # Aplicar cada producto de la distribución
-        for item in estrategia["distribucion"]:
-            sofipo_nombre = item["sofipo"]
-            producto_nombre = item["producto"]
-            monto = item["monto"]
-            
-            # Activar el checkbox de la SOFIPO
-            st.session_state[f"check_{sofipo_nombre}"] = True
-            
-            # Validar que el producto existe en esta SOFIPO
-            if sofipo_nombre in SOFIPOS_DATA:
-                productos_disponibles = list(SOFIPOS_DATA[sofipo_nombre]['productos'].keys())
-                
-                # Si el producto existe exactamente, usarlo
-                if producto_nombre in productos_disponibles:
-                    producto_valido = producto_nombre
-                else:
-                    # Si no existe, intentar encontrar uno similar o usar el primero
-                    producto_valido = productos_disponibles[0]
-                    # Buscar por coincidencia parcial
-                    for prod in productos_disponibles:
-                        if producto_nombre.lower() in prod.lower() or prod.lower() in producto_nombre.lower():
-                            producto_valido = prod
-                            break
-                
-                # Seleccionar el producto validado
-                st.session_state[f"prod_{sofipo_nombre}"] = producto_valido
-                
-                # Asignar el monto con el nombre validado
-                st.session_state[f"monto_{sofipo_nombre}_{producto_valido}"] = int(monto)
+        # Reemplazar la selección por la distribución (items que caen en el mismo producto se suman)
+        aplicar_inversiones_estado(estado, inversiones_desde_estrategia(estrategia["distribucion"]))
+        escribir_widgets_portafolio(estado)
         
         # Limpiar la estrategia pendiente
         del st.session_state["estrategia_objetivo_pendiente"]
@@ -1846,26 +4597,26 @@ def main():
         
         with col_pref1:
             st.markdown("**🏦 ¿Qué SOFIPOs quieres usar?**")
-            usa_nu_obj = st.checkbox("💜 Nu México", value=True, key="usa_nu_obj", help="15% hasta $25k")
-            usa_didi_obj = st.checkbox("🚗 DiDi", value=True, key="usa_didi_obj", help="16% los primeros $10k")
-            usa_klar_obj = st.checkbox("💙 Klar", value=True, key="usa_klar_obj", help="15% con Klar Plus")
-            usa_uala_obj = st.checkbox("🔴 Ualá", value=True, key="usa_uala_obj", help="16% hasta $50k con Plus")
+            usa_nu_obj = st.checkbox("💜 Nu México", value=True, key="usa_nu_obj", help=ayuda_tasas_sofipo("Nu México"))
+            usa_didi_obj = st.checkbox("🚗 DiDi", value=True, key="usa_didi_obj", help=ayuda_tasas_sofipo("DiDi"))
+            usa_klar_obj = st.checkbox("💙 Klar", value=True, key="usa_klar_obj", help=ayuda_tasas_sofipo("Klar"))
+            usa_uala_obj = st.checkbox("🔴 Ualá", value=True, key="usa_uala_obj", help=ayuda_tasas_sofipo("Ualá"))
         
         with col_pref2:
             st.markdown("**📦 Más opciones**")
-            usa_mp_obj = st.checkbox("💛 Mercado Pago", value=True, key="usa_mp_obj", help="13% con $3k/mes")
-            usa_stori_obj = st.checkbox("🟠 Stori", value=True, key="usa_stori_obj", help="Hasta 11% (plazo fijo)")
-            usa_finsus_obj = st.checkbox("🟢 Finsus", value=True, key="usa_finsus_obj", help="10.09% (plazo fijo)")
+            usa_mp_obj = st.checkbox("💛 Mercado Pago", value=True, key="usa_mp_obj", help=ayuda_tasas_sofipo("Mercado Pago"))
+            usa_stori_obj = st.checkbox("🟠 Stori", value=True, key="usa_stori_obj", help=ayuda_tasas_sofipo("Stori"))
+            usa_finsus_obj = st.checkbox("🟢 Finsus", value=True, key="usa_finsus_obj", help=ayuda_tasas_sofipo("Finsus"))
         
         st.markdown("**✅ ¿Cumples algún requisito especial?**")
         col_req1, col_req2 = st.columns(2)
         
         with col_req1:
             cumple_klar_plus_obj = st.checkbox("✨ Klar Plus/Platino", value=False, key="cumple_klar_plus_obj")
-            cumple_uala_plus_obj = st.checkbox("💳 Ualá Plus ($3k/mes)", value=False, key="cumple_uala_plus_obj")
+            cumple_uala_plus_obj = st.checkbox(f"💳 Ualá Plus ({texto_requisito(producto_con_requisito('Ualá')[1])})", value=False, key="cumple_uala_plus_obj")
         
         with col_req2:
-            cumple_mercadopago_obj = st.checkbox("💰 Mercado Pago ($3k/mes)", value=False, key="cumple_mercadopago_obj")
+            cumple_mercadopago_obj = st.checkbox(f"💰 Mercado Pago ({texto_requisito(producto_con_requisito('Mercado Pago')[1])})", value=False, key="cumple_mercadopago_obj")
         
         st.markdown("**💧 ¿Necesitas tu dinero disponible en cualquier momento?**")
         solo_vista_obj = st.checkbox(
@@ -1925,118 +4676,35 @@ def main():
         # Mostrar resultados si ya se calculó
         if st.session_state.get("mostrar_resultado_objetivo", False):
             
-            # Función para calcular distribución ÓPTIMA
-            def calcular_tasa_ponderada_real_obj(monto_prueba):
-                productos_disponibles = []
-                
-                if usa_nu_obj:
-                    productos_disponibles.append({"sofipo": "Nu México", "producto": "Cajita Turbo", "tasa": 15.0, "maximo": 25000, "tipo": "vista", "requisito": None})
-                    productos_disponibles.append({"sofipo": "Nu México", "producto": "Dinero en Cajita", "tasa": 7.5, "maximo": None, "tipo": "vista", "requisito": None})
-                
-                if usa_didi_obj:
-                    productos_disponibles.append({"sofipo": "DiDi", "producto": "DiDi Ahorro (primeros $10k)", "tasa": 16.0, "maximo": 10000, "tipo": "vista", "requisito": None})
-                    productos_disponibles.append({"sofipo": "DiDi", "producto": "DiDi Ahorro (después de $10k)", "tasa": 8.5, "maximo": None, "tipo": "vista", "requisito": None})
-                
-                if usa_stori_obj and not solo_vista_obj:
-                    productos_disponibles.append({"sofipo": "Stori", "producto": "28 días", "tasa": 9.5, "maximo": None, "tipo": "plazo", "requisito": None})
-                    productos_disponibles.append({"sofipo": "Stori", "producto": "90 días", "tasa": 10.0, "maximo": None, "tipo": "plazo", "requisito": None})
-                    productos_disponibles.append({"sofipo": "Stori", "producto": "180 días", "tasa": 10.5, "maximo": None, "tipo": "plazo", "requisito": None})
-                    productos_disponibles.append({"sofipo": "Stori", "producto": "360 días", "tasa": 11.0, "maximo": None, "tipo": "plazo", "requisito": None})
-                
-                if usa_klar_obj:
-                    productos_disponibles.append({"sofipo": "Klar", "producto": "Cuenta (Base)", "tasa": 8.5, "maximo": None, "tipo": "vista", "requisito": None})
-                    if cumple_klar_plus_obj:
-                        productos_disponibles.append({"sofipo": "Klar", "producto": "Inversión Flexible Max", "tasa": 15.0, "maximo": None, "tipo": "vista", "requisito": "Klar Plus"})
-                
-                if usa_uala_obj:
-                    productos_disponibles.append({"sofipo": "Ualá", "producto": "Cuenta Base", "tasa": 7.75, "maximo": 30000, "tipo": "vista", "requisito": None})
-                    if cumple_uala_plus_obj:
-                        productos_disponibles.append({"sofipo": "Ualá", "producto": "Cuenta Plus", "tasa": 16.0, "maximo": 50000, "tipo": "vista", "requisito": "Ualá Plus"})
-                
-                if usa_mp_obj:
-                    if cumple_mercadopago_obj:
-                        productos_disponibles.append({"sofipo": "Mercado Pago", "producto": "Cuenta Remunerada", "tasa": 13.0, "maximo": 25000, "tipo": "vista", "requisito": "$3k/mes"})
-                    else:
-                        productos_disponibles.append({"sofipo": "Mercado Pago", "producto": "Cuenta Remunerada Base", "tasa": 10.0, "maximo": None, "tipo": "vista", "requisito": None})
-                
-                if usa_finsus_obj and not solo_vista_obj:
-                    productos_disponibles.append({"sofipo": "Finsus", "producto": "Plazo Fijo 30 días", "tasa": 8.09, "maximo": None, "tipo": "plazo", "requisito": None})
-                    productos_disponibles.append({"sofipo": "Finsus", "producto": "Plazo Fijo 90 días", "tasa": 8.39, "maximo": None, "tipo": "plazo", "requisito": None})
-                    productos_disponibles.append({"sofipo": "Finsus", "producto": "Plazo Fijo 360 días", "tasa": 10.09, "maximo": None, "tipo": "plazo", "requisito": None})
-                
-                if not productos_disponibles:
-                    return 0, []
-                
-                productos_ordenados = sorted(productos_disponibles, key=lambda x: x["tasa"], reverse=True)
-                
-                distribucion = []
-                saldo = monto_prueba
-                
-                for producto in productos_ordenados:
-                    if saldo <= 0:
-                        break
-                    
-                    if producto["maximo"] is not None:
-                        monto_asignar = min(producto["maximo"], saldo)
-                    else:
-                        monto_asignar = saldo
-                    
-                    if monto_asignar > 0:
-                        distribucion.append({
-                            "sofipo": producto["sofipo"],
-                            "producto": producto["producto"],
-                            "monto": monto_asignar,
-                            "tasa": producto["tasa"],
-                            "tipo": producto["tipo"],
-                            "requisito": producto["requisito"]
-                        })
-                        saldo -= monto_asignar
-                        
-                        if producto["maximo"] is None:
-                            break
-                
-                if distribucion:
-                    rendimiento_total = 0
-                    dias_simulacion = 12 * 30
-                    for d in distribucion:
-                        interes = calcular_interes_compuesto(d["monto"], d["tasa"], dias_simulacion)
-                        rendimiento_total += interes
-                    tasa_ponderada = (rendimiento_total / monto_prueba) * 100 if monto_prueba > 0 else 0
-                    return tasa_ponderada, distribucion
-                else:
-                    return 0, []
+            preferencias_obj = {
+                "usa_nu": usa_nu_obj,
+                "usa_didi": usa_didi_obj,
+                "usa_stori": usa_stori_obj,
+                "usa_klar": usa_klar_obj,
+                "usa_uala": usa_uala_obj,
+                "usa_mp": usa_mp_obj,
+                "usa_finsus": usa_finsus_obj,
+                "cumple_klar_plus": cumple_klar_plus_obj,
+                "cumple_uala_plus": cumple_uala_plus_obj,
+                "cumple_mercadopago": cumple_mercadopago_obj,
+                "solo_vista": solo_vista_obj
+            }
             
-            # Calcular
-            tasa_referencia, _ = calcular_tasa_ponderada_real_obj(100000)
+            # Calcular en segundo plano
+            llave_objetivo = enviar_tarea(
+                resolver_capital_objetivo, ganancia_anual_objetivo, preferencias_obj,
+                huella=huella_productos(productos_elegibles(preferencias_obj))
+            )
+            resultado_objetivo = resultado_tarea(llave_objetivo)
             
-            if tasa_referencia == 0:
+            if resultado_objetivo is None:
+                mostrar_progreso_tarea(llave_objetivo, "Calculando el capital necesario...")
+            elif resultado_objetivo["tasa_referencia"] == 0:
                 st.error("⚠️ No hay SOFIPOs disponibles con tu configuración. Activa al menos una SOFIPO.")
             else:
-                capital_estimado = (ganancia_anual_objetivo / tasa_referencia) * 100
-                capital_min = max(1000, capital_estimado * 0.5)
-                capital_max = capital_estimado * 2
-                capital_necesario = capital_estimado
-                iteraciones = 0
-                max_iteraciones = 30
-                
-                while iteraciones < max_iteraciones and capital_max - capital_min > 10:
-                    capital_prueba = (capital_min + capital_max) / 2
-                    tasa_ponderada, dist = calcular_tasa_ponderada_real_obj(capital_prueba)
-                    ganancia_estimada = capital_prueba * tasa_ponderada / 100
-                    diferencia = abs(ganancia_estimada - ganancia_anual_objetivo)
-                    
-                    if diferencia < 10:
-                        capital_necesario = capital_prueba
-                        break
-                    elif ganancia_estimada < ganancia_anual_objetivo:
-                        capital_min = capital_prueba
-                    else:
-                        capital_max = capital_prueba
-                    
-                    capital_necesario = capital_prueba
-                    iteraciones += 1
-                
-                tasa_real, distribucion_final = calcular_tasa_ponderada_real_obj(capital_necesario)
+                capital_necesario = resultado_objetivo["capital"]
+                tasa_real = resultado_objetivo["tasa"]
+                distribucion_final = resultado_objetivo["distribucion"]
                 ganancia_anual_real = capital_necesario * tasa_real / 100
                 ganancia_mensual_real = ganancia_anual_real / 12
                 
@@ -2085,21 +4753,26 @@ def main():
                         
                         st.markdown("")  # Espacio
                 
-                if capital_necesario > 200000:
-                    st.warning("⚠️ **Capital alto**: Recuerda que el IPAB protege hasta $200k por institución.")
+                if capital_necesario > LIMITE_IPAB_MXN:
+                    st.warning(f"⚠️ **Capital alto**: Recuerda que el IPAB protege hasta ${LIMITE_IPAB_MXN:,} por institución (25,000 UDIs).")
                 
                 # Botón para aplicar la estrategia
                 st.markdown("---")
                 col_btn1, col_btn2 = st.columns([3, 1])
                 with col_btn1:
                     if st.button("🚀 Aplicar esta estrategia y ver simulación completa", use_container_width=True, type="primary", key="btn_aplicar_obj"):
-                        st.session_state["estrategia_objetivo_pendiente"] = {
-                            "capital": int(capital_necesario),
-                            "distribucion": distribucion_final,
-                            "nombre": "Estrategia desde Objetivo"
-                        }
-                        st.session_state["modo_simulador"] = "distribucion"
-                        st.rerun()
+                        st.session_state["propuesta_pendiente"] = "propuesta_objetivo"
+                
+                # La calculadora proyecta a 12 meses; se compara con lo capturado en el simulador
+                if revisar_propuesta("propuesta_objetivo", distribucion_final,
+                                     st.session_state.get("monto_total_input", 50000), 12):
+                    st.session_state["estrategia_objetivo_pendiente"] = {
+                        "capital": int(capital_necesario),
+                        "distribucion": distribucion_final,
+                        "nombre": "Estrategia desde Objetivo"
+                    }
+                    st.session_state["modo_simulador"] = "distribucion"
+                    st.rerun()
         
         st.stop()  # No mostrar el resto del flujo en modo objetivo
     
@@ -2133,14 +4806,14 @@ def main():
             st.success("💡 ¡Excelente capital! Podrás diversificar en múltiples instituciones y maximizar ganancias")
     
     with col2:
-        periodo_options = [3, 6, 12, 24]
+        periodo_options = list(PLAZOS_ESTANDAR_MESES)
         default_periodo = st.session_state.get("periodo_simulacion", 12)
         default_index = periodo_options.index(default_periodo) if default_periodo in periodo_options else 2
         periodo_simulacion = st.selectbox(
             "📅 ¿Por cuánto tiempo?",
             options=periodo_options,
             index=default_index,
-            format_func=lambda x: f"{x} meses ({x//12} año)" if x >= 12 else f"{x} meses",
+            format_func=lambda x: f"{x} meses ({formato_plazo(x)})" if x >= 12 else formato_plazo(x),
             help="El plazo en el que quieres ver crecer tu inversión",
             key="periodo_simulacion"
         )
@@ -2152,8 +4825,10 @@ def main():
             st.caption("⏰ Medio año - Balance entre tiempo y ganancias")
         elif periodo_simulacion == 12:
             st.caption("⏰ 1 año completo - Recomendado para ver el GAT real")
+        elif periodo_simulacion <= 60:
+            st.caption(f"⏰ {formato_plazo(periodo_simulacion)} - Maximiza el interés compuesto")
         else:
-            st.caption("⏰ 2 años - Maximiza el interés compuesto")
+            st.caption(f"⏰ {formato_plazo(periodo_simulacion)} - Horizonte de largo plazo (retiro). Las tasas reales cambiarán; úsalo como referencia")
     
     with col3:
         # Selector de escenario de tasas (sin key para forzar recálculo inmediato)
@@ -2173,6 +4848,19 @@ def main():
             st.caption("📉 Bajan 0.25% cada 3 meses")
         else:
             st.caption("📉 Bajan 0.5% cada 3 meses")
+        
+        # Vista después de impuestos (la ganancia neta ya se calcula junto con la bruta)
+        anio_isr, retencion_isr = tasa_retencion_isr()
+        st.toggle(
+            "🧾 Después de impuestos (ISR)",
+            key="modo_isr",
+            help=f"Retención {anio_isr}: {retencion_isr * 100:.2f}% anual sobre el capital, devengada diario"
+        )
+        st.toggle(
+            "📉 En pesos de hoy (GAT real)",
+            key="modo_real",
+            help="Descuenta la inflación con la serie de referencia de la UDI (valores interpolados entre los de inicio de año) y una inflación supuesta después del último dato"
+        )
     
     # Calculadora rápida en una nueva fila
     st.markdown("---")
@@ -2180,10 +4868,10 @@ def main():
     
     with col_calc1:
         st.markdown("📊 **Ganancia estimada:**")
-        tasa_promedio = 13.5  # Promedio de mercado
+        tasa_promedio = tasa_promedio_mercado()
         ganancia_estimada = monto_total * (tasa_promedio / 100) * (periodo_simulacion / 12)
         st.metric(
-            label="Con tasa promedio ~13.5%",
+            label=f"Con tasa promedio ~{tasa_promedio:.1f}%",
             value=f"${ganancia_estimada:,.0f}",
             delta=f"+{(ganancia_estimada/monto_total*100):.1f}%" if monto_total > 0 else "0%"
         )
@@ -2220,13 +4908,7 @@ def main():
             
             # Mostrar total de aportaciones
             if frecuencia_aportacion := st.session_state.get("frecuencia_aportacion", "Mensual"):
-                if frecuencia_aportacion == "Semanal":
-                    num_aportaciones = int(periodo_simulacion * 4.33)
-                elif frecuencia_aportacion == "Quincenal":
-                    num_aportaciones = periodo_simulacion * 2
-                else:  # Mensual
-                    num_aportaciones = periodo_simulacion
-                
+                num_aportaciones = int(periodos_aportacion(frecuencia_aportacion, periodo_simulacion).sum())
                 total_aportaciones = aportacion_monto * num_aportaciones
                 st.caption(f"📊 Total a aportar: **${total_aportaciones:,}** en {num_aportaciones} aportaciones")
         
@@ -2266,12 +4948,24 @@ def main():
             elif estrategia_aportacion == "Solo productos de mayor rendimiento":
                 st.caption("🚀 Priorizará las mejores tasas disponibles")
             else:
-                st.caption("🤖 El sistema distribuirá inteligentemente")
+                st.caption("🤖 Cada aportación va a la mejor tasa con espacio, sin pasar de límites ni de la cobertura IPAB")
+                liquidez_objetivo_aportaciones = st.slider(
+                    "💧 Liquidez mínima a mantener",
+                    min_value=0,
+                    max_value=100,
+                    value=0,
+                    step=10,
+                    format="%d%%",
+                    key="liquidez_objetivo_aportaciones",
+                    help="Si tu dinero a la vista baja de este porcentaje, las aportaciones van primero a productos a la vista"
+                )
     else:
         # Valores por defecto cuando no hay aportaciones
         aportacion_monto = 0
         frecuencia_aportacion = "Mensual"
         estrategia_aportacion = "Misma distribución que capital inicial"
+    if estrategia_aportacion != "Distribución inteligente automática":
+        liquidez_objetivo_aportaciones = None
     
     st.divider()
     
@@ -2289,36 +4983,41 @@ def main():
         Estos te darán acceso a tasas de interés más altas, pero requieren ciertos compromisos:
         """)
         
+        # Tasas, límites y montos de cada requisito salen del catálogo
+        nombre_klar, info_klar = producto_con_requisito("Klar")
+        _, info_mp = producto_con_requisito("Mercado Pago")
+        nombre_uala, info_uala = producto_con_requisito("Ualá")
+        
         col1, col2 = st.columns(2)
         
         with col1:
             cumple_klar_plus = st.checkbox(
                 "💳 Tengo Klar Plus o Platino",
                 value=st.session_state.get("cumple_klar_plus", False),
-                help="Si tienes una membresía pagada de Klar (Plus o Platino), marca esto. Te da acceso a 15% de interés sin límite.",
+                help=f"Si tienes una membresía pagada de Klar (Plus o Platino), marca esto. Te da acceso a {mejora_por_requisito('Klar')}.",
                 key="cumple_klar_plus"
             )
             if cumple_klar_plus:
-                st.caption("✅ Tendrás acceso a Klar Max (15% sin límite)")
+                st.caption(f"✅ Tendrás acceso a {nombre_klar}: {mejora_por_requisito('Klar')}")
             
             cumple_mercadopago = st.checkbox(
-                "💰 Puedo depositar $3,000/mes en Mercado Pago",
+                f"💰 Puedo depositar {texto_requisito(info_mp, completo=True)} en Mercado Pago",
                 value=st.session_state.get("cumple_mercadopago", False),
-                help="¿Puedes depositar o recibir al menos $3,000 pesos al mes en tu cuenta de Mercado Pago? Si sí, obtendrás 13% en vez de 10%",
+                help=f"¿Puedes depositar o recibir al menos {texto_requisito(info_mp, completo=True)} en tu cuenta de Mercado Pago? Si sí, obtendrás {mejora_por_requisito('Mercado Pago')}",
                 key="cumple_mercadopago"
             )
             if cumple_mercadopago:
-                st.caption("✅ Obtendrás 13% (en vez de 10%)")
+                st.caption(f"✅ Obtendrás {mejora_por_requisito('Mercado Pago')}")
         
         with col2:
             cumple_uala_plus = st.checkbox(
-                "💸 Gasto $3k/mes con tarjeta Ualá O tengo mi nómina ahí",
+                f"💸 Gasto {texto_requisito(info_uala)} con tarjeta Ualá O tengo mi nómina ahí",
                 value=st.session_state.get("cumple_uala_plus", False),
-                help="Si gastas $3,000 al mes con las tarjetas de Ualá, o si recibes tu sueldo ahí, marca esto. Te da 16% hasta $50,000",
+                help=f"Si gastas {texto_requisito(info_uala, completo=True)} con las tarjetas de Ualá, o si recibes tu sueldo ahí, marca esto. Te da {mejora_por_requisito('Ualá')}",
                 key="cumple_uala_plus"
             )
             if cumple_uala_plus:
-                st.caption("✅ Tendrás acceso a Ualá Plus (16% hasta $50k)")
+                st.caption(f"✅ Tendrás acceso a {nombre_uala}: {mejora_por_requisito('Ualá')}")
     
     with st.expander("🚫 ¿Hay instituciones que NO quieres usar?", expanded=False):
         st.markdown("""
@@ -2331,14 +5030,14 @@ def main():
         
         with col1:
             usa_nu = st.checkbox("💜 Nu México (Nubank)", value=True, key="usa_nu", help="Líder en México con app excelente")
-            usa_didi = st.checkbox("🚗 DiDi (la app de transporte)", value=True, key="usa_didi", help="16% los primeros $10,000")
-            usa_stori = st.checkbox("🟦 Stori (tarjeta y ahorro)", value=True, key="usa_stori", help="Hasta 11% a plazo fijo")
-            usa_klar = st.checkbox("⚡ Klar", value=True, key="usa_klar", help="8.5% básico, 15% con Plus")
+            usa_didi = st.checkbox("🚗 DiDi (la app de transporte)", value=True, key="usa_didi", help=ayuda_tasas_sofipo("DiDi"))
+            usa_stori = st.checkbox("🟦 Stori (tarjeta y ahorro)", value=True, key="usa_stori", help=ayuda_tasas_sofipo("Stori"))
+            usa_klar = st.checkbox("⚡ Klar", value=True, key="usa_klar", help=ayuda_tasas_sofipo("Klar"))
         
         with col2:
-            usa_uala = st.checkbox("🔴 Ualá", value=True, key="usa_uala", help="7.75% básico, 16% con Plus")
-            usa_mp = st.checkbox("💙 Mercado Pago", value=True, key="usa_mp", help="10-13% según uso")
-            usa_finsus = st.checkbox("🟢 Finsus", value=True, key="usa_finsus", help="Hasta 10.09% a plazo")
+            usa_uala = st.checkbox("🔴 Ualá", value=True, key="usa_uala", help=ayuda_tasas_sofipo("Ualá"))
+            usa_mp = st.checkbox("💙 Mercado Pago", value=True, key="usa_mp", help=ayuda_tasas_sofipo("Mercado Pago"))
+            usa_finsus = st.checkbox("🟢 Finsus", value=True, key="usa_finsus", help=ayuda_tasas_sofipo("Finsus"))
         
         # Contador de SOFIPOs activas
         sofipos_activas = sum([usa_nu, usa_didi, usa_stori, usa_klar, usa_uala, usa_mp, usa_finsus])
@@ -2376,6 +5075,21 @@ def main():
     # ========================================================================
     # ESTRATEGIAS DE OPTIMIZACIÓN - SECCIÓN DESTACADA
     # ========================================================================
+    # Preferencias del usuario (mismo formato que guardar_simulacion)
+    preferencias_usuario = {
+        "usa_nu": usa_nu,
+        "usa_didi": usa_didi,
+        "usa_stori": usa_stori,
+        "usa_klar": usa_klar,
+        "usa_uala": usa_uala,
+        "usa_mp": usa_mp,
+        "usa_finsus": usa_finsus,
+        "cumple_klar_plus": cumple_klar_plus,
+        "cumple_uala_plus": cumple_uala_plus,
+        "cumple_mercadopago": cumple_mercadopago,
+        "solo_vista": solo_vista
+    }
+    
     # Solo mostrar recomendaciones si hay capital disponible
     if monto_total > 0:
         st.markdown("## 🎯 Paso 4: Elige cómo invertir tu dinero")
@@ -2390,340 +5104,139 @@ def main():
             1. **🛡️ Conservadora**: Para quienes quieren seguridad y poder sacar su dinero en cualquier momento
             2. **⚖️ Balanceada**: Balance perfecto entre seguridad y ganancias (la más popular)
             3. **🚀 Agresiva**: Para maximizar ganancias (puede incluir plazos fijos)
+            4. **🏆 Búsqueda óptima**: Prueba miles de combinaciones con tus preferencias y te muestra las mejores
             
             👉 **Haz clic en cualquier pestaña de abajo y luego en el botón "Aplicar esta estrategia"**
             """)
             
-            tab1, tab2, tab3 = st.tabs(["🛡️ Conservadora", "⚖️ Balanceada", "🚀 Agresiva"])
+            tab1, tab2, tab3, tab4 = st.tabs(["🛡️ Conservadora", "⚖️ Balanceada", "🚀 Agresiva", "🏆 Búsqueda óptima"])
+            
+            # Las tres estrategias se resuelven juntas y quedan en caché por capital y preferencias
+            estrategias = calcular_estrategias(
+                monto_total, preferencias_usuario,
+                huella=huella_productos(productos_elegibles(preferencias_usuario))
+            )
             
             with tab1:
-                st.markdown("""
-                ### Estrategia Conservadora (Menor Riesgo)
-                
-                **Perfil**: Prioriza seguridad y liquidez sobre rendimiento máximo.
-                
-                **Distribución sugerida**:
-                - 30% Nu México (Cajita Turbo) - 15% GAT (hasta $25k)
-                - 25% Mercado Pago - 13% GAT (requiere $3k/mes)
-                - 20% Ualá Base - 7.75% GAT (hasta $30k)
-                - 15% Klar Cuenta - 8.5% GAT
-                - 10% Nu México (Dinero en Cajita) - 7.5% GAT (emergencias)
-                
-                **Ventajas**:
-                - ? Máxima liquidez inmediata (100%)
-                - ? Diversificación en 4 instituciones sólidas
-                - ? Rendimiento promedio ~11.3% anual
-                
-                **Consideraciones**:
-                - Todas las opciones tienen liquidez inmediata
-                - Ideal para fondos de emergencia
-                - Mercado Pago requiere $3k/mes, resto sin requisitos especiales
-                """)
+                mostrar_estrategia("Conservadora", estrategias["Conservadora"], monto_total, periodo_simulacion, solo_vista)
             
             with tab2:
-                st.markdown("""
-                ### Estrategia Balanceada (Riesgo Moderado)
-                
-                **Perfil**: Balance entre rendimiento, liquidez y diversificación.
-                
-                **Distribución sugerida**:
-                - 20% DiDi (hasta $10k) - 16% GAT (después 8.5%)
-                - 25% Nu México (Cajita Turbo) - 15% GAT
-                - 20% Klar Inversión Max - 15% GAT (requiere Plus/Platino)
-                - 15% Mercado Pago - 13% GAT (requiere $3k/mes)
-                - 20% Stori 90 días - 10% GAT
-                
-                **Ventajas**:
-                - ? Excelente diversificación (5 SOFIPOs)
-                - ? 80% con liquidez inmediata
-                - ? Rendimiento optimizado (~13.8% ponderado)
-                
-                **Consideraciones**:
-                - Requiere membresía Klar Plus/Platino
-                - Mercado Pago requiere depositar al menos $3,000/mes
-                - 20% a plazo fijo de 90 días en Stori
-                - Balance perfecto entre liquidez y rendimiento
-                - Ideal para la mayoría de inversores
-                """)
+                mostrar_estrategia("Balanceada", estrategias["Balanceada"], monto_total, periodo_simulacion, solo_vista)
             
             with tab3:
-                st.markdown("""
-                ### 🚀 Estrategia Agresiva - Maximizar Rendimientos
-                
-                **Objetivo**: Obtener el **máximo rendimiento posible** sin importar el riesgo ni la liquidez.
-                
-                **Filosofía**: Toda tu inversión trabaja al máximo, aprovechando las mejores tasas de mercado.
-                """)
-                
-                # Calcular distribución agresiva con montos específicos
-                st.subheader("💰 Distribución Recomendada para tu Capital")
-                
                 # Mostrar filtro activo si está en modo solo vista
                 if solo_vista:
                     st.info("💧 **Modo A LA VISTA activado**: Solo se mostrarán productos sin plazo fijo")
                 
-                # ================================================================
-                # ALGORITMO INTELIGENTE DE OPTIMIZACIÓN DE RENDIMIENTO
-                # ================================================================
-                
-                # Construir lista de todas las opciones disponibles con sus límites y tasas
-                opciones_disponibles = []
-                
-                # DiDi Ahorro (16% hasta $10k, luego 8.5%)
-                if usa_didi:
-                    opciones_disponibles.append({
-                        "sofipo": "DiDi",
-                        "producto": "DiDi Ahorro",
-                        "tasa": 16.0,
-                        "limite": 10000,
-                        "minimo": 0,
-                        "prioridad": 1,  # Máxima prioridad por mejor tasa
-                        "liquidez": "Inmediata",
-                        "tipo": "vista",
-                        "razon": "🚗 16% primeros $10k 💧 A LA VISTA",
-                        "emoji": "🚗"
-                    })
-                
-                # Ualá Plus (16% hasta $50k) - SOLO si cumple requisitos
-                if usa_uala and cumple_uala_plus:
-                    opciones_disponibles.append({
-                        "sofipo": "Ualá",
-                        "producto": "Cuenta Plus",
-                        "tasa": 16.0,
-                        "limite": 50000,
-                        "minimo": 0,
-                        "prioridad": 2,
-                        "liquidez": "Inmediata",
-                        "tipo": "vista",
-                        "razon": "🔴 16% hasta $50k ✅ Cumples $3k/mes 💧 A LA VISTA",
-                        "emoji": "🔴"
-                    })
-                
-                # Nu México Cajita Turbo (15% hasta $25k)
-                if usa_nu:
-                    opciones_disponibles.append({
-                        "sofipo": "Nu México",
-                        "producto": "Cajita Turbo",
-                        "tasa": 15.0,
-                        "limite": 25000,
-                        "minimo": 0,
-                        "prioridad": 3,
-                        "liquidez": "Inmediata",
-                        "tipo": "vista",
-                        "razon": "💜 15% hasta $25k 💧 A LA VISTA",
-                        "emoji": "💜"
-                    })
-                
-                # Klar Inversión Max (15%) - SOLO si cumple requisitos
-                if usa_klar and cumple_klar_plus:
-                    opciones_disponibles.append({
-                        "sofipo": "Klar",
-                        "producto": "Inversión Flexible Max",
-                        "tasa": 15.0,
-                        "limite": None,  # Sin límite
-                        "minimo": 100,
-                        "prioridad": 4,
-                        "liquidez": "Inmediata",
-                        "tipo": "vista",
-                        "razon": "⚡ 15% sin límite ✅ Tienes Plus/Platino 💧 A LA VISTA",
-                        "emoji": "⚡"
-                    })
-                
-                # Mercado Pago (13% hasta $25k) - SOLO si cumple requisitos
-                if usa_mp and cumple_mercadopago:
-                    opciones_disponibles.append({
-                        "sofipo": "Mercado Pago",
-                        "producto": "Cuenta Remunerada",
-                        "tasa": 13.0,
-                        "limite": 25000,
-                        "minimo": 0,
-                        "prioridad": 5,
-                        "liquidez": "Inmediata",
-                        "tipo": "vista",
-                        "razon": "� 13% hasta $25k ✅ Cumples $3k/mes 💧 A LA VISTA",
-                        "emoji": "💙"
-                    })
-                
-                # Stori 90 días (10%) - Solo si NO está en modo solo_vista
-                if not solo_vista and usa_stori:
-                    opciones_disponibles.append({
-                        "sofipo": "Stori",
-                        "producto": "90 días",
-                        "tasa": 10.0,
-                        "limite": None,
-                        "minimo": 1000,
-                        "prioridad": 6,
-                        "liquidez": "90 días",
-                        "tipo": "plazo",
-                        "razon": "🟦 10% plazo 90 días 📅 PLAZO FIJO",
-                        "emoji": "🟦"
-                    })
-                
-                # Finsus 360 días (10.09%) - Solo si NO está en modo solo_vista
-                if not solo_vista and usa_finsus:
-                    opciones_disponibles.append({
-                        "sofipo": "Finsus",
-                        "producto": "Plazo Fijo 360 días",
-                        "tasa": 10.09,
-                        "limite": None,
-                        "minimo": 0,
-                        "prioridad": 7,
-                        "liquidez": "360 días",
-                        "tipo": "plazo",
-                        "razon": "🟢 10.09% plazo 360 días 📅 PLAZO FIJO",
-                        "emoji": "🟢"
-                    })
-                
-                # Ualá Base (7.75%) - Solo si NO tiene Ualá Plus
-                if usa_uala and not cumple_uala_plus:
-                    opciones_disponibles.append({
-                        "sofipo": "Ualá",
-                        "producto": "Cuenta Base",
-                        "tasa": 7.75,
-                        "limite": 30000,
-                        "minimo": 0,
-                        "prioridad": 8,
-                        "liquidez": "Inmediata",
-                        "tipo": "vista",
-                        "razon": "� 7.75% hasta $30k 💧 A LA VISTA",
-                        "emoji": "🔴"
-                    })
-                
-                # Klar Cuenta (8.5%) - Solo si NO tiene Klar Max
-                if usa_klar and not cumple_klar_plus:
-                    opciones_disponibles.append({
-                        "sofipo": "Klar",
-                        "producto": "Inversión Flexible",
-                        "tasa": 8.5,
-                        "limite": None,
-                        "minimo": 100,
-                        "prioridad": 9,
-                        "liquidez": "Inmediata",
-                        "tipo": "vista",
-                        "razon": "⚡ 8.5% sin límite 💧 A LA VISTA",
-                        "emoji": "⚡"
-                    })
-                
-                # ================================================================
-                # DISTRIBUIR CAPITAL OPTIMIZANDO RENDIMIENTO
-                # ================================================================
-                
-                # Ordenar opciones por tasa descendente (no por prioridad fija)
-                opciones_disponibles.sort(key=lambda x: (-x['tasa'], x['prioridad']))
+                mostrar_estrategia("Agresiva", estrategias["Agresiva"], monto_total, periodo_simulacion, solo_vista)
+                tasa_ponderada_agresiva = estrategias["Agresiva"]["gat_capital"]
                 
-                distribucion_agresiva = []
-                saldo_restante = monto_total
+                # Advertencias dinámicas según preferencias
+                advertencias = ["**⚠️ Consideraciones importantes:**"]
+                advertencias.append(f"- Esta estrategia alcanza un rendimiento ponderado de ~{tasa_ponderada_agresiva:.1f}%")
                 
-                for opcion in opciones_disponibles:
-                    if saldo_restante <= 0:
-                        break
-                    
-                    # Verificar si cumple mínimo
-                    if saldo_restante < opcion['minimo']:
+                # Advertencias sobre requisitos incluidos (tasas y montos del catálogo)
+                for cumple, sofipo, condicion_cumplida, condicion in [
+                    (cumple_mercadopago, "Mercado Pago", "cumples requisito de {requisito}", "si puedes depositar {requisito}"),
+                    (cumple_uala_plus, "Ualá", "cumples requisito de {requisito}", "si puedes consumir {requisito}"),
+                    (cumple_klar_plus, "Klar", "tienes membresía {requisito}", "si tienes membresía {requisito}")
+                ]:
+                    producto, info = producto_con_requisito(sofipo)
+                    if info is None:
                         continue
-                    
-                    # Calcular cuánto asignar
-                    if opcion['limite'] is None:
-                        # Sin límite: asignar todo el saldo restante
-                        monto_asignar = saldo_restante
-                    else:
-                        # Con límite: asignar hasta el límite o lo que quede
-                        monto_asignar = min(opcion['limite'], saldo_restante)
-                    
-                    # Agregar a la distribución
-                    distribucion_agresiva.append({
-                        "sofipo": opcion['sofipo'],
-                        "producto": opcion['producto'],
-                        "monto": monto_asignar,
-                        "tasa": opcion['tasa'],
-                        "razon": opcion['razon'],
-                        "emoji": opcion['emoji']
-                    })
-                    
-                    saldo_restante -= monto_asignar
-                
-                # Advertencia si quedan fondos sin asignar
-                if saldo_restante > 0:
-                    if solo_vista:
-                        st.warning(f"⚠️ Quedan **${saldo_restante:,.0f}** sin asignar. En modo A LA VISTA, los productos a plazo fijo están excluidos. Desactiva el modo A LA VISTA o activa más SOFIPOs para distribuir todo tu capital.")
+                    oferta = f"{sofipo} {producto} {tasa_maxima_producto(info):g}%"
+                    if cumple:
+                        advertencias.append(f"- ✅ Incluye {oferta} ({condicion_cumplida.format(requisito=texto_requisito(info))})")
                     else:
-                        st.warning(f"⚠️ Quedan **${saldo_restante:,.0f}** sin asignar. Has excluido demasiadas SOFIPOs. Activa al menos una más para distribuir todo tu capital.")
+                        advertencias.append(f"- 💡 Podrías mejorar con {oferta} {condicion.format(requisito=texto_requisito(info))}")
                 
-                # Mostrar tabla con montos exactos
-                if distribucion_agresiva:
-                    st.markdown("**💰 Montos específicos sugeridos:**")
-                else:
-                    st.error("⚠️ No hay recomendaciones disponibles. Has excluido todas las SOFIPOs. Activa al menos una para ver recomendaciones.")
+                advertencias.append("- Parte del capital puede quedar en plazos fijos (menor liquidez)")
+                advertencias.append("- No es recomendable para fondos de emergencia")
                 
-                for i, dist in enumerate(distribucion_agresiva, 1):
-                    porcentaje = (dist['monto'] / monto_total * 100) if monto_total > 0 else 0
-                    col1, col2, col3 = st.columns([2, 2, 1])
-                    
-                    with col1:
-                        st.markdown(f"**{i}. {dist['sofipo']}** - {dist['producto']}")
-                        st.caption(dist['razon'])
-                    
-                    with col2:
-                        st.metric(
-                            "Monto",
-                            f"${dist['monto']:,.0f}",
-                            delta=f"{porcentaje:.1f}% del total"
-                        )
-                    
-                    with col3:
-                        st.metric("GAT", f"{dist['tasa']}%")
+                st.warning("\n".join(advertencias))
+            
+            with tab4:
+                st.markdown("""
+                ### Búsqueda del Mejor Portafolio
                 
-                # Calcular rendimiento proyectado de esta estrategia usando el MISMO método que los resultados
-                ganancia_12m = 0
-                dias_simulacion = 12 * 30  # 360 días (igual que en los resultados)
-                for d in distribucion_agresiva:
-                    # Usar el mismo cálculo que en la simulación principal
-                    interes = calcular_interes_compuesto(d['monto'], d['tasa'], dias_simulacion)
-                    ganancia_12m += interes
+                **Perfil**: Prueba miles de combinaciones con las instituciones que elegiste, tus requisitos
+                y tu preferencia de liquidez, respetando mínimos, límites de cada producto y la protección IPAB.
                 
-                ganancia_12m = int(ganancia_12m)
-                tasa_ponderada_agresiva = (ganancia_12m / monto_total * 100) if monto_total > 0 else 0
+                Tú decides qué pesa más: el **score** del portafolio (protección, liquidez y diversificación)
+                o el **rendimiento**.
+                """)
                 
-                st.success(f"🎯 **Con esta estrategia agresiva obtendrás:**")
-                col1, col2 = st.columns(2)
+                col1, col2 = st.columns([3, 1])
                 with col1:
-                    st.metric("Tasa ponderada", f"{tasa_ponderada_agresiva:.2f}%")
+                    peso_score = st.slider(
+                        "¿Qué priorizas? (0 = solo rendimiento, 100 = solo score)",
+                        min_value=0,
+                        max_value=100,
+                        value=50,
+                        step=10,
+                        key="busqueda_peso_score"
+                    )
                 with col2:
-                    st.metric("Ganancia estimada (12 meses)", f"${ganancia_12m:,.0f}")
+                    top_k = st.number_input("Opciones a mostrar", min_value=1, max_value=10, value=3, key="busqueda_top_k")
                 
-                # Botón para aplicar estrategia
-                st.markdown("---")
-                if st.button("🚀 Aplicar esta estrategia a mi simulación", key="btn_aplicar_agresiva", type="primary"):
-                    # Guardar la distribución en session_state
-                    st.session_state['estrategia_aplicada'] = distribucion_agresiva
-                    st.session_state['aplicar_estrategia'] = True
-                    st.success("✅ Estrategia aplicada! Desplázate hacia abajo para ver los cambios.")
-                    st.rerun()
-                
-                # Advertencias dinámicas según preferencias
-                advertencias = ["**⚠️ Consideraciones importantes:**"]
-                advertencias.append(f"- Esta estrategia alcanza un rendimiento ponderado de ~{tasa_ponderada_agresiva:.1f}%")
-                
-                # Advertencias sobre requisitos incluidos
-                if cumple_mercadopago:
-                    advertencias.append("- ✅ Incluye Mercado Pago 13% (cumples requisito de $3k/mes)")
-                else:
-                    advertencias.append("- 💡 Podrías mejorar con Mercado Pago 13% si puedes depositar $3k/mes")
-                
-                if cumple_uala_plus:
-                    advertencias.append("- ✅ Incluye Ualá Plus 16% (cumples requisito de $3k/mes)")
-                else:
-                    advertencias.append("- 💡 Podrías mejorar con Ualá Plus 16% si puedes consumir $3k/mes")
-                
-                if cumple_klar_plus:
-                    advertencias.append("- ✅ Incluye Klar Max 15% (tienes membresía Plus/Platino)")
-                else:
-                    advertencias.append("- 💡 Podrías mejorar con Klar Max 15% si tienes membresía Plus/Platino")
+                if st.button("🔎 Buscar los mejores portafolios", key="btn_buscar_optimo"):
+                    st.session_state['busqueda_optima'] = {
+                        "argumentos": (monto_total, periodo_simulacion, productos_elegibles(preferencias_usuario)),
+                        "opciones": {
+                            "peso_score": peso_score / 100,
+                            "top_k": int(top_k),
+                            "huella": huella_productos(productos_elegibles(preferencias_usuario))
+                        },
+                        "parametros": (monto_total, periodo_simulacion)
+                    }
                 
-                advertencias.append("- Parte del capital puede quedar en plazos fijos (menor liquidez)")
-                advertencias.append("- No es recomendable para fondos de emergencia")
+                # La búsqueda corre en segundo plano; si su resultado salió del caché se vuelve a enviar
+                solicitud = st.session_state.get('busqueda_optima')
+                busqueda = None
+                if solicitud and solicitud["parametros"] == (monto_total, periodo_simulacion):
+                    llave_busqueda = enviar_tarea(buscar_portafolios_optimos, *solicitud["argumentos"], **solicitud["opciones"])
+                    busqueda = resultado_tarea(llave_busqueda)
+                    if busqueda is None:
+                        mostrar_progreso_tarea(llave_busqueda, "Evaluando combinaciones...")
                 
-                st.warning("\n".join(advertencias))
+                if solicitud and solicitud["parametros"] != (monto_total, periodo_simulacion):
+                    st.info("ℹ️ Cambiaste tu capital o el plazo. Vuelve a buscar para actualizar los resultados.")
+                elif busqueda:
+                    if not busqueda["candidatos"]:
+                        st.error("⚠️ No se encontró ninguna combinación válida. Activa más SOFIPOs o desactiva el modo A LA VISTA.")
+                    else:
+                        st.caption(
+                            f"Se evaluaron {busqueda['evaluados']:,} combinaciones "
+                            f"({busqueda['descartados']:,} descartadas por mínimos o límites)."
+                        )
+                    
+                    for i, candidato in enumerate(busqueda["candidatos"], 1):
+                        with st.container(border=True):
+                            st.markdown(f"**Opción {i}** {clasificar_score(candidato['score'])['semaforo']}")
+                            col1, col2, col3, col4 = st.columns(4)
+                            with col1:
+                                st.metric("Score", f"{candidato['score']}/100")
+                            with col2:
+                                st.metric("GAT ponderado", f"{candidato['gat_capital']:.2f}%")
+                            with col3:
+                                st.metric(f"Ganancia ({periodo_simulacion} meses)", f"${candidato['ganancia_total']:,.0f}")
+                            with col4:
+                                st.metric("Liquidez", f"{candidato['porcentaje_liquidez']:.0f}%")
+                            
+                            estrategia_candidato = estrategia_desde_vector(candidato["montos"])
+                            for item in estrategia_candidato:
+                                st.markdown(f"- {item['emoji']} **{item['sofipo']}** - {item['producto']}: ${item['monto']:,.0f}")
+                            
+                            if candidato["total_invertido"] < monto_total:
+                                st.caption(f"⚠️ ${monto_total - candidato['total_invertido']:,.0f} quedan sin asignar por los límites de cada producto y del IPAB.")
+                            
+                            if st.button("🏆 Aplicar esta estrategia a mi simulación", key=f"btn_aplicar_busqueda_{i}", type="primary"):
+                                st.session_state['propuesta_pendiente'] = f"propuesta_busqueda_{i}"
+                            
+                            if revisar_propuesta(f"propuesta_busqueda_{i}", estrategia_candidato, monto_total, periodo_simulacion):
+                                st.session_state['estrategia_aplicada'] = estrategia_candidato
+                                st.session_state['aplicar_estrategia'] = True
+                                st.rerun()
     
     st.divider()
     
@@ -2737,22 +5250,10 @@ def main():
     if 'aplicar_estrategia' in st.session_state and st.session_state['aplicar_estrategia']:
         estrategia_aplicada = st.session_state.get('estrategia_aplicada', [])
         
-        # Pre-cargar todos los valores en session_state
-        for item in estrategia_aplicada:
-            sofipo_name = item['sofipo']
-            producto_nombre = item['producto']
-            monto_valor = item['monto']
-            
-            # Marcar checkbox
-            st.session_state[f"check_{sofipo_name}"] = True
-            # Seleccionar producto
-            st.session_state[f"prod_{sofipo_name}"] = producto_nombre
-            # Establecer monto
-            key_monto = f"monto_{sofipo_name}_{producto_nombre}"
-            st.session_state[key_monto] = monto_valor
-            
-            # Debug
-            st.caption(f"🔧 Debug: {sofipo_name} - {producto_nombre} → ${monto_valor:,.0f} (key: {key_monto})")
+        # Reemplazar la selección (las SOFIPOs fuera de la estrategia quedan desmarcadas
+        # para no sumar montos anteriores) y pre-cargar los widgets
+        aplicar_inversiones_estado(estado, inversiones_desde_estrategia(estrategia_aplicada))
+        escribir_widgets_portafolio(estado)
         
         # Limpiar el flag
         st.session_state['aplicar_estrategia'] = False
@@ -2769,6 +5270,7 @@ def main():
     sofipos_names = list(SOFIPOS_DATA.keys())
     tabs = st.tabs([f"{SOFIPOS_DATA[s]['logo']} {s}" for s in sofipos_names])
     
+    # idx es también la casilla de la SOFIPO en el estado (mismo orden que el catálogo)
     for idx, (sofipo_name, tab) in enumerate(zip(sofipos_names, tabs)):
         with tab:
             sofipo_data = SOFIPOS_DATA[sofipo_name]
@@ -2790,10 +5292,7 @@ def main():
                     # Selector de producto
                     productos = list(sofipo_data['productos'].keys())
                     
-                    # Validar que el producto guardado existe, si no usar el primero
-                    producto_guardado = st.session_state.get(f"prod_{sofipo_name}", productos[0])
-                    if producto_guardado not in productos:
-                        producto_guardado = productos[0]
+                    producto_guardado = CATALOGO["claves"][estado["producto"][idx]][1]
                     
                     producto_seleccionado = st.selectbox(
                         "📦 Elige el producto:",
@@ -2825,15 +5324,16 @@ def main():
                     # Selector de modo: Monto o Porcentaje
                     modo_input = st.radio(
                         "Ingresar como:",
-                        ["💵 Monto ($)", "📊 Porcentaje (%)"],
+                        MODOS_CAPTURA,
+                        index=int(estado["porcentual"][idx]),
                         key=f"modo_{sofipo_name}",
                         horizontal=True
                     )
                     
-                    if modo_input == "💵 Monto ($)":
-                        # Determinar valor inicial: usar el guardado en session_state o el default
+                    if modo_input == MODOS_CAPTURA[0]:
+                        # Valor inicial: el del estado del portafolio
                         monto_key = f"monto_{sofipo_name}_{producto_seleccionado}"
-                        valor_inicial = st.session_state.get(monto_key, max(10000, producto_info['minimo']))
+                        valor_inicial = estado["monto"][idx].item()
                         
                         # Monto a invertir
                         monto = st.number_input(
@@ -2854,7 +5354,7 @@ def main():
                             "¿Qué % de tu capital invertirás aquí?",
                             min_value=0.0,
                             max_value=100.0,
-                            value=10.0,
+                            value=estado["porcentaje"][idx].item(),
                             step=5.0,
                             key=f"pct_{sofipo_name}_{producto_seleccionado}",
                             help="Porcentaje de tu capital total"
@@ -2870,19 +5370,12 @@ def main():
                         
                         st.caption(f"💵 Invertirás **${monto:,.0f}**")
                 
-                # Advertencias especiales por SOFIPO
-                if sofipo_name == "Mercado Pago":
-                    if monto > 25000:
-                        st.warning("⚠️ Mercado Pago tiene un límite de $25,000 para obtener el 13%")
-                    st.info("ℹ️ Requieres depositar al menos $3,000 MXN mensuales para mantener la tasa del 13%")
-                
-                if sofipo_name == "Ualá":
-                    if "Plus" in producto_seleccionado:
-                        if monto > 50000:
-                            st.warning("⚠️ Ualá Plus tiene un límite de $50,000 para obtener el 16%")
-                        st.info("ℹ️ Requieres consumir $3,000/mes con tarjetas Ualá o domiciliar tu nómina")
-                    elif "Base" in producto_seleccionado and monto > 30000:
-                        st.warning("⚠️ La tasa base del 7.75% aplica solo hasta $30,000")
+                # Advertencias de límite y de depósito mensual del producto (salen del catálogo)
+                if producto_info['tipo'] != "vista_hibrida" and producto_info.get('limite_max') and monto > producto_info['limite_max']:
+                    st.warning(f"⚠️ {producto_seleccionado} tiene un límite de ${producto_info['limite_max']:,} para obtener el {producto_info['tasa_base']:g}%")
+                if producto_info.get('requisito_deposito'):
+                    forma = FORMA_REQUISITO_DEPOSITO.get(sofipo_name, "depositar")
+                    st.info(f"ℹ️ Requieres {forma} al menos {texto_requisito(producto_info, completo=True)} para mantener la tasa del {producto_info['tasa_base']:g}%")
                 
                 # Requisitos especiales
                 cumple_requisito = True
@@ -2892,7 +5385,7 @@ def main():
                                 "¿Tienes membresía Klar Plus o Platino?",
                                 value=True,
                                 key=f"req_{sofipo_name}_{producto_seleccionado}",
-                                help="Necesitas membresía Plus o Platino para obtener el 15%"
+                                help=f"Necesitas membresía Plus o Platino para obtener el {producto_info['tasa_base']:g}%"
                             )
                 
                 # Guardar inversión (solo si el producto existe)
@@ -2963,88 +5456,21 @@ def main():
             st.info("💡 **Simulación desde $0** - Se proyectará el crecimiento solo con aportaciones recurrentes. Selecciona productos arriba para ver dónde se invertirán las aportaciones.")
         
         # Calcular rendimientos para cada inversión (skip si no hay inversiones)
-        resultados = []
         proyecciones_todas = []
         total_invertido = sum([inv["monto"] for inv in inversiones_seleccionadas.values()]) if inversiones_seleccionadas else 0
         
-        for inversion_key, inversion in inversiones_seleccionadas.items():
-            monto = inversion['monto']
-            producto_info = inversion['producto_info']
-            tipo = producto_info['tipo']
-            
-            # Determinar tasa efectiva
-            if tipo == "vista_hibrida":
-                # DiDi con estructura híbrida
-                interes_anual = calcular_rendimiento_hibrido_didi(
-                    monto,
-                    producto_info['tasa_premium'],
-                    producto_info['limite_premium'],
-                    producto_info['tasa_base'],
-                    365
-                )
-                tasa_efectiva = (interes_anual / monto) * 100
-                tipo_interes = "Compuesto (Diario)"
-                
-            elif tipo == "vista":
-                # A la vista con interés compuesto
-                tasa_efectiva = producto_info['tasa_base']
-                tipo_interes = "Compuesto (Diario)"
-                
-            elif tipo == "plazo":
-                # Plazo fijo con interés simple
-                tasa_efectiva = producto_info['tasa_base']
-                tipo_interes = "Simple"
-            
-            # Calcular rendimientos
-            dias_simulacion = periodo_simulacion * 30
-            
-            if tipo == "vista_hibrida":
-                ganancia_periodo = calcular_rendimiento_hibrido_didi(
-                    monto,
-                    producto_info['tasa_premium'],
-                    producto_info['limite_premium'],
-                    producto_info['tasa_base'],
-                    dias_simulacion
-                )
-            elif tipo == "vista" or tipo_interes == "Compuesto (Diario)":
-                ganancia_periodo = calcular_interes_compuesto(monto, tasa_efectiva, dias_simulacion)
-            else:
-                ganancia_periodo = calcular_interes_simple(monto, tasa_efectiva, dias_simulacion)
-            
-            ganancia_dia = ganancia_periodo / dias_simulacion
-            ganancia_mes = ganancia_dia * 30
-            ganancia_anio = ganancia_dia * 365
-            
-            resultados.append({
-                "SOFIPO": inversion['sofipo'],
-                "Producto": inversion['producto'],
-                "Monto Invertido": f"${monto:,.2f}",
-                "GAT Efectivo": f"{tasa_efectiva:.2f}%",
-                "Ganancia/Día": f"${ganancia_dia:.2f}",
-                "Ganancia/Mes": f"${ganancia_mes:.2f}",
-                "Ganancia/Año": f"${ganancia_anio:.2f}",
-                f"Total ({periodo_simulacion} meses)": f"${monto + ganancia_periodo:,.2f}",
-                "Ganancia Total": f"${ganancia_periodo:,.2f}",
-                "Tipo Interés": tipo_interes
-            })
-            
-            # Generar proyección mensual con escenario de tasas
-            escenario_tasas = st.session_state.get("escenario_tasas", "Realista")
-            
-            # DEBUG: Mostrar escenario y tasa
-            st.caption(f"🔍 Debug: Escenario={escenario_tasas}, Tasa inicial={tasa_efectiva}%")
-            
-            if tipo == "vista" or tipo_interes == "Compuesto (Diario)":
-                proyeccion = generar_proyeccion_mensual(
-                    monto, tasa_efectiva, "compuesto", periodo_simulacion, escenario_tasas
-                )
-            else:
-                proyeccion = generar_proyeccion_mensual(
-                    monto, tasa_efectiva, "simple", periodo_simulacion, escenario_tasas
-                )
-            
-            proyeccion['SOFIPO'] = inversion_key
-            proyecciones_todas.append(proyeccion)
+        # Solo se recalculan los productos cuyo monto, plazo o escenario cambió
+        escenario_tasas = st.session_state.get("escenario_tasas", "Realista")
+        modelo_portafolio = st.session_state.setdefault("modelo_portafolio", nuevo_modelo_portafolio())
+        actualizar_modelo_portafolio(modelo_portafolio, inversiones_seleccionadas, periodo_simulacion, escenario_tasas, retencion_isr)
+        modo_isr = st.session_state.get("modo_isr", False)
+        modo_real = st.session_state.get("modo_real", False)
+        
+        # Resultados numéricos por producto; el formato se aplica solo al mostrarlos
+        resultados = tabla_resultados(inversiones_seleccionadas, modelo_portafolio, periodo_simulacion, con_isr=modo_isr)
+        
+        for inversion_key in inversiones_seleccionadas:
+            proyecciones_todas.append(modelo_portafolio["productos"][inversion_key]["proyeccion"])
         
         # ====================================================================
         # RESUMEN VISUAL SIMPLIFICADO
@@ -3053,10 +5479,8 @@ def main():
         total_invertido = sum([inv['monto'] for inv in inversiones_seleccionadas.values()]) if inversiones_seleccionadas else 0
         
         # Calcular ganancia total y GAT ponderado
-        ganancia_total = 0
-        for resultado in resultados:
-            ganancia_str = resultado["Ganancia Total"].replace("$", "").replace(",", "")
-            ganancia_total += float(ganancia_str)
+        ganancia_total = float(valores_columna(resultados, "Ganancia Total").sum())
+        isr_total = sum(modelo_portafolio["productos"][llave]["isr_retenido"] for llave in inversiones_seleccionadas)
         
         # CORRECCIÓN FINANCIERA: Calcular la tasa efectiva anualizada correctamente
         # Si el periodo es < 12 meses, necesitamos calcular la tasa equivalente anual
@@ -3079,254 +5503,205 @@ def main():
         
         col1, col2, col3 = st.columns(3)
         
-        with col1:
-            st.markdown('<div class="metric-card">', unsafe_allow_html=True)
-            st.metric("Inviertes", f"${total_invertido:,.0f}")
-            st.markdown('</div>', unsafe_allow_html=True)
-        
-        with col2:
-            st.markdown('<div class="metric-card">', unsafe_allow_html=True)
-            st.metric(f"Ganas en {periodo_simulacion} meses", f"${ganancia_total:,.0f}")
-            st.markdown('</div>', unsafe_allow_html=True)
-        
-        with col3:
-            st.markdown('<div class="metric-card">', unsafe_allow_html=True)
-            st.metric("Terminas con", f"${total_invertido + ganancia_total:,.0f}")
-            st.markdown('</div>', unsafe_allow_html=True)
-        
-        # GAT Ponderado destacado (solo si hay capital invertido)
-        if total_invertido > 0:
-            st.success(f"📊 **Tu tasa promedio ponderada es: {rendimiento_ponderado:.2f}% anual**")
-            
-            # Mostrar información del escenario de tasas
-            escenario_actual = st.session_state.get("escenario_tasas", "Realista")
-            trimestres_periodo = periodo_simulacion // 3
-            if escenario_actual == "Realista" and trimestres_periodo > 0:
-                reduccion_total = 0.25 * trimestres_periodo
-                st.info(f"📉 **Escenario Realista**: Las tasas bajan 0.25% cada trimestre. En {periodo_simulacion} meses ({trimestres_periodo} trimestres), habrán bajado ~{reduccion_total:.2f}%. Tasa final estimada: ~{rendimiento_ponderado - reduccion_total:.1f}%")
-            elif escenario_actual == "Conservador" and trimestres_periodo > 0:
-                reduccion_total = 0.5 * trimestres_periodo
-                st.warning(f"📉 **Escenario Conservador**: Las tasas bajan 0.5% cada trimestre. En {periodo_simulacion} meses ({trimestres_periodo} trimestres), habrán bajado ~{reduccion_total:.2f}%. Tasa final estimada: ~{rendimiento_ponderado - reduccion_total:.1f}%")
-        
-        # Tabla detallada en expander (solo si hay productos)
-        if resultados:
-            with st.expander("🔍 Ver desglose detallado por SOFIPO"):
-                df_resultados = pd.DataFrame(resultados)
-                st.dataframe(df_resultados, width="stretch", hide_index=True)
-        
-        # ====================================================================
-        # DASHBOARD EJECUTIVO MOVIDO AL FINAL
-        # ====================================================================
-        # El dashboard ejecutivo se mostrará DESPUÉS de calcular todo (capital + aportaciones)
-        # para mostrar métricas precisas del portafolio final
-        
-        # ELIMINADO TEMPORALMENTE - Se recalculará al final con datos reales
-        if False:  # Deshabilitado - se reemplazará con dashboard unificado al final
-            st.markdown("---")
-            st.markdown("### 📊 Dashboard Ejecutivo")
-            st.caption("🚀 Tu portafolio en 30 segundos")
-            
-            # Calcular métricas para el score
-            num_sofipos = len(inversiones_seleccionadas)
-            
-            # Calcular montos por SOFIPO para verificar protección IPAB
-            montos_por_sofipo = {}
-            for inversion_key, inversion in inversiones_seleccionadas.items():
-                sofipo = inversion['sofipo']
-                monto = inversion['monto']
-                if sofipo not in montos_por_sofipo:
-                    montos_por_sofipo[sofipo] = 0
-                montos_por_sofipo[sofipo] += monto
-            
-            proteccion_ipab_completa = all(monto <= 200000 for monto in montos_por_sofipo.values())
-            
-            # Calcular porcentaje de liquidez
-            monto_liquido = sum(
-                inv['monto'] for inv in inversiones_seleccionadas.values() 
-                if inv['producto_info']['tipo'] in ['vista', 'vista_hibrida']
-            )
-            porcentaje_liquidez = (monto_liquido / total_invertido * 100) if total_invertido > 0 else 0
-            
-            # ====================================================================
-            # SISTEMA DE SCORE INTELIGENTE (0-100)
-            # ====================================================================
-            
-            score_total = 0
-            componentes_score = []
-            
-            # 1. RENDIMIENTO (40 puntos máximo) - El más importante
-            if rendimiento_ponderado >= 15:
-                score_rendimiento = 40
-                nivel_rendimiento = "Excelente"
-            elif rendimiento_ponderado >= 14:
-                score_rendimiento = 35
-                nivel_rendimiento = "Muy Bueno"
-            elif rendimiento_ponderado >= 13:
-                score_rendimiento = 30
-                nivel_rendimiento = "Bueno"
-            elif rendimiento_ponderado >= 12:
-                score_rendimiento = 25
-                nivel_rendimiento = "Aceptable"
-            else:
-                score_rendimiento = int((rendimiento_ponderado / 12) * 25)
-                nivel_rendimiento = "Mejorable"
-            
-            score_total += score_rendimiento
-            componentes_score.append(("Rendimiento", score_rendimiento, 40, nivel_rendimiento))
-            
-            # 2. PROTECCIÓN IPAB (25 puntos máximo)
-            if proteccion_ipab_completa:
-                score_ipab = 25
-                nivel_ipab = "100% Protegido"
-            else:
-                # Calcular qué porcentaje del total está protegido
-                monto_protegido = sum(min(m, 200000) for m in montos_por_sofipo.values())
-                porcentaje_protegido = (monto_protegido / total_invertido * 100) if total_invertido > 0 else 0
-                score_ipab = int((porcentaje_protegido / 100) * 25)
-                nivel_ipab = f"{porcentaje_protegido:.0f}% Protegido"
-            
-            score_total += score_ipab
-            componentes_score.append(("Protección IPAB", score_ipab, 25, nivel_ipab))
-            
-            # 3. LIQUIDEZ (20 puntos máximo)
-            if porcentaje_liquidez >= 80:
-                score_liquidez = 20
-                nivel_liquidez = "Muy Alta"
-            elif porcentaje_liquidez >= 50:
-                score_liquidez = 15
-                nivel_liquidez = "Balanceada"
-            elif porcentaje_liquidez >= 30:
-                score_liquidez = 10
-                nivel_liquidez = "Moderada"
-            else:
-                score_liquidez = int((porcentaje_liquidez / 30) * 10)
-                nivel_liquidez = "Baja"
-            
-            score_total += score_liquidez
-            componentes_score.append(("Liquidez", score_liquidez, 20, nivel_liquidez))
-            
-            # 4. DIVERSIFICACIÓN (15 puntos máximo) - Peso reducido para no penalizar tanto
-            if num_sofipos >= 5:
-                score_diversificacion = 15
-                nivel_diversificacion = "Excelente"
-            elif num_sofipos >= 3:
-                score_diversificacion = 12
-                nivel_diversificacion = "Buena"
-            elif num_sofipos >= 2:
-                score_diversificacion = 9
-                nivel_diversificacion = "Aceptable"
-            else:
-                score_diversificacion = 6
-                nivel_diversificacion = "Básica"
-            
-            score_total += score_diversificacion
-            componentes_score.append(("Diversificación", score_diversificacion, 15, nivel_diversificacion))
-            
-            # ====================================================================
-            # SEMÁFORO DE RIESGO
-            # ====================================================================
-            
-            if score_total >= 85:
-                semaforo = "🟢"
-                semaforo_texto = "EXCELENTE"
-                semaforo_color = "#22c55e"
-                mensaje_riesgo = "Tu portafolio está muy bien optimizado"
-            elif score_total >= 70:
-                semaforo = "🟢"
-                semaforo_texto = "BUENO"
-                semaforo_color = "#84cc16"
-                mensaje_riesgo = "Portafolio sólido con buen balance"
-            elif score_total >= 55:
-                semaforo = "🟡"
-                semaforo_texto = "ACEPTABLE"
-                semaforo_color = "#eab308"
-                mensaje_riesgo = "Considera mejorar algunos aspectos"
-            else:
-                semaforo = "🔴"
-                semaforo_texto = "MEJORABLE"
-                semaforo_color = "#ef4444"
-                mensaje_riesgo = "Hay áreas importantes que optimizar"
-            
-            # ====================================================================
-            # MOSTRAR DASHBOARD EN TARJETA ÚNICA (VERSIÓN NATIVA STREAMLIT)
-            # ====================================================================
-            
-            # Contenedor principal con estilo
-            dashboard_container = st.container()
-            
-            with dashboard_container:
-                # Header del dashboard
-                col_score, col_msg = st.columns([1, 2])
-                
-                with col_score:
-                    st.markdown(f"""
-                    <div style="text-align: center; padding: 20px; background: {semaforo_color}15; border-radius: 10px; border: 2px solid {semaforo_color};">
-                        <div style="font-size: 48px; font-weight: bold; color: {semaforo_color};">
-                            {score_total}/100
-                        </div>
-                        <div style="font-size: 18px; font-weight: bold; color: {semaforo_color}; margin-top: 10px;">
-                            {semaforo} {semaforo_texto}
-                        </div>
-                    </div>
-                    """, unsafe_allow_html=True)
-                
-                with col_msg:
-                    st.info(f"**Score de Calidad del Portafolio**\n\n{mensaje_riesgo}")
-                
-                # Desglose del score
-                st.markdown("---")
-                st.markdown("### 📋 Desglose del Score")
-                
-                for comp in componentes_score:
-                    col1, col2 = st.columns([3, 1])
-                    with col1:
-                        st.markdown(f"**{comp[0]}**")
-                        st.progress(comp[1] / comp[2])
-                    with col2:
-                        st.metric(
-                            label="Puntos",
-                            value=f"{comp[1]}/{comp[2]}",
-                            delta=comp[3]
-                        )
-                    st.caption(f"_{comp[3]}_")
-                    st.markdown("")  # Espacio
-            
-            # ====================================================================
-            # KPIs PRINCIPALES EN FORMATO COMPACTO
-            # ====================================================================
-            
-            col_kpi1, col_kpi2, col_kpi3, col_kpi4 = st.columns(4)
-            
-            with col_kpi1:
+        with col1:
+            st.markdown('<div class="metric-card">', unsafe_allow_html=True)
+            st.metric("Inviertes", f"${total_invertido:,.0f}")
+            st.markdown('</div>', unsafe_allow_html=True)
+        
+        with col2:
+            st.markdown('<div class="metric-card">', unsafe_allow_html=True)
+            st.metric(f"Ganas en {periodo_simulacion} meses", f"${ganancia_total:,.0f}")
+            st.markdown('</div>', unsafe_allow_html=True)
+        
+        with col3:
+            st.markdown('<div class="metric-card">', unsafe_allow_html=True)
+            st.metric("Terminas con", f"${total_invertido + ganancia_total:,.0f}")
+            st.markdown('</div>', unsafe_allow_html=True)
+        
+        # Ganancia nominal contra la que queda después de la retención de ISR
+        if modo_isr and total_invertido > 0:
+            col_isr1, col_isr2, col_isr3 = st.columns(3)
+            with col_isr1:
+                st.metric("Ganancia nominal", f"${ganancia_total:,.0f}")
+            with col_isr2:
+                st.metric(f"ISR retenido ({retencion_isr * 100:.2f}%)", f"-${isr_total:,.0f}")
+            with col_isr3:
                 st.metric(
-                    label="📈 GAT Ponderado",
-                    value=f"{rendimiento_ponderado:.2f}%",
-                    delta="Anual"
+                    "Ganancia neta",
+                    f"${ganancia_total - isr_total:,.0f}",
+                    delta=f"{(ganancia_total - isr_total) / total_invertido * 100:.2f}% en el periodo"
                 )
-            
-            with col_kpi2:
+        
+        # Misma proyección en pesos de hoy (toda la matriz se deflacta de una vez)
+        if modo_real and total_invertido > 0:
+            agregado_real = a_pesos_de_hoy(modelo_portafolio["agregado"])
+            columna_total = COLUMNAS_AGREGADAS.index("Total Neto" if modo_isr else "Total Acumulado")
+            ganancia_real = agregado_real[-1, columna_total] - total_invertido
+            inflacion_periodo = inflacion_anual_esperada(periodo_simulacion)
+            col_real1, col_real2, col_real3 = st.columns(3)
+            with col_real1:
+                st.metric("Inflación esperada", f"{inflacion_periodo:.2f}% anual")
+            with col_real2:
                 st.metric(
-                    label="🏦 SOFIPOs",
-                    value=f"{num_sofipos}",
-                    delta=nivel_diversificacion
+                    "Ganancia real" + (" (neta de ISR)" if modo_isr else ""),
+                    f"${ganancia_real:,.0f}",
+                    help="Lo que ganas medido en pesos de hoy"
                 )
+            with col_real3:
+                st.metric("GAT real", f"{gat_real(rendimiento_ponderado, inflacion_periodo):.2f}%")
+        
+        # GAT Ponderado destacado (solo si hay capital invertido)
+        if total_invertido > 0:
+            st.success(f"📊 **Tu tasa promedio ponderada es: {rendimiento_ponderado:.2f}% anual**")
             
-            with col_kpi3:
-                st.metric(
-                    label="🛡️ IPAB",
-                    value=f"{nivel_ipab}",
-                    delta="Protección"
+            # Mostrar información del escenario de tasas
+            escenario_actual = st.session_state.get("escenario_tasas", "Realista")
+            trimestres_periodo = periodo_simulacion // 3
+            if escenario_actual == "Realista" and trimestres_periodo > 0:
+                reduccion_total = 0.25 * trimestres_periodo
+                tasa_final = max(TASA_MINIMA_ESCENARIO, rendimiento_ponderado - reduccion_total)
+                st.info(f"📉 **Escenario Realista**: Las tasas bajan 0.25% cada trimestre (mínimo {TASA_MINIMA_ESCENARIO:.0f}%). En {periodo_simulacion} meses ({trimestres_periodo} trimestres), habrán bajado ~{reduccion_total:.2f}%. Tasa final estimada: ~{tasa_final:.1f}%")
+            elif escenario_actual == "Conservador" and trimestres_periodo > 0:
+                reduccion_total = 0.5 * trimestres_periodo
+                tasa_final = max(TASA_MINIMA_ESCENARIO, rendimiento_ponderado - reduccion_total)
+                st.warning(f"📉 **Escenario Conservador**: Las tasas bajan 0.5% cada trimestre (mínimo {TASA_MINIMA_ESCENARIO:.0f}%). En {periodo_simulacion} meses ({trimestres_periodo} trimestres), habrán bajado ~{reduccion_total:.2f}%. Tasa final estimada: ~{tasa_final:.1f}%")
+        
+        # Tabla detallada en expander (solo si hay productos)
+        if resultados["num_filas"]:
+            with st.expander("🔍 Ver desglose detallado por SOFIPO"):
+                st.dataframe(
+                    pagina_tabla(resultados, np.arange(resultados["num_filas"])),
+                    width="stretch",
+                    hide_index=True,
+                    column_config=configuracion_columnas_tabla(resultados)
                 )
             
-            with col_kpi4:
-                st.metric(
-                    label="💧 Liquidez",
-                    value=f"{porcentaje_liquidez:.0f}%",
-                    delta=nivel_liquidez
+            # Con aportaciones la línea de tiempo se arma con el libro (sección de aportaciones)
+            if not (aportaciones_activas and aportacion_monto > 0):
+                with st.expander("🛡️ Cobertura IPAB en el tiempo"):
+                    mostrar_cobertura_ipab(
+                        np.column_stack([modelo_portafolio["productos"][llave]["proyeccion"]["Total Acumulado"].to_numpy() for llave in inversiones_seleccionadas]),
+                        [inv["sofipo"] for inv in inversiones_seleccionadas.values()],
+                        oscuro=modo_oscuro
+                    )
+
+        # ====================================================================
+        # EXPLORADOR DE SENSIBILIDAD (CAPITAL x PLAZO x TASAS)
+        # ====================================================================
+
+        if total_invertido > 0:
+            with st.expander("🧪 Explorador de sensibilidad: capital × plazo × tasas"):
+                st.caption("Tu misma distribución evaluada con otros capitales, plazos y niveles de tasas. La malla se calcula una sola vez; mover los controles solo consulta resultados ya calculados.")
+
+                # Al redondear a centenas, capitales chicos repiten renglones
+                capitales_malla = np.unique(np.linspace(max(1000, total_invertido * 0.1), total_invertido * 3, 50).round(-2))
+                horizontes_malla = cortes_resolucion_adaptativa(max(24, periodo_simulacion))
+                desplazamientos_malla = np.linspace(-2.5, 2.5, 11)
+
+                montos_malla = vector_desde_seleccion(inversiones_seleccionadas)
+                malla = calcular_malla_sensibilidad(
+                    montos_malla,
+                    capitales_malla,
+                    horizontes_malla,
+                    desplazamientos_malla,
+                    huella_productos(montos_malla > 0)
                 )
-            
-            st.markdown("---")
-        
+
+                excedidos = np.flatnonzero(malla["sin_asignar"] > 0.5)
+                if len(excedidos):
+                    st.caption(f"⚠️ Desde \\${capitales_malla[excedidos[0]]:,.0f} tu distribución rebasa el límite máximo de algún producto. Ese excedente (hasta \\${malla['sin_asignar'].max():,.0f}) no se invierte en la malla: no suma ganancia y el GAT se calcula sobre lo invertido.")
+
+                col_sens1, col_sens2 = st.columns(2)
+                with col_sens1:
+                    metrica_malla = st.radio(
+                        "Métrica",
+                        ["Ganancia total", "GAT ponderado"],
+                        horizontal=True,
+                        key="metrica_sensibilidad"
+                    )
+                with col_sens2:
+                    desplazamiento_sel = st.select_slider(
+                        "Cambio en todas las tasas (puntos)",
+                        options=list(desplazamientos_malla),
+                        value=0.0,
+                        format_func=lambda x: f"{x:+.1f}%",
+                        key="desplazamiento_sensibilidad"
+                    )
+
+                k_desplazamiento = int(np.argmin(np.abs(desplazamientos_malla - desplazamiento_sel)))
+                valores_malla = malla["ganancia"] if metrica_malla == "Ganancia total" else malla["gat"]
+
+                fig_malla = go.Figure(data=go.Heatmap(
+                    z=valores_malla[:, :, k_desplazamiento],
+                    x=horizontes_malla,
+                    y=capitales_malla,
+                    colorscale="Viridis",
+                    hovertemplate=(
+                        'Capital: $%{y:,.0f}<br>Plazo: %{x} meses<br>' +
+                        ('Ganancia: $%{z:,.0f}' if metrica_malla == "Ganancia total" else 'GAT: %{z:.2f}%') +
+                        '<extra></extra>'
+                    )
+                ))
+                fig_malla.update_layout(
+                    height=420,
+                    margin=dict(l=20, r=20, t=30, b=20),
+                    xaxis_title="Plazo (meses)",
+                    yaxis_title="Capital (MXN)",
+                    yaxis_tickformat="$,.0f",
+                    template="plotly_white" if not modo_oscuro else "plotly_dark",
+                    paper_bgcolor='rgba(0,0,0,0)'
+                )
+                st.plotly_chart(fig_malla, use_container_width=True, config={'displayModeBar': False})
+
+                # Corte por plazo: capital x cambio de tasas
+                horizonte_sel = st.select_slider(
+                    "Plazo para comparar escenarios de tasas",
+                    options=list(horizontes_malla),
+                    value=min(periodo_simulacion, horizontes_malla[-1]),
+                    format_func=formato_plazo,
+                    key="horizonte_sensibilidad"
+                )
+                fig_tasas = go.Figure(data=go.Heatmap(
+                    z=valores_malla[:, int(np.searchsorted(horizontes_malla, horizonte_sel)), :],
+                    x=[f"{d:+.1f}%" for d in desplazamientos_malla],
+                    y=capitales_malla,
+                    colorscale="RdYlGn",
+                    hovertemplate='Capital: $%{y:,.0f}<br>Cambio de tasas: %{x}<br>Valor: %{z:,.2f}<extra></extra>'
+                ))
+                fig_tasas.update_layout(
+                    height=380,
+                    margin=dict(l=20, r=20, t=30, b=20),
+                    xaxis_title="Cambio en tasas",
+                    yaxis_title="Capital (MXN)",
+                    yaxis_tickformat="$,.0f",
+                    template="plotly_white" if not modo_oscuro else "plotly_dark",
+                    paper_bgcolor='rgba(0,0,0,0)'
+                )
+                st.plotly_chart(fig_tasas, use_container_width=True, config={'displayModeBar': False})
+
+            with st.expander("💡 ¿Dónde rinde más tu siguiente peso?"):
+                st.caption(f"Derivadas exactas del saldo final a {periodo_simulacion} meses: cuánto ganarías de más por cada \\$1,000 adicionales en cada producto, y cuánto cambia tu ganancia si su tasa sube 1 punto.")
+
+                filas_marginal = tabla_retorno_marginal(
+                    vector_desde_seleccion(inversiones_seleccionadas),
+                    periodo_simulacion * 30
+                )
+                st.dataframe(
+                    pd.DataFrame(filas_marginal),
+                    width="stretch",
+                    hide_index=True,
+                    column_config={
+                        "Monto": st.column_config.NumberColumn(format="dollar"),
+                        "Por cada $1,000 extra": st.column_config.NumberColumn(format="dollar"),
+                        "Por +1 punto de tasa": st.column_config.NumberColumn(format="dollar"),
+                        "Espacio antes del límite": st.column_config.NumberColumn(format="dollar")
+                    }
+                )
+
+                mejor_marginal = filas_marginal[0] if filas_marginal else None
+                if mejor_marginal and (mejor_marginal["Espacio antes del límite"] is None or mejor_marginal["Espacio antes del límite"] > 0):
+                    st.success(f"🎯 Tu siguiente peso rinde más en **{mejor_marginal['SOFIPO']} - {mejor_marginal['Producto']}** (+\\${mejor_marginal['Por cada $1,000 extra']:,.2f} por cada \\$1,000)")
+
         # ====================================================================
         # SECCIÓN UNIFICADA: VISUALIZACIÓN Y ANÁLISIS
         # ====================================================================
@@ -3334,17 +5709,17 @@ def main():
         # mostrando el resultado final consolidado
         
         # Mostrar visualizaciones si hay proyecciones o aportaciones activas
+        tabla_libro_exportacion = None
         if len(proyecciones_todas) > 0 or (total_invertido == 0 and aportaciones_activas and aportacion_monto > 0):
             st.markdown("---")
             st.markdown("## 📊 Visualización de tu Inversión")
             
             # Caso especial: Solo aportaciones sin capital inicial
             if total_invertido == 0 and aportaciones_activas and aportacion_monto > 0:
-                st.info(f"💡 Iniciando desde $0 con aportaciones {frecuencia_aportacion.lower()}es de ${aportacion_monto:,.0f} a tasa promedio del mercado (15% anual)")
-                
-                # Generar proyección solo con aportaciones
-                # Usar la tasa más alta disponible de los productos habilitados
-                tasa_referencia = 15.0  # Tasa promedio conservadora
+                # Generar proyección solo con aportaciones, al promedio de la
+                # mejor tasa de cada SOFIPO habilitada
+                tasa_referencia = tasa_promedio_mercado(productos_elegibles(preferencias_usuario))
+                st.info(f"💡 Iniciando desde $0 con aportaciones {frecuencia_aportacion.lower()}es de ${aportacion_monto:,.0f} a tasa promedio del mercado ({tasa_referencia:.1f}% anual)")
                 
                 escenario_tasas = st.session_state.get("escenario_tasas", "Realista")
                 df_total_con_aportaciones = generar_proyeccion_con_aportaciones(
@@ -3354,22 +5729,16 @@ def main():
                     meses=periodo_simulacion,
                     aportacion=aportacion_monto,
                     frecuencia=frecuencia_aportacion,
-                    escenario=escenario_tasas
+                    escenario=escenario_tasas,
+                    retencion_isr=retencion_isr
                 )
                 # No hay proyección sin aportaciones, por lo que df_total será None
                 df_total = None
             
             # Caso normal: Hay capital inicial
             elif len(proyecciones_todas) > 0:
-                # Combinar todas las proyecciones
-                df_proyecciones_completo = pd.concat(proyecciones_todas, ignore_index=True)
-                
-                # Agrupar por mes y sumar TODO
-                df_total = df_proyecciones_completo.groupby('Mes').agg({
-                    'Capital Inicial': 'sum',
-                    'Intereses Generados': 'sum',
-                    'Total Acumulado': 'sum'
-                }).reset_index()
+                # Suma de todos los productos por mes (el modelo la mantiene al día)
+                df_total = proyeccion_agregada(modelo_portafolio)
                 
                 # Si hay aportaciones activas, generar proyección con aportaciones
                 escenario_tasas = st.session_state.get("escenario_tasas", "Realista")
@@ -3381,7 +5750,8 @@ def main():
                         meses=periodo_simulacion,
                         aportacion=aportacion_monto,
                         frecuencia=frecuencia_aportacion,
-                        escenario=escenario_tasas
+                        escenario=escenario_tasas,
+                        retencion_isr=retencion_isr
                     )
                 else:
                     df_total_con_aportaciones = None
@@ -3437,245 +5807,98 @@ def main():
                     </div>
                     """, unsafe_allow_html=True)
             
-            # Crear gráfico profesional con gradiente
-            fig = go.Figure()
+            # Series de la gráfica (la figura se arma y se cachea en figura_crecimiento)
+            series_grafica = []
+            anotaciones_grafica = []
             
             # Si hay aportaciones, mostrar comparación
             if aportaciones_activas and aportacion_monto > 0:
-                # Área de relleno para CON aportaciones
-                fig.add_trace(go.Scatter(
-                    x=df_total_con_aportaciones['Mes'],
-                    y=df_total_con_aportaciones['Total Acumulado'],
-                    mode='lines',
-                    name='Con Aportaciones (área)',
-                    line=dict(width=0),
-                    fillcolor='rgba(67, 233, 123, 0.3)',
-                    fill='tozeroy',
-                    showlegend=False,
-                    hoverinfo='skip'
-                ))
-                
-                # Línea principal CON aportaciones
-                fig.add_trace(go.Scatter(
-                    x=df_total_con_aportaciones['Mes'],
-                    y=df_total_con_aportaciones['Total Acumulado'],
-                    mode='lines+markers',
-                    name='Con Aportaciones',
-                    line=dict(
-                        width=3.5,
-                        color='#43e97b',
-                        shape='spline',
-                    ),
-                    marker=dict(
-                        size=9,
-                        color='#43e97b',
-                        symbol='circle',
-                        line=dict(color='white', width=2)
-                    ),
-                    hovertemplate=(
-                        '<b style="color:#43e97b;">Con Aportaciones</b><br>' +
-                        '<b>Mes %{x}</b><br>' +
-                        'Total: <b>$%{y:,.0f}</b><br>' +
-                        '<extra></extra>'
-                    )
+                series_grafica.append((
+                    "Con Aportaciones", "con_aportaciones",
+                    df_total_con_aportaciones['Mes'].to_numpy(),
+                    df_total_con_aportaciones['Total Acumulado'].to_numpy()
                 ))
                 
                 # Línea SIN aportaciones (para comparar) - solo si hay capital inicial
                 if df_total is not None:
-                    fig.add_trace(go.Scatter(
-                        x=df_total['Mes'],
-                        y=df_total['Total Acumulado'],
-                        mode='lines+markers',
-                        name='Sin Aportaciones',
-                        line=dict(
-                            width=2.5,
-                            color='#667eea',
-                            shape='spline',
-                            dash='dash'
-                        ),
-                        marker=dict(
-                            size=7,
-                            color='#667eea',
-                            symbol='circle',
-                            line=dict(color='white', width=1.5)
-                        ),
-                        hovertemplate=(
-                            '<b style="color:#667eea;">Sin Aportaciones</b><br>' +
-                            '<b>Mes %{x}</b><br>' +
-                            'Total: <b>$%{y:,.0f}</b><br>' +
-                            '<extra></extra>'
-                        )
+                    series_grafica.append((
+                        "Sin Aportaciones", "sin_aportaciones",
+                        df_total['Mes'].to_numpy(),
+                        df_total['Total Acumulado'].to_numpy()
                     ))
             else:
                 # Gráfico normal sin aportaciones
-                # Área de relleno con gradiente
-                fig.add_trace(go.Scatter(
-                    x=df_total['Mes'],
-                    y=df_total['Total Acumulado'],
-                    mode='lines',
-                    name='Crecimiento',
-                    line=dict(width=0),
-                    fillcolor='rgba(102, 126, 234, 0.3)',
-                    fill='tozeroy',
-                    showlegend=False,
-                    hoverinfo='skip'
+                series_grafica.append((
+                    "Total del Portafolio", "total",
+                    df_total['Mes'].to_numpy(),
+                    df_total['Total Acumulado'].to_numpy()
                 ))
-                
-                # Línea principal con gradiente profesional
-                fig.add_trace(go.Scatter(
-                    x=df_total['Mes'],
-                    y=df_total['Total Acumulado'],
-                    mode='lines+markers',
-                    name='Total del Portafolio',
-                    line=dict(
-                        width=3.5,
-                        color='#667eea',
-                        shape='spline',  # Línea suavizada
-                    ),
-                    marker=dict(
-                        size=9,
-                        color='#667eea',
-                        symbol='circle',
-                        line=dict(color='white', width=2)
-                    ),
-                    hovertemplate=(
-                        '<b style="color:#667eea;">Total Acumulado</b><br>' +
-                        '<b>Mes %{x}</b><br>' +
-                        'Monto: <b>$%{y:,.0f}</b><br>' +
-                        '<extra></extra>'
-                    )
+            
+            # Total después de la retención de ISR (misma pasada que el bruto)
+            df_principal = df_total_con_aportaciones if aportaciones_activas and aportacion_monto > 0 else df_total
+            if modo_isr:
+                series_grafica.append((
+                    "Neto de ISR", "neto",
+                    df_principal['Mes'].to_numpy(),
+                    df_principal['Total Neto'].to_numpy()
+                ))
+            
+            # Total en pesos de hoy (bruto o neto, según la vista de ISR)
+            if modo_real:
+                series_grafica.append((
+                    "En pesos de hoy", "real",
+                    df_principal['Mes'].to_numpy(),
+                    a_pesos_de_hoy(df_principal['Total Neto' if modo_isr else 'Total Acumulado'].to_numpy())
                 ))
             
             # Línea de capital inicial (más sutil) - solo si hay capital
             if total_invertido > 0 and df_total is not None:
-                fig.add_trace(go.Scatter(
-                    x=df_total['Mes'],
-                    y=[total_invertido] * len(df_total),
-                    mode='lines',
-                    name='Capital Inicial',
-                    line=dict(
-                        width=2,
-                        color='rgba(150, 150, 150, 0.4)',
-                        dash='dot'
-                    ),
-                    hovertemplate='Capital Inicial: $%{y:,.0f}<extra></extra>'
+                series_grafica.append((
+                    "Capital Inicial", "capital",
+                    df_total['Mes'].to_numpy(),
+                    np.full(len(df_total), float(total_invertido))
                 ))
             
             # Anotación profesional al final
             if aportaciones_activas and aportacion_monto > 0:
                 # Anotación para CON aportaciones
                 total_final_con_aport = df_total_con_aportaciones['Total Acumulado'].iloc[-1]
-                aportaciones_totales = df_total_con_aportaciones['Aportaciones Acumuladas'].iloc[-1]
                 intereses_con_aport = df_total_con_aportaciones['Intereses Generados'].iloc[-1]
                 
-                fig.add_annotation(
-                    x=df_total_con_aportaciones['Mes'].iloc[-1],
-                    y=total_final_con_aport,
-                    text=f"<b>${total_final_con_aport:,.0f}</b><br>+${intereses_con_aport:,.0f} intereses",
-                    showarrow=True,
-                    arrowhead=2,
-                    arrowsize=1,
-                    arrowwidth=2,
-                    arrowcolor="#43e97b",
-                    ax=40,
-                    ay=-50,
-                    font=dict(size=12, color="#43e97b", family="Arial"),
-                    bgcolor="rgba(255,255,255,0.9)",
-                    bordercolor="#43e97b",
-                    borderwidth=2,
-                    borderpad=4
-                )
+                anotaciones_grafica.append({
+                    "x": df_total_con_aportaciones['Mes'].iloc[-1],
+                    "y": total_final_con_aport,
+                    "texto": f"<b>${total_final_con_aport:,.0f}</b><br>+${intereses_con_aport:,.0f} intereses",
+                    "color": "#43e97b",
+                    "ax": 40,
+                    "ay": -50
+                })
                 
                 # Anotación para SIN aportaciones (más pequeña) - solo si hay capital inicial
                 if df_total is not None:
                     total_final_correcto = total_invertido + ganancia_total
-                    fig.add_annotation(
-                        x=df_total['Mes'].iloc[-1],
-                        y=df_total['Total Acumulado'].iloc[-1],
-                        text=f"<b>${total_final_correcto:,.0f}</b>",
-                        showarrow=True,
-                        arrowhead=2,
-                        arrowsize=1,
-                        arrowwidth=2,
-                        arrowcolor="#667eea",
-                        ax=-40,
-                        ay=30,
-                        font=dict(size=11, color="#667eea", family="Arial"),
-                        bgcolor="rgba(255,255,255,0.85)",
-                        bordercolor="#667eea",
-                        borderwidth=1.5,
-                        borderpad=3
-                    )
-            else:
+                    anotaciones_grafica.append({
+                        "x": df_total['Mes'].iloc[-1],
+                        "y": df_total['Total Acumulado'].iloc[-1],
+                        "texto": f"<b>${total_final_correcto:,.0f}</b>",
+                        "color": "#667eea",
+                        "ax": -40,
+                        "ay": 30,
+                        "tamano": 11
+                    })
+            elif df_total is not None:
                 # Anotación normal sin aportaciones
-                if df_total is not None:
-                    total_final_correcto = total_invertido + ganancia_total
-                    
-                    fig.add_annotation(
-                        x=df_total['Mes'].iloc[-1],
-                        y=df_total['Total Acumulado'].iloc[-1],
-                        text=f"<b>${total_final_correcto:,.0f}</b><br>+${ganancia_total:,.0f}",
-                        showarrow=True,
-                        arrowhead=2,
-                        arrowsize=1,
-                        arrowwidth=2,
-                        arrowcolor="#667eea",
-                        ax=40,
-                        ay=-40,
-                        font=dict(size=12, color="#667eea", family="Arial"),
-                        bgcolor="rgba(255,255,255,0.9)",
-                        bordercolor="#667eea",
-                        borderwidth=2,
-                        borderpad=4
-                    )
-            
-            fig.update_layout(
-                height=450,
-                margin=dict(l=20, r=20, t=40, b=20),
-                hovermode='x unified',
-                template="plotly_white" if not modo_oscuro else "plotly_dark",
-                paper_bgcolor='rgba(0,0,0,0)',
-                plot_bgcolor='rgba(0,0,0,0)',
-                font=dict(
-                    size=12,
-                    color='#333333' if not modo_oscuro else '#c9d1d9',
-                    family="Arial"
-                ),
-                xaxis=dict(
-                    title="<b>Periodo (Meses)</b>",
-                    showgrid=True,
-                    gridwidth=1,
-                    gridcolor='rgba(200,200,200,0.2)',
-                    zeroline=False,
-                    showline=True,
-                    linewidth=2,
-                    linecolor='rgba(200,200,200,0.3)'
-                ),
-                yaxis=dict(
-                    title="<b>Monto Total (MXN)</b>",
-                    showgrid=True,
-                    gridwidth=1,
-                    gridcolor='rgba(200,200,200,0.2)',
-                    zeroline=False,
-                    showline=True,
-                    linewidth=2,
-                    linecolor='rgba(200,200,200,0.3)',
-                    tickformat="$,.0f"
-                ),
-                showlegend=True,
-                legend=dict(
-                    orientation="h",
-                    yanchor="top",
-                    y=-0.15,
-                    xanchor="center",
-                    x=0.5,
-                    bgcolor='rgba(255,255,255,0.8)' if not modo_oscuro else 'rgba(30,30,30,0.8)',
-                    bordercolor='rgba(200,200,200,0.3)',
-                    borderwidth=1,
-                    font=dict(size=11)
-                )
-            )
+                total_final_correcto = total_invertido + ganancia_total
+                anotaciones_grafica.append({
+                    "x": df_total['Mes'].iloc[-1],
+                    "y": df_total['Total Acumulado'].iloc[-1],
+                    "texto": f"<b>${total_final_correcto:,.0f}</b><br>+${ganancia_total:,.0f}",
+                    "color": "#667eea",
+                    "ax": 40,
+                    "ay": -40
+                })
             
+            fig = figura_crecimiento(series_grafica, anotaciones_grafica, oscuro=modo_oscuro)
             st.plotly_chart(fig, use_container_width=True, config={'displayModeBar': False})
             
             # Tab 2: Distribución Final (se llenará después de calcular todo)
@@ -3689,19 +5912,34 @@ def main():
                 st.markdown("---")
                 st.subheader("📋 Desglose Mensual Detallado")
                 
-                for inversion_key, df_proyeccion in zip(
-                    df_proyecciones_completo['SOFIPO'].unique(),
+                for numero, (inversion_key, df_proyeccion) in enumerate(zip(
+                    inversiones_seleccionadas,
                     proyecciones_todas
-                ):
+                )):
                     with st.expander(f"📊 {inversion_key}"):
-                        # Formatear el dataframe
-                        df_display = df_proyeccion.copy()
-                        df_display['Capital Inicial'] = df_display['Capital Inicial'].apply(lambda x: f"${x:,.2f}")
-                        df_display['Intereses Generados'] = df_display['Intereses Generados'].apply(lambda x: f"${x:,.2f}")
-                        df_display['Total Acumulado'] = df_display['Total Acumulado'].apply(lambda x: f"${x:,.2f}")
-                        df_display = df_display.drop('SOFIPO', axis=1)
+                        # Plazos largos: mensual los primeros 2 años, trimestral hasta el año 5 y anual después
+                        if periodo_simulacion > 24:
+                            renglones = np.concatenate(([0], cortes_resolucion_adaptativa(periodo_simulacion)))
+                            st.caption("Saldos al cierre de cada mes los primeros 2 años, de cada trimestre hasta el año 5 y de cada año después")
+                        else:
+                            renglones = slice(None)
                         
-                        st.dataframe(df_display, width="stretch", hide_index=True)
+                        tabla_desglose = crear_tabla([
+                            ("Mes", df_proyeccion['Mes'].to_numpy()[renglones], "entero"),
+                            ("Capital Inicial", df_proyeccion['Capital Inicial'].to_numpy()[renglones], "dinero"),
+                            ("Intereses Generados", df_proyeccion['Intereses Generados'].to_numpy()[renglones], "dinero"),
+                            ("Total Acumulado", df_proyeccion['Total Acumulado'].to_numpy()[renglones], "dinero"),
+                            *([
+                                ("Intereses Netos", df_proyeccion['Intereses Netos'].to_numpy()[renglones], "dinero"),
+                                ("Total Neto", df_proyeccion['Total Neto'].to_numpy()[renglones], "dinero")
+                            ] if modo_isr else []),
+                            ("Tasa Actual", df_proyeccion['Tasa Actual'].to_numpy()[renglones], "porcentaje")
+                        ])
+                        mostrar_tabla_numerica(
+                            tabla_desglose,
+                            key=f"tabla_desglose_{numero}",
+                            nombre_archivo=f"desglose_{re.sub(r'[^0-9A-Za-z]+', '_', inversion_key).strip('_').lower()}.csv"
+                        )
             
             # ====================================================================
             # IMPACTO DE APORTACIONES RECURRENTES
@@ -3783,7 +6021,6 @@ def main():
                 # CASO ESPECIAL: Si total_invertido = 0, necesitamos crear productos ficticios para la distribución
                 if total_invertido == 0:
                     # Crear una distribución basada en los productos habilitados por el usuario
-                    # Usamos la tasa de referencia del 15% del cálculo anterior
                     st.info("ℹ️ Dado que inicias desde $0, la distribución de aportaciones se simulará con productos habilitados de mayor rendimiento.")
                     
                     # Crear distribución ficticia inteligente usando productos habilitados
@@ -3793,20 +6030,25 @@ def main():
                     # Construir lista de productos disponibles según habilitaciones
                     productos_ficticios = []
                     
-                    if st.session_state.get("usa_didi", True):
-                        productos_ficticios.append({"key": "didi_16", "sofipo": "DiDi", "producto": "DiDi Ahorro", "tasa": 16.0, "limite": 10000})
-                    if st.session_state.get("usa_nu", True):
-                        productos_ficticios.append({"key": "nu_turbo", "sofipo": "Nu México", "producto": "Cajita Turbo", "tasa": 15.0, "limite": 25000})
-                    if st.session_state.get("usa_klar", True) and st.session_state.get("cumple_klar_plus", False):
-                        productos_ficticios.append({"key": "klar_max", "sofipo": "Klar", "producto": "Inversión Max", "tasa": 15.0, "limite": None})
-                    if st.session_state.get("usa_mercadopago", True) and st.session_state.get("cumple_mercadopago", False):
-                        productos_ficticios.append({"key": "mp_rendimiento", "sofipo": "Mercado Pago", "producto": "Mercado Pago Rendimiento", "tasa": 13.0, "limite": None})
-                    if st.session_state.get("usa_uala", True) and st.session_state.get("cumple_uala_plus", False):
-                        productos_ficticios.append({"key": "uala_plus", "sofipo": "Ualá", "producto": "Cuenta Plus", "tasa": 16.0, "limite": 50000})
-                    if st.session_state.get("usa_finsus", True):
-                        productos_ficticios.append({"key": "finsus_garantizado", "sofipo": "Finsus", "producto": "Garantizado", "tasa": 10.09, "limite": None})
-                    if st.session_state.get("usa_stori", True):
-                        productos_ficticios.append({"key": "stori_90", "sofipo": "Stori", "producto": "Inversión 90 días", "tasa": 10.0, "limite": None})
+                    # El mejor producto elegible de cada SOFIPO, con tasa y límite del catálogo
+                    tasas_ficticias = np.where(CATALOGO["tipo_calculo"] == TIPO_HIBRIDO, CATALOGO["tasa_premium"], CATALOGO["tasa_base"])
+                    mejores_ficticios = {}
+                    for i in np.flatnonzero(productos_elegibles(preferencias_usuario)).tolist():
+                        sofipo_ficticio = CATALOGO["claves"][i][0]
+                        mejor = mejores_ficticios.get(sofipo_ficticio)
+                        if mejor is None or tasas_ficticias[i] > tasas_ficticias[mejor]:
+                            mejores_ficticios[sofipo_ficticio] = i
+                    for i in mejores_ficticios.values():
+                        sofipo_ficticio, producto_ficticio = CATALOGO["claves"][i]
+                        info_ficticio = SOFIPOS_DATA[sofipo_ficticio]['productos'][producto_ficticio]
+                        productos_ficticios.append({
+                            "key": f"{sofipo_ficticio}_{producto_ficticio}",
+                            "sofipo": sofipo_ficticio,
+                            "producto": producto_ficticio,
+                            "tasa": tasas_ficticias[i].item(),
+                            "limite": info_ficticio['limite_premium'] if info_ficticio['tipo'] == "vista_hibrida" else info_ficticio.get('limite_max'),
+                            "liquido": info_ficticio['tipo'] != "plazo"
+                        })
                     
                     # Ordenar por tasa descendente
                     productos_ficticios.sort(key=lambda x: -x["tasa"])
@@ -3830,7 +6072,8 @@ def main():
                         inversiones_seleccionadas,
                         aportacion_monto,
                         estrategia_aportacion,
-                        total_invertido
+                        total_invertido,
+                        liquidez_objetivo_aportaciones
                     )
                 
                 # Mostrar estrategia seleccionada
@@ -3846,21 +6089,20 @@ def main():
                     st.markdown(f"**Monto por aportación:** \\${aportacion_monto:,.0f}")
                     st.markdown("---")
                     
-                    st.info("""
+                    renglones_ejemplo = ("\n" + " " * 20).join(ejemplo_aportaciones())
+                    st.info(f"""
                     **📊 Distribución Dinámica Inteligente**
                     
                     La distribución de tus aportaciones se recalcula **cada mes** automáticamente:
                     
                     1. **Prioriza mejores tasas**: Primero llena productos con mayor rendimiento
-                    2. **Respeta límites máximos**: DiDi $10k, Nu $25k, Klar $10k, etc.
+                    2. **Respeta límites máximos**: {limites_ejemplo_aportaciones()}, etc.
                     3. **Redistribuye automáticamente**: Cuando un producto alcanza su límite, el dinero va al siguiente mejor
                     4. **Maximiza tu rendimiento**: Siempre aprovecha las mejores oportunidades disponibles
+                    5. **Cuida la cobertura IPAB** (distribución inteligente): ninguna institución recibe más aportaciones al llegar a 25,000 UDIs, y si fijaste una liquidez mínima las aportaciones la reponen primero
                     
-                    **Ejemplo:** Si tienes aportaciones de $5,000 quincenales ($10,000/mes):
-                    - **Mes 1:** $10k → DiDi 16% (cabe todo)
-                    - **Mes 2:** DiDi ya tiene $10k → $10k va a Nu 15%
-                    - **Mes 3:** Nu recibe $10k más (ya tiene $20k)
-                    - **Mes 4:** Nu alcanza límite $25k → $5k a Nu + $5k a Klar 15%
+                    **Ejemplo:** Si tienes aportaciones de \\$5,000 quincenales (\\$10,000/mes):
+                    {renglones_ejemplo}
                     - Y así sucesivamente...
                     
                     ✨ **La tabla mes a mes te muestra exactamente cómo se distribuye cada aportación**
@@ -3873,572 +6115,334 @@ def main():
                 st.markdown("##### 📅 Proyección Mes a Mes de Aportaciones")
                 st.caption("Detalle de cómo se distribuirá cada aportación y el crecimiento acumulado por producto")
                 
-                # Calcular aportaciones por mes según frecuencia
-                aportaciones_por_mes_dict = {
-                    "Semanal": 4.33,
-                    "Quincenal": 2,
-                    "Mensual": 1
-                }
-                num_aportaciones_por_mes = aportaciones_por_mes_dict[frecuencia_aportacion]
-                
-                # Crear proyección mes a mes
-                proyeccion_mensual = []
-                
-                # Inicializar acumulados según el modo
+                # Productos que reciben aportaciones: (key, nombre, tasa, límite, saldo inicial)
                 if total_invertido == 0:
-                    # Modo $0: crear diccionario de productos ficticios con saldo inicial 0
-                    acumulados_por_producto = {key: 0 for key in distribucion_aportacion.keys()}
-                    # Crear mapeo de productos ficticios
-                    productos_info = {}
-                    for prod in productos_ficticios:
-                        productos_info[prod["key"]] = {
-                            "sofipo": prod["sofipo"],
-                            "producto": prod["producto"],
-                            "tasa": prod["tasa"],
-                            "limite": prod.get("limite", float('inf'))
-                        }
+                    # Modo $0: productos ficticios con saldo inicial 0
+                    productos_libro = [
+                        (prod["key"], f"{prod['sofipo']} ({prod['tasa']}%)", prod["tasa"], prod.get("limite") or float('inf'), 0)
+                        for prod in productos_ficticios
+                    ]
                 else:
                     # Modo normal: usar inversiones seleccionadas
-                    acumulados_por_producto = {key: inv['monto'] for key, inv in inversiones_seleccionadas.items()}
+                    productos_libro = []
+                    for key, inv_data in inversiones_seleccionadas.items():
+                        info = inv_data['producto_info']
+                        limite = info.get('limite_maximo') or info.get('limite_max') or info.get('limite_premium') or float('inf')
+                        productos_libro.append((key, f"{inv_data['sofipo']} ({info['tasa_base']}%)", info['tasa_base'], limite, inv_data['monto']))
                 
-                # Determinar nombre del periodo según frecuencia
-                nombre_periodo = {
-                    "Semanal": "Semana",
-                    "Quincenal": "Quincena",
-                    "Mensual": "Mes"
-                }[frecuencia_aportacion]
+                claves_libro = [prod[0] for prod in productos_libro]
+                if total_invertido == 0:
+                    sofipos_libro = [prod["sofipo"] for prod in productos_ficticios]
+                    liquidos_libro = [prod["liquido"] for prod in productos_ficticios]
+                else:
+                    sofipos_libro = [inv["sofipo"] for inv in inversiones_seleccionadas.values()]
+                    liquidos_libro = [inv["producto_info"]["tipo"] in ("vista", "vista_hibrida") for inv in inversiones_seleccionadas.values()]
                 
-                # Calcular cuántos periodos hay en total
-                periodos_por_mes = num_aportaciones_por_mes
-                total_periodos = int(periodo_simulacion * periodos_por_mes)
+                # Reglas del reparto según la estrategia de aportaciones
+                if estrategia_aportacion == "Misma distribución que capital inicial" and total_invertido > 0:
+                    reglas_libro = {"pesos": [prod[4] for prod in productos_libro]}
+                elif estrategia_aportacion == "Distribución inteligente automática":
+                    reglas_libro = {
+                        "sofipos": sofipos_libro,
+                        "liquidos": liquidos_libro,
+                        "liquidez_objetivo": liquidez_objetivo_aportaciones
+                    }
+                else:
+                    reglas_libro = {}
+                nombres_libro = [prod[1] for prod in productos_libro]
+                tasas_libro = np.array([prod[2] for prod in productos_libro], dtype=float)
                 
-                # Variables para tracking
-                intereses_acumulados_total = 0
+                llave_libro = enviar_tarea(
+                    calcular_libro_aportaciones,
+                    saldos_iniciales=[prod[4] for prod in productos_libro],
+                    tasas=tasas_libro,
+                    limites=[prod[3] for prod in productos_libro],
+                    aportacion=aportacion_monto,
+                    frecuencia=frecuencia_aportacion,
+                    meses=periodo_simulacion,
+                    retencion_isr=retencion_isr,
+                    escenario=escenario_tasas,
+                    **reglas_libro
+                )
+                libro = resultado_tarea(llave_libro)
                 
-                proyeccion_periodos = []
-                periodo_actual = 1
+                if libro is None:
+                    mostrar_progreso_tarea(llave_libro, f"Calculando {formato_plazo(periodo_simulacion)} de aportaciones...")
+                else:
+                    num_periodos = len(libro["mes"])
                 
-                for mes in range(1, periodo_simulacion + 1):
-                    # Calcular cuántos periodos hay en este mes
-                    num_periodos_mes = int(periodos_por_mes) if periodos_por_mes == int(periodos_por_mes) else periodos_por_mes
-                    
-                    if frecuencia_aportacion == "Semanal":
-                        # 4.33 semanas por mes, distribuir apropiadamente
-                        periodos_este_mes = [1] * 4
-                        if mes % 3 == 0:  # Cada 3 meses hay una semana extra
-                            periodos_este_mes.append(1)
+                    # Saldos finales por producto (modo $0: solo los que recibieron dinero)
+                    saldos_finales = libro["saldos"][-1] if num_periodos else np.array([prod[4] for prod in productos_libro], dtype=float)
+                    acumulados_por_producto = {
+                        key: saldo
+                        for key, saldo in zip(claves_libro, saldos_finales)
+                        if total_invertido > 0 or saldo > 0 or key in distribucion_aportacion
+                    }
+                    intereses_acumulados_total = libro["intereses_acumulados"][-1] if num_periodos else 0
+                
+                    # Determinar nombre del periodo según frecuencia
+                    nombre_periodo = {
+                        "Semanal": "Semana",
+                        "Quincenal": "Quincena",
+                        "Mensual": "Mes"
+                    }[frecuencia_aportacion]
+                
+                    tabla_libro_exportacion = tabla_libro_aportaciones(libro, nombres_libro, aportacion_monto, nombre_periodo, con_isr=modo_isr)
+                
+                    # Vista adaptativa: mensual los primeros 2 años, trimestral hasta el año 5 y anual después
+                    vista_libro = st.radio(
+                        "Ver tabla:",
+                        ["📆 Resumida", f"🔎 Cada {nombre_periodo.lower()}"],
+                        index=0 if periodo_simulacion > 24 else 1,
+                        horizontal=True,
+                        key="vista_libro_aportaciones",
+                        help="La vista resumida agrupa por mes los primeros 2 años, por trimestre hasta el año 5 y por año después"
+                    )
+                
+                    if vista_libro == "📆 Resumida" and num_periodos:
+                        cortes = cortes_resolucion_adaptativa(periodo_simulacion)
+                        fin_renglon = np.searchsorted(libro["mes"], cortes, side="right") - 1
+                        inicio_renglon = np.concatenate(([0], fin_renglon[:-1] + 1))
+                        meses_inicio = np.concatenate(([1], cortes[:-1] + 1))
+                        con_periodos = fin_renglon >= inicio_renglon
+                        etiquetas_renglon = [
+                            etiqueta_rango_meses(inicio, fin_mes)
+                            for inicio, fin_mes in zip(meses_inicio[con_periodos], cortes[con_periodos])
+                        ]
+                        inicio_renglon = inicio_renglon[con_periodos]
+                        fin_renglon = fin_renglon[con_periodos]
                     else:
-                        periodos_este_mes = [1] * int(num_periodos_mes)
-                    
-                    for _ in periodos_este_mes:
-                        # DISTRIBUCIÓN DINÁMICA: Recalcular según límites disponibles
-                        monto_aportacion_periodo = aportacion_monto
-                        monto_restante = monto_aportacion_periodo
-                        
-                        # Ordenar productos por tasa descendente
-                        if total_invertido == 0:
-                            productos_ordenados = sorted(productos_ficticios, key=lambda x: -x["tasa"])
-                        else:
-                            productos_ordenados = sorted(
-                                [(k, v) for k, v in inversiones_seleccionadas.items()],
-                                key=lambda x: -x[1]['producto_info']['tasa_base']
-                            )
-                        
-                        # Primero calcular intereses sobre saldos actuales
-                        intereses_periodo = 0
-                        dias = 30 / periodos_por_mes  # Días por periodo
-                        
-                        for key in acumulados_por_producto.keys():
-                            if acumulados_por_producto[key] > 0:
-                                if total_invertido == 0:
-                                    prod_info = next((p for p in productos_ficticios if p["key"] == key), None)
-                                    if prod_info:
-                                        tasa = prod_info["tasa"]
-                                        interes = calcular_interes_compuesto(acumulados_por_producto[key], tasa, dias)
-                                        acumulados_por_producto[key] += interes
-                                        intereses_periodo += interes
-                                else:
-                                    inv_data = inversiones_seleccionadas[key]
-                                    tasa = inv_data['producto_info']['tasa_base']
-                                    interes = calcular_interes_compuesto(acumulados_por_producto[key], tasa, dias)
-                                    acumulados_por_producto[key] += interes
-                                    intereses_periodo += interes
-                        
-                        intereses_acumulados_total += intereses_periodo
-                        
-                        # Ahora distribuir la aportación
-                        sofipos_usadas = []
-                        for item in productos_ordenados:
-                            if monto_restante <= 0:
-                                break
-                            
-                            if total_invertido == 0:
-                                sofipo_key = item["key"]
-                                limite = item.get("limite") or float('inf')
-                                nombre_sofipo = f"{item['sofipo']} ({item['tasa']}%)"
-                            else:
-                                sofipo_key, inv_data = item
-                                limite = inv_data['producto_info'].get('limite_maximo') or inv_data['producto_info'].get('limite_max') or inv_data['producto_info'].get('limite_premium') or float('inf')
-                                nombre_sofipo = f"{inv_data['sofipo']} ({inv_data['producto_info']['tasa_base']}%)"
-                            
-                            if limite is None:
-                                limite = float('inf')
-                            
-                            # Calcular espacio disponible
-                            espacio_disponible = max(0, limite - acumulados_por_producto.get(sofipo_key, 0))
-                            monto_a_aportar = min(espacio_disponible, monto_restante)
-                            
-                            if monto_a_aportar > 0:
-                                acumulados_por_producto[sofipo_key] = acumulados_por_producto.get(sofipo_key, 0) + monto_a_aportar
-                                sofipos_usadas.append(f"{nombre_sofipo}: \\${monto_a_aportar:,.0f} → Total: \\${acumulados_por_producto[sofipo_key]:,.0f}")
-                                monto_restante -= monto_a_aportar
-                        
-                        # Crear fila para este periodo
-                        total_acumulado_general = sum(acumulados_por_producto.values())
-                        
-                        proyeccion_periodos.append({
-                            nombre_periodo: periodo_actual,
-                            "Aportación": f"${monto_aportacion_periodo:,.0f}",
-                            "Distribución": " | ".join(sofipos_usadas) if sofipos_usadas else "Sin distribución",
-                            "Total Acumulado": f"${total_acumulado_general:,.0f}",
-                            "Intereses Totales": f"${intereses_acumulados_total:,.0f}"
-                        })
-                        
-                        periodo_actual += 1
-                        
-                        if periodo_actual > total_periodos:
-                            break
-                    
-                    if periodo_actual > total_periodos:
-                        break
+                        inicio_renglon = fin_renglon = np.arange(num_periodos)
+                        etiquetas_renglon = None
+                
+                    # La distribución se arma solo para los renglones visibles
+                    asignado_acumulado = np.vstack([np.zeros(len(productos_libro)), np.cumsum(libro["asignado"], axis=0)])
+                    orden_tasas = np.argsort(-tasas_libro, kind="stable")
+                    aportaciones_renglon = fin_renglon - inicio_renglon + 1
+                
+                    def distribucion_renglones(indices):
+                        textos = []
+                        for r in indices:
+                            primero, ultimo = inicio_renglon[r], fin_renglon[r]
+                            asignado_renglon = asignado_acumulado[ultimo + 1] - asignado_acumulado[primero]
+                            sofipos_usadas = [
+                                f"{nombres_libro[i]}: ${asignado_renglon[i]:,.0f} → Total: ${libro['saldos'][ultimo, i]:,.0f}"
+                                for i in orden_tasas
+                                if asignado_renglon[i] > 0
+                            ]
+                            textos.append(" | ".join(sofipos_usadas) if sofipos_usadas else "Sin distribución")
+                        return textos
+                
+                    if etiquetas_renglon is None:
+                        columnas_libro = [
+                            (nombre_periodo, np.arange(1, num_periodos + 1), "entero"),
+                            ("Aportación", np.full(num_periodos, float(aportacion_monto)), "dinero")
+                        ]
+                    else:
+                        columnas_libro = [
+                            ("Periodo", lambda indices: [etiquetas_renglon[r] for r in indices], "texto"),
+                            ("Aportaciones", aportaciones_renglon, "entero"),
+                            ("Aportación", aportacion_monto * aportaciones_renglon.astype(float), "dinero")
+                        ]
+                    columnas_libro += [
+                        ("Mes", libro["mes"][fin_renglon], "entero"),
+                        ("Distribución", distribucion_renglones, "texto"),
+                        ("Total Acumulado", libro["total"][fin_renglon], "dinero"),
+                        ("Intereses Totales", libro["intereses_acumulados"][fin_renglon], "dinero")
+                    ]
+                    if modo_isr:
+                        columnas_libro += [
+                            ("Total Neto", libro["total_neto"][fin_renglon], "dinero"),
+                            ("Intereses Netos", libro["intereses_netos"][fin_renglon], "dinero")
+                        ]
+                
+                    mostrar_tabla_numerica(
+                        crear_tabla(columnas_libro),
+                        key="tabla_libro_aportaciones",
+                        nombre_archivo=f"aportaciones_{frecuencia_aportacion.lower()}.csv",
+                        altura=400
+                    )
                 
-                # Crear DataFrame
-                df_proyeccion = pd.DataFrame(proyeccion_periodos)
+                    if num_periodos and libro["sin_asignar"][-1] > 0:
+                        st.warning(f"⚠️ **${libro['sin_asignar'][-1]:,.0f}** de tus aportaciones ya no caben en ningún producto (límites y cobertura IPAB). Se cuentan en el total, pero sin rendimiento: considera agregar otra SOFIPO.")
                 
-                # Mostrar tabla
-                st.dataframe(df_proyeccion, use_container_width=True, hide_index=True, height=400)
+                    # Saldos al cierre de cada mes: las aportaciones también pueden llevar una institución arriba del tope
+                    if num_periodos:
+                        with st.expander("🛡️ Cobertura IPAB en el tiempo (con aportaciones)"):
+                            cierre_mes = np.maximum(np.searchsorted(libro["mes"], np.arange(1, periodo_simulacion + 1), side="right") - 1, 0)
+                            mostrar_cobertura_ipab(
+                                np.vstack([[prod[4] for prod in productos_libro], libro["saldos"][cierre_mes]]),
+                                sofipos_libro,
+                                oscuro=modo_oscuro
+                            )
                 
-                # ====================================================================
-                # TAB 2: VISUALIZACIÓN FINAL - DISTRIBUCIÓN DEL PORTAFOLIO
-                # ====================================================================
-                # Usamos los valores EXACTOS calculados dinámicamente
+                    # ====================================================================
+                    # TAB 2: VISUALIZACIÓN FINAL - DISTRIBUCIÓN DEL PORTAFOLIO
+                    # ====================================================================
+                    # Usamos los valores EXACTOS calculados dinámicamente
                 
-                if acumulados_por_producto:
-                    with tab2:
-                        st.markdown("## 🎯 Tu Portafolio Final - Análisis Completo")
+                    if acumulados_por_producto:
+                        with tab2:
+                            st.markdown("## 🎯 Tu Portafolio Final - Análisis Completo")
                     
-                        # Calcular valores EXACTOS una sola vez
-                        total_final_exacto = sum(acumulados_por_producto.values())
-                        total_aportado_exacto = periodo_simulacion * num_aportaciones_por_mes * aportacion_monto
-                        intereses_exactos = intereses_acumulados_total
+                            # Calcular valores EXACTOS una sola vez
+                            total_final_exacto = sum(acumulados_por_producto.values())
+                            total_aportado_exacto = num_periodos * aportacion_monto
+                            intereses_exactos = intereses_acumulados_total
                         
-                        # Verificación: el total debe ser aportaciones + intereses (si empieza en $0)
-                        # O capital_inicial + intereses + aportaciones (si hay capital inicial)
-                        if total_invertido == 0:
-                            # Modo $0: Total = Aportaciones + Intereses
-                            verificacion_total = total_aportado_exacto + intereses_exactos
-                        else:
-                            # Con capital: Total = Capital + Aportaciones + Intereses
-                            verificacion_total = total_invertido + total_aportado_exacto + intereses_exactos
+                            # Verificación: el total debe ser aportaciones + intereses (si empieza en $0)
+                            # O capital_inicial + intereses + aportaciones (si hay capital inicial)
+                            if total_invertido == 0:
+                                # Modo $0: Total = Aportaciones + Intereses
+                                verificacion_total = total_aportado_exacto + intereses_exactos
+                            else:
+                                # Con capital: Total = Capital + Aportaciones + Intereses
+                                verificacion_total = total_invertido + total_aportado_exacto + intereses_exactos
                         
-                        # Usar el valor verificado para consistencia
-                        total_final_exacto = verificacion_total
+                            # Usar el valor verificado para consistencia
+                            total_final_exacto = verificacion_total
                         
-                        # ============================================================
-                        # DISEÑO PROFESIONAL: Cards de métricas principales
-                        # ============================================================
+                            # ============================================================
+                            # DISEÑO PROFESIONAL: Cards de métricas principales
+                            # ============================================================
                         
-                        st.markdown('<div style="background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); padding: 2rem; border-radius: 15px; margin-bottom: 2rem;">', unsafe_allow_html=True)
+                            st.markdown('<div style="background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); padding: 2rem; border-radius: 15px; margin-bottom: 2rem;">', unsafe_allow_html=True)
                         
-                        col_m1, col_m2, col_m3 = st.columns(3)
+                            col_m1, col_m2, col_m3 = st.columns(3)
                         
-                        with col_m1:
-                            st.markdown(f"""
-                            <div style="background: rgba(255,255,255,0.95); padding: 1.5rem; border-radius: 10px; text-align: center; box-shadow: 0 4px 6px rgba(0,0,0,0.1);">
-                                <div style="font-size: 0.9rem; color: #666; font-weight: 600; margin-bottom: 0.5rem;">💰 TOTAL ACUMULADO</div>
-                                <div style="font-size: 2.2rem; font-weight: 700; color: #667eea; margin-bottom: 0.3rem;">${total_final_exacto:,.2f}</div>
-                                <div style="font-size: 0.8rem; color: #888;">Al final de {periodo_simulacion} meses</div>
-                            </div>
-                            """, unsafe_allow_html=True)
+                            with col_m1:
+                                st.markdown(f"""
+                                <div style="background: rgba(255,255,255,0.95); padding: 1.5rem; border-radius: 10px; text-align: center; box-shadow: 0 4px 6px rgba(0,0,0,0.1);">
+                                    <div style="font-size: 0.9rem; color: #666; font-weight: 600; margin-bottom: 0.5rem;">💰 TOTAL ACUMULADO</div>
+                                    <div style="font-size: 2.2rem; font-weight: 700; color: #667eea; margin-bottom: 0.3rem;">${total_final_exacto:,.2f}</div>
+                                    <div style="font-size: 0.8rem; color: #888;">Al final de {periodo_simulacion} meses</div>
+                                </div>
+                                """, unsafe_allow_html=True)
                         
-                        with col_m2:
-                            st.markdown(f"""
-                            <div style="background: rgba(255,255,255,0.95); padding: 1.5rem; border-radius: 10px; text-align: center; box-shadow: 0 4px 6px rgba(0,0,0,0.1);">
-                                <div style="font-size: 0.9rem; color: #666; font-weight: 600; margin-bottom: 0.5rem;">📥 TOTAL APORTADO</div>
-                                <div style="font-size: 2.2rem; font-weight: 700; color: #43e97b; margin-bottom: 0.3rem;">${total_aportado_exacto:,.2f}</div>
-                                <div style="font-size: 0.8rem; color: #888;">{periodo_simulacion * int(num_aportaciones_por_mes)} aportaciones de ${aportacion_monto:,.0f}</div>
-                            </div>
-                            """, unsafe_allow_html=True)
+                            with col_m2:
+                                st.markdown(f"""
+                                <div style="background: rgba(255,255,255,0.95); padding: 1.5rem; border-radius: 10px; text-align: center; box-shadow: 0 4px 6px rgba(0,0,0,0.1);">
+                                    <div style="font-size: 0.9rem; color: #666; font-weight: 600; margin-bottom: 0.5rem;">📥 TOTAL APORTADO</div>
+                                    <div style="font-size: 2.2rem; font-weight: 700; color: #43e97b; margin-bottom: 0.3rem;">${total_aportado_exacto:,.2f}</div>
+                                    <div style="font-size: 0.8rem; color: #888;">{num_periodos:,} aportaciones de ${aportacion_monto:,.0f}</div>
+                                </div>
+                                """, unsafe_allow_html=True)
                         
-                        with col_m3:
-                            rendimiento_efectivo = (intereses_exactos / total_aportado_exacto * 100) if total_aportado_exacto > 0 else 0
-                            st.markdown(f"""
-                            <div style="background: rgba(255,255,255,0.95); padding: 1.5rem; border-radius: 10px; text-align: center; box-shadow: 0 4px 6px rgba(0,0,0,0.1);">
-                                <div style="font-size: 0.9rem; color: #666; font-weight: 600; margin-bottom: 0.5rem;">📈 INTERESES GENERADOS</div>
-                                <div style="font-size: 2.2rem; font-weight: 700; color: #f093fb; margin-bottom: 0.3rem;">${intereses_exactos:,.2f}</div>
-                                <div style="font-size: 0.8rem; color: #888;">{rendimiento_efectivo:.2f}% sobre tus aportaciones</div>
-                            </div>
-                            """, unsafe_allow_html=True)
+                            with col_m3:
+                                rendimiento_efectivo = (intereses_exactos / total_aportado_exacto * 100) if total_aportado_exacto > 0 else 0
+                                st.markdown(f"""
+                                <div style="background: rgba(255,255,255,0.95); padding: 1.5rem; border-radius: 10px; text-align: center; box-shadow: 0 4px 6px rgba(0,0,0,0.1);">
+                                    <div style="font-size: 0.9rem; color: #666; font-weight: 600; margin-bottom: 0.5rem;">📈 INTERESES GENERADOS</div>
+                                    <div style="font-size: 2.2rem; font-weight: 700; color: #f093fb; margin-bottom: 0.3rem;">${intereses_exactos:,.2f}</div>
+                                    <div style="font-size: 0.8rem; color: #888;">{rendimiento_efectivo:.2f}% sobre tus aportaciones</div>
+                                </div>
+                                """, unsafe_allow_html=True)
                         
-                        st.markdown('</div>', unsafe_allow_html=True)
+                            st.markdown('</div>', unsafe_allow_html=True)
                         
-                        # ============================================================
-                        # GRÁFICA DE DISTRIBUCIÓN + DESGLOSE
-                        # ============================================================
+                            if modo_isr and num_periodos:
+                                intereses_netos_exactos = libro["intereses_netos"][-1]
+                                st.info(
+                                    f"🧾 **Después de ISR ({retencion_isr * 100:.2f}% anual)**: terminas con "
+                                    f"**${libro['total_neto'][-1]:,.2f}**; intereses netos ${intereses_netos_exactos:,.2f} "
+                                    f"(ISR retenido ${intereses_exactos - intereses_netos_exactos:,.2f})"
+                                )
                         
-                        col_viz, col_detalle = st.columns([1.5, 1])
+                            # ============================================================
+                            # GRÁFICA DE DISTRIBUCIÓN + DESGLOSE
+                            # ============================================================
                         
-                        with col_viz:
-                            st.markdown("### 🎨 Distribución por SOFIPO")
-                            
-                            # Preparar datos del pie chart con valores EXACTOS
-                            labels_pie = []
-                            values_pie = []
-                            colors_pie = []
+                            col_viz, col_detalle = st.columns([1.5, 1])
+                        
+                            with col_viz:
+                                st.markdown("### 🎨 Distribución por SOFIPO")
                             
-                            color_map = {
-                                "DiDi": "#FF6B6B",
-                                "Nu México": "#8B5CF6",
-                                "Klar": "#3B82F6",
-                                "Mercado Pago": "#FCD34D",
-                                "Ualá": "#10B981",
-                                "Finsus": "#F59E0B",
-                                "Stori": "#EC4899"
-                            }
+                                # Preparar datos del pie chart con valores EXACTOS
+                                labels_pie = []
+                                values_pie = []
+                                colors_pie = []
                             
-                            for key, monto in sorted(acumulados_por_producto.items(), key=lambda x: -x[1]):
-                                if monto > 0:
-                                    # Obtener nombre de la SOFIPO
-                                    if total_invertido == 0:
-                                        prod_info = next((p for p in productos_ficticios if p["key"] == key), None)
-                                        if prod_info:
-                                            nombre = prod_info["sofipo"]
-                                            tasa = prod_info["tasa"]
-                                    else:
-                                        inv_data = inversiones_seleccionadas.get(key)
-                                        if inv_data:
-                                            nombre = inv_data["sofipo"]
-                                            tasa = inv_data["producto_info"]["tasa_base"]
+                                for key, monto in sorted(acumulados_por_producto.items(), key=lambda x: -x[1]):
+                                    if monto > 0:
+                                        # Obtener nombre de la SOFIPO
+                                        if total_invertido == 0:
+                                            prod_info = next((p for p in productos_ficticios if p["key"] == key), None)
+                                            if prod_info:
+                                                nombre = prod_info["sofipo"]
+                                                tasa = prod_info["tasa"]
+                                        else:
+                                            inv_data = inversiones_seleccionadas.get(key)
+                                            if inv_data:
+                                                nombre = inv_data["sofipo"]
+                                                tasa = inv_data["producto_info"]["tasa_base"]
                                     
-                                    porcentaje = (monto / total_final_exacto * 100)
-                                    labels_pie.append(f"{nombre} ({tasa}%)<br>{porcentaje:.1f}%")
-                                    values_pie.append(monto)
-                                    colors_pie.append(color_map.get(nombre, "#94A3B8"))
-                            
-                            # Crear pie chart mejorado
-                            fig_pie = go.Figure(data=[go.Pie(
-                                labels=labels_pie,
-                                values=values_pie,
-                                marker=dict(
-                                    colors=colors_pie,
-                                    line=dict(color='white', width=3)
-                                ),
-                                hole=0.45,
-                                textinfo='none',  # No mostrar texto en el chart
-                                hovertemplate='<b>%{label}</b><br>Monto: $%{value:,.2f}<extra></extra>',
-                                pull=[0.02] * len(labels_pie)  # Separar ligeramente
-                            )])
-                            
-                            # Agregar anotación en el centro
-                            fig_pie.add_annotation(
-                                text=f"<b>${total_final_exacto:,.0f}</b><br><span style='font-size:14px;'>Total Final</span>",
-                                x=0.5, y=0.5,
-                                font=dict(size=24, color='#667eea', family="Arial", weight="bold"),
-                                showarrow=False
-                            )
-                            
-                            fig_pie.update_layout(
-                                showlegend=True,
-                                height=450,
-                                margin=dict(t=10, b=10, l=10, r=10),
-                                paper_bgcolor='rgba(0,0,0,0)',
-                                legend=dict(
-                                    orientation="h",
-                                    yanchor="bottom",
-                                    y=-0.2,
-                                    xanchor="center",
-                                    x=0.5,
-                                    font=dict(size=11)
-                                )
-                            )
+                                        porcentaje = (monto / total_final_exacto * 100)
+                                        labels_pie.append(f"{nombre} ({tasa}%)<br>{porcentaje:.1f}%")
+                                        values_pie.append(monto)
+                                        colors_pie.append(COLORES_SOFIPO.get(nombre, "#94A3B8"))
                             
-                            st.plotly_chart(fig_pie, use_container_width=True, config={'displayModeBar': False})
+                                fig_pie = figura_distribucion(labels_pie, values_pie, colors_pie, total_final_exacto, oscuro=modo_oscuro)
+                                st.plotly_chart(fig_pie, use_container_width=True, config={'displayModeBar': False})
                         
-                        with col_detalle:
-                            st.markdown("### 📊 Desglose Detallado")
+                            with col_detalle:
+                                st.markdown("### 📊 Desglose Detallado")
                             
-                            # Mostrar lista ordenada por monto
-                            for key, monto in sorted(acumulados_por_producto.items(), key=lambda x: -x[1]):
-                                if monto > 0:
-                                    if total_invertido == 0:
-                                        prod_info = next((p for p in productos_ficticios if p["key"] == key), None)
-                                        if prod_info:
-                                            nombre = prod_info["sofipo"]
-                                            tasa = prod_info["tasa"]
-                                    else:
-                                        inv_data = inversiones_seleccionadas.get(key)
-                                        if inv_data:
-                                            nombre = inv_data["sofipo"]
-                                            producto_info = inv_data["producto_info"]
+                                # Mostrar lista ordenada por monto
+                                for key, monto in sorted(acumulados_por_producto.items(), key=lambda x: -x[1]):
+                                    if monto > 0:
+                                        if total_invertido == 0:
+                                            prod_info = next((p for p in productos_ficticios if p["key"] == key), None)
+                                            if prod_info:
+                                                nombre = prod_info["sofipo"]
+                                                tasa = prod_info["tasa"]
+                                        else:
+                                            inv_data = inversiones_seleccionadas.get(key)
+                                            if inv_data:
+                                                nombre = inv_data["sofipo"]
+                                                producto_info = inv_data["producto_info"]
                                             
-                                            # Calcular tasa efectiva para productos híbridos
-                                            if producto_info.get("tipo") == "vista_hibrida" and "tasa_premium" in producto_info:
-                                                limite = producto_info.get("limite_premium", 0)
-                                                if monto <= limite:
-                                                    # Todo el monto está en tasa premium
-                                                    tasa = producto_info["tasa_premium"]
+                                                # Calcular tasa efectiva para productos híbridos
+                                                if producto_info.get("tipo") == "vista_hibrida" and "tasa_premium" in producto_info:
+                                                    limite = producto_info.get("limite_premium", 0)
+                                                    if monto <= limite:
+                                                        # Todo el monto está en tasa premium
+                                                        tasa = producto_info["tasa_premium"]
+                                                    else:
+                                                        # Calcular tasa ponderada
+                                                        monto_premium = limite
+                                                        monto_base = monto - limite
+                                                        tasa_ponderada = (monto_premium * producto_info["tasa_premium"] + monto_base * producto_info["tasa_base"]) / monto
+                                                        tasa = round(tasa_ponderada, 2)
                                                 else:
-                                                    # Calcular tasa ponderada
-                                                    monto_premium = limite
-                                                    monto_base = monto - limite
-                                                    tasa_ponderada = (monto_premium * producto_info["tasa_premium"] + monto_base * producto_info["tasa_base"]) / monto
-                                                    tasa = round(tasa_ponderada, 2)
-                                            else:
-                                                tasa = producto_info["tasa_base"]
+                                                    tasa = producto_info["tasa_base"]
                                     
-                                    porcentaje = (monto / total_final_exacto * 100)
-                                    color = color_map.get(nombre, "#94A3B8")
+                                        porcentaje = (monto / total_final_exacto * 100)
+                                        color = COLORES_SOFIPO.get(nombre, "#94A3B8")
                                     
-                                    st.markdown(f"""
-                                    <div style="background: {color}15; padding: 1rem; border-radius: 8px; margin-bottom: 0.8rem; border-left: 4px solid {color};">
-                                        <div style="display: flex; justify-content: space-between; align-items: center;">
-                                            <div>
-                                                <div style="font-weight: 700; font-size: 1.1rem; color: {color};">{nombre}</div>
-                                                <div style="font-size: 0.85rem; color: #666; margin-top: 0.2rem;">{tasa}% anual</div>
-                                            </div>
-                                            <div style="text-align: right;">
-                                                <div style="font-weight: 700; font-size: 1.2rem; color: #333;">${monto:,.2f}</div>
-                                                <div style="font-size: 0.85rem; color: #888;">{porcentaje:.2f}%</div>
+                                        st.markdown(f"""
+                                        <div style="background: {color}15; padding: 1rem; border-radius: 8px; margin-bottom: 0.8rem; border-left: 4px solid {color};">
+                                            <div style="display: flex; justify-content: space-between; align-items: center;">
+                                                <div>
+                                                    <div style="font-weight: 700; font-size: 1.1rem; color: {color};">{nombre}</div>
+                                                    <div style="font-size: 0.85rem; color: #666; margin-top: 0.2rem;">{tasa}% anual</div>
+                                                </div>
+                                                <div style="text-align: right;">
+                                                    <div style="font-weight: 700; font-size: 1.2rem; color: #333;">${monto:,.2f}</div>
+                                                    <div style="font-size: 0.85rem; color: #888;">{porcentaje:.2f}%</div>
+                                                </div>
                                             </div>
                                         </div>
-                                    </div>
-                                    """, unsafe_allow_html=True)
-                            
-                            # Mostrar totales de verificación
-                            st.markdown("---")
-                            st.markdown("**✓ Verificación:**")
-                            st.caption(f"Suma de partes: ${sum(acumulados_por_producto.values()):,.2f}")
-                            st.caption(f"Total mostrado: ${total_final_exacto:,.2f}")
-                            diferencia = abs(sum(acumulados_por_producto.values()) - total_final_exacto)
-                            if diferencia < 0.01:
-                                st.success("✓ Números verificados correctamente")
-                    
-                    # ====================================================================
-                # DASHBOARD EJECUTIVO - ELIMINADO
-                # ====================================================================
-                # Sección eliminada por solicitud del usuario
-                
-                if False:  # Dashboard deshabilitado
-                    st.markdown("---")
-                    st.markdown("### 📊 Dashboard Ejecutivo - Tu Portafolio Final")
-                    st.caption("🚀 Análisis completo después de capital inicial + aportaciones")
-                    
-                    # Calcular métricas del portafolio FINAL
-                    total_final = sum(acumulados_por_producto.values())
-                    
-                    # Contar SOFIPOs únicas en el portafolio final
-                    num_sofipos_final = len([m for m in acumulados_por_producto.values() if m > 0])
-                    
-                    # Calcular concentración máxima
-                    if total_final > 0:
-                        concentracion_maxima = max(acumulados_por_producto.values()) / total_final * 100
-                    else:
-                        concentracion_maxima = 0
-                    
-                    # Calcular tasa ponderada final
-                    if total_invertido > 0:
-                        # Con capital inicial: usar rendimiento calculado antes
-                        tasa_final = rendimiento_ponderado
-                    else:
-                        # Solo aportaciones: calcular tasa efectiva
-                        aportaciones_totales = periodo_simulacion * num_aportaciones_por_mes * aportacion_monto
-                        if aportaciones_totales > 0:
-                            tasa_final = (intereses_acumulados_total / aportaciones_totales) * (12 / periodo_simulacion) * 100
-                        else:
-                            tasa_final = 0
-                    
-                    # ====================================================================
-                    # SISTEMA DE SCORE INTELIGENTE (0-100)
-                    # ====================================================================
-                    
-                    score_total = 0
-                    componentes_score = []
-                    
-                    # 1. RENDIMIENTO (40 puntos máximo)
-                    if tasa_final >= 15:
-                        score_rendimiento = 40
-                        nivel_rendimiento = "Excelente"
-                    elif tasa_final >= 14:
-                        score_rendimiento = 35
-                        nivel_rendimiento = "Muy Bueno"
-                    elif tasa_final >= 13:
-                        score_rendimiento = 30
-                        nivel_rendimiento = "Bueno"
-                    elif tasa_final >= 12:
-                        score_rendimiento = 25
-                        nivel_rendimiento = "Aceptable"
-                    else:
-                        score_rendimiento = int((tasa_final / 12) * 25)
-                        nivel_rendimiento = "Mejorable"
-                    
-                    score_total += score_rendimiento
-                    componentes_score.append(("Rendimiento", score_rendimiento, 40, nivel_rendimiento))
-                    
-                    # 2. PROTECCIÓN IPAB (25 puntos máximo)
-                    montos_por_sofipo_final = {}
-                    for key, monto in acumulados_por_producto.items():
-                        if monto > 0:
-                            if total_invertido == 0:
-                                prod_info = next((p for p in productos_ficticios if p["key"] == key), None)
-                                if prod_info:
-                                    sofipo_nombre = prod_info["sofipo"]
-                            else:
-                                inv_data = inversiones_seleccionadas.get(key)
-                                if inv_data:
-                                    sofipo_nombre = inv_data["sofipo"]
+                                        """, unsafe_allow_html=True)
                             
-                            if sofipo_nombre not in montos_por_sofipo_final:
-                                montos_por_sofipo_final[sofipo_nombre] = 0
-                            montos_por_sofipo_final[sofipo_nombre] += monto
-                    
-                    proteccion_ipab_completa = all(monto <= 200000 for monto in montos_por_sofipo_final.values())
-                    
-                    if proteccion_ipab_completa:
-                        score_ipab = 25
-                        nivel_ipab = "100% Protegido"
-                    else:
-                        monto_protegido = sum(min(m, 200000) for m in montos_por_sofipo_final.values())
-                        porcentaje_protegido = (monto_protegido / total_final * 100) if total_final > 0 else 0
-                        score_ipab = int((porcentaje_protegido / 100) * 25)
-                        nivel_ipab = f"{porcentaje_protegido:.0f}% Protegido"
-                    
-                    score_total += score_ipab
-                    componentes_score.append(("Protección IPAB", score_ipab, 25, nivel_ipab))
-                    
-                    # 3. DIVERSIFICACIÓN (20 puntos máximo)
-                    if num_sofipos_final >= 5:
-                        score_diversificacion = 20
-                        nivel_diversificacion = "Excelente"
-                    elif num_sofipos_final >= 3:
-                        score_diversificacion = 16
-                        nivel_diversificacion = "Muy Buena"
-                    elif num_sofipos_final >= 2:
-                        score_diversificacion = 12
-                        nivel_diversificacion = "Buena"
-                    else:
-                        score_diversificacion = 8
-                        nivel_diversificacion = "Básica"
-                    
-                    score_total += score_diversificacion
-                    componentes_score.append(("Diversificación", score_diversificacion, 20, nivel_diversificacion))
-                    
-                    # 4. CONCENTRACIÓN (15 puntos máximo)
-                    if concentracion_maxima <= 30:
-                        score_concentracion = 15
-                        nivel_concentracion = "Excelente"
-                    elif concentracion_maxima <= 50:
-                        score_concentracion = 12
-                        nivel_concentracion = "Buena"
-                    elif concentracion_maxima <= 70:
-                        score_concentracion = 8
-                        nivel_concentracion = "Moderada"
-                    else:
-                        score_concentracion = 4
-                        nivel_concentracion = "Alta"
-                    
-                    score_total += score_concentracion
-                    componentes_score.append(("Concentración", score_concentracion, 15, nivel_concentracion))
-                    
-                    # ====================================================================
-                    # SEMÁFORO DE RIESGO
-                    # ====================================================================
-                    
-                    if score_total >= 85:
-                        semaforo = "🟢"
-                        semaforo_texto = "EXCELENTE"
-                        semaforo_color = "#22c55e"
-                        mensaje_riesgo = "Tu portafolio está muy bien optimizado"
-                    elif score_total >= 70:
-                        semaforo = "🟢"
-                        semaforo_texto = "BUENO"
-                        semaforo_color = "#84cc16"
-                        mensaje_riesgo = "Portafolio sólido con buen balance"
-                    elif score_total >= 55:
-                        semaforo = "🟡"
-                        semaforo_texto = "ACEPTABLE"
-                        semaforo_color = "#eab308"
-                        mensaje_riesgo = "Considera mejorar algunos aspectos"
-                    else:
-                        semaforo = "🔴"
-                        semaforo_texto = "MEJORABLE"
-                        semaforo_color = "#ef4444"
-                        mensaje_riesgo = "Hay áreas importantes que optimizar"
-                    
-                    # Mostrar Dashboard
-                    col_score, col_msg = st.columns([1, 2])
-                    
-                    with col_score:
-                        st.markdown(f"""
-                        <div style="text-align: center; padding: 20px; background: {semaforo_color}15; border-radius: 10px; border: 2px solid {semaforo_color};">
-                            <div style="font-size: 48px; font-weight: bold; color: {semaforo_color};">
-                                {score_total}/100
-                            </div>
-                            <div style="font-size: 18px; font-weight: bold; color: {semaforo_color}; margin-top: 10px;">
-                                {semaforo} {semaforo_texto}
-                            </div>
-                        </div>
-                        """, unsafe_allow_html=True)
-                    
-                    with col_msg:
-                        st.info(f"**Score de Calidad del Portafolio**\n\n{mensaje_riesgo}")
-                    
-                    # Desglose del score
-                    st.markdown("#### 📋 Desglose del Score")
-                    
-                    for comp in componentes_score:
-                        col_nombre, col_progreso = st.columns([1, 3])
-                        with col_nombre:
-                            st.markdown(f"**{comp[0]}**")
-                        with col_progreso:
-                            st.progress(
-                                comp[1] / comp[2],
-                                text=f"{comp[1]}/{comp[2]} pts - {comp[3]}"
-                            )
-                        st.caption(f"_{comp[3]}_")
-                        st.markdown("")
-                    
-                    # KPIs principales
-                    st.markdown("#### 📊 Métricas Clave")
-                    
-                    col_kpi1, col_kpi2, col_kpi3, col_kpi4 = st.columns(4)
-                    
-                    with col_kpi1:
-                        st.metric(
-                            label="📈 Tasa Efectiva",
-                            value=f"{tasa_final:.2f}%",
-                            delta="Anual"
-                        )
-                    
-                    with col_kpi2:
-                        st.metric(
-                            label="🏦 SOFIPOs",
-                            value=f"{num_sofipos_final}",
-                            delta=nivel_diversificacion
-                        )
-                    
-                    with col_kpi3:
-                        st.metric(
-                            label="🛡️ IPAB",
-                            value=f"{nivel_ipab}",
-                            delta="Protección"
-                        )
-                    
-                    with col_kpi4:
-                        st.metric(
-                            label="📊 Concentración",
-                            value=f"{concentracion_maxima:.0f}%",
-                            delta=nivel_concentracion
-                        )
+                                # Mostrar totales de verificación
+                                st.markdown("---")
+                                st.markdown("**✓ Verificación:**")
+                                st.caption(f"Suma de partes: ${sum(acumulados_por_producto.values()):,.2f}")
+                                st.caption(f"Total mostrado: ${total_final_exacto:,.2f}")
+                                diferencia = abs(sum(acumulados_por_producto.values()) - total_final_exacto)
+                                if diferencia < 0.01:
+                                    st.success("✓ Números verificados correctamente")
+
             else:
                 # ================================================================
                 # TAB 2: DISTRIBUCIÓN FINAL - SIN APORTACIONES (solo capital inicial)
@@ -4486,16 +6490,6 @@ def main():
                         values_pie = []
                         colors_pie = []
                         
-                        color_map = {
-                            "DiDi": "#FF6B6B",
-                            "Nu México": "#8B5CF6",
-                            "Klar": "#3B82F6",
-                            "Mercado Pago": "#FCD34D",
-                            "Ualá": "#10B981",
-                            "Finsus": "#F59E0B",
-                            "Stori": "#EC4899"
-                        }
-                        
                         for key, inv_data in sorted(inversiones_seleccionadas.items(), key=lambda x: -x[1]['monto']):
                             monto_inicial = inv_data['monto']
                             # Calcular monto final con intereses
@@ -4507,45 +6501,9 @@ def main():
                             nombre = inv_data["sofipo"]
                             labels_pie.append(f"{nombre} ({tasa}%)<br>{porcentaje:.1f}%")
                             values_pie.append(monto_final)
-                            colors_pie.append(color_map.get(nombre, "#94A3B8"))
-                        
-                        # Crear pie chart
-                        fig_pie = go.Figure(data=[go.Pie(
-                            labels=labels_pie,
-                            values=values_pie,
-                            marker=dict(
-                                colors=colors_pie,
-                                line=dict(color='white', width=3)
-                            ),
-                            hole=0.45,
-                            textinfo='none',
-                            hovertemplate='<b>%{label}</b><br>Monto: $%{value:,.2f}<extra></extra>',
-                            pull=[0.02] * len(labels_pie)
-                        )])
-                        
-                        # Anotación en el centro
-                        fig_pie.add_annotation(
-                            text=f"<b>${total_final_sin_aport:,.0f}</b><br><span style='font-size:14px;'>Total Final</span>",
-                            x=0.5, y=0.5,
-                            font=dict(size=24, color='#667eea', family="Arial", weight="bold"),
-                            showarrow=False
-                        )
-                        
-                        fig_pie.update_layout(
-                            showlegend=True,
-                            height=450,
-                            margin=dict(t=10, b=10, l=10, r=10),
-                            paper_bgcolor='rgba(0,0,0,0)',
-                            legend=dict(
-                                orientation="h",
-                                yanchor="bottom",
-                                y=-0.2,
-                                xanchor="center",
-                                x=0.5,
-                                font=dict(size=11)
-                            )
-                        )
+                            colors_pie.append(COLORES_SOFIPO.get(nombre, "#94A3B8"))
                         
+                        fig_pie = figura_distribucion(labels_pie, values_pie, colors_pie, total_final_sin_aport, oscuro=modo_oscuro)
                         st.plotly_chart(fig_pie, use_container_width=True, config={'displayModeBar': False})
                     
                     with col_detalle:
@@ -4577,14 +6535,35 @@ def main():
                             porcentaje = (monto_final / total_final_sin_aport * 100)
                             
                             st.markdown(f"""
-                            <div style="background: rgba(255,255,255,0.05); padding: 1rem; border-radius: 8px; border-left: 4px solid {color_map.get(nombre, '#94A3B8')}; margin-bottom: 0.8rem;">
+                            <div style="background: rgba(255,255,255,0.05); padding: 1rem; border-radius: 8px; border-left: 4px solid {COLORES_SOFIPO.get(nombre, '#94A3B8')}; margin-bottom: 0.8rem;">
                                 <div style="font-weight: 700; font-size: 1rem; margin-bottom: 0.3rem;">{nombre}</div>
                                 <div style="font-size: 0.85rem; color: #888; margin-bottom: 0.5rem;">{producto} · {tasa}% GAT</div>
-                                <div style="font-size: 1.2rem; font-weight: 600; color: {color_map.get(nombre, '#94A3B8')};">${monto_final:,.0f}</div>
+                                <div style="font-size: 1.2rem; font-weight: 600; color: {COLORES_SOFIPO.get(nombre, '#94A3B8')};">${monto_final:,.0f}</div>
                                 <div style="font-size: 0.8rem; color: #666;">{porcentaje:.1f}% del total · +${interes:,.0f} intereses</div>
                             </div>
                             """, unsafe_allow_html=True)
             
+        # ====================================================================
+        # EXPORTAR RESULTADOS
+        # ====================================================================
+
+        tablas_exportacion = []
+        if proyecciones_todas:
+            tablas_exportacion.append(("📈 Proyección mensual por producto", "proyeccion_mensual", tabla_proyecciones(proyecciones_todas, con_isr=modo_isr)))
+        if tabla_libro_exportacion is not None:
+            tablas_exportacion.append(("💰 Libro de aportaciones", f"aportaciones_{frecuencia_aportacion.lower()}", tabla_libro_exportacion))
+        if resultados["num_filas"]:
+            tablas_exportacion.append(("🔍 Resultados por SOFIPO", "resultados", resultados))
+        if tablas_exportacion:
+            mostrar_exportaciones(tablas_exportacion, periodo_simulacion)
+
+        # ====================================================================
+        # DASHBOARD EJECUTIVO (SCORE DEL PORTAFOLIO)
+        # ====================================================================
+
+        if total_invertido > 0:
+            mostrar_dashboard_score(score_portafolio(vector_desde_seleccion(inversiones_seleccionadas), periodo_simulacion))
+
         # ====================================================================
         # ANÁLISIS Y RECOMENDACIONES (SIMPLIFICADO)
         # ====================================================================
@@ -4593,8 +6572,7 @@ def main():
         st.header("3️⃣ Recomendaciones Personalizadas")
         
         # Realizar análisis de diversificación (solo si hay capital inicial)
-        if total_invertido > 0:
-            analisis = analizar_diversificacion(inversiones_seleccionadas)
+        analisis = analizar_diversificacion(inversiones_seleccionadas) if total_invertido > 0 else None
         if analisis:
             recomendaciones = generar_recomendaciones(
                 analisis, 
@@ -4631,16 +6609,16 @@ def main():
         st.divider()
         
         with st.expander("📚 Glosario y Conceptos Clave"):
-            st.markdown("""
+            st.markdown(f"""
             **GAT Nominal**: Ganancia Anual Total antes de impuestos. Es la tasa de rendimiento anual.
             
-            **GAT Real**: Ganancia Anual Total después de restar inflación.
+            **GAT Real**: Ganancia Anual Total después de restar inflación. Actívala con "📉 En pesos de hoy" (UDI de hoy: ${valor_udi():.4f}).
             
             **Interés Simple**: Interés calculado solo sobre el capital inicial.
             
             **Interés Compuesto**: Interés calculado sobre capital + intereses previos.
             
-            **IPAB**: Instituto para la Protección al Ahorro Bancario. Protege hasta 25,000 UDIs (~$200,000 MXN) por persona por institución.
+            **IPAB**: Instituto para la Protección al Ahorro Bancario. Protege hasta 25,000 UDIs (~${LIMITE_IPAB_MXN:,} MXN hoy) por persona por institución.
             
             **SOFIPO**: Sociedad Financiera Popular regulada por CNBV.
             
@@ -4648,7 +6626,7 @@ def main():
             """)
         
         with st.expander("⚖️ Aspectos Legales y Fiscales"):
-            st.markdown("""
+            st.markdown(f"""
             ### Regulación
             - Todas las SOFIPOs mostradas están reguladas por CNBV
             - Supervisadas por Banco de México y CONDUSEF
@@ -4656,13 +6634,13 @@ def main():
             
             ### Protección IPAB
             - Cobertura: Hasta 25,000 UDIs por persona por institución
-            - Equivalente aproximado: ~$200,000 MXN (varía con UDI)
+            - Equivalente hoy: ~${LIMITE_IPAB_MXN:,} MXN (sube con la UDI)
             - Aplica a depósitos en SOFIPOs reguladas
             
             ### Impuestos
             - Los intereses generados están sujetos a ISR
             - Las SOFIPOs retienen impuestos automáticamente
-            - Tasa de retención: 1.04% mensual (aprox)
+            - Tasa de retención {anio_isr}: {retencion_isr * 100:.2f}% anual sobre el capital, devengada diario
             - Declaración anual puede generar saldo a favor
             
             **Nota**: Consulta con un contador para tu situación específica.
@@ -4674,30 +6652,28 @@ def main():
         # Mostrar tabla comparativa de tasas
         st.subheader("📊 Tabla Comparativa de Tasas (Referencia)")
         
-        tabla_comparativa = []
-        for sofipo_name, sofipo_data in SOFIPOS_DATA.items():
-            for producto_name, producto_info in sofipo_data['productos'].items():
-                tabla_comparativa.append({
-                    "SOFIPO": f"{sofipo_data['logo']} {sofipo_name}",
-                    "Producto": producto_name,
-                    "GAT Nominal": f"{producto_info['tasa_base']}%",
-                    "Liquidez": producto_info['liquidez'],
-                    "Mínimo": f"${producto_info['minimo']:,}"
-                })
+        st.dataframe(tabla_comparativa_compartida(CATALOGO_TASAS["version"]), width="stretch", hide_index=True)
         
-        df_comparativa = pd.DataFrame(tabla_comparativa)
-        st.dataframe(df_comparativa, width="stretch", hide_index=True)
+        col_version, col_recargar = st.columns([3, 1])
+        with col_version:
+            st.caption(f"Catálogo de tasas versión `{CATALOGO_TASAS['version']}` ({CATALOGO_TASAS['actualizado']})")
+            if "error" in CATALOGO_TASAS:
+                st.warning(f"⚠️ El archivo del catálogo tiene errores; se siguen usando las tasas anteriores. {CATALOGO_TASAS['error']}")
+        with col_recargar:
+            if st.button("🔄 Recargar tasas", key="btn_recargar_tasas", help="Vuelve a leer las tasas sin reiniciar el servidor"):
+                recargar_recursos_compartidos()
+                st.rerun()
     
     # Footer
     st.divider()
-    st.markdown("""
+    st.markdown(f"""
     ---
     <div style='text-align: center; background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); 
                 padding: 2rem; border-radius: 20px; color: white; margin-top: 2rem;'>
         <h3 style='margin: 0; font-weight: 700;'>💰 Simulador de Inversiones Multi-SOFIPO</h3>
         <p style='margin: 1rem 0; opacity: 0.9;'>ℹ️ Este simulador es una herramienta educativa. Las tasas pueden variar.<br>
         Verifica siempre las condiciones vigentes con cada institución.</p>
-        <p style='margin: 0.5rem 0;'><span class="badge">📅 Tasas actualizadas: Noviembre 2025</span></p>
+        <p style='margin: 0.5rem 0;'><span class="badge">📅 Tasas actualizadas: {CATALOGO_TASAS['actualizado']}</span></p>
         <p style='margin-top: 1rem; font-size: 1.1rem;'>Desarrollado con 💚 para inversionistas mexicanos 🇲🇽</p>
     </div>
     """, unsafe_allow_html=True)
@@ -4705,7 +6681,7 @@ def main():
 
     # Fecha de última actualización
     st.markdown("---")
-    st.markdown('<div style="text-align: center; font-size: 0.7rem; color: #999; padding: 1rem;">📅 Última actualización de tasas: 21 de Noviembre, 2025</div>', unsafe_allow_html=True)
+    st.markdown(f'<div style="text-align: center; font-size: 0.7rem; color: #999; padding: 1rem;">📅 Última actualización de tasas: {CATALOGO_TASAS["actualizado"]}</div>', unsafe_allow_html=True)
 if __name__ == "__main__":
     main()
 